@@ -0,0 +1,15 @@
+# Benchmarks Package
+# 效能基準測試（不需要 GPU 與網路）
+import sys
+from contextlib import contextmanager
+
+
+@contextmanager
+def report_stdout():
+    """執行期間應用程式的 print 改送 stderr，回傳原本的 stdout 只用來輸出報告 JSON
+    （`python -m benchmarks.bench_xxx > result.json` 得到合法的 JSON）"""
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        yield stdout
+    finally:
+        sys.stdout = stdout
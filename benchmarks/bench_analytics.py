@@ -0,0 +1,107 @@
+"""
+Analytics Benchmark - 儀表板統計查詢延遲
+
+在不同事件數量下量測 track_generation 寫入成本、儀表板各端點查詢延遲，
+以及從檢查點重啟時的追趕時間，驗證查詢成本不隨事件總數成長。
+
+用法:
+    python -m benchmarks.bench_analytics --sizes 1000,100000,1000000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from benchmarks import report_stdout  # noqa: E402
+
+MODELS = ['z-image-turbo', 'gemini-flash-image', 'gpt-image-1']
+SIZES = [(512, 512), (768, 768), (1024, 1024), (1024, 768)]
+MODES = ['single', 'batch', 'api', 'img2img']
+
+
+def _fill(store, target):
+    """直接批次寫入事件（模擬既有的大量歷史事件）"""
+    current = store.execute("SELECT COUNT(*) FROM analytics_events").fetchone()[0]
+    rng = random.Random(current)
+    now = datetime.now().isoformat()
+    with store.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO analytics_events (type, model, prompt_length, prompt_preview, "
+            "resolution, mode, duration, timestamp) VALUES ('generation', ?, 20, 'bench', ?, ?, ?, ?)",
+            ((rng.choice(MODELS), '%dx%d' % rng.choice(SIZES), rng.choice(MODES),
+              rng.lognormvariate(1.5, 0.5), now) for _ in range(current, target))
+        )
+
+
+def _median_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return round(samples[len(samples) // 2] * 1000, 3)
+
+
+def run(sizes, repeat=50):
+    from services.metadata_store import get_metadata_store
+    from services.analytics_service import AnalyticsService
+    store = get_metadata_store()
+
+    results = []
+    for size in sizes:
+        _fill(store, size)
+        # 新實例：載入檢查點後追趕新事件
+        t0 = time.perf_counter()
+        analytics = AnalyticsService()
+        entry = {'size': size, 'startup_catch_up_s': round(time.perf_counter() - t0, 3)}
+        analytics.checkpoint()
+
+        t0 = time.perf_counter()
+        AnalyticsService()
+        entry['startup_from_checkpoint_ms'] = round((time.perf_counter() - t0) * 1000, 3)
+
+        entry['track_generation_ms'] = _median_ms(
+            lambda: analytics.track_generation('z-image-turbo', 'bench prompt', 768, 768, duration=4.2),
+            repeat)
+        entry['overview_ms'] = _median_ms(analytics.get_overview, repeat)
+        entry['models_ms'] = _median_ms(analytics.get_model_usage, repeat)
+        entry['resolutions_ms'] = _median_ms(analytics.get_popular_resolutions, repeat)
+        entry['modes_ms'] = _median_ms(analytics.get_mode_distribution, repeat)
+        entry['speed_ms'] = _median_ms(analytics.get_generation_speed, repeat)
+        entry['speed'] = analytics.get_generation_speed()
+        results.append(entry)
+        print(json.dumps(entry, ensure_ascii=False), file=sys.stderr)
+    return {'benchmark': 'analytics', 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--output', help='結果 JSON 輸出路徑（預設印到 stdout；應用程式輸出改送 stderr）')
+    args = parser.parse_args()
+    sizes = sorted(int(s) for s in args.sizes.split(','))
+
+    with report_stdout() as stdout:
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp:
+            # 必須在匯入 services 之前改寫輸出路徑
+            config.OUTPUT_PATH = tmp
+            report = run(sizes, args.repeat)
+
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        print(text, file=stdout)
+
+
+if __name__ == '__main__':
+    main()
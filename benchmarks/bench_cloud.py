@@ -0,0 +1,131 @@
+"""
+Cloud Provider Benchmark - 以本機模擬伺服器量測雲端 Provider 的連線重用與並行度
+
+啟動 benchmarks/mock_cloud_server.py（背景執行緒），將 config.CLOUD_BASE_URLS 指向它，
+使用真實的 google-genai / openai SDK 量測：
+
+    fresh_client   每次呼叫前清空 client 快取（舊行為：每次重建 client 與連線）
+    pooled         同一 API Key 共用 client，keep-alive 重用連線
+    concurrent     ModelRegistry.generate_many() 在背景事件迴圈並行送出
+
+每項回報延遲統計、吞吐量與伺服器端新建的 TCP 連線數。
+
+用法:
+    python -m benchmarks.bench_cloud --requests 16 --latency 0.3 --output cloud.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from benchmarks import report_stdout  # noqa: E402
+from benchmarks.bench_e2e import latency_stats, git_commit  # noqa: E402
+from benchmarks.mock_cloud_server import MockCloudServer  # noqa: E402
+
+MODELS = {'gemini': 'gemini-flash-image', 'openai': 'gpt-image-1'}
+
+
+def _sequential(provider, server, count, fresh):
+    from providers.cloud import client_pool
+    server.reset_stats()
+    samples = []
+    start = time.perf_counter()
+    for i in range(count):
+        if fresh:
+            client_pool.clear_clients()
+        t0 = time.perf_counter()
+        result = provider.generate(f"benchmark prompt {i}", 1024, 1024)
+        if not result.get('success'):
+            raise RuntimeError(result.get('error'))
+        samples.append(time.perf_counter() - t0)
+    stats = latency_stats(samples, time.perf_counter() - start)
+    stats['server'] = server.snapshot()
+    return stats
+
+
+def _concurrent(registry, server, count, concurrency):
+    server.reset_stats()
+    requests = [{'prompt': f"benchmark prompt {i}", 'width': 1024, 'height': 1024} for i in range(count)]
+    start = time.perf_counter()
+    results = registry.generate_many(requests, concurrency)
+    wall = time.perf_counter() - start
+    failed = [r.get('error') for r in results if not r.get('success')]
+    if failed:
+        raise RuntimeError(failed[0])
+    stats = latency_stats([r['duration'] for r in results], wall)
+    stats['server'] = server.snapshot()
+    return stats
+
+
+def run(args):
+    server = MockCloudServer(('127.0.0.1', 0), args.latency, args.size).start()
+    config.CLOUD_BASE_URLS = {'gemini': server.url, 'openai': f"{server.url}/v1"}
+
+    from services.model_registry import get_model_registry
+    registry = get_model_registry()
+    results = {}
+    for provider_id, model_id in MODELS.items():
+        provider = registry._get_cloud_provider(model_id, provider_id)
+        provider.set_api_key('benchmark')
+        registry.switch_model(model_id)
+        # 暖機：SDK 匯入、非同步 client 建立與首次連線不列入量測
+        provider.generate('warmup', 1024, 1024)
+        registry.generate_many([{'prompt': 'warmup', 'width': 1024, 'height': 1024}] * args.concurrency,
+                               args.concurrency)
+        results[provider_id] = {
+            'fresh_client': _sequential(provider, server, args.requests, fresh=True),
+            'pooled': _sequential(provider, server, args.requests, fresh=False),
+            'concurrent': _concurrent(registry, server, args.requests, args.concurrency),
+        }
+        print(f"[cloud] {provider_id}: " + ', '.join(
+            f"{k} {v['throughput_per_s']}/s conn={v['server']['connections']}"
+            for k, v in results[provider_id].items()), file=sys.stderr)
+    server.shutdown()
+
+    return {
+        'benchmark': 'bench_cloud',
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {'requests': args.requests, 'latency': args.latency, 'concurrency': args.concurrency,
+                   'size': args.size},
+        'results': results,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=16, help='每項量測的請求數')
+    parser.add_argument('--latency', type=float, default=0.3, help='模擬伺服器延遲（秒）')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--size', type=int, default=256, help='回傳圖片邊長')
+    parser.add_argument('--output', help='結果 JSON 輸出路徑（預設印到 stdout；應用程式輸出改送 stderr）')
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    with report_stdout() as stdout:
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp:
+            config.OUTPUT_PATH = tmp
+            report = run(args)
+
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        print(text, file=stdout)
+        stdout.flush()
+        os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,512 @@
+"""
+End-to-End Benchmark - 以假模型量測主要 HTTP 流程的吞吐量與延遲
+
+不需要 GPU 與網路：本地模型換成決定性的 FakePipeline，Gemini / OpenAI 換成假 client
+（見 benchmarks/stubs.py），其餘流程（PNG 編碼、存檔、歷史、統計、JSON 服務）照常執行。
+
+量測項目:
+    generate        POST /generate
+    batch_generate  POST /batch-generate
+    batch_stream    POST /batch-generate 一次回傳 JSON vs NDJSON 串流（首筆結果時間、峰值記憶體）
+    queue           POST /api/queue/submit → 全部完成
+    story           POST /api/stories/<id>/generate-all
+    export_pdf/ppt  POST /export-pdf, /export-ppt
+    batch_download  POST /batch-download 串流 ZIP（首位元組時間、峰值記憶體）
+    cloud           POST /avatar/generate（Gemini / OpenAI 假 client）
+    json_services   歷史、收藏、提示詞庫、專案、作品集、故事、模型、統計等讀寫端點
+
+結果以 JSON 輸出（含 commit 與參數），可存檔後跨 commit 比較。
+
+用法:
+    python -m benchmarks.bench_e2e --output before.json
+    python -m benchmarks.bench_e2e --only generate,queue --repeat 50 --step-time 0
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import base64
+import argparse
+import platform
+import tempfile
+import subprocess
+from io import BytesIO
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from benchmarks import report_stdout  # noqa: E402
+
+SCENARIOS = ('generate', 'batch_generate', 'batch_stream', 'queue', 'story', 'export_pdf', 'export_ppt',
+             'batch_download', 'cloud', 'json_services')
+LOCAL_MODEL = 'z-image-turbo'
+CLOUD_MODELS = ('gemini-flash-image', 'gpt-image-1')
+TAGS = ['portrait', 'landscape', 'anime', 'api', 'img2img', 'favorite']
+WORDS = ['夕陽', '城市', 'cyberpunk', 'forest', 'portrait', 'watercolor', '貓', 'mountain',
+         'neon', 'studio light', '海邊', 'cinematic', 'anime girl', 'oil painting']
+
+
+# ── 統計 ──────────────────────────────────────────────────────
+def latency_stats(samples, wall=None):
+    """延遲樣本（秒）→ 毫秒統計與吞吐量"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pct(q):
+        return round(ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] * 1000, 3)
+
+    wall = wall if wall is not None else sum(samples)
+    return {
+        'count': len(samples),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+        'p50_ms': pct(50),
+        'p95_ms': pct(95),
+        'p99_ms': pct(99),
+        'max_ms': round(ordered[-1] * 1000, 3),
+        'throughput_per_s': round(len(samples) / wall, 3) if wall else None,
+    }
+
+
+def _timed(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return latency_stats(samples, time.perf_counter() - start)
+
+
+def _check(resp, expect=200):
+    if resp.status_code != expect:
+        raise RuntimeError(f"{resp.request.path} 回傳 {resp.status_code}: {resp.get_data(as_text=True)[:200]}")
+    return resp
+
+
+def _prompt(rng, words=6):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# ── 測試資料 ──────────────────────────────────────────────────
+def seed_json_files(output_path, sizes, rng):
+    """匯入 services 之前寫好 JSON 檔（專案、提示詞庫、作品集、故事）"""
+    now = datetime(2024, 1, 1)
+
+    def image(i):
+        return {'filename': f"seed_{i}.png", 'image_url': f"/images/seed_{i}.png",
+                'prompt': _prompt(rng), 'seed': i, 'model': LOCAL_MODEL,
+                'added_at': (now + timedelta(minutes=i)).isoformat(), 'metadata': {},
+                'rating': None, 'notes': ''}
+
+    projects = []
+    for p in range(sizes['projects']):
+        images = [image(p * 1000 + i) for i in range(sizes['project_images'])]
+        projects.append({
+            'id': uuid.uuid4().hex[:8], 'name': f"專案 {p}", 'description': _prompt(rng, 10),
+            'created_at': now.isoformat(), 'updated_at': now.isoformat(),
+            'images': images, 'image_count': len(images),
+            'settings': {'default_model': None, 'default_style': None, 'default_size': None,
+                         'default_negative_prompt': ''},
+            'tags': rng.sample(TAGS, 2), 'status': 'active', 'notes': '',
+        })
+
+    library = [{
+        'id': uuid.uuid4().hex[:8], 'title': f"提示詞 {i}", 'prompt': _prompt(rng, 12),
+        'negative_prompt': 'blurry', 'category': rng.choice(['portrait', 'landscape', 'custom']),
+        'tags': rng.sample(TAGS, 2), 'author': 'bench', 'rating': 0, 'ratings_count': 0,
+        'use_count': 0, 'created_at': now.isoformat(), 'is_default': False,
+    } for i in range(sizes['library'])]
+
+    galleries = []
+    for g in range(sizes['galleries']):
+        images = [{'filename': f"seed_{g}_{i}.png", 'image_url': f"/images/seed_{g}_{i}.png",
+                   'prompt': _prompt(rng), 'caption': '', 'added_at': now.isoformat()}
+                  for i in range(sizes['gallery_images'])]
+        galleries.append({
+            'id': uuid.uuid4().hex[:8], 'title': f"作品集 {g}", 'description': '', 'images': images,
+            'created_at': now.isoformat(), 'updated_at': now.isoformat(), 'is_public': True,
+            'views': 0, 'tags': [], 'layout': 'masonry', 'theme': 'default',
+        })
+
+    files = {'projects.json': projects, 'prompt_library.json': library, 'galleries.json': galleries}
+    for name, data in files.items():
+        with open(os.path.join(output_path, name), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def seed_store(sizes, rng):
+    """歷史、收藏與統計事件寫入 SQLite"""
+    from services.history_service import get_history_service
+    from services.favorites_service import get_favorites_service
+    from services.analytics_service import get_analytics_service
+
+    history = get_history_service()
+    base = datetime(2024, 1, 1)
+    with history.store.transaction() as conn:
+        for i in range(sizes['history']):
+            history._insert(conn, {
+                'id': f"seed_{i}", 'prompt': _prompt(rng), 'filename': f"seed_{i}.png",
+                'timestamp': (base + timedelta(seconds=i)).isoformat(),
+                'image_url': f"/images/seed_{i}.png", 'tags': rng.sample(TAGS, 2),
+                'model': LOCAL_MODEL,
+            })
+
+    favorites = get_favorites_service()
+    for i in range(sizes['favorites']):
+        favorites.add_favorite(f"{_prompt(rng)} #{i}")
+
+    analytics = get_analytics_service()
+    for i in range(sizes['analytics']):
+        analytics.track_generation(LOCAL_MODEL, _prompt(rng), 768, 768, duration=rng.uniform(3, 9))
+
+
+def seed_images(count, width, height):
+    """產生供匯出使用的圖片並寫入歷史，回傳檔名"""
+    from benchmarks.stubs import fake_image
+    from services.history_service import get_history_service
+    history = get_history_service()
+    filenames = []
+    for i in range(count):
+        filename = f"export_src_{i:04d}.png"
+        fake_image(f"export {i}", width, height, i).save(os.path.join(config.OUTPUT_PATH, filename))
+        history.add_to_history(f"匯出測試 {i} {WORDS[i % len(WORDS)]}", filename, model=LOCAL_MODEL)
+        filenames.append(filename)
+    return filenames
+
+
+# ── 情境 ──────────────────────────────────────────────────────
+def bench_generate(client, args, rng):
+    def once():
+        _check(client.post('/generate', json={'prompt': _prompt(rng)}))
+    return _timed(once, args.repeat)
+
+
+def bench_batch_generate(client, args, rng):
+    def once():
+        _check(client.post('/batch-generate', json={'prompts': [_prompt(rng) for _ in range(args.batch_size)]}))
+    stats = _timed(once, max(1, args.repeat // args.batch_size))
+    stats['batch_size'] = args.batch_size
+    stats['images_per_s'] = round(stats['throughput_per_s'] * args.batch_size, 3)
+    return stats
+
+
+def bench_batch_stream(client, args, rng):
+    """同一批提示詞分別以 JSON 與 NDJSON 取得，比較首筆結果時間與峰值記憶體（tracemalloc）"""
+    import tracemalloc
+    prompts = [_prompt(rng) for _ in range(args.batch_size)]
+    results = {'batch_size': args.batch_size}
+    for mode in ('json', 'ndjson'):
+        body = {'prompts': prompts}
+        if mode == 'ndjson':
+            body['stream'] = 'ndjson'
+        tracemalloc.start()
+        start = time.perf_counter()
+        first_result = None
+        received = 0
+        resp = client.post('/batch-generate', json=body, buffered=False)
+        for chunk in resp.response:
+            received += len(chunk)
+            if first_result is None and (mode == 'json' or b'"type": "result"' in chunk):
+                first_result = time.perf_counter() - start
+        total = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        resp.close()
+        if mode == 'json':
+            first_result = total
+        results[mode] = {
+            'first_result_ms': round(first_result * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'peak_mb': round(peak / 2 ** 20, 2),
+            'response_mb': round(received / 2 ** 20, 2),
+        }
+    return results
+
+
+def bench_queue(client, args, rng):
+    from services.queue_service import get_queue_service
+    queue = get_queue_service()
+    submit = []
+    task_ids = []
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        resp = _check(client.post('/api/queue/submit', json={'params': {'prompt': _prompt(rng)}}))
+        submit.append(time.perf_counter() - t0)
+        task_ids.append(resp.get_json()['task']['id'])
+
+    deadline = time.time() + args.timeout
+    while time.time() < deadline:
+        statuses = [queue.get_task(t)['status'] for t in task_ids]
+        if all(s in ('completed', 'failed', 'cancelled') for s in statuses):
+            break
+        time.sleep(0.01)
+    wall = time.perf_counter() - start
+
+    end_to_end, waits = [], []
+    failed = 0
+    for task_id in task_ids:
+        task = queue.get_task(task_id)
+        if task['status'] != 'completed':
+            failed += 1
+            continue
+        created = datetime.fromisoformat(task['created_at'])
+        end_to_end.append((datetime.fromisoformat(task['completed_at']) - created).total_seconds())
+        waits.append((datetime.fromisoformat(task['started_at']) - created).total_seconds())
+    return {
+        'submit': latency_stats(submit),
+        'end_to_end': latency_stats(end_to_end, wall),
+        'queue_wait': latency_stats(waits),
+        'failed': failed,
+    }
+
+
+def bench_story(client, args, rng):
+    samples = []
+    for _ in range(max(1, args.repeat // 10)):
+        story = _check(client.post('/api/stories', json={'title': '基準故事', 'layout': '4koma'})).get_json()['story']
+        sid = story['id']
+        _check(client.post(f'/api/stories/{sid}/characters',
+                           json={'name': '小明', 'appearance': 'short black hair, red scarf'}))
+        for i in range(len(story['panels'])):
+            _check(client.put(f'/api/stories/{sid}/panels/{i}', json={'scene_description': _prompt(rng)}))
+        t0 = time.perf_counter()
+        _check(client.post(f'/api/stories/{sid}/generate-all'))
+        samples.append(time.perf_counter() - t0)
+    stats = latency_stats(samples)
+    stats['panels'] = len(story['panels'])
+    return stats
+
+
+def bench_export(client, args, endpoint, filenames):
+    sizes = []
+
+    def once():
+        resp = _check(client.post(endpoint, json={'filenames': filenames, 'title': '基準匯出'}))
+        sizes.append(len(resp.get_data()))
+        resp.close()
+    stats = _timed(once, max(1, args.repeat // 10), warmup=0)
+    stats['images'] = len(filenames)
+    stats['output_bytes'] = sizes[-1] if sizes else None
+    return stats
+
+
+def _stream_stats(resp, start):
+    """讀完串流回應，回傳首位元組時間、總時間與大小"""
+    first_byte = None
+    received = 0
+    for chunk in resp.response:
+        if first_byte is None and chunk:
+            first_byte = time.perf_counter() - start
+        received += len(chunk)
+    total = time.perf_counter() - start
+    resp.close()
+    return {
+        'first_byte_ms': round((first_byte or total) * 1000, 1),
+        'total_ms': round(total * 1000, 1),
+        'output_mb': round(received / 2 ** 20, 2),
+        'mb_per_s': round(received / 2 ** 20 / total, 1) if total else None,
+    }
+
+
+def bench_batch_download(client, args, filenames):
+    import tracemalloc
+    runs = []
+    for _ in range(max(1, args.repeat // 10)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        resp = client.post('/batch-download', json={'filenames': filenames}, buffered=False)
+        stats = _stream_stats(resp, start)
+        stats['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        tracemalloc.stop()
+        runs.append(stats)
+    best = min(runs, key=lambda r: r['total_ms'])
+    best['images'] = len(filenames)
+    best['runs'] = len(runs)
+    return best
+
+
+def bench_cloud(client, args, rng, registry):
+    buffered = BytesIO()
+    from benchmarks.stubs import fake_image
+    fake_image('avatar input', 512, 512).save(buffered, format='JPEG')
+    photo = 'data:image/jpeg;base64,' + base64.b64encode(buffered.getvalue()).decode()
+    results = {}
+    for model_id in CLOUD_MODELS:
+        switched = registry.switch_model(model_id)
+        if not switched.get('success'):
+            results[model_id] = {'error': switched.get('error')}
+            continue
+
+        def once():
+            _check(client.post('/avatar/generate', json={'feature': 'professional', 'image': photo}))
+        results[model_id] = _timed(once, max(1, args.repeat // 2))
+    registry.switch_model(LOCAL_MODEL)
+    return results
+
+
+def bench_json_services(client, args, rng):
+    reads = {
+        'history_page': '/history?limit=50',
+        'history_tag': '/history?limit=50&tag=anime',
+        'favorites': '/favorites',
+        'prompt_library': '/api/prompt-library',
+        'projects': '/api/projects',
+        'galleries': '/api/galleries',
+        'stories': '/api/stories',
+        'models': '/models',
+        'analytics_overview': '/api/analytics/overview',
+        'analytics_speed': '/api/analytics/speed',
+        'search': '/api/search?q=cyberpunk',
+    }
+    results = {}
+    for name, path in reads.items():
+        results[name] = _timed(lambda: _check(client.get(path)), args.repeat * 2)
+
+    counter = iter(range(10 ** 9))
+    writes = {
+        'favorite_add': lambda: client.post('/favorites', json={'prompt': f"{_prompt(rng)} {next(counter)}"}),
+        'library_add': lambda: client.post('/api/prompt-library', json={'title': 'bench', 'prompt': _prompt(rng)}),
+        'gallery_create': lambda: client.post('/api/galleries', json={'title': f"bench {next(counter)}"}),
+        'project_create': lambda: client.post('/api/projects', json={'name': f"bench {next(counter)}"}),
+    }
+    for name, fn in writes.items():
+        results[name] = _timed(lambda: _check(fn()), args.repeat, warmup=0)
+    return results
+
+
+# ── 主流程 ────────────────────────────────────────────────────
+def run(args):
+    rng = random.Random(args.seed)
+    sizes = {
+        'history': args.history, 'favorites': args.favorites, 'library': args.library,
+        'projects': args.projects, 'project_images': 40, 'galleries': args.galleries,
+        'gallery_images': 30, 'analytics': min(args.history, 2000),
+    }
+    seed_json_files(config.OUTPUT_PATH, sizes, rng)
+
+    # 匯入 app 會初始化所有服務，必須在改寫路徑與寫入測試資料之後
+    from app import app
+    from services.model_registry import get_model_registry
+    from benchmarks.stubs import install_stubs
+
+    registry = get_model_registry()
+    clients = install_stubs(registry, step_time=args.step_time, cloud_latency=args.cloud_latency)
+    t0 = time.perf_counter()
+    loaded = registry.switch_model(LOCAL_MODEL)
+    if not loaded.get('success'):
+        raise RuntimeError(f"假模型載入失敗: {loaded.get('error')}")
+    model_load_ms = round((time.perf_counter() - t0) * 1000, 3)
+
+    t0 = time.perf_counter()
+    seed_store(sizes, rng)
+    seed_ms = round((time.perf_counter() - t0) * 1000, 1)
+
+    client = app.test_client()
+    only = set(args.only.split(',')) if args.only else set(SCENARIOS)
+    results = {}
+    export_files = None
+    for name in SCENARIOS:
+        if name not in only:
+            continue
+        print(f"[bench] {name} ...", file=sys.stderr)
+        if name == 'generate':
+            results[name] = bench_generate(client, args, rng)
+        elif name == 'batch_generate':
+            results[name] = bench_batch_generate(client, args, rng)
+        elif name == 'batch_stream':
+            results[name] = bench_batch_stream(client, args, rng)
+        elif name == 'queue':
+            results[name] = bench_queue(client, args, rng)
+        elif name == 'story':
+            results[name] = bench_story(client, args, rng)
+        elif name in ('export_pdf', 'export_ppt'):
+            if export_files is None:
+                export_files = seed_images(args.export_images, config.IMAGE_WIDTH, config.IMAGE_HEIGHT)
+            endpoint = '/export-pdf' if name == 'export_pdf' else '/export-ppt'
+            results[name] = bench_export(client, args, endpoint, export_files)
+        elif name == 'batch_download':
+            if export_files is None:
+                export_files = seed_images(args.export_images, config.IMAGE_WIDTH, config.IMAGE_HEIGHT)
+            results[name] = bench_batch_download(client, args, export_files)
+        elif name == 'cloud':
+            results[name] = bench_cloud(client, args, rng, registry)
+        elif name == 'json_services':
+            results[name] = bench_json_services(client, args, rng)
+        print(json.dumps({name: results[name]}, ensure_ascii=False), file=sys.stderr)
+
+    return {
+        'benchmark': 'e2e',
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {
+            'repeat': args.repeat, 'seed': args.seed, 'step_time': args.step_time,
+            'cloud_latency': args.cloud_latency, 'resolution': f"{config.IMAGE_WIDTH}x{config.IMAGE_HEIGHT}",
+            'batch_size': args.batch_size, 'export_images': args.export_images, 'data_sizes': sizes,
+        },
+        'setup': {'model_load_ms': model_load_ms, 'seed_ms': seed_ms},
+        'stub_calls': {
+            'gemini': clients['gemini'].models.calls,
+            'openai': clients['openai'].images.calls,
+        },
+        'results': results,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--only', help=f"逗號分隔的情境（{', '.join(SCENARIOS)}）")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--step-time', type=float, default=0.005, help='假 pipeline 每步去噪耗時（秒）')
+    parser.add_argument('--cloud-latency', type=float, default=0.2, help='假雲端 API 往返耗時（秒）')
+    parser.add_argument('--resolution', type=int, default=512, help='生成解析度（正方形）')
+    parser.add_argument('--batch-size', type=int, default=5)
+    parser.add_argument('--export-images', type=int, default=20)
+    parser.add_argument('--history', type=int, default=5000)
+    parser.add_argument('--favorites', type=int, default=300)
+    parser.add_argument('--library', type=int, default=1000)
+    parser.add_argument('--projects', type=int, default=50)
+    parser.add_argument('--galleries', type=int, default=100)
+    parser.add_argument('--timeout', type=float, default=300, help='佇列情境等待上限（秒）')
+    parser.add_argument('--output', help='結果 JSON 輸出路徑（預設印到 stdout；應用程式輸出改送 stderr）')
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    with report_stdout() as stdout:
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp:
+            # 必須在匯入 services 之前改寫輸出路徑
+            config.OUTPUT_PATH = tmp
+            config.IMAGE_WIDTH = config.IMAGE_HEIGHT = args.resolution
+            report = run(args)
+
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        print(text, file=stdout)
+        # 佇列處理器為常駐執行緒，直接結束行程
+        stdout.flush()
+        os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
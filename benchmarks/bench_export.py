@@ -0,0 +1,167 @@
+"""
+Export Benchmark - 量測 PDF / PPT 匯出（services/export_service.py）
+
+    variants    build_pdf() / build_ppt() 在不同執行緒數（--lossless 另量測 PDF 無損嵌入）下的耗時與輸出大小
+    http        POST /export-pdf、/export-ppt 的首位元組時間與總時間；峰值記憶體（tracemalloc）
+                另跑一次量測，避免追蹤負擔影響計時
+    background  背景工作：回傳 202 的耗時、完成耗時與下載大小
+
+圖片以 benchmarks/stubs.py 的 fake_image 產生並寫入歷史記錄（含提示詞）。
+
+用法:
+    python -m benchmarks.bench_export --images 200 --resolution 1024 --output export.json
+    python -m benchmarks.bench_export --formats pptx --workers 4
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from benchmarks import report_stdout  # noqa: E402
+from benchmarks.bench_e2e import git_commit, seed_images, _stream_stats  # noqa: E402
+
+
+ENDPOINTS = {'pdf': '/export-pdf', 'pptx': '/export-ppt'}
+
+
+def bench_variants(kind, filenames, workers_list, repeat, lossless=False):
+    from services.export_service import BUILDERS, spooled_output
+    rows = []
+    setting = 'PDF_EXPORT_JPEG_QUALITY' if kind == 'pdf' else 'PPT_EXPORT_JPEG_QUALITY'
+    original_quality = getattr(config, setting)
+    for quality in ((original_quality, None) if lossless and kind == 'pdf' else (original_quality,)):
+        setattr(config, setting, quality)
+        for workers in workers_list:
+            best = None
+            for _ in range(repeat):
+                output = spooled_output()
+                start = time.perf_counter()
+                added = BUILDERS[kind](filenames, output, title='基準匯出', workers=workers)
+                elapsed = time.perf_counter() - start
+                size = output.tell()
+                output.close()
+                best = elapsed if best is None else min(best, elapsed)
+            rows.append({
+                'kind': kind,
+                'embed': f'jpeg q{quality}' if quality else 'lossless',
+                'workers': workers,
+                'images': added,
+                'total_ms': round(best * 1000, 1),
+                'ms_per_image': round(best * 1000 / max(added, 1), 2),
+                'output_mb': round(size / 2 ** 20, 2),
+            })
+            print(f"[export] {rows[-1]}", file=sys.stderr)
+    setattr(config, setting, original_quality)
+    return rows
+
+
+def _client():
+    from flask import Flask
+    from routes.export import export_bp
+
+    app = Flask(__name__)
+    app.register_blueprint(export_bp)
+    return app.test_client()
+
+
+def bench_http(client, kind, filenames):
+    import tracemalloc
+
+    def post():
+        return client.post(ENDPOINTS[kind], json={'filenames': filenames, 'title': '基準匯出', 'background': False},
+                           buffered=False)
+
+    start = time.perf_counter()
+    stats = _stream_stats(post(), start)
+    tracemalloc.start()
+    _stream_stats(post(), time.perf_counter())
+    stats['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+    tracemalloc.stop()
+    return stats
+
+
+def bench_background(client, kind, filenames, timeout=600):
+    start = time.perf_counter()
+    resp = client.post(ENDPOINTS[kind], json={'filenames': filenames, 'title': '基準匯出', 'background': True})
+    accepted = time.perf_counter() - start
+    job = resp.get_json()['job']
+    polls = 0
+    while job['status'] in ('queued', 'running') and time.perf_counter() - start < timeout:
+        time.sleep(0.1)
+        polls += 1
+        job = client.get(job['status_url']).get_json()['job']
+    finished = time.perf_counter() - start
+    download = client.get(job['download_url'])
+    size = len(download.get_data())
+    download.close()
+    return {
+        'status': job['status'],
+        'accepted_ms': round(accepted * 1000, 1),
+        'finished_ms': round(finished * 1000, 1),
+        'polls': polls,
+        'output_mb': round(size / 2 ** 20, 2),
+    }
+
+
+def run(args):
+    filenames = seed_images(args.images, args.resolution, args.resolution)
+    workers_list = sorted({1, args.workers or min(8, os.cpu_count() or 1)})
+    client = _client()
+    results = {'variants': [], 'http': {}, 'background': {}}
+    for kind in args.formats.split(','):
+        results['variants'] += bench_variants(kind, filenames, workers_list, args.repeat, args.lossless)
+        results['http'][kind] = bench_http(client, kind, filenames)
+        print(f"[export] http {kind}: {results['http'][kind]}", file=sys.stderr)
+        results['background'][kind] = bench_background(client, kind, filenames)
+        print(f"[export] background {kind}: {results['background'][kind]}", file=sys.stderr)
+    return {
+        'benchmark': 'bench_export',
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'params': {'images': args.images, 'resolution': args.resolution, 'repeat': args.repeat,
+                   'formats': args.formats, 'pdf_dpi': config.PDF_EXPORT_DPI,
+                   'pdf_jpeg_quality': config.PDF_EXPORT_JPEG_QUALITY, 'ppt_dpi': config.PPT_EXPORT_DPI,
+                   'ppt_jpeg_quality': config.PPT_EXPORT_JPEG_QUALITY},
+        'results': results,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--resolution', type=int, default=1024, help='圖片解析度（正方形）')
+    parser.add_argument('--workers', type=int, help='比較的執行緒數（預設 CPU 核心數，另量測 1）')
+    parser.add_argument('--formats', default='pdf,pptx', help='逗號分隔的格式（pdf, pptx）')
+    parser.add_argument('--lossless', action='store_true', help='另量測無損嵌入（PDF_EXPORT_JPEG_QUALITY = None）')
+    parser.add_argument('--repeat', type=int, default=1, help='每個組合量測次數（取最佳）')
+    parser.add_argument('--output', help='結果 JSON 輸出路徑（預設印到 stdout；應用程式輸出改送 stderr）')
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    with report_stdout() as stdout:
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp:
+            # 必須在匯入 services 之前改寫輸出路徑
+            config.OUTPUT_PATH = tmp
+            report = run(args)
+
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        print(text, file=stdout)
+
+
+if __name__ == '__main__':
+    main()
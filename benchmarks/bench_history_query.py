@@ -0,0 +1,109 @@
+"""
+History Query Benchmark - 歷史記錄分頁查詢延遲
+
+在不同資料量（50 → 1,000,000 筆）下量測 query_history 的首頁、
+游標翻頁與各種過濾條件的延遲，驗證查詢時間不隨總筆數成長。
+
+用法:
+    python -m benchmarks.bench_history_query --sizes 50,10000,1000000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from benchmarks import report_stdout  # noqa: E402
+
+MODELS = ['z-image-turbo', 'gemini-flash-image', 'gpt-image-1']
+TAGS = ['portrait', 'landscape', 'anime', 'api', 'img2img', 'favorite']
+
+
+def _fill(history, target):
+    """批次補足歷史記錄到 target 筆"""
+    current = history.count()
+    base = datetime(2024, 1, 1)
+    rng = random.Random(current)
+    with history.store.transaction() as conn:
+        for i in range(current, target):
+            history._insert(conn, {
+                'id': f"bench_{i}",
+                'prompt': f"bench prompt {i} 夕陽 城市 {rng.choice(TAGS)}",
+                'filename': f"bench_{i}.png",
+                'timestamp': (base + timedelta(seconds=i)).isoformat(),
+                'image_url': f"/images/bench_{i}.png",
+                'tags': rng.sample(TAGS, 2) + (['rare'] if i % 1000 == 0 else []),
+                'model': rng.choice(MODELS),
+            })
+
+
+def _time_query(history, repeat, **kwargs):
+    samples = []
+    page = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        page = history.query_history(**kwargs)
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return round(samples[len(samples) // 2] * 1000, 3), page
+
+
+def run(sizes, repeat=20):
+    from services.history_service import get_history_service
+    history = get_history_service()
+
+    results = []
+    for size in sizes:
+        _fill(history, size)
+        first_ms, first_page = _time_query(history, repeat, limit=50)
+        entry = {'size': size, 'first_page_ms': first_ms}
+        if first_page['next_cursor']:
+            entry['next_page_ms'], _ = _time_query(history, repeat, limit=50,
+                                                   cursor=first_page['next_cursor'])
+        entry['tag_filter_ms'], _ = _time_query(history, repeat, limit=50, tags=['anime'])
+        entry['tag_rare_ms'], _ = _time_query(history, repeat, limit=50, tags=['rare'])
+        entry['tag_and_ms'], _ = _time_query(history, repeat, limit=50, all_tags=['anime', 'api'])
+        entry['tag_and_not_ms'], _ = _time_query(history, repeat, limit=50, tags=['anime', 'portrait'],
+                                                 exclude_tags=['api'])
+        entry['tag_not_only_ms'], _ = _time_query(history, repeat, limit=50, exclude_tags=['anime'])
+        t0 = time.perf_counter()
+        history.get_tag_counts()
+        entry['tag_counts_ms'] = round((time.perf_counter() - t0) * 1000, 3)
+        entry['model_filter_ms'], _ = _time_query(history, repeat, limit=50, model='gpt-image-1')
+        entry['date_range_ms'], _ = _time_query(history, repeat, limit=50,
+                                                since='2024-01-01T00:00:10', until='2024-01-01T00:00:40')
+        entry['prompt_filter_ms'], _ = _time_query(history, repeat, limit=50, prompt='城市')
+        results.append(entry)
+        print(json.dumps(entry, ensure_ascii=False), file=sys.stderr)
+    return {'benchmark': 'history_query', 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='50,1000,100000')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='結果 JSON 輸出路徑（預設印到 stdout；應用程式輸出改送 stderr）')
+    args = parser.parse_args()
+    sizes = sorted(int(s) for s in args.sizes.split(','))
+
+    with report_stdout() as stdout:
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp:
+            # 必須在匯入 services 之前改寫輸出路徑
+            config.OUTPUT_PATH = tmp
+            report = run(sizes, args.repeat)
+
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        print(text, file=stdout)
+
+
+if __name__ == '__main__':
+    main()
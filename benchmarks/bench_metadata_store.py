@@ -0,0 +1,92 @@
+"""
+Metadata Store Benchmark - SQLite 中繼資料儲存寫入效能
+
+驗證歷史記錄 / 收藏 / 統計事件的單筆寫入成本不隨資料量成長 (O(1))。
+比較前 N 筆與最後 N 筆寫入的平均延遲，輸出 JSON 結果。
+
+用法:
+    python -m benchmarks.bench_metadata_store --rows 100000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from benchmarks import report_stdout  # noqa: E402
+
+
+def _measure(label, rows, sample, op):
+    """執行 rows 次 op，回傳前後兩段取樣的平均延遲"""
+    head, tail = [], []
+    started = time.perf_counter()
+    for i in range(rows):
+        t0 = time.perf_counter()
+        op(i)
+        elapsed = time.perf_counter() - t0
+        if i < sample:
+            head.append(elapsed)
+        elif i >= rows - sample:
+            tail.append(elapsed)
+    total = time.perf_counter() - started
+
+    head_us = sum(head) / len(head) * 1e6
+    tail_us = sum(tail) / len(tail) * 1e6 if tail else head_us
+    return {
+        'name': label,
+        'rows': rows,
+        'total_seconds': round(total, 3),
+        'ops_per_second': round(rows / total, 1),
+        'first_sample_us': round(head_us, 1),
+        'last_sample_us': round(tail_us, 1),
+        'growth_ratio': round(tail_us / head_us, 2),
+    }
+
+
+def run(rows=100000, sample=1000):
+    from services.history_service import get_history_service
+    from services.favorites_service import get_favorites_service
+    from services.analytics_service import get_analytics_service
+
+    history = get_history_service()
+    favorites = get_favorites_service()
+    analytics = get_analytics_service()
+
+    results = [
+        _measure('history.add_to_history', rows, sample,
+                 lambda i: history.add_to_history(f"bench prompt {i} 測試", f"bench_{i}.png", tags=['bench'])),
+        _measure('favorites.add_favorite', rows, sample,
+                 lambda i: favorites.add_favorite(f"favorite prompt {i}")),
+        _measure('analytics.track_generation', rows, sample,
+                 lambda i: analytics.track_generation('z-image-turbo', f"prompt {i}", 768, 768,
+                                                      mode='single', duration=1.0)),
+    ]
+    return {'benchmark': 'metadata_store', 'rows': rows, 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--sample', type=int, default=1000)
+    parser.add_argument('--output', help='結果 JSON 輸出路徑（預設印到 stdout；應用程式輸出改送 stderr）')
+    args = parser.parse_args()
+
+    with report_stdout() as stdout:
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp:
+            # 必須在匯入 services 之前改寫輸出路徑
+            config.OUTPUT_PATH = tmp
+            report = run(args.rows, args.sample)
+
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        print(text, file=stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Rate Limit Benchmark - 量測每金鑰速率限制（services/rate_limit_service.py）本身的開銷
+
+    check        RateLimitService.check() 單次耗時（單執行緒 / 多執行緒、不同金鑰數）
+    decorator    以 Flask test client 呼叫 @require_api_key 保護的空路由，
+                 比較 API_RATE_LIMIT_ENABLED 開 / 關的每請求延遲差
+    enforcement  單一金鑰連續送出超過突發上限的請求，確認 429 與標頭
+
+用法:
+    python -m benchmarks.bench_rate_limit --iterations 200000 --output rate_limit.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from benchmarks import report_stdout  # noqa: E402
+from benchmarks.bench_e2e import latency_stats, git_commit  # noqa: E402
+
+
+def bench_check(iterations, keys, threads):
+    from services.rate_limit_service import RateLimitService
+    limiter = RateLimitService()
+    key_hashes = [f"{i:064x}" for i in range(keys)]
+    per_thread = iterations // threads
+
+    def worker(offset):
+        for i in range(per_thread):
+            limiter.check(key_hashes[(i + offset) % keys], 'read', 10 ** 9)
+
+    pool = [threading.Thread(target=worker, args=(n * 7919,)) for n in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    wall = time.perf_counter() - start
+    total = per_thread * threads
+    return {
+        'keys': keys,
+        'threads': threads,
+        'checks': total,
+        'wall_us_per_check': round(wall / total * 1e6, 3),
+        'checks_per_s': round(total / wall),
+    }
+
+
+def _client():
+    from flask import Flask, jsonify
+    from services.api_key_service import require_api_key, get_api_key_service
+
+    app = Flask(__name__)
+
+    @app.route('/read')
+    @require_api_key('history')
+    def read():
+        return jsonify({'success': True})
+
+    api_key = get_api_key_service().create_key('bench-rate-limit', rate_limit=10 ** 6,
+                                               read_rate_limit=10 ** 6)['api_key']
+    return app.test_client(), api_key
+
+
+def bench_decorator(repeat):
+    client, api_key = _client()
+    headers = {'X-API-Key': api_key}
+    results = {}
+    for enabled in (False, True, False, True):
+        config.API_RATE_LIMIT_ENABLED = enabled
+        client.get('/read', headers=headers)
+        samples = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            client.get('/read', headers=headers)
+            samples.append(time.perf_counter() - t0)
+        # 開 / 關各量兩輪取較佳者，降低暖機與雜訊影響
+        stats = latency_stats(samples)
+        label = 'enabled' if enabled else 'disabled'
+        if label not in results or stats['mean_ms'] < results[label]['mean_ms']:
+            results[label] = stats
+    config.API_RATE_LIMIT_ENABLED = True
+    results['overhead_us'] = round((results['enabled']['mean_ms'] - results['disabled']['mean_ms']) * 1000, 2)
+    return results
+
+
+def check_enforcement():
+    from flask import Flask, jsonify
+    from services.api_key_service import require_api_key, get_api_key_service
+
+    app = Flask(__name__)
+
+    @app.route('/gen', methods=['POST'])
+    @require_api_key('generate', budget='generate')
+    def gen():
+        return jsonify({'success': True})
+
+    @app.route('/read')
+    @require_api_key('history')
+    def read():
+        return jsonify({'success': True})
+
+    api_key = get_api_key_service().create_key('bench-enforce', rate_limit=60, read_rate_limit=600)['api_key']
+    client = app.test_client()
+    headers = {'X-API-Key': api_key}
+    statuses = [client.post('/gen', headers=headers).status_code for _ in range(15)]
+    limited = client.post('/gen', headers=headers)
+    read = client.get('/read', headers=headers)
+    return {
+        'generate_statuses': statuses,
+        'limited_status': limited.status_code,
+        'limited_headers': {k: v for k, v in limited.headers.items() if k.startswith(('RateLimit', 'Retry'))},
+        'read_status_after_generate_limited': read.status_code,
+        'read_headers': {k: v for k, v in read.headers.items() if k.startswith('RateLimit')},
+    }
+
+
+def run(args):
+    results = {'check': [bench_check(args.iterations, keys, threads)
+                         for keys in (1, 1000) for threads in (1, 8)]}
+    for row in results['check']:
+        print(f"[rate-limit] check keys={row['keys']} threads={row['threads']}: "
+              f"{row['wall_us_per_check']} µs", file=sys.stderr)
+    results['decorator'] = bench_decorator(args.repeat)
+    print(f"[rate-limit] decorator overhead: {results['decorator']['overhead_us']} µs/request", file=sys.stderr)
+    results['enforcement'] = check_enforcement()
+    return {
+        'benchmark': 'bench_rate_limit',
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {'iterations': args.iterations, 'repeat': args.repeat},
+        'results': results,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200000, help='check() 量測次數')
+    parser.add_argument('--repeat', type=int, default=2000, help='decorator 每輪請求數')
+    parser.add_argument('--output', help='結果 JSON 輸出路徑（預設印到 stdout；應用程式輸出改送 stderr）')
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    with report_stdout() as stdout:
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp:
+            config.OUTPUT_PATH = tmp
+            import services.api_key_service as api_key_service
+            api_key_service.API_KEYS_FILE = os.path.join(tmp, 'api_keys.json')
+            report = run(args)
+
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        print(text, file=stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Search Benchmark - 提示詞全文搜尋延遲
+
+在不同資料量下量測 /api/search 背後 SearchService.search 的延遲，
+涵蓋常見詞、罕見詞、前綴、中文片語、多詞 AND 與排除條件。
+
+用法:
+    python -m benchmarks.bench_search --sizes 1000,100000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from benchmarks import report_stdout  # noqa: E402
+
+WORDS = ['portrait', 'landscape', 'cyberpunk', 'watercolor', 'sunset', 'forest', 'neon',
+         'cinematic', 'lighting', 'ultra', 'detailed', 'castle', 'ocean', 'mountain', 'robot']
+CJK_WORDS = ['夕陽', '城市', '森林', '橘貓', '雪山', '水墨', '海邊', '夜景']
+
+QUERIES = {
+    'common_word': 'lighting',
+    'rare_word': 'zeppelin',
+    'prefix': 'cyber',
+    'cjk_phrase': '夕陽',
+    'cjk_rare': '飛船',
+    'multi_and': 'neon castle 城市',
+    'exclude': 'forest -robot',
+}
+
+
+def _fill(history, target):
+    current = history.count()
+    base = datetime(2024, 1, 1)
+    rng = random.Random(current)
+    with history.store.transaction() as conn:
+        for i in range(current, target):
+            words = rng.sample(WORDS, 5) + rng.sample(CJK_WORDS, 2)
+            if i % 5000 == 0:
+                words += ['zeppelin', '飛船']
+            history._insert(conn, {
+                'id': f"bench_{i}",
+                'prompt': ' '.join(words),
+                'filename': f"bench_{i}.png",
+                'timestamp': (base + timedelta(seconds=i)).isoformat(),
+                'image_url': f"/images/bench_{i}.png",
+                'tags': [],
+                'model': None,
+            })
+
+
+def run(sizes, repeat=20, limit=20):
+    from services.history_service import get_history_service
+    from services.search_service import get_search_service
+    history = get_history_service()
+    search = get_search_service()
+
+    results = []
+    for size in sizes:
+        t0 = time.perf_counter()
+        _fill(history, size)
+        entry = {'size': size, 'fill_s': round(time.perf_counter() - t0, 2)}
+        for name, query in QUERIES.items():
+            samples = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                hits = search.search(query, limit=limit)
+                samples.append(time.perf_counter() - t0)
+            samples.sort()
+            entry[f'{name}_ms'] = round(samples[len(samples) // 2] * 1000, 3)
+            entry[f'{name}_hits'] = len(hits)
+        results.append(entry)
+        print(json.dumps(entry, ensure_ascii=False), file=sys.stderr)
+    return {'benchmark': 'search', 'limit': limit, 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--output', help='結果 JSON 輸出路徑（預設印到 stdout；應用程式輸出改送 stderr）')
+    args = parser.parse_args()
+    sizes = sorted(int(s) for s in args.sizes.split(','))
+
+    with report_stdout() as stdout:
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp:
+            # 必須在匯入 services 之前改寫輸出路徑
+            config.OUTPUT_PATH = tmp
+            report = run(sizes, args.repeat, args.limit)
+
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        print(text, file=stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Similar Prompt Benchmark - 提示詞向量索引建立與 top-k 查詢延遲
+
+量測雜湊向量化速度、增量建立索引時間，以及在不同資料量下
+「相似提示詞」與「重複生成偵測」的查詢延遲。
+
+用法:
+    python -m benchmarks.bench_similar --sizes 1000,100000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from benchmarks import report_stdout  # noqa: E402
+
+SUBJECTS = ['cat', 'dog', 'castle', 'robot', 'forest', 'city', 'ocean', 'dragon', '橘貓', '山水']
+STYLES = ['watercolor', 'cyberpunk', 'oil painting', 'anime', 'photorealistic', '水墨']
+DETAILS = ['at sunset', 'at night', 'in the rain', 'with neon lights', 'cinematic lighting', '8k']
+
+
+def _prompt(rng):
+    return f"{rng.choice(STYLES)} {rng.choice(SUBJECTS)} {rng.choice(DETAILS)}, {rng.choice(DETAILS)}"
+
+
+def _fill(history, target):
+    current = history.count()
+    base = datetime(2024, 1, 1)
+    rng = random.Random(current)
+    with history.store.transaction() as conn:
+        for i in range(current, target):
+            history._insert(conn, {
+                'id': f"bench_{i}",
+                'prompt': _prompt(rng),
+                'filename': f"bench_{i}.png",
+                'timestamp': (base + timedelta(seconds=i)).isoformat(),
+                'image_url': f"/images/bench_{i}.png",
+                'tags': [],
+                'model': None,
+            })
+
+
+def run(sizes, repeat=20, k=10):
+    from services.history_service import get_history_service
+    from services.embedding_service import get_embedding_service, embed_text
+    history = get_history_service()
+    embeddings = get_embedding_service()
+
+    rng = random.Random(0)
+    prompts = [_prompt(rng) for _ in range(2000)]
+    t0 = time.perf_counter()
+    for prompt in prompts:
+        embed_text(prompt)
+    embed_us = (time.perf_counter() - t0) / len(prompts) * 1e6
+
+    results = []
+    for size in sizes:
+        _fill(history, size)
+        t0 = time.perf_counter()
+        applied = embeddings.refresh()
+        entry = {'size': size, 'indexed': applied, 'index_s': round(time.perf_counter() - t0, 2)}
+
+        for name, call in (('similar', lambda p: embeddings.similar(p, k=k)),
+                           ('duplicates', embeddings.find_duplicates)):
+            samples = []
+            for i in range(repeat):
+                t0 = time.perf_counter()
+                call(prompts[i])
+                samples.append(time.perf_counter() - t0)
+            samples.sort()
+            entry[f'{name}_ms'] = round(samples[len(samples) // 2] * 1000, 3)
+
+        # 新增一筆後的增量更新成本
+        history.add_to_history(prompts[0], 'incremental.png')
+        t0 = time.perf_counter()
+        embeddings.refresh()
+        entry['incremental_refresh_ms'] = round((time.perf_counter() - t0) * 1000, 3)
+        entry['file_bytes'] = embeddings.stats()['file_bytes']
+        results.append(entry)
+        print(json.dumps(entry, ensure_ascii=False), file=sys.stderr)
+    return {'benchmark': 'similar_prompts', 'embed_us': round(embed_us, 1), 'k': k, 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--output', help='結果 JSON 輸出路徑（預設印到 stdout；應用程式輸出改送 stderr）')
+    args = parser.parse_args()
+    sizes = sorted(int(s) for s in args.sizes.split(','))
+
+    with report_stdout() as stdout:
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp:
+            # 必須在匯入 services 之前改寫輸出路徑
+            config.OUTPUT_PATH = tmp
+            report = run(sizes, args.repeat, args.k)
+
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        print(text, file=stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""
+HTTP Load Test - 以遞增並發量壓測 HTTP API
+
+在子行程以 app.py 相同的 Flask 伺服器設定（threaded、無 reloader）啟動應用程式，
+本地模型換成假 pipeline（benchmarks/stubs.py），測試資料與 bench_e2e 相同；
+主行程以封閉迴圈的客戶端執行緒對每個端點做並發掃描，回報吞吐量、尾端延遲與錯誤率；
+佇列已滿的 429（code = QUEUE_LIMIT）是預期的背壓，另計為 queue_limited，不算入錯誤率。
+
+端點:
+    api_generate   POST /api/v1/generate（X-API-Key）
+    queue_submit   POST /api/queue/submit
+    history        GET  /history
+    galleries      GET  /api/galleries
+    models         GET  /models
+
+回歸偵測: --baseline 指定先前的結果 JSON，吞吐量下降或 p95 上升超過 --tolerance、
+或錯誤率增加超過 1 個百分點即列為回歸，行程以狀態碼 1 結束。
+
+用法:
+    python -m benchmarks.load_test --concurrency 1,4,16 --duration 5 --output load.json
+    python -m benchmarks.load_test --baseline load.json
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import signal
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from benchmarks import report_stdout  # noqa: E402
+from benchmarks.bench_e2e import latency_stats, git_commit, _prompt, LOCAL_MODEL  # noqa: E402
+
+ENDPOINTS = {
+    'history': ('GET', '/history?limit=50', None),
+    'galleries': ('GET', '/api/galleries', None),
+    'models': ('GET', '/models', None),
+    'api_generate': ('POST', '/api/v1/generate', 'generate'),
+    'queue_submit': ('POST', '/api/queue/submit', 'queue'),
+}
+READY_PREFIX = 'LOADTEST_READY'
+
+
+# ── 伺服器子行程 ──────────────────────────────────────────────
+def serve(args):
+    """子行程：準備資料與假模型後以 app.py 的設定啟動伺服器"""
+    import random
+    tmp = tempfile.mkdtemp(prefix='zimage_load_')
+    # 主行程以 terminate() 結束伺服器，轉成 SystemExit 讓 atexit 清除暫存資料
+    atexit.register(shutil.rmtree, tmp, True)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    config.OUTPUT_PATH = tmp
+    config.IMAGE_WIDTH = config.IMAGE_HEIGHT = args.resolution
+
+    from benchmarks.bench_e2e import seed_json_files, seed_store
+    rng = random.Random(args.seed)
+    sizes = {'history': args.history, 'favorites': 100, 'library': 200, 'projects': 20,
+             'project_images': 40, 'galleries': args.galleries, 'gallery_images': 30, 'analytics': 500}
+    seed_json_files(tmp, sizes, rng)
+
+    from app import app
+    from services.model_registry import get_model_registry
+    from services.api_key_service import get_api_key_service
+    from services.queue_service import get_queue_service
+    from benchmarks.stubs import install_stubs
+
+    registry = get_model_registry()
+    install_stubs(registry, step_time=args.step_time)
+    registry.switch_model(LOCAL_MODEL)
+    seed_store(sizes, rng)
+    # 上限設得夠高：速率限制與佇列上限的檢查開銷計入量測，但不拒絕請求
+    api_key = get_api_key_service().create_key('load-test', rate_limit=10 ** 6, read_rate_limit=10 ** 6,
+                                               max_pending=10 ** 6)['api_key']
+    get_queue_service()
+
+    print(f"{READY_PREFIX} {api_key}", flush=True)
+    app.run(host='127.0.0.1', port=args.port, debug=False, use_reloader=False, threaded=True)
+
+
+def start_server(args):
+    """啟動伺服器子行程並等待就緒，回傳 (process, api_key)"""
+    cmd = [sys.executable, '-m', 'benchmarks.load_test', '--serve', '--port', str(args.port),
+           '--seed', str(args.seed), '--step-time', str(args.step_time),
+           '--resolution', str(args.resolution), '--history', str(args.history),
+           '--galleries', str(args.galleries)]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.Popen(cmd, cwd=root, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            text=True, encoding='utf-8')
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        line = proc.stdout.readline()
+        if not line:
+            if proc.poll() is not None:
+                raise RuntimeError(f"伺服器子行程結束（狀態碼 {proc.returncode}）")
+            continue
+        if line.startswith(READY_PREFIX):
+            api_key = line.split()[1]
+            # 之後的輸出不再讀取，轉給背景執行緒丟棄以免管線塞滿
+            threading.Thread(target=lambda: [None for _ in proc.stdout], daemon=True).start()
+            _wait_port(args.port, deadline)
+            return proc, api_key
+    proc.kill()
+    raise RuntimeError('伺服器啟動逾時')
+
+
+def _wait_port(port, deadline):
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"連接埠 {port} 未開啟")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# ── 客戶端 ────────────────────────────────────────────────────
+def _body(kind, rng):
+    if kind == 'generate':
+        return {'prompt': _prompt(rng), 'output_format': 'url'}
+    if kind == 'queue':
+        return {'params': {'prompt': _prompt(rng)}}
+    return None
+
+
+def run_level(port, api_key, name, concurrency, duration, timeout):
+    """以 concurrency 個封閉迴圈客戶端持續請求 duration 秒"""
+    import random
+    method, path, kind = ENDPOINTS[name]
+    stop_at = time.perf_counter() + duration
+    lock = threading.Lock()
+    latencies, statuses, errors = [], {}, []
+    queue_limited = [0]
+
+    def worker(index):
+        rng = random.Random(index)
+        while time.perf_counter() < stop_at:
+            body = _body(kind, rng)
+            headers = {'Content-Type': 'application/json', 'X-API-Key': api_key}
+            payload = json.dumps(body).encode('utf-8') if body is not None else None
+            t0 = time.perf_counter()
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+                conn.request(method, path, body=payload, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                conn.close()
+                elapsed = time.perf_counter() - t0
+                limited = resp.status == 429 and b'"QUEUE_LIMIT"' in data
+                with lock:
+                    statuses[resp.status] = statuses.get(resp.status, 0) + 1
+                    queue_limited[0] += limited
+                    if resp.status < 400:
+                        latencies.append(elapsed)
+            except Exception as e:
+                with lock:
+                    errors.append(type(e).__name__)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    total = sum(statuses.values()) + len(errors)
+    failed = len(errors) + sum(n for code, n in statuses.items() if code >= 400) - queue_limited[0]
+    result = latency_stats(latencies, wall)
+    result.update({
+        'concurrency': concurrency,
+        'requests': total,
+        'error_rate': round(failed / total, 4) if total else None,
+        'queue_limited': queue_limited[0],
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+    })
+    if errors:
+        result['exceptions'] = {e: errors.count(e) for e in set(errors)}
+    return result
+
+
+# ── 回歸比較 ──────────────────────────────────────────────────
+def compare(current, baseline, tolerance):
+    """逐端點、逐並發量比較，回傳回歸清單"""
+    regressions = []
+    for name, levels in current.get('results', {}).items():
+        base_levels = {lv['concurrency']: lv for lv in baseline.get('results', {}).get(name, [])}
+        for level in levels:
+            base = base_levels.get(level['concurrency'])
+            if not base or not base.get('count') or not level.get('count'):
+                continue
+            where = f"{name}@{level['concurrency']}"
+            if level['throughput_per_s'] < base['throughput_per_s'] * (1 - tolerance):
+                regressions.append({'endpoint': where, 'metric': 'throughput_per_s',
+                                    'baseline': base['throughput_per_s'], 'current': level['throughput_per_s']})
+            if level['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                regressions.append({'endpoint': where, 'metric': 'p95_ms',
+                                    'baseline': base['p95_ms'], 'current': level['p95_ms']})
+            if (level.get('error_rate') or 0) > (base.get('error_rate') or 0) + 0.01:
+                regressions.append({'endpoint': where, 'metric': 'error_rate',
+                                    'baseline': base.get('error_rate'), 'current': level['error_rate']})
+    return regressions
+
+
+def run(args):
+    proc, api_key = start_server(args)
+    levels = sorted(int(c) for c in args.concurrency.split(','))
+    names = args.endpoints.split(',') if args.endpoints else list(ENDPOINTS)
+    results = {}
+    try:
+        for name in names:
+            if name not in ENDPOINTS:
+                raise ValueError(f"未知端點: {name}（可用: {', '.join(ENDPOINTS)}）")
+            results[name] = []
+            for concurrency in levels:
+                level = run_level(args.port, api_key, name, concurrency, args.duration, args.timeout)
+                results[name].append(level)
+                print(f"[load] {name} c={concurrency} {level.get('throughput_per_s')}/s "
+                      f"p95={level.get('p95_ms')}ms err={level.get('error_rate')} "
+                      f"queue_limited={level['queue_limited']}", file=sys.stderr)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    return {
+        'benchmark': 'load_test',
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {'concurrency': levels, 'duration': args.duration, 'step_time': args.step_time,
+                   'resolution': args.resolution, 'history': args.history, 'galleries': args.galleries},
+        'results': results,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', default='1,2,4,8,16,32')
+    parser.add_argument('--duration', type=float, default=5.0, help='每個並發量持續秒數')
+    parser.add_argument('--endpoints', help=f"逗號分隔（{', '.join(ENDPOINTS)}）")
+    parser.add_argument('--timeout', type=float, default=60.0, help='單一請求逾時（秒）')
+    parser.add_argument('--step-time', type=float, default=0.005, help='假 pipeline 每步去噪耗時（秒）')
+    parser.add_argument('--resolution', type=int, default=512)
+    parser.add_argument('--history', type=int, default=5000)
+    parser.add_argument('--galleries', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--port', type=int, default=0, help='伺服器連接埠（0 = 自動挑選）')
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--baseline', help='先前的結果 JSON，用於回歸偵測')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='允許的退步比例')
+    parser.add_argument('--output', help='結果 JSON 輸出路徑（預設印到 stdout；應用程式輸出改送 stderr）')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    if args.serve:
+        serve(args)
+        return
+    with report_stdout() as stdout:
+        if not args.port:
+            args.port = _free_port()
+
+        report = run(args)
+        exit_code = 0
+        if args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            report['baseline_commit'] = baseline.get('commit')
+            report['regressions'] = compare(report, baseline, args.tolerance)
+            exit_code = 1 if report['regressions'] else 0
+
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        print(text, file=stdout)
+        if report.get('regressions'):
+            print(f"[load] 偵測到 {len(report['regressions'])} 項回歸", file=sys.stderr)
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Mock Cloud Server - 本機模擬 Gemini / OpenAI 圖片 API
+
+以 HTTP/1.1 keep-alive 回應官方 SDK 實際送出的請求，讓雲端 Provider 的連線池、
+非同步路徑與並行度可以在沒有網路與 API Key 的環境下驗證：
+
+    POST /v1beta/models/<model>:generateContent   Gemini generate_content
+    POST /v1beta/models/<model>:predict           Imagen generate_images
+    POST /v1/images/generations                   OpenAI images.generate
+    POST /v1/images/edits                         OpenAI images.edit
+    GET  /stats                                   連線數 / 請求數 / 最大同時處理數
+
+設定 config.CLOUD_BASE_URLS = {"gemini": url, "openai": url + "/v1"} 即可讓 Provider 改連此伺服器。
+
+故障注入（驗證重試 / 斷路器 / 對沖）：
+    --fail-rate 0.3 --fail-status 503   隨機比例的請求回傳錯誤
+    server.fail_next(2, 429, retry_after=1)   接下來 N 個請求回傳指定錯誤
+    server.slow_next(1, 3.0)                  接下來 N 個請求額外延遲（模擬長尾）
+
+用法:
+    python -m benchmarks.mock_cloud_server --port 8090 --latency 0.5
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stubs import fake_png_b64  # noqa: E402
+
+
+class MockCloudServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.2, size=256, fail_rate=0.0, fail_status=503):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.size = size
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.lock = threading.Lock()
+        self._faults = []
+        self._slow = []
+        self.stats = {'connections': 0, 'requests': 0, 'in_flight': 0, 'max_in_flight': 0, 'failed': 0}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.stats['connections'] += 1
+        super().process_request(request, client_address)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats.update(connections=0, requests=0, max_in_flight=0, failed=0)
+
+    def fail_next(self, count, status=503, retry_after=None):
+        """接下來 count 個請求回傳 status（可附 Retry-After 秒數）"""
+        with self.lock:
+            self._faults.extend([(status, retry_after)] * count)
+
+    def slow_next(self, count, delay):
+        """接下來 count 個請求額外延遲 delay 秒"""
+        with self.lock:
+            self._slow.extend([delay] * count)
+
+    def _next_fault(self):
+        """(額外延遲, 錯誤狀態碼或 None, Retry-After)"""
+        with self.lock:
+            delay = self._slow.pop(0) if self._slow else 0.0
+            if self._faults:
+                status, after = self._faults.pop(0)
+            elif self.fail_rate and random.random() < self.fail_rate:
+                status, after = self.fail_status, None
+            else:
+                return delay, None, None
+            self.stats['failed'] += 1
+            return delay, status, after
+
+    def start(self):
+        """在背景執行緒啟動，回傳自身"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, self.server.snapshot())
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        with server.lock:
+            server.stats['requests'] += 1
+            server.stats['in_flight'] += 1
+            server.stats['max_in_flight'] = max(server.stats['max_in_flight'], server.stats['in_flight'])
+        try:
+            delay, fault, after = server._next_fault()
+            if server.latency or delay:
+                time.sleep(server.latency + delay)
+            if fault:
+                headers = {'Retry-After': str(after)} if after is not None else None
+                self._send_json(fault, {'error': {'code': fault, 'message': f'injected {fault}',
+                                                  'status': 'UNAVAILABLE'}}, headers)
+                return
+            path = self.path.split('?')[0]
+            prompt = raw[:200].decode('utf-8', 'replace')
+            image = fake_png_b64(prompt, server.size, server.size)
+            if path.endswith(':generateContent'):
+                self._send_json(200, {'candidates': [{
+                    'content': {'role': 'model', 'parts': [{'inlineData': {'mimeType': 'image/png', 'data': image}}]},
+                    'finishReason': 'STOP',
+                }]})
+            elif path.endswith(':predict'):
+                self._send_json(200, {'predictions': [{'bytesBase64Encoded': image, 'mimeType': 'image/png'}]})
+            elif path.endswith('/images/generations') or path.endswith('/images/edits'):
+                self._send_json(200, {'created': int(time.time()), 'data': [{'b64_json': image}]})
+            else:
+                self._send_json(404, {'error': {'message': f'unknown endpoint {path}'}})
+        finally:
+            with server.lock:
+                server.stats['in_flight'] -= 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.2, help='每個請求的模擬延遲（秒）')
+    parser.add_argument('--size', type=int, default=256, help='回傳圖片邊長')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='隨機回傳錯誤的比例')
+    parser.add_argument('--fail-status', type=int, default=503, help='注入錯誤的 HTTP 狀態碼')
+    args = parser.parse_args()
+    server = MockCloudServer((args.host, args.port), args.latency, args.size, args.fail_rate, args.fail_status)
+    print(f"[mock] {server.url}  (gemini: {server.url}  openai: {server.url}/v1)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Benchmark Stubs - 不需要 GPU 與網路的假模型
+
+- FakePipeline：決定性的 diffusers pipeline 替身（同提示詞 + 種子 → 同一張圖），
+  以 sleep 模擬文字編碼 / 每步去噪 / VAE 解碼的耗時，輸出真實尺寸的 PIL 圖片，
+  PNG 編碼、存檔、歷史寫入等後續流程都照常執行
+- FakeGeminiClient / FakeOpenAIClient：回傳與官方 SDK 相同結構的回應物件
+- install_stubs(registry)：替換註冊表內各 Provider 的 pipeline 載入與 API client
+
+所有耗時皆可由參數調整，設為 0 即只量測應用程式本身的開銷。
+"""
+import time
+import zlib
+import base64
+from io import BytesIO
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+
+def fake_image(prompt, width, height, seed=0):
+    """依提示詞與種子產生決定性的圖片（漸層 + 低幅雜訊，PNG 壓縮率接近真實圖片）"""
+    key = zlib.crc32(f"{prompt}|{seed}".encode('utf-8'))
+    rng = np.random.default_rng(key)
+    base = rng.integers(0, 256, size=3)
+    ys = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+    xs = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    gradient = base + 96 * xs + 64 * ys
+    noise = rng.integers(-12, 13, size=(height, width, 3))
+    pixels = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels, 'RGB')
+
+
+def fake_png_b64(prompt, width=1024, height=1024, seed=0):
+    buffered = BytesIO()
+    fake_image(prompt, width, height, seed).save(buffered, format='PNG')
+    return base64.b64encode(buffered.getvalue()).decode()
+
+
+# ── 本地 pipeline ─────────────────────────────────────────────
+class _FakeVAE:
+    def __init__(self, decode_time):
+        self.decode_time = decode_time
+
+    def decode(self, latents):
+        if self.decode_time:
+            time.sleep(self.decode_time)
+        prompt, width, height, seed = latents
+        return fake_image(prompt, width, height, seed)
+
+
+class FakePipeline:
+    """決定性的 diffusers pipeline 替身"""
+
+    def __init__(self, step_time=0.005, encode_time=0.01, decode_time=0.02):
+        self.step_time = step_time
+        self.encode_time = encode_time
+        self.vae = _FakeVAE(decode_time)
+        self.calls = 0
+
+    def encode_prompt(self, prompt, negative_prompt=None):
+        if self.encode_time:
+            time.sleep(self.encode_time)
+        return prompt, negative_prompt
+
+    def __call__(self, prompt, height, width, num_inference_steps=9, guidance_scale=0.0,
+                 generator=None, negative_prompt=None, **kwargs):
+        self.calls += 1
+        seed = generator.initial_seed() if generator is not None else 0
+        self.encode_prompt(prompt, negative_prompt)
+        if self.step_time:
+            for _ in range(num_inference_steps):
+                time.sleep(self.step_time)
+        image = self.vae.decode((prompt, width, height, seed))
+        return SimpleNamespace(images=[image])
+
+
+# ── 雲端 client ───────────────────────────────────────────────
+class _FakeGeminiModels:
+    def __init__(self, latency, size):
+        self.latency = latency
+        self.size = size
+        self.calls = 0
+
+    def _image_b64(self, contents):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return fake_png_b64(str(contents)[:200], self.size, self.size)
+
+    def generate_content(self, model, contents, config=None):
+        part = SimpleNamespace(inline_data=SimpleNamespace(data=self._image_b64(contents),
+                                                           mime_type='image/png'))
+        candidate = SimpleNamespace(content=SimpleNamespace(parts=[part]), finish_reason='STOP')
+        return SimpleNamespace(candidates=[candidate], text='')
+
+    def generate_images(self, model, prompt, config=None):
+        image = SimpleNamespace(image_bytes=self._image_b64(prompt))
+        return SimpleNamespace(generated_images=[SimpleNamespace(image=image)])
+
+
+class FakeGeminiClient:
+    """google.genai.Client 替身"""
+
+    def __init__(self, latency=0.2, size=1024):
+        self.models = _FakeGeminiModels(latency, size)
+
+
+class _FakeOpenAIImages:
+    def __init__(self, latency, size):
+        self.latency = latency
+        self.size = size
+        self.calls = 0
+
+    def _response(self, prompt):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        item = SimpleNamespace(b64_json=fake_png_b64(prompt, self.size, self.size), url=None)
+        return SimpleNamespace(data=[item])
+
+    def generate(self, model, prompt, size=None, response_format=None, n=1, **kwargs):
+        return self._response(prompt)
+
+    def edit(self, model, image, prompt, size=None, response_format=None, n=1, **kwargs):
+        return self._response(prompt)
+
+
+class FakeOpenAIClient:
+    """openai.OpenAI 替身"""
+
+    def __init__(self, latency=0.2, size=1024):
+        self.images = _FakeOpenAIImages(latency, size)
+
+
+# ── 安裝到註冊表 ──────────────────────────────────────────────
+def install_stubs(registry, step_time=0.005, encode_time=0.01, decode_time=0.02,
+                  load_time=0.0, cloud_latency=0.2, cloud_size=1024):
+    """將註冊表內所有本地 / 雲端 Provider 換成假模型，回傳共用的 client 以便統計呼叫次數"""
+    def loader():
+        if load_time:
+            time.sleep(load_time)
+        return FakePipeline(step_time, encode_time, decode_time)
+
+    for provider in registry._local_providers.values():
+        provider._load_pipeline = loader
+
+    gemini = FakeGeminiClient(cloud_latency, cloud_size)
+    for provider in registry._gemini_providers.values():
+        provider.set_api_key('benchmark')
+        provider._get_client = lambda client=gemini: client
+
+    openai = FakeOpenAIClient(cloud_latency, cloud_size)
+    for provider in registry._openai_providers.values():
+        provider.set_api_key('benchmark')
+        provider._get_client = lambda client=openai: client
+
+    return {'gemini': gemini, 'openai': openai}
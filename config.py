@@ -60,6 +60,154 @@ PORT = 5000
 DEBUG = False
 USE_RELOADER = False  # 避免生成過程中重新載入
 
+# ===========================
+# 生產模式 (python serve.py)
+# ===========================
+
+# web worker 行程數 (gunicorn；Windows 改用 waitress 單行程多執行緒)
+WEB_WORKERS = 4
+
+# 每個 web worker 的執行緒數
+WEB_THREADS = 8
+
+# 推論行程 (持有模型與佇列) 的本機 IPC 位址
+INFERENCE_HOST = "127.0.0.1"
+INFERENCE_PORT = 5001
+
+# ===========================
+# 生成佇列
+# ===========================
+
+# 佇列後端: "memory" = 單一推論行程 (預設); "sqlite" = 共用 broker 檔案，
+# 多個推論行程 / GPU 節點可同時領取任務 (各節點需共用 OUTPUT_PATH 與 broker 檔案)
+QUEUE_BACKEND = "memory"
+
+# broker 檔案路徑；None = OUTPUT_PATH/queue.db
+QUEUE_BROKER_PATH = None
+
+# 任務租約秒數；節點超過此時間未續約，任務重新排入佇列
+QUEUE_LEASE_SECONDS = 60
+
+# 節點心跳 / 續約間隔 (秒)
+QUEUE_HEARTBEAT_INTERVAL = 5
+
+# 同一任務最多領取次數 (含租約過期重試)
+QUEUE_MAX_ATTEMPTS = 3
+
+# 模型親和：指定模型的任務等待超過此秒數後，未載入該模型的節點也可領取
+QUEUE_AFFINITY_WAIT = 30
+
+# 佇列任務指定其他模型時是否切換模型；切換會改變網頁介面的使用中模型，
+# 因此預設關閉（不切換的節點只領取符合目前模型的任務，其餘保持排隊），--queue-worker 節點自動開啟
+QUEUE_SWITCH_MODELS = False
+
+# 每個 API 金鑰的待處理任務數上限 (金鑰的 max_pending 欄位可覆寫；None = 不限制)
+QUEUE_MAX_PENDING_PER_KEY = 20
+
+# 網頁介面 (未帶 API 金鑰) 的待處理任務數上限；None = 不限制
+QUEUE_MAX_PENDING_WEB = None
+
+# 大量生成工作 (JSONL) 的單一工作提示詞數上限
+BULK_MAX_ITEMS = 10000
+
+# 每個大量生成工作同時放在佇列中的任務數 (完成一筆補一筆)
+BULK_WINDOW = 8
+
+# 串流進度在沒有新結果時送出心跳的間隔 (秒)
+BULK_STREAM_HEARTBEAT = 15
+
+# ===========================
+# 雲端 API (Gemini / OpenAI)
+# ===========================
+
+# 覆寫 API 端點，例如指向本機模擬伺服器測試；None = 官方端點
+# (OpenAI 需含 /v1，例如 "http://127.0.0.1:8090/v1")
+CLOUD_BASE_URLS = {"gemini": None, "openai": None}
+
+# 單次雲端請求逾時 (秒)
+CLOUD_TIMEOUT = 120
+
+# 批量生成時同時進行的雲端請求數上限
+CLOUD_CONCURRENCY = 8
+
+# 暫時性錯誤 (429 / 5xx / 連線逾時) 的最多嘗試次數 (含第一次)
+CLOUD_RETRY_ATTEMPTS = 3
+
+# 指數退避基準與上限 (秒)；Retry-After 超過上限時不再重試
+CLOUD_RETRY_BASE_DELAY = 1.0
+CLOUD_RETRY_MAX_DELAY = 20.0
+
+# 斷路器：連續幾次服務端失敗後暫停送出請求，暫停幾秒後試探
+CLOUD_BREAKER_THRESHOLD = 5
+CLOUD_BREAKER_RESET = 30
+
+# 對沖請求：超過此秒數未回應時再送出一份相同請求 (會增加 API 用量)；None = 停用
+CLOUD_HEDGE_DELAY = None
+
+# 速率限制 (provider_settings.json 的 rate_limits) 下同步請求最多等待秒數，超過則直接回報錯誤；
+# 佇列任務不受此限，會留在佇列中等額度恢復
+CLOUD_RATE_LIMIT_MAX_WAIT = 120
+
+# ===========================
+# 對外 API (/api/v1) 速率限制
+# ===========================
+
+# 是否依 API 金鑰限制請求速率 (超過時回傳 429 與 Retry-After)
+API_RATE_LIMIT_ENABLED = True
+
+# 新金鑰預設的每分鐘生成請求上限 (金鑰的 rate_limit 欄位；0 = 不限制)
+API_RATE_LIMIT_DEFAULT = 60
+
+# 新金鑰預設的每分鐘讀取請求上限 (history、models 等；金鑰的 read_rate_limit 欄位)
+API_READ_RATE_LIMIT_DEFAULT = 600
+
+# 可連續突發的請求數 = 此秒數內的額度
+API_RATE_LIMIT_BURST_SECONDS = 10
+
+# ===========================
+# Webhook (/api/v1/jobs 完成通知)
+# ===========================
+
+# 投遞 webhook 的執行緒數 (與 GPU 工作執行緒分開，不阻塞生成)
+WEBHOOK_WORKERS = 4
+
+# 單次投遞逾時 (秒)
+WEBHOOK_TIMEOUT = 10
+
+# 最多投遞次數 (含第一次)；連線錯誤、408 / 429 / 5xx 時重試
+WEBHOOK_MAX_ATTEMPTS = 5
+
+# 重試退避基準 (秒)，第 n 次重試等待 基準 × 2^(n-1)
+WEBHOOK_RETRY_BASE_DELAY = 2.0
+
+# 是否允許送往本機 / 私有網段 (僅供本機測試；對外服務請保持 False)
+WEBHOOK_ALLOW_PRIVATE = False
+
+# ===========================
+# 匯出 (PDF / PPT)
+# ===========================
+
+# 匯出時解碼 / 縮圖的執行緒數；None = CPU 核心數 (上限 8)
+EXPORT_WORKERS = None
+
+# PDF 嵌入圖片的解析度 (依版面大小縮圖，超過此 DPI 的像素不嵌入)
+PDF_EXPORT_DPI = 150
+
+# PDF 圖片以 JPEG 嵌入的品質；None = 無損 (檔案較大、產生較慢)
+PDF_EXPORT_JPEG_QUALITY = 90
+
+# PPT 圖片的解析度 (依投影片上的顯示大小縮圖)
+PPT_EXPORT_DPI = 150
+
+# PPT 縮圖後以 JPEG 儲存的品質 (含透明度的圖片改存 PNG)；None = 一律 PNG
+PPT_EXPORT_JPEG_QUALITY = 90
+
+# 圖片數超過此值時改為背景工作：立即回傳 202 與進度 / 下載網址；None = 一律同步回傳
+EXPORT_BACKGROUND_THRESHOLD = 50
+
+# 背景匯出的檔案保留秒數，逾時後刪除
+EXPORT_JOB_TTL = 3600
+
 # ===========================
 # LLM 設定 (本地大語言模型)
 # ===========================
@@ -77,6 +225,22 @@ LLM_CONTEXT_LENGTH = 4096
 # 最大生成 token 數
 LLM_MAX_TOKENS = 512
 
+# ===========================
+# 效能剖析 (/debug/profiles)
+# ===========================
+
+# 是否允許以 X-Profile 標頭剖析單一請求 (X-Profile: 1 取樣, X-Profile: cprofile 另存 cProfile)
+PROFILE_ENABLED = False
+
+# 慢請求門檻 (秒)；設定後每個請求都以堆疊取樣記錄，超過門檻才保存。None = 停用
+PROFILE_SLOW_THRESHOLD = None
+
+# 堆疊取樣間隔 (秒)
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# 最多保留幾份剖析結果
+PROFILE_KEEP = 50
+
 # ===========================
 # 提示訊息
 # ===========================
@@ -2,6 +2,6 @@
 Providers Package
 各圖片生成模型的抽象層，讓模型選項完全獨立
 """
-from providers.base import BaseProvider
+from providers.base import BaseProvider, StageTimings, GENERATION_STAGES
 
-__all__ = ['BaseProvider']
+__all__ = ['BaseProvider', 'StageTimings', 'GENERATION_STAGES']
@@ -7,10 +7,48 @@ Base Provider - 所有圖片生成 Provider 的抽象基底類別
 3. 在 model_registry.py 的 CLOUD_MODELS 或 LOCAL_MODELS 清單加入設定
 不需要動其他任何地方。
 """
+import time
+import asyncio
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from typing import Optional
 
 
+# 單次生成的階段名稱（依流程順序）
+GENERATION_STAGES = (
+    'queue_wait',     # 佇列等待
+    'model_load',     # 自動載入模型
+    'text_encode',    # 文字編碼器
+    'denoise',        # 去噪迴圈
+    'vae_decode',     # VAE 解碼
+    'api_call',       # 雲端 API 往返
+    'image_encode',   # PNG / base64 編碼
+    'persist',        # 存檔與寫入歷史
+)
+
+
+class StageTimings(dict):
+    """單次生成各階段耗時（秒），由呼叫端建立後沿著生成流程傳遞
+
+    Provider 透過 generate(..., timings=StageTimings()) 收到時記錄內部階段，
+    未收到時可忽略。
+    """
+
+    def add(self, stage: str, seconds: float):
+        self[stage] = self.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def rounded(self, digits: int = 4) -> dict:
+        return {k: round(v, digits) for k, v in self.items()}
+
+
 class BaseProvider(ABC):
     """所有圖片生成 Provider 的抽象基底類別"""
 
@@ -69,6 +107,8 @@ class BaseProvider(ABC):
         """
         文字生圖
 
+        kwargs 可帶 timings (StageTimings)，Provider 將內部階段耗時記錄於其中
+
         Returns:
             {
                 'success': bool,
@@ -79,6 +119,19 @@ class BaseProvider(ABC):
             }
         """
 
+    async def agenerate(self, prompt: str, width: int, height: int,
+                        negative_prompt: Optional[str] = None,
+                        seed: Optional[int] = None,
+                        **kwargs) -> dict:
+        """
+        非同步文字生圖（在 providers/cloud/client_pool 的事件迴圈上執行）
+
+        預設在執行緒池呼叫 generate()；雲端 Provider 覆寫為原生非同步 client。
+        Returns: 與 generate() 相同格式
+        """
+        return await asyncio.to_thread(self.generate, prompt, width, height,
+                                       negative_prompt=negative_prompt, seed=seed, **kwargs)
+
     def img2img(self, image_base64: str, prompt: str,
                 strength: float = 0.7,
                 width: Optional[int] = None,
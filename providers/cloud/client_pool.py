@@ -0,0 +1,104 @@
+"""
+Cloud Client Pool - 雲端 SDK client 快取與非同步執行
+
+- 依 (provider, 同步/非同步, API Key 雜湊, base_url) 快取長期存活的 client，
+  重複使用 SDK 內部的 HTTP 連線池（keep-alive、TLS session），不再每次呼叫重建
+- 非同步 client（genai client.aio、AsyncOpenAI）只在單一背景事件迴圈執行緒上使用，
+  同步程式以 run_async() 提交協程，同一行程內可並行多個雲端生成
+- API 端點可由 config.CLOUD_BASE_URLS 覆寫，指向本機模擬伺服器測試
+  （benchmarks/mock_cloud_server.py）
+"""
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+import config
+
+# 同時保留的 client 數上限（超過時關閉最久未使用者）
+MAX_CLIENTS = 16
+
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+_stats = {'created': 0, 'reused': 0, 'evicted': 0}
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def key_hash(api_key):
+    """API Key 只以雜湊值作為快取鍵與日誌識別"""
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:16]
+
+
+def base_url(provider_id):
+    return (getattr(config, 'CLOUD_BASE_URLS', None) or {}).get(provider_id) or None
+
+
+def get_client(provider_id, api_key, factory, kind='sync'):
+    """取得快取的 client，不存在時以 factory(api_key, base_url) 建立"""
+    url = base_url(provider_id)
+    key = (provider_id, kind, key_hash(api_key), url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            _stats['reused'] += 1
+            return client
+        client = factory(api_key, url)
+        _clients[key] = client
+        _stats['created'] += 1
+        evicted = []
+        while len(_clients) > MAX_CLIENTS:
+            evicted.append(_clients.popitem(last=False)[1])
+            _stats['evicted'] += 1
+    for old in evicted:
+        _close(old)
+    return client
+
+
+def clear_clients(provider_id=None):
+    """關閉並移除快取的 client（API Key 或端點變更時呼叫）"""
+    with _clients_lock:
+        keys = [k for k in _clients if provider_id is None or k[0] == provider_id]
+        removed = [_clients.pop(k) for k in keys]
+    for client in removed:
+        _close(client)
+    return len(removed)
+
+
+def _close(client):
+    close = getattr(client, 'close', None)
+    if close is None:
+        return
+    try:
+        result = close()
+        if asyncio.iscoroutine(result):
+            # 非同步 client 須在所屬事件迴圈關閉
+            if _loop is not None and _loop.is_running():
+                asyncio.run_coroutine_threadsafe(result, _loop)
+            else:
+                result.close()
+    except Exception:
+        pass
+
+
+def get_stats():
+    with _clients_lock:
+        return {**_stats, 'cached': len(_clients)}
+
+
+# ── 非同步執行 ─────────────────────────────────────────────────
+def _event_loop():
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='cloud-async', daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run_async(coro):
+    """在背景事件迴圈執行協程，回傳 concurrent.futures.Future"""
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop())
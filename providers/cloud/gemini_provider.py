@@ -14,7 +14,11 @@ import base64
 import random
 from typing import Optional
 
+import config
 from providers.base import BaseProvider
+from providers.cloud import client_pool
+from providers.cloud.resilience import get_policy
+from providers.cloud.rate_limiter import get_rate_limiter
 
 # ── Gemini 可用模型設定（未來直接加這裡即可）────────────────────
 GEMINI_MODELS = {
@@ -76,16 +80,27 @@ class GeminiProvider(BaseProvider):
         return bool(self._api_key)
 
     def get_status(self) -> dict:
+        resilience = self._policy.snapshot()
+        rate_limit = get_rate_limiter().status(self.provider_id, self._model_id)
         if self.is_configured():
+            message = f'{self._model_meta["display_name"]} · 雲端就緒'
+            if resilience['breaker']['state'] != 'closed':
+                message = f'{self._model_meta["display_name"]} · 服務異常，暫停送出請求'
+            elif rate_limit['predicted_wait'] > 0:
+                message = f'{self._model_meta["display_name"]} · 達速率上限，約 {rate_limit["predicted_wait"]} 秒後送出'
             return {
                 'ready': True,
-                'message': f'{self._model_meta["display_name"]} · 雲端就緒',
+                'message': message,
                 'requires': None,
+                'resilience': resilience,
+                'rate_limit': rate_limit,
             }
         return {
             'ready': False,
             'message': '請在設定中填入 Gemini API Key',
             'requires': 'api_key',
+            'resilience': resilience,
+            'rate_limit': rate_limit,
         }
 
     # ── 能力 ──────────────────────────────────────────────────
@@ -99,20 +114,47 @@ class GeminiProvider(BaseProvider):
         return self._model_meta.get('supports_image_input', False)
 
     # ── 內部：取得 AI client ───────────────────────────────────
+    @property
+    def _policy(self):
+        """重試 / 斷路器（所有 Gemini 模型共用）"""
+        return get_policy('gemini')
+
+    @staticmethod
+    def _create_client(api_key, base_url):
+        from google import genai
+        from google.genai import types
+        return genai.Client(api_key=api_key, http_options=types.HttpOptions(
+            base_url=base_url, timeout=int(config.CLOUD_TIMEOUT * 1000)))
+
     def _get_client(self):
+        """同一 API Key 共用一個 client（含連線池），client.aio 供非同步路徑使用"""
         if not self._api_key:
             raise RuntimeError("Gemini API Key 未設定，請至設定頁面填入")
-        from google import genai
-        return genai.Client(api_key=self._api_key)
+        return client_pool.get_client('gemini', self._api_key, self._create_client)
+
+    def _text2img_request(self, prompt: str, negative_prompt: Optional[str]):
+        from google.genai import types
+        full_prompt = prompt
+        if negative_prompt:
+            full_prompt += f"\n\nAvoid: {negative_prompt}"
+        return dict(
+            model=self._model_id,
+            contents=full_prompt,
+            config=types.GenerateContentConfig(
+                response_modalities=['IMAGE', 'TEXT']
+            ),
+        )
 
     def _process_response(self, response) -> dict:
         """解析 Gemini generateContent 回應"""
         try:
             for part in response.candidates[0].content.parts:
                 if hasattr(part, 'inline_data') and part.inline_data:
+                    data = part.inline_data.data
                     return {
                         'success': True,
-                        'base64': part.inline_data.data,
+                        # SDK 回傳原始位元組，統一轉為 base64 字串
+                        'base64': base64.b64encode(data).decode() if isinstance(data, bytes) else data,
                         'mime_type': part.inline_data.mime_type or 'image/png',
                         'seed': random.randint(0, 2 ** 32 - 1),
                     }
@@ -139,18 +181,27 @@ class GeminiProvider(BaseProvider):
             if self._model_meta.get('use_generate_images'):
                 return self._generate_with_imagen(client, prompt)
 
-            full_prompt = prompt
-            if negative_prompt:
-                full_prompt += f"\n\nAvoid: {negative_prompt}"
+            request = self._text2img_request(prompt, negative_prompt)
+            response = self._policy.call(lambda: client.models.generate_content(**request), model=self._model_id)
+            return self._process_response(response)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
 
-            from google.genai import types
-            response = client.models.generate_content(
-                model=self._model_id,
-                contents=full_prompt,
-                config=types.GenerateContentConfig(
-                    response_modalities=['IMAGE', 'TEXT']
-                ),
-            )
+    async def agenerate(self, prompt: str, width: int, height: int,
+                        negative_prompt: Optional[str] = None,
+                        seed: Optional[int] = None,
+                        **kwargs) -> dict:
+        """非同步文字生圖（client.aio，與同步路徑共用連線設定）"""
+        try:
+            client = self._get_client()
+            if self._model_meta.get('use_generate_images'):
+                response = await self._policy.acall(
+                    lambda: client.aio.models.generate_images(model=self._model_id, prompt=prompt),
+                    model=self._model_id)
+                return self._process_imagen_response(response)
+            request = self._text2img_request(prompt, negative_prompt)
+            response = await self._policy.acall(lambda: client.aio.models.generate_content(**request),
+                                                model=self._model_id)
             return self._process_response(response)
         except Exception as e:
             return {'success': False, 'error': str(e)}
@@ -158,22 +209,27 @@ class GeminiProvider(BaseProvider):
     def _generate_with_imagen(self, client, prompt: str) -> dict:
         """使用 Imagen generateImages API"""
         try:
-            response = client.models.generate_images(
+            response = self._policy.call(lambda: client.models.generate_images(
                 model=self._model_id,
                 prompt=prompt,
-            )
-            if response.generated_images:
-                img = response.generated_images[0]
-                return {
-                    'success': True,
-                    'base64': img.image.image_bytes if hasattr(img.image, 'image_bytes') else img.image.imageBytes,
-                    'mime_type': 'image/jpeg',
-                    'seed': random.randint(0, 2 ** 32 - 1),
-                }
-            return {'success': False, 'error': 'Imagen 未回傳圖片'}
+            ), model=self._model_id)
+            return self._process_imagen_response(response)
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    def _process_imagen_response(self, response) -> dict:
+        if response.generated_images:
+            img = response.generated_images[0]
+            raw = img.image.image_bytes if hasattr(img.image, 'image_bytes') else img.image.imageBytes
+            return {
+                'success': True,
+                # SDK 回傳原始位元組，統一轉為 base64 字串
+                'base64': base64.b64encode(raw).decode() if isinstance(raw, bytes) else raw,
+                'mime_type': 'image/jpeg',
+                'seed': random.randint(0, 2 ** 32 - 1),
+            }
+        return {'success': False, 'error': 'Imagen 未回傳圖片'}
+
     # ── 圖生圖 ─────────────────────────────────────────────────
     def img2img(self, image_base64: str, prompt: str,
                 strength: float = 0.7,
@@ -191,13 +247,13 @@ class GeminiProvider(BaseProvider):
                 types.Part.from_bytes(data=base64.b64decode(image_base64), mime_type=mime_type),
                 types.Part.from_text(text=prompt),
             ]
-            response = client.models.generate_content(
+            response = self._policy.call(lambda: client.models.generate_content(
                 model=self._model_id,
                 contents=types.Content(parts=parts),
                 config=types.GenerateContentConfig(
                     response_modalities=['IMAGE', 'TEXT']
                 ),
-            )
+            ), model=self._model_id)
             return self._process_response(response)
         except Exception as e:
             return {'success': False, 'error': str(e)}
@@ -252,13 +308,14 @@ class GeminiProvider(BaseProvider):
     def _call_gemini(self, client, parts_list: list, model_id: str = None) -> dict:
         """統一呼叫 Gemini API 的內部方法"""
         from google.genai import types
-        response = client.models.generate_content(
-            model=model_id or self._model_id,
+        model_id = model_id or self._model_id
+        response = self._policy.call(lambda: client.models.generate_content(
+            model=model_id,
             contents=types.Content(parts=parts_list),
             config=types.GenerateContentConfig(
                 response_modalities=['IMAGE', 'TEXT']
             ),
-        )
+        ), model=model_id)
         return self._process_response(response)
 
     def _img_part(self, b64: str, mime: str):
@@ -315,7 +372,7 @@ The output must look indistinguishable from a real professional photograph."""
         # Step 1: Generate prompt via text-only call
         try:
             from google.genai import types
-            prompt_resp = client.models.generate_content(
+            prompt_resp = self._policy.call(lambda: client.models.generate_content(
                 model='gemini-2.5-flash',
                 contents=f"""Based on a photo, generate an English prompt for an anime avatar in the style of "{style}".
 Achieve {strength_desc} transformation. Preserve the person's recognizable facial features.
@@ -323,7 +380,7 @@ Output ONLY the English prompt, no markdown.""",
                 config=types.GenerateContentConfig(
                     system_instruction="You are an expert AI art prompt engineer for anime-style avatars."
                 ),
-            )
+            ), model='gemini-2.5-flash', images=0)
             img_prompt = (prompt_resp.text or '').strip()
             if not img_prompt:
                 img_prompt = f"Transform this photo into {style} anime style avatar, preserving facial features."
@@ -486,10 +543,10 @@ Clean, scalable vector-style design on white background. Suitable for business u
 
         # Logo 優先使用 Imagen
         try:
-            response = client.models.generate_images(
+            response = self._policy.call(lambda: client.models.generate_images(
                 model='imagen-4.0-generate-001',
                 prompt=prompt,
-            )
+            ), model='imagen-4.0-generate-001')
             if response.generated_images:
                 img = response.generated_images[0]
                 raw = img.image.image_bytes if hasattr(img.image, 'image_bytes') else img.image.imageBytes
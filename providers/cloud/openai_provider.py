@@ -12,7 +12,11 @@ import random
 from typing import Optional
 from io import BytesIO
 
+import config
 from providers.base import BaseProvider
+from providers.cloud import client_pool
+from providers.cloud.resilience import get_policy
+from providers.cloud.rate_limiter import get_rate_limiter
 
 # ── OpenAI 可用模型設定 ──────────────────────────────────────────
 OPENAI_MODELS = {
@@ -65,16 +69,27 @@ class OpenAIProvider(BaseProvider):
         return bool(self._api_key)
 
     def get_status(self) -> dict:
+        resilience = self._policy.snapshot()
+        rate_limit = get_rate_limiter().status(self.provider_id, self._model_id)
         if self.is_configured():
+            message = f'{self._model_meta["display_name"]} · 雲端就緒'
+            if resilience['breaker']['state'] != 'closed':
+                message = f'{self._model_meta["display_name"]} · 服務異常，暫停送出請求'
+            elif rate_limit['predicted_wait'] > 0:
+                message = f'{self._model_meta["display_name"]} · 達速率上限，約 {rate_limit["predicted_wait"]} 秒後送出'
             return {
                 'ready': True,
-                'message': f'{self._model_meta["display_name"]} · 雲端就緒',
+                'message': message,
                 'requires': None,
+                'resilience': resilience,
+                'rate_limit': rate_limit,
             }
         return {
             'ready': False,
             'message': '請在設定中填入 OpenAI API Key',
             'requires': 'api_key',
+            'resilience': resilience,
+            'rate_limit': rate_limit,
         }
 
     # ── 能力 ──────────────────────────────────────────────────
@@ -88,11 +103,32 @@ class OpenAIProvider(BaseProvider):
         return self._model_meta.get('supports_image_input', False)
 
     # ── 內部：取得 client ──────────────────────────────────────
+    @property
+    def _policy(self):
+        """重試 / 斷路器（所有 OpenAI 模型共用）"""
+        return get_policy('openai')
+
+    @staticmethod
+    def _create_client(api_key, base_url):
+        from openai import OpenAI
+        # 重試由 resilience 層統一處理，關閉 SDK 內建重試
+        return OpenAI(api_key=api_key, base_url=base_url, timeout=config.CLOUD_TIMEOUT, max_retries=0)
+
+    @staticmethod
+    def _create_async_client(api_key, base_url):
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=config.CLOUD_TIMEOUT, max_retries=0)
+
     def _get_client(self):
+        """同一 API Key 共用一個 client（含連線池）"""
         if not self._api_key:
             raise RuntimeError("OpenAI API Key 未設定，請至設定頁面填入")
-        from openai import OpenAI
-        return OpenAI(api_key=self._api_key)
+        return client_pool.get_client('openai', self._api_key, self._create_client)
+
+    def _get_async_client(self):
+        if not self._api_key:
+            raise RuntimeError("OpenAI API Key 未設定，請至設定頁面填入")
+        return client_pool.get_client('openai', self._api_key, self._create_async_client, kind='async')
 
     def _best_size(self, width: int, height: int) -> str:
         """選擇最接近的支援尺寸"""
@@ -132,24 +168,8 @@ class OpenAIProvider(BaseProvider):
                  **kwargs) -> dict:
         try:
             client = self._get_client()
-            size = self._best_size(width, height)
-
-            full_prompt = prompt
-            if negative_prompt:
-                full_prompt += f". Avoid: {negative_prompt}"
-
-            gen_kwargs = dict(
-                model=self._model_id,
-                prompt=full_prompt,
-                size=size,
-                response_format='b64_json',
-                n=1,
-            )
-            # DALL-E 3 支援品質設定
-            if self._model_id == 'dall-e-3':
-                gen_kwargs['quality'] = 'hd'
-
-            response = client.images.generate(**gen_kwargs)
+            request = self._text2img_request(prompt, width, height, negative_prompt)
+            response = self._policy.call(lambda: client.images.generate(**request), model=self._model_id)
             b64 = self._response_to_b64(response)
             return {
                 'success': True,
@@ -160,6 +180,47 @@ class OpenAIProvider(BaseProvider):
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    async def agenerate(self, prompt: str, width: int, height: int,
+                        negative_prompt: Optional[str] = None,
+                        seed: Optional[int] = None,
+                        **kwargs) -> dict:
+        """非同步文字生圖（AsyncOpenAI）"""
+        try:
+            client = self._get_async_client()
+            request = self._text2img_request(prompt, width, height, negative_prompt)
+            response = await self._policy.acall(lambda: client.images.generate(**request), model=self._model_id)
+            if not (response.data and getattr(response.data[0], 'b64_json', None)):
+                # 回傳 URL 時下載屬同步 I/O，移到執行緒池
+                import asyncio
+                b64 = await asyncio.to_thread(self._response_to_b64, response)
+            else:
+                b64 = response.data[0].b64_json
+            return {
+                'success': True,
+                'base64': b64,
+                'mime_type': 'image/png',
+                'seed': random.randint(0, 2 ** 32 - 1),
+            }
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def _text2img_request(self, prompt, width, height, negative_prompt):
+        full_prompt = prompt
+        if negative_prompt:
+            full_prompt += f". Avoid: {negative_prompt}"
+
+        gen_kwargs = dict(
+            model=self._model_id,
+            prompt=full_prompt,
+            size=self._best_size(width, height),
+            response_format='b64_json',
+            n=1,
+        )
+        # DALL-E 3 支援品質設定
+        if self._model_id == 'dall-e-3':
+            gen_kwargs['quality'] = 'hd'
+        return gen_kwargs
+
     # ── 圖生圖 ─────────────────────────────────────────────────
     def img2img(self, image_base64: str, prompt: str,
                 strength: float = 0.7,
@@ -182,14 +243,14 @@ class OpenAIProvider(BaseProvider):
             if negative_prompt:
                 full_prompt += f". Avoid: {negative_prompt}"
 
-            response = client.images.edit(
+            response = self._policy.call(lambda: self._edit(client, dict(
                 model=self._model_id,
                 image=img_file,
                 prompt=full_prompt,
                 size=size,
                 response_format='b64_json',
                 n=1,
-            )
+            )), idempotent=False, model=self._model_id)
             b64 = self._response_to_b64(response)
             return {
                 'success': True,
@@ -232,12 +293,21 @@ class OpenAIProvider(BaseProvider):
                 mask_file.name = 'mask.png'
                 edit_kwargs['mask'] = mask_file
 
-            response = client.images.edit(**edit_kwargs)
+            response = self._policy.call(lambda: self._edit(client, edit_kwargs), idempotent=False,
+                                         model=self._model_id)
             b64 = self._response_to_b64(response)
             return {'success': True, 'base64': b64, 'mime_type': 'image/png', 'seed': 0}
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @staticmethod
+    def _edit(client, edit_kwargs: dict):
+        """images.edit；重試時檔案需從頭重新上傳"""
+        for key in ('image', 'mask'):
+            if key in edit_kwargs:
+                edit_kwargs[key].seek(0)
+        return client.images.edit(**edit_kwargs)
+
     def _build_edit_prompt(self, feature: str, params: dict) -> str:
         """為每個 Avatar Studio 功能建立提示詞"""
         prompts = {
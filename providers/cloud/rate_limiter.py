@@ -0,0 +1,172 @@
+"""
+Cloud Rate Limiter - 雲端 API 的用戶端速率限制（token bucket）
+
+在送出請求前先在本地扣除額度，避免批量生成或佇列超過 Gemini / OpenAI 的配額而收到 429。
+額度設定在 provider_settings.json 各 Provider 的 rate_limits：
+
+    "gemini": {
+        "api_key": "...",
+        "rate_limits": {
+            "requests_per_minute": 60,          # 整個 Provider（同一 API Key）
+            "images_per_minute": 30,
+            "models": {                          # 個別模型（SDK 模型 ID）
+                "gemini-2.5-flash-image": {"requests_per_minute": 10, "images_per_minute": 10}
+            }
+        }
+    }
+
+未設定的項目不限制。額度以預約方式扣除：桶不足時仍先扣（可為負值），呼叫端等待
+欠額補滿所需的秒數，因此同時到達的請求會依序排開，predict_wait() 即為新請求的預估等待。
+限制狀態在各行程（推論行程 / 佇列節點）各自獨立。
+"""
+import time
+import asyncio
+import threading
+import config
+
+LIMIT_KEYS = ('requests_per_minute', 'images_per_minute')
+
+
+class RateLimitExceeded(RuntimeError):
+    """預估等待超過 CLOUD_RATE_LIMIT_MAX_WAIT，請求未送出"""
+
+    def __init__(self, provider_id, wait):
+        self.retry_after = wait
+        super().__init__(f"{provider_id} 已達本地設定的速率上限，預估需等待 {int(wait) + 1} 秒，請稍後再試")
+
+
+class TokenBucket:
+    """每分鐘補充 per_minute 個 token，容量 burst（預設為一分鐘額度）"""
+
+    def __init__(self, per_minute, burst=None):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst or per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """取得 amount 個 token 需等待的秒數"""
+        self._refill(now)
+        if amount <= 0 or self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.tokens -= amount
+
+    def snapshot(self, now):
+        self._refill(now)
+        return {'per_minute': self.per_minute, 'available': round(self.tokens, 2)}
+
+
+class RateLimiter:
+    """各 Provider / 模型的請求數與圖片數 token bucket"""
+
+    def __init__(self):
+        self._buckets = {}   # (provider_id, model_id 或 None, limit_key) -> TokenBucket
+        self._lock = threading.Lock()
+        self.stats = {}      # provider_id -> {'waited': 次數, 'wait_seconds': 秒, 'rejected': 次數}
+
+    def configure(self, provider_id, limits):
+        """更新 Provider 的額度設定（設定改變的桶重建，其餘保留目前狀態）"""
+        limits = limits or {}
+        with self._lock:
+            wanted = {}
+            for key in LIMIT_KEYS:
+                if limits.get(key):
+                    wanted[(provider_id, None, key)] = limits[key]
+            for model_id, model_limits in (limits.get('models') or {}).items():
+                for key in LIMIT_KEYS:
+                    if (model_limits or {}).get(key):
+                        wanted[(provider_id, model_id, key)] = model_limits[key]
+            for bucket_key in [k for k in self._buckets if k[0] == provider_id and k not in wanted]:
+                del self._buckets[bucket_key]
+            for bucket_key, per_minute in wanted.items():
+                bucket = self._buckets.get(bucket_key)
+                if bucket is None or bucket.per_minute != per_minute:
+                    self._buckets[bucket_key] = TokenBucket(per_minute)
+
+    def _costs(self, provider_id, model_id, images):
+        """此請求需扣除的 (桶, 數量)"""
+        costs = []
+        for scope in ((None,) if model_id is None else (None, model_id)):
+            for key, amount in (('requests_per_minute', 1), ('images_per_minute', images)):
+                bucket = self._buckets.get((provider_id, scope, key))
+                if bucket is not None and amount:
+                    costs.append((bucket, amount))
+        return costs
+
+    def predict_wait(self, provider_id, model_id=None, images=1):
+        """新請求目前需等待的秒數（不扣額度）"""
+        now = time.monotonic()
+        with self._lock:
+            return max((b.wait_time(n, now) for b, n in self._costs(provider_id, model_id, images)), default=0.0)
+
+    def reserve(self, provider_id, model_id=None, images=1, max_wait=None):
+        """預約額度並回傳需等待的秒數；超過 max_wait 時拋出 RateLimitExceeded 且不扣額度"""
+        now = time.monotonic()
+        with self._lock:
+            costs = self._costs(provider_id, model_id, images)
+            if not costs:
+                return 0.0
+            wait = max(b.wait_time(n, now) for b, n in costs)
+            stats = self.stats.setdefault(provider_id, {'waited': 0, 'wait_seconds': 0.0, 'rejected': 0})
+            if max_wait is not None and wait > max_wait:
+                stats['rejected'] += 1
+                raise RateLimitExceeded(provider_id, wait)
+            for bucket, amount in costs:
+                bucket.take(amount, now)
+            if wait > 0:
+                stats['waited'] += 1
+                stats['wait_seconds'] += wait
+            return wait
+
+    def acquire(self, provider_id, model_id=None, images=1):
+        """同步等待直到可送出請求，回傳實際等待秒數"""
+        wait = self.reserve(provider_id, model_id, images, config.CLOUD_RATE_LIMIT_MAX_WAIT)
+        if wait > 0:
+            print(f"[Cloud] {provider_id} 達速率上限，等待 {wait:.1f} 秒")
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self, provider_id, model_id=None, images=1):
+        wait = self.reserve(provider_id, model_id, images, config.CLOUD_RATE_LIMIT_MAX_WAIT)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def status(self, provider_id, model_id=None):
+        """單一模型的額度狀態（provider.get_status() 使用）"""
+        now = time.monotonic()
+        with self._lock:
+            buckets = {}
+            for (pid, scope, key), bucket in self._buckets.items():
+                if pid == provider_id and scope in (None, model_id):
+                    buckets[f"{'model' if scope else 'provider'}.{key}"] = bucket.snapshot(now)
+            costs = self._costs(provider_id, model_id, 1)
+            wait = max((b.wait_time(n, now) for b, n in costs), default=0.0)
+            return {
+                'limited': bool(buckets),
+                'predicted_wait': round(wait, 1),
+                'buckets': buckets,
+                **{k: round(v, 1) for k, v in self.stats.get(provider_id, {}).items()},
+            }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
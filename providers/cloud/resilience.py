@@ -0,0 +1,332 @@
+"""
+Cloud Resilience - 雲端 API 呼叫的重試、斷路器與對沖請求
+
+每個 Provider（gemini / openai）共用一組 ResiliencePolicy，包住實際的 SDK 呼叫：
+
+- 重試：429 / 408 / 5xx / 連線錯誤 / 逾時等暫時性錯誤以指數退避 + full jitter 重試；
+  回應帶 Retry-After 時至少等待該秒數，超過 CLOUD_RETRY_MAX_DELAY 則不再重試
+- 斷路器：連續 CLOUD_BREAKER_THRESHOLD 次服務端失敗（5xx、連線錯誤、逾時）後開啟，
+  期間直接失敗、不送出請求；CLOUD_BREAKER_RESET 秒後半開，只放行一個試探請求，成功即關閉
+- 對沖：冪等呼叫在 CLOUD_HEDGE_DELAY 秒內未回應時再送出一份相同請求，採用先成功者
+  （預設停用，啟用後 API 用量會增加）
+- 速率限制：每次嘗試送出前向 rate_limiter 預約額度，超過本地設定的每分鐘上限時先等待
+
+狀態與計數透過 provider.get_status()['resilience'] 與 /metrics 提供。
+"""
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import config
+from services.metrics_service import CLOUD_RETRIES, CLOUD_BREAKER_STATE
+from providers.cloud.rate_limiter import get_rate_limiter, RateLimitExceeded
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+# 同步對沖請求的執行緒池（非同步路徑直接使用事件迴圈）
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='cloud-hedge')
+
+
+class CircuitOpenError(RuntimeError):
+    """斷路器開啟中，請求未送出"""
+
+    def __init__(self, provider_id, retry_in):
+        self.retry_in = max(0.0, retry_in)
+        super().__init__(f"{provider_id} 服務暫時無法使用（連續失敗，已暫停送出請求），"
+                         f"請約 {int(self.retry_in) + 1} 秒後再試")
+
+
+# ── 錯誤分類 ───────────────────────────────────────────────────
+def status_code(exc):
+    """SDK 例外的 HTTP 狀態碼（openai: status_code；genai: code），沒有時為 None"""
+    for attr in ('status_code', 'code'):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_network_error(exc):
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    name = type(exc).__name__
+    return 'Timeout' in name or 'Connect' in name
+
+
+def is_transient(exc):
+    code = status_code(exc)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    return is_network_error(exc)
+
+
+def is_outage(exc):
+    """是否計入斷路器（服務端故障；429 代表服務正常但超出配額，不計入）"""
+    code = status_code(exc)
+    if code is not None:
+        return code >= 500 or code == 408
+    return is_network_error(exc)
+
+
+def retry_after(exc):
+    """回應標頭的 Retry-After（秒），沒有時為 None"""
+    headers = getattr(getattr(exc, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        value = headers.get('retry-after-ms')
+        if value:
+            return float(value) / 1000
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# ── 斷路器 ─────────────────────────────────────────────────────
+class CircuitBreaker:
+    """closed → (連續失敗) → open → (冷卻) → half_open → (試探成功) → closed"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, threshold=None, reset_timeout=None):
+        self.name = name
+        self.threshold = threshold or config.CLOUD_BREAKER_THRESHOLD
+        self.reset_timeout = reset_timeout or config.CLOUD_BREAKER_RESET
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.opened_count = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """放行時回傳 None，否則拋出 CircuitOpenError"""
+        with self._lock:
+            if self.state == self.OPEN:
+                elapsed = time.time() - self.opened_at
+                if elapsed < self.reset_timeout:
+                    raise CircuitOpenError(self.name, self.reset_timeout - elapsed)
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    raise CircuitOpenError(self.name, 1.0)
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+                print(f"[Cloud] {self.name} 斷路器關閉，恢復正常")
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                self.opened_at = time.time()
+                self.opened_count += 1
+                self._set_state(self.OPEN)
+                print(f"[Cloud] {self.name} 連續失敗 {self.failures} 次，斷路器開啟 {self.reset_timeout} 秒")
+
+    def is_closed(self):
+        return self.state == self.CLOSED
+
+    def _set_state(self, state):
+        self.state = state
+        CLOUD_BREAKER_STATE.set({self.CLOSED: 0, self.HALF_OPEN: 1, self.OPEN: 2}[state], provider=self.name)
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = round(max(0.0, self.reset_timeout - (time.time() - self.opened_at)), 1)
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'opened_count': self.opened_count,
+                'retry_in': retry_in,
+            }
+
+
+# ── 重試 / 對沖 ────────────────────────────────────────────────
+class ResiliencePolicy:
+    """單一 Provider 的重試、斷路器與對沖設定"""
+
+    def __init__(self, provider_id):
+        self.provider_id = provider_id
+        self.breaker = CircuitBreaker(provider_id)
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'retries': 0, 'failures': 0, 'rejected': 0, 'hedges': 0, 'hedge_wins': 0}
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _admit(self):
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self._count('rejected')
+            raise
+
+    def _backoff(self, attempt, exc):
+        """第 attempt 次失敗後的等待秒數；不應再重試時回傳 None"""
+        if attempt + 1 >= config.CLOUD_RETRY_ATTEMPTS or not is_transient(exc):
+            return None
+        if not self.breaker.is_closed():
+            return None
+        delay = random.uniform(0, min(config.CLOUD_RETRY_MAX_DELAY, config.CLOUD_RETRY_BASE_DELAY * 2 ** attempt))
+        after = retry_after(exc)
+        if after is not None:
+            if after > config.CLOUD_RETRY_MAX_DELAY:
+                return None
+            delay = max(delay, after)
+        return delay
+
+    def _on_failure(self, attempt, exc):
+        if is_outage(exc):
+            self.breaker.record_failure()
+        else:
+            # 4xx / 429：服務可連線，視為斷路器成功
+            self.breaker.record_success()
+        delay = self._backoff(attempt, exc)
+        if delay is None:
+            self._count('failures')
+            return None
+        self._count('retries')
+        code = status_code(exc)
+        CLOUD_RETRIES.inc(provider=self.provider_id, reason=str(code) if code else 'network')
+        print(f"[Cloud] {self.provider_id} 暫時性錯誤（{code or type(exc).__name__}），"
+              f"{delay:.1f} 秒後第 {attempt + 2} 次嘗試")
+        return delay
+
+    def _should_hedge(self, idempotent):
+        return idempotent and config.CLOUD_HEDGE_DELAY and self.breaker.is_closed()
+
+    def _hedge_quota(self, model, images):
+        """對沖請求同樣計入速率限制，額度不足時不對沖"""
+        try:
+            return get_rate_limiter().reserve(self.provider_id, model, images, max_wait=0) == 0
+        except RateLimitExceeded:
+            return False
+
+    def call(self, fn, idempotent=True, model=None, images=1):
+        """同步呼叫 fn()，失敗時依策略重試
+
+        model / images: 速率限制的模型（SDK 模型 ID）與此請求產生的圖片數（文字請求為 0）
+        """
+        self._count('calls')
+        limiter = get_rate_limiter()
+        attempt = 0
+        while True:
+            self._admit()
+            limiter.acquire(self.provider_id, model, images)
+            try:
+                if self._should_hedge(idempotent):
+                    result = self._hedged(fn, lambda: self._hedge_quota(model, images))
+                else:
+                    result = fn()
+            except Exception as e:
+                delay = self._on_failure(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def acall(self, factory, idempotent=True, model=None, images=1):
+        """非同步版本；factory() 每次回傳新的協程"""
+        self._count('calls')
+        limiter = get_rate_limiter()
+        attempt = 0
+        while True:
+            self._admit()
+            await limiter.aacquire(self.provider_id, model, images)
+            try:
+                if self._should_hedge(idempotent):
+                    result = await self._ahedged(factory, lambda: self._hedge_quota(model, images))
+                else:
+                    result = await factory()
+            except Exception as e:
+                delay = self._on_failure(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _hedged(self, fn, quota):
+        first = _hedge_pool.submit(fn)
+        done, _ = wait([first], timeout=config.CLOUD_HEDGE_DELAY)
+        if done or not quota():
+            return first.result()
+        self._count('hedges')
+        second = _hedge_pool.submit(fn)
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self._count('hedge_wins')
+                    # 落後的請求無法中斷，結果直接捨棄
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    async def _ahedged(self, factory, quota):
+        first = asyncio.ensure_future(factory())
+        done, _ = await asyncio.wait({first}, timeout=config.CLOUD_HEDGE_DELAY)
+        if done or not quota():
+            return await first
+        self._count('hedges')
+        second = asyncio.ensure_future(factory())
+        pending, error = {first, second}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count('hedge_wins')
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['breaker'] = self.breaker.snapshot()
+        return stats
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def get_policy(provider_id):
+    """取得 Provider 共用的韌性策略（同一 Provider 的所有模型共用斷路器）"""
+    with _policies_lock:
+        policy = _policies.get(provider_id)
+        if policy is None:
+            policy = _policies[provider_id] = ResiliencePolicy(provider_id)
+        return policy
@@ -10,8 +10,9 @@ import random
 from typing import Optional
 from io import BytesIO
 import base64
+from contextlib import contextmanager
 
-from providers.base import BaseProvider
+from providers.base import BaseProvider, StageTimings
 import config
 
 
@@ -178,6 +179,43 @@ class DiffusersProvider(BaseProvider):
                 pass
 
     # ── 生成 ──────────────────────────────────────────────────
+    @contextmanager
+    def _instrument_pipeline(self, timings: StageTimings):
+        """暫時包裝 encode_prompt 與 vae.decode 以量測文字編碼與 VAE 解碼耗時
+
+        GPU 運算為非同步，量測前後同步 CUDA 才能得到真實耗時
+        """
+        import torch
+        sync = torch.cuda.synchronize if torch.cuda.is_available() else (lambda: None)
+        patched = []
+
+        def wrap(owner, attr, stage):
+            original = getattr(owner, attr, None)
+            if original is None or attr in vars(owner):
+                return
+
+            def timed(*args, **kwargs):
+                sync()
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    sync()
+                    timings.add(stage, time.perf_counter() - start)
+
+            setattr(owner, attr, timed)
+            patched.append((owner, attr))
+
+        wrap(self._pipeline, 'encode_prompt', 'text_encode')
+        vae = getattr(self._pipeline, 'vae', None)
+        if vae is not None:
+            wrap(vae, 'decode', 'vae_decode')
+        try:
+            yield
+        finally:
+            for owner, attr in patched:
+                delattr(owner, attr)
+
     def generate(self, prompt: str, width: int, height: int,
                  negative_prompt: Optional[str] = None,
                  seed: Optional[int] = None,
@@ -187,6 +225,10 @@ class DiffusersProvider(BaseProvider):
         if self._pipeline is None:
             return {'success': False, 'error': '尚未載入模型，請先點擊「載入模型」'}
 
+        timings = kwargs.get('timings')
+        if timings is None:
+            timings = StageTimings()
+
         try:
             import torch
             if torch.cuda.is_available():
@@ -212,12 +254,22 @@ class DiffusersProvider(BaseProvider):
             if negative_prompt and self._model_config.get('supports_negative_prompt', True):
                 gen_kwargs['negative_prompt'] = negative_prompt
 
-            image = self._pipeline(**gen_kwargs).images[0]
+            encoded = timings.get('text_encode', 0.0)
+            decoded = timings.get('vae_decode', 0.0)
+            pipeline_start = time.perf_counter()
+            with self._instrument_pipeline(timings):
+                image = self._pipeline(**gen_kwargs).images[0]
+            # 去噪 = pipeline 總耗時扣掉文字編碼與 VAE 解碼
+            elapsed = time.perf_counter() - pipeline_start
+            timings.add('denoise', max(0.0, elapsed
+                                       - (timings.get('text_encode', 0.0) - encoded)
+                                       - (timings.get('vae_decode', 0.0) - decoded)))
 
             # 轉 base64
-            buffered = BytesIO()
-            image.save(buffered, format="PNG")
-            img_b64 = base64.b64encode(buffered.getvalue()).decode()
+            with timings.stage('image_encode'):
+                buffered = BytesIO()
+                image.save(buffered, format="PNG")
+                img_b64 = base64.b64encode(buffered.getvalue()).decode()
 
             return {
                 'success': True,
@@ -19,6 +19,9 @@ from routes.prompt_library import prompt_library_bp
 from routes.story import story_bp
 from routes.avatar import avatar_bp
 from routes.settings import settings_bp
+from routes.search import search_bp
+from routes.metrics import metrics_bp
+from routes.debug import debug_bp
 
 
 def register_blueprints(app):
@@ -41,3 +44,6 @@ def register_blueprints(app):
     app.register_blueprint(story_bp)
     app.register_blueprint(avatar_bp)
     app.register_blueprint(settings_bp)
+    app.register_blueprint(search_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(debug_bp)
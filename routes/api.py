@@ -1,15 +1,23 @@
 """
 External API Routes - 對外 API 端點
 提供帶認證的 RESTful API，讓外部應用程式可以整合圖片生成功能
+
+/generate 同步等待生成完成；/jobs 排入生成佇列後立即回傳 job_id，
+可輪詢狀態或提供 webhook_url 在完成時接收簽章通知（services/webhook_service.py）。
 """
 import os
+import time
 import base64
 from io import BytesIO
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 import config
 from services.api_key_service import get_api_key_service, require_api_key
+from services.queue_service import get_queue_service, QueueLimitError
+from services.webhook_service import validate_url
 from services.history_service import get_history_service
+from services.analytics_service import get_analytics_service
+from providers.base import StageTimings
 
 api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
 
@@ -33,8 +41,18 @@ def create_api_key():
         return jsonify({'error': '請輸入金鑰名稱'}), 400
 
     permissions = data.get('permissions')
+    try:
+        rate_limit = data.get('rate_limit')
+        read_rate_limit = data.get('read_rate_limit')
+        rate_limit = None if rate_limit is None else int(rate_limit)
+        read_rate_limit = None if read_rate_limit is None else int(read_rate_limit)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'rate_limit / read_rate_limit 必須是整數'}), 400
+    if (rate_limit or 0) < 0 or (read_rate_limit or 0) < 0:
+        return jsonify({'error': 'rate_limit / read_rate_limit 不可為負數'}), 400
+
     service = get_api_key_service()
-    result = service.create_key(name, permissions)
+    result = service.create_key(name, permissions, rate_limit, read_rate_limit)
     return jsonify(result)
 
 
@@ -58,10 +76,20 @@ def revoke_api_key(key_id):
     return jsonify(result), 404
 
 
+@api_bp.route('/keys/<key_id>/webhook-secret', methods=['POST'])
+def rotate_webhook_secret(key_id):
+    """重新產生金鑰的 webhook 簽章 secret"""
+    service = get_api_key_service()
+    result = service.rotate_webhook_secret(key_id)
+    if result['success']:
+        return jsonify(result)
+    return jsonify(result), 404
+
+
 # ===== 對外 API 端點 (需要 API Key) =====
 
 @api_bp.route('/generate', methods=['POST'])
-@require_api_key('generate')
+@require_api_key('generate', budget='generate')
 def api_generate():
     """外部 API: 生成圖片
 
@@ -106,19 +134,25 @@ def api_generate():
         if registry.active_pipeline is None:
             return jsonify({'error': '尚未載入模型'}), 503
 
+        timings = StageTimings()
+        start_time = time.time()
         image, used_seed = registry.generate(
             prompt, width, height, seed,
-            negative_prompt=negative_prompt if negative_prompt else None
+            negative_prompt=negative_prompt if negative_prompt else None,
+            timings=timings
         )
+        duration = time.time() - start_time
 
         # 儲存圖片
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"api_{timestamp}.png"
         save_path = os.path.join(config.OUTPUT_PATH, filename)
-        image.save(save_path)
+        with timings.stage('persist'):
+            image.save(save_path)
 
-        history_service = get_history_service()
-        history_service.add_to_history(f"[API] {prompt}", filename, tags=["api"])
+            history_service = get_history_service()
+            history_service.add_to_history(f"[API] {prompt}", filename, tags=["api"],
+                                           model=registry.active_model_id)
 
         result = {
             'success': True,
@@ -131,13 +165,18 @@ def api_generate():
         }
 
         if output_format == 'base64':
-            buffered = BytesIO()
-            image.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
+            with timings.stage('image_encode'):
+                buffered = BytesIO()
+                image.save(buffered, format="PNG")
+                img_str = base64.b64encode(buffered.getvalue()).decode()
             result['image'] = f"data:image/png;base64,{img_str}"
         else:
             result['image_url'] = f"/images/{filename}"
 
+        get_analytics_service().track_generation(
+            registry.active_model_id, prompt, width, height,
+            mode='api', duration=round(duration, 2), timings=timings
+        )
         return jsonify(result)
 
     except Exception as e:
@@ -147,16 +186,34 @@ def api_generate():
 @api_bp.route('/history', methods=['GET'])
 @require_api_key('history')
 def api_history():
-    """外部 API: 取得歷史記錄"""
+    """外部 API: 取得歷史記錄
+
+    支援 cursor 游標分頁（建議）與舊版 offset 分頁，
+    並可依 tag / q / model / since / until 過濾。
+    """
     history_service = get_history_service()
-    history = history_service.load_history()
-    limit = request.args.get('limit', 50, type=int)
-    offset = request.args.get('offset', 0, type=int)
+    try:
+        page = history_service.query_history(
+            limit=request.args.get('limit', 50, type=int),
+            cursor=request.args.get('cursor'),
+            offset=request.args.get('offset', 0, type=int),
+            tags=request.args.getlist('tag'),
+            all_tags=request.args.getlist('all_tag'),
+            exclude_tags=request.args.getlist('exclude_tag'),
+            prompt=request.args.get('q'),
+            model=request.args.get('model'),
+            since=request.args.get('since'),
+            until=request.args.get('until')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     return jsonify({
         'success': True,
-        'total': len(history),
-        'history': history[offset:offset + limit]
+        'total': history_service.count(),
+        'history': page['items'],
+        'next_cursor': page['next_cursor'],
+        'has_more': page['has_more']
     })
 
 
@@ -171,3 +228,135 @@ def api_list_models():
         'models': registry.list_models(),
         'active_model': registry.active_model_id
     })
+
+
+# ===== 非同步任務 (需要 API Key) =====
+
+def _request_key():
+    """目前請求的 API 金鑰 (id, key_info)；require_api_key 已驗證過"""
+    api_key = request.headers.get('X-API-Key') or request.args.get('api_key')
+    service = get_api_key_service()
+    key_hash = service._hash_key(api_key)
+    return key_hash[:8], service.keys.get(key_hash, {})
+
+
+def _own_job(job_id):
+    """取得屬於目前金鑰的任務；其他金鑰的任務視為不存在"""
+    key_id, _ = _request_key()
+    task = get_queue_service().get_task(job_id)
+    if not task or task.get('tenant') != key_id:
+        return None
+    return task
+
+
+def _job_view(task):
+    """任務狀態（不含 base64 圖片）"""
+    params = task.get('params') or {}
+    job = {
+        'job_id': task['id'],
+        'status': task['status'],
+        'prompt': params.get('prompt'),
+        'model': params.get('model'),
+        'created_at': task.get('created_at'),
+        'started_at': task.get('started_at'),
+        'completed_at': task.get('completed_at'),
+        'progress': task.get('progress', 0),
+        'error': task.get('error'),
+        'result_url': f"/api/v1/jobs/{task['id']}/result",
+    }
+    result = task.get('result')
+    if isinstance(result, dict):
+        job['result'] = {k: v for k, v in result.items() if k != 'image'}
+        if result.get('filename'):
+            job['result']['image_url'] = f"/images/{result['filename']}"
+    if params.get('webhook'):
+        job['webhook'] = get_queue_service().webhook_status(task['id']) or {
+            'url': params['webhook']['url'], 'status': 'pending'}
+    return job
+
+
+@api_bp.route('/jobs', methods=['POST'])
+@require_api_key('generate', budget='generate')
+def api_submit_job():
+    """外部 API: 非同步生成（排入佇列，立即回傳 job_id）
+
+    Body:
+        {
+            "prompt": "a cat sitting on a window",
+            "negative_prompt": "blurry",
+            "width": 768,
+            "height": 768,
+            "seed": 12345,
+            "model": "z-image-turbo",
+            "priority": 0,
+            "webhook_url": "https://example.com/hooks/zimage"  // 可選
+        }
+
+    webhook 以 POST JSON 通知 job.completed / job.failed，
+    標頭 X-ZImage-Signature: t=<時間>,v1=<HMAC-SHA256(webhook_secret, "<t>.<body>")>
+    """
+    try:
+        data = request.get_json() or {}
+        prompt = data.get('prompt', '')
+        if not prompt:
+            return jsonify({'error': '請提供 prompt 參數'}), 400
+
+        params = {
+            'prompt': prompt,
+            'negative_prompt': data.get('negative_prompt') or None,
+            'width': int(data.get('width', config.IMAGE_WIDTH)),
+            'height': int(data.get('height', config.IMAGE_HEIGHT)),
+            'seed': data.get('seed'),
+        }
+        if data.get('model'):
+            params['model'] = data['model']
+
+        key_id, key_info = _request_key()
+        webhook_url = data.get('webhook_url')
+        if webhook_url:
+            params['webhook'] = {'url': validate_url(webhook_url)}
+            if not get_api_key_service().get_webhook_secret(key_id):
+                return jsonify({
+                    'error': '此金鑰尚未設定 webhook secret，請先呼叫 POST /api/v1/keys/<id>/webhook-secret',
+                    'code': 'WEBHOOK_SECRET_REQUIRED'
+                }), 400
+
+        task = get_queue_service().submit(
+            'generate', params, int(data.get('priority', 0)),
+            tenant=key_id, weight=key_info.get('queue_weight', 1.0),
+            max_pending=key_info.get('max_pending', config.QUEUE_MAX_PENDING_PER_KEY))
+    except QueueLimitError as e:
+        return jsonify({'error': str(e), 'code': 'QUEUE_LIMIT', 'limit': e.limit}), 429
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    job = _job_view(task)
+    job['status_url'] = f"/api/v1/jobs/{task['id']}"
+    return jsonify({'success': True, **job}), 202
+
+
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+@require_api_key('generate')
+def api_get_job(job_id):
+    """外部 API: 查詢非同步任務狀態"""
+    task = _own_job(job_id)
+    if not task:
+        return jsonify({'error': '任務不存在', 'code': 'JOB_NOT_FOUND'}), 404
+    return jsonify({'success': True, **_job_view(task)})
+
+
+@api_bp.route('/jobs/<job_id>/result', methods=['GET'])
+@require_api_key('generate')
+def api_get_job_result(job_id):
+    """外部 API: 取得任務結果（含 base64 圖片）；未完成時回傳 202，失敗 / 取消時回傳 409"""
+    task = _own_job(job_id)
+    if not task:
+        return jsonify({'error': '任務不存在', 'code': 'JOB_NOT_FOUND'}), 404
+    if task['status'] in ('pending', 'processing'):
+        return jsonify({'success': False, 'job_id': job_id, 'status': task['status']}), 202
+    if task['status'] != 'completed':
+        return jsonify({'error': task.get('error') or '任務未完成', 'job_id': job_id,
+                        'status': task['status']}), 409
+    return jsonify({'success': True, 'job_id': job_id, 'result': task.get('result')})
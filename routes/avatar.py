@@ -77,7 +77,8 @@ def avatar_generate():
         # 加入歷史
         try:
             history_service = get_history_service()
-            history_service.add_to_history(f'[Avatar/{feature}]', filename)
+            history_service.add_to_history(f'[Avatar/{feature}]', filename,
+                                           model=registry.active_model_id)
         except Exception:
             pass
 
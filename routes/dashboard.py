@@ -51,9 +51,12 @@ def analytics_modes():
 
 @dashboard_bp.route('/api/analytics/speed', methods=['GET'])
 def analytics_speed():
-    """生成速度統計"""
+    """生成速度統計（總耗時與各階段 p50 / p95 / p99，可依 model / resolution 過濾）"""
     analytics = get_analytics_service()
-    return jsonify({'success': True, 'data': analytics.get_generation_speed()})
+    return jsonify({'success': True, 'data': analytics.get_generation_speed(
+        model=request.args.get('model') or None,
+        resolution=request.args.get('resolution') or None
+    )})
 
 
 @dashboard_bp.route('/api/analytics/activity', methods=['GET'])
@@ -0,0 +1,100 @@
+"""
+Debug Routes - 逐請求效能剖析與慢請求列表
+"""
+from flask import Blueprint, request, jsonify, send_file, g
+from services.profiler_service import get_profiler_service
+
+debug_bp = Blueprint('debug', __name__)
+
+PROFILE_HEADER = 'X-Profile'
+# 不剖析的端點（靜態檔、指標與剖析列表本身）
+_SKIP_ENDPOINTS = {'static', 'metrics.metrics', 'debug.list_profiles', 'debug.download_profile'}
+
+
+@debug_bp.before_app_request
+def _start_profile():
+    if request.endpoint in _SKIP_ENDPOINTS:
+        return
+    profiler = get_profiler_service()
+    header = request.headers.get(PROFILE_HEADER, '').strip().lower()
+    if header and header not in ('0', 'false', 'off') and profiler.header_enabled():
+        mode = 'cprofile' if header == 'cprofile' else 'sample'
+        g.profile_session = profiler.start(mode=mode, trigger='header')
+    elif profiler.slow_threshold is not None:
+        g.profile_session = profiler.start(mode='sample', trigger='threshold')
+
+
+@debug_bp.after_app_request
+def _finish_profile(response):
+    session = g.pop('profile_session', None)
+    if session is None:
+        return response
+    info = {
+        'method': request.method,
+        'path': request.path,
+        'route': request.url_rule.rule if request.url_rule is not None else None,
+        'status': response.status_code,
+    }
+    if response.is_streamed:
+        # 串流回應（NDJSON / SSE / 匯出 / 下載）的內容在此之後才於同一執行緒產生，
+        # 回應關閉時才結束剖析；標頭此時就要送出，只有以標頭要求的剖析能先附上 id
+        if session.trigger == 'header':
+            response.headers['X-Profile-Id'] = session.id
+        response.call_on_close(lambda: _save_profile(session, info))
+        return response
+    if _save_profile(session, info):
+        response.headers['X-Profile-Id'] = session.id
+    return response
+
+
+def _save_profile(session, info):
+    """結束剖析，需要保留時寫出；回傳是否已保存"""
+    profiler = get_profiler_service()
+    profiler.stop(session)
+    if not profiler.should_keep(session):
+        return False
+    try:
+        profiler.save(session, info)
+        return True
+    except Exception as e:
+        print(f"[Profiler] 保存失敗: {e}")
+        return False
+
+
+@debug_bp.route('/debug/profiles', methods=['GET'])
+def list_profiles():
+    """最近保存的剖析結果（慢請求或以標頭要求者）"""
+    try:
+        profiler = get_profiler_service()
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 200)
+        profiles = profiler.list_profiles(limit)
+        for profile in profiles:
+            profile['downloads'] = {
+                fmt: f"/debug/profiles/{profile['id']}?format={fmt}" for fmt in profile.get('formats', [])
+            }
+        return jsonify({
+            'success': True,
+            'header_enabled': profiler.header_enabled(),
+            'slow_threshold': profiler.slow_threshold,
+            'profiles': profiles,
+            'count': len(profiles),
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@debug_bp.route('/debug/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """下載剖析檔（format=folded 供 flamegraph.pl / speedscope，format=prof 為 pstats）"""
+    try:
+        fmt = request.args.get('format', 'folded')
+        path = get_profiler_service().get_profile_path(profile_id, fmt)
+        if path is None:
+            return jsonify({'error': '找不到剖析結果'}), 404
+        mimetype = 'text/plain' if fmt == 'folded' else 'application/octet-stream'
+        return send_file(path, mimetype=mimetype, as_attachment=True,
+                         download_name=f"{profile_id}.{fmt}")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -159,10 +159,8 @@ def add_images_to_gallery(gallery_id):
         return jsonify({'error': '請選擇要加入的圖片'}), 400
 
     galleries = _load_galleries()
-    history = get_history_service().load_history()
-
-    # 建立 filename -> history item 的映射
-    history_map = {item['filename']: item for item in history}
+    # 只查詢要加入的檔案的 prompt
+    prompt_map = get_history_service().get_prompts_by_filenames(filenames)
 
     for g in galleries:
         if g['id'] == gallery_id:
@@ -182,8 +180,8 @@ def add_images_to_gallery(gallery_id):
                 }
 
                 # 從歷史記錄補充 prompt 資訊
-                if fn in history_map:
-                    image_entry['prompt'] = history_map[fn].get('prompt', '')
+                if fn in prompt_map:
+                    image_entry['prompt'] = prompt_map[fn]
 
                 g['images'].append(image_entry)
                 added += 1
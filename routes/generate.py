@@ -2,15 +2,18 @@
 Generate Routes - 圖片生成相關路由
 """
 import os
+import json
 import time
 import base64
 from io import BytesIO
 from datetime import datetime
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
+from PIL import Image
 import config
 from services.model_registry import get_model_registry
 from services.history_service import get_history_service
 from services.analytics_service import get_analytics_service
+from providers.base import StageTimings
 
 
 generate_bp = Blueprint('generate', __name__)
@@ -42,11 +45,13 @@ def generate_image():
 
         # 使用模型註冊表生成圖片
         registry = get_model_registry()
+        timings = StageTimings()
         if registry.active_pipeline is None:
             # 自動載入預設模型
             models = registry.list_models()
             if models:
-                switch_result = registry.switch_model(models[0]['id'])
+                with timings.stage('model_load'):
+                    switch_result = registry.switch_model(models[0]['id'])
                 if not switch_result.get('success'):
                     return jsonify({'error': f"自動載入模型失敗: {switch_result.get('error', '')}"}), 503
             else:
@@ -58,7 +63,8 @@ def generate_image():
         start_time = time.time()
         image, seed = registry.generate(
             full_prompt, width, height,
-            negative_prompt=negative_prompt if negative_prompt else None
+            negative_prompt=negative_prompt if negative_prompt else None,
+            timings=timings
         )
         duration = time.time() - start_time
 
@@ -67,25 +73,27 @@ def generate_image():
         filename = f"generated_{timestamp}.png"
         save_path = os.path.join(config.OUTPUT_PATH, filename)
 
-        # 儲存圖片
-        image.save(save_path)
-        print(f"圖片已儲存至：{save_path}")
+        with timings.stage('persist'):
+            # 儲存圖片
+            image.save(save_path)
+            print(f"圖片已儲存至：{save_path}")
 
-        # 添加到歷史記錄
-        history_service = get_history_service()
-        history_service.add_to_history(prompt, filename)
+            # 添加到歷史記錄
+            history_service = get_history_service()
+            history_service.add_to_history(prompt, filename, model=registry.active_model_id)
+
+        # 將圖片轉換為 base64 以便在網頁上顯示
+        with timings.stage('image_encode'):
+            buffered = BytesIO()
+            image.save(buffered, format="PNG")
+            img_str = base64.b64encode(buffered.getvalue()).decode()
 
         # 追蹤統計
         get_analytics_service().track_generation(
             registry.active_model_id, prompt, width, height,
-            mode='single', duration=round(duration, 2)
+            mode='single', duration=round(duration, 2), timings=timings
         )
 
-        # 將圖片轉換為 base64 以便在網頁上顯示
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-
         return jsonify({
             'success': True,
             'image': f"data:image/png;base64,{img_str}",
@@ -99,95 +107,201 @@ def generate_image():
         return jsonify({'error': str(e)}), 500
 
 
-@generate_bp.route('/batch-generate', methods=['POST'])
-def batch_generate():
-    """批量生成圖片 API"""
-    try:
-        data = request.get_json()
-        prompts = data.get('prompts', [])
-        negative_prompt = data.get('negative_prompt', '')  # 批量共用負面提示詞
-
-        if not prompts or len(prompts) == 0:
-            return jsonify({'error': '請輸入至少一個提示詞'}), 400
-
-        # 限制批量數量 (避免 VRAM 問題)
-        max_batch = 20
-        if len(prompts) > max_batch:
-            return jsonify({'error': f'批量生成最多支援 {max_batch} 張圖片'}), 400
-
-        registry = get_model_registry()
-        history_service = get_history_service()
-
-        if registry.active_pipeline is None:
-            return jsonify({'error': '尚未載入模型，請先在模型選擇器中選擇一個模型'}), 503
-
-        results = []
-        failed_prompts = []
+def _batch_results(entries, total, negative_prompt, use_cloud, cloud_chunk=None):
+    """依序生成批量圖片，每張存檔後立即產生結果（前一張的圖片不再被引用）
 
-        print(f"\n開始批量生成 {len(prompts)} 張圖片...")
+    雲端模型每 cloud_chunk 張為一組並行送出（None = 全部一組），記憶體中最多同時保留一組結果。
+    """
+    registry = get_model_registry()
+    history_service = get_history_service()
+    chunk_size = (cloud_chunk or len(entries)) if use_cloud else 1
 
-        for idx, prompt in enumerate(prompts, 1):
-            prompt = prompt.strip()
-            if not prompt:
-                continue
+    for chunk_start in range(0, len(entries), chunk_size):
+        chunk = entries[chunk_start:chunk_start + chunk_size]
+        cloud_outcomes = None
+        if use_cloud:
+            # 雲端模型：同一組提示詞以非同步 client 並行送出，完成後依序存檔
+            cloud_outcomes = registry.generate_many([
+                {'prompt': prompt, 'width': config.IMAGE_WIDTH, 'height': config.IMAGE_HEIGHT,
+                 'negative_prompt': negative_prompt if negative_prompt else None}
+                for _, prompt in chunk
+            ])
 
+        for position, (idx, prompt) in enumerate(chunk):
             try:
-                print(f"\n[{idx}/{len(prompts)}] 生成：{prompt}")
+                print(f"\n[{idx}/{total}] 生成：{prompt}")
 
                 # 生成圖片
-                image, seed = registry.generate(
-                    prompt, config.IMAGE_WIDTH, config.IMAGE_HEIGHT,
-                    negative_prompt=negative_prompt if negative_prompt else None
-                )
+                if cloud_outcomes is None:
+                    timings = StageTimings()
+                    start_time = time.time()
+                    image, seed = registry.generate(
+                        prompt, config.IMAGE_WIDTH, config.IMAGE_HEIGHT,
+                        negative_prompt=negative_prompt if negative_prompt else None,
+                        timings=timings
+                    )
+                    duration = time.time() - start_time
+                else:
+                    outcome = cloud_outcomes[position]
+                    cloud_outcomes[position] = None  # 解碼後釋放 base64
+                    if not outcome.get('success'):
+                        raise RuntimeError(outcome.get('error', '生成失敗'))
+                    timings = StageTimings(outcome['timings'])
+                    duration = outcome['duration']
+                    image = Image.open(BytesIO(base64.b64decode(outcome['base64'])))
 
                 # 生成檔案名稱
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 filename = f"batch_{timestamp}_{idx:03d}.png"
                 save_path = os.path.join(config.OUTPUT_PATH, filename)
 
-                # 儲存圖片
-                image.save(save_path)
-                print(f"✓ 圖片已儲存: {filename}")
+                with timings.stage('persist'):
+                    # 儲存圖片
+                    image.save(save_path)
+                    print(f"✓ 圖片已儲存: {filename}")
 
-                # 添加到歷史記錄
-                history_service.add_to_history(prompt, filename)
+                    # 添加到歷史記錄
+                    history_service.add_to_history(prompt, filename, model=registry.active_model_id)
 
                 # 轉換為 base64
-                buffered = BytesIO()
-                image.save(buffered, format="PNG")
-                img_str = base64.b64encode(buffered.getvalue()).decode()
+                with timings.stage('image_encode'):
+                    buffered = BytesIO()
+                    image.save(buffered, format="PNG")
+                    img_str = base64.b64encode(buffered.getvalue()).decode()
+                del image, buffered
+
+                get_analytics_service().track_generation(
+                    registry.active_model_id, prompt, config.IMAGE_WIDTH, config.IMAGE_HEIGHT,
+                    mode='batch', duration=round(duration, 2), timings=timings
+                )
 
-                results.append({
+                yield {
                     'success': True,
                     'prompt': prompt,
                     'filename': filename,
                     'image': f"data:image/png;base64,{img_str}",
                     'index': idx
-                })
+                }
 
             except Exception as e:
-                print(f"✗ 生成失敗 [{idx}/{len(prompts)}]: {str(e)}")
-                failed_prompts.append({
-                    'prompt': prompt,
-                    'index': idx,
-                    'error': str(e)
-                })
-                results.append({
+                print(f"✗ 生成失敗 [{idx}/{total}]: {str(e)}")
+                yield {
                     'success': False,
                     'prompt': prompt,
                     'error': str(e),
                     'index': idx
-                })
+                }
+
+
+def _batch_stream_format(data):
+    """串流格式：body 的 stream 欄位（ndjson / sse）或 Accept 標頭；None = 一次回傳 JSON"""
+    requested = str(data.get('stream') or '').lower()
+    if requested in ('ndjson', 'sse'):
+        return requested
+    if requested in ('1', 'true'):
+        return 'ndjson'
+    accept = request.headers.get('Accept', '')
+    if 'application/x-ndjson' in accept:
+        return 'ndjson'
+    if 'text/event-stream' in accept:
+        return 'sse'
+    return None
+
+
+def _stream_batch(results, total, stream_format):
+    """逐張送出結果的串流回應，最後一筆為 type=done 的統計
+
+    每行（NDJSON）或每個事件（SSE，事件名稱 result / done）只含一張圖片，
+    送出後即釋放；用戶端中斷連線時不再生成剩餘的提示詞。
+    """
+    def encode(event_type, payload):
+        text = json.dumps({'type': event_type, **payload}, ensure_ascii=False)
+        if stream_format == 'sse':
+            return f"event: {event_type}\ndata: {text}\n\n"
+        return text + '\n'
+
+    def generate():
+        succeeded = failed = 0
+        yield encode('start', {'total': total})
+        try:
+            for result in results:
+                if result['success']:
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield encode('result', {'completed': succeeded + failed, **result})
+        except Exception as e:
+            # 回應標頭已送出，只能以事件回報錯誤
+            print(f"批量生成錯誤：{str(e)}")
+            yield encode('error', {'error': str(e), 'completed': succeeded + failed})
+            return
+        print(f"\n批量生成完成! 成功: {succeeded}/{total}")
+        yield encode('done', {
+            'success': True,
+            'total': total,
+            'succeeded': succeeded,
+            'failed': failed,
+            'message': f'批量生成完成，成功 {succeeded} 張，失敗 {failed} 張'
+        })
+
+    mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    response = Response(generate(), mimetype=mimetype)
+    # 避免反向代理緩衝整個回應
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@generate_bp.route('/batch-generate', methods=['POST'])
+def batch_generate():
+    """批量生成圖片 API
+
+    Body 帶 "stream": "ndjson" | "sse"（或 Accept: application/x-ndjson / text/event-stream）時，
+    每張圖片存檔後立即串流送出，不等全部完成；否則全部完成後一次回傳 JSON。
+    """
+    try:
+        data = request.get_json()
+        prompts = data.get('prompts', [])
+        negative_prompt = data.get('negative_prompt', '')  # 批量共用負面提示詞
+
+        if not prompts or len(prompts) == 0:
+            return jsonify({'error': '請輸入至少一個提示詞'}), 400
+
+        # 限制批量數量 (避免 VRAM 問題)
+        max_batch = 20
+        if len(prompts) > max_batch:
+            return jsonify({'error': f'批量生成最多支援 {max_batch} 張圖片'}), 400
+
+        registry = get_model_registry()
+
+        active_model = registry.get_active_model()
+        use_cloud = bool(active_model) and active_model.get('provider_type') == 'cloud'
+        if registry.active_pipeline is None and not use_cloud:
+            return jsonify({'error': '尚未載入模型，請先在模型選擇器中選擇一個模型'}), 503
+
+        entries = [(idx, prompt.strip()) for idx, prompt in enumerate(prompts, 1) if prompt.strip()]
+
+        print(f"\n開始批量生成 {len(prompts)} 張圖片...")
+
+        stream_format = _batch_stream_format(data)
+        if stream_format:
+            # 串流模式：雲端每組 CLOUD_CONCURRENCY 張，完成一組就開始送出
+            results = _batch_results(entries, len(prompts), negative_prompt, use_cloud,
+                                     cloud_chunk=config.CLOUD_CONCURRENCY)
+            return _stream_batch(results, len(prompts), stream_format)
+
+        results = list(_batch_results(entries, len(prompts), negative_prompt, use_cloud))
+        failed_count = sum(1 for r in results if not r['success'])
 
-        print(f"\n批量生成完成! 成功: {len(results) - len(failed_prompts)}/{len(prompts)}")
+        print(f"\n批量生成完成! 成功: {len(results) - failed_count}/{len(prompts)}")
 
         return jsonify({
             'success': True,
             'total': len(prompts),
-            'succeeded': len(results) - len(failed_prompts),
-            'failed': len(failed_prompts),
+            'succeeded': len(results) - failed_count,
+            'failed': failed_count,
             'results': results,
-            'message': f'批量生成完成，成功 {len(results) - len(failed_prompts)} 張，失敗 {len(failed_prompts)} 張'
+            'message': f'批量生成完成，成功 {len(results) - failed_count} 張，失敗 {failed_count} 張'
         })
 
     except Exception as e:
@@ -248,7 +362,7 @@ def generate_with_seed():
         image.save(save_path)
 
         # 添加到歷史
-        history_service.add_to_history(prompt, filename)
+        history_service.add_to_history(prompt, filename, model=registry.active_model_id)
 
         # 轉base64
         buffered = BytesIO()
@@ -2,12 +2,12 @@
 History Routes - 歷史記錄相關路由
 """
 import os
-import zipfile
-import tempfile
+import time
 from datetime import datetime
-from flask import Blueprint, request, jsonify, send_from_directory, send_file
+from flask import Blueprint, Response, request, jsonify, send_from_directory
 import config
 from services.history_service import get_history_service
+from services.zip_stream import stream_zip
 
 
 history_bp = Blueprint('history', __name__)
@@ -21,14 +21,40 @@ def get_image(filename):
 
 @history_bp.route('/history', methods=['GET'])
 def get_history():
-    """獲取歷史記錄"""
+    """獲取歷史記錄（游標分頁）
+
+    Query:
+        limit: 每頁筆數（預設 50）
+        cursor: 上一頁的 next_cursor
+        tag: 標籤，符合任一即可（可重複）
+        all_tag: 必須同時具備的標籤（可重複）
+        exclude_tag: 排除的標籤（可重複）
+        q: 提示詞關鍵字
+        model: 模型 ID
+        since / until: ISO 時間範圍
+    """
     try:
         history_service = get_history_service()
-        history = history_service.load_history()
+        page = history_service.query_history(
+            limit=request.args.get('limit', 50, type=int),
+            cursor=request.args.get('cursor'),
+            tags=request.args.getlist('tag'),
+            all_tags=request.args.getlist('all_tag'),
+            exclude_tags=request.args.getlist('exclude_tag'),
+            prompt=request.args.get('q'),
+            model=request.args.get('model'),
+            since=request.args.get('since'),
+            until=request.args.get('until')
+        )
         return jsonify({
             'success': True,
-            'history': history
+            'history': page['items'],
+            'next_cursor': page['next_cursor'],
+            'has_more': page['has_more'],
+            'total': history_service.count()
         })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -38,7 +64,7 @@ def clear_history():
     """清除所有歷史記錄"""
     try:
         history_service = get_history_service()
-        history_service.save_history([])
+        history_service.clear_history()
         return jsonify({
             'success': True,
             'message': '歷史記錄已清除'
@@ -49,7 +75,11 @@ def clear_history():
 
 @history_bp.route('/batch-download', methods=['POST'])
 def batch_download():
-    """批量下載圖片為 ZIP"""
+    """批量下載圖片為 ZIP
+
+    邊讀檔邊串流送出（services/zip_stream.py），不建立暫存檔；
+    回應結束後於日誌與 zimage_download_first_byte_seconds 指標記錄首位元組時間。
+    """
     try:
         data = request.get_json()
         filenames = data.get('filenames', [])
@@ -57,24 +87,35 @@ def batch_download():
         if not filenames:
             return jsonify({'error': '沒有要下載的檔案'}), 400
 
-        # 建立臨時 ZIP 檔案
+        request_start = time.perf_counter()
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         zip_filename = f"batch_images_{timestamp}.zip"
-        zip_path = os.path.join(tempfile.gettempdir(), zip_filename)
 
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for filename in filenames:
-                file_path = os.path.join(config.OUTPUT_PATH, filename)
-                if os.path.exists(file_path):
-                    zipf.write(file_path, filename)
-
-        # 發送檔案後刪除臨時檔案
-        return send_file(
-            zip_path,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=zip_filename
-        )
+        entries = []
+        seen = set()
+        for filename in filenames:
+            # 只接受輸出資料夾內的檔名，避免 ../ 讀取其他檔案
+            if not isinstance(filename, str) or os.path.basename(filename) != filename or filename in seen:
+                continue
+            seen.add(filename)
+            entries.append((os.path.join(config.OUTPUT_PATH, filename), filename))
+
+        def generate():
+            from services.metrics_service import DOWNLOAD_FIRST_BYTE
+            stats = {}
+            first = True
+            for chunk in stream_zip(entries, stats):
+                if first:
+                    first = False
+                    DOWNLOAD_FIRST_BYTE.observe(time.perf_counter() - request_start, kind='zip')
+                yield chunk
+            print(f"[Download] {zip_filename}: {stats['files']} 個檔案, {stats['bytes'] / 2 ** 20:.1f} MB, "
+                  f"首位元組 {(stats['first_byte'] or 0) * 1000:.1f} ms, 共 {stats['duration']:.2f}s")
+
+        response = Response(generate(), mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename="{zip_filename}"'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
 
     except Exception as e:
         print(f"批量下載錯誤：{str(e)}")
@@ -93,12 +134,9 @@ def delete_images():
 
         deleted_count = 0
         failed_files = []
+        removed_files = []
 
-        # 載入歷史記錄
-        history_service = get_history_service()
-        history = history_service.load_history()
-
-        # 刪除圖片檔案並從歷史記錄中移除
+        # 刪除圖片檔案
         for filename in filenames:
             file_path = os.path.join(config.OUTPUT_PATH, filename)
 
@@ -109,15 +147,14 @@ def delete_images():
                     deleted_count += 1
                     print(f"✓ 已刪除圖片: {filename}")
 
-                # 從歷史記錄中移除
-                history = [item for item in history if item['filename'] != filename]
+                removed_files.append(filename)
 
             except Exception as e:
                 print(f"✗ 刪除 {filename} 失敗: {e}")
                 failed_files.append(filename)
 
-        # 儲存更新後的歷史記錄
-        history_service.save_history(history)
+        # 從歷史記錄中移除
+        get_history_service().remove_by_filenames(removed_files)
 
         if failed_files:
             return jsonify({
@@ -136,7 +136,8 @@ def image_to_image():
 
         # 添加歷史
         history_service = get_history_service()
-        history_service.add_to_history(f"[img2img] {prompt}", filename, tags=["img2img"])
+        history_service.add_to_history(f"[img2img] {prompt}", filename, tags=["img2img"],
+                                       model=registry.active_model_id)
 
         # 回傳 base64
         buffered = BytesIO()
@@ -226,7 +227,8 @@ def generate_variations():
 
                 history_service.add_to_history(
                     f"[variation] {prompt} (strength={strength:.2f})",
-                    filename, tags=["variation", "img2img"]
+                    filename, tags=["variation", "img2img"],
+                    model=registry.active_model_id
                 )
 
                 buffered = BytesIO()
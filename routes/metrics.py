@@ -0,0 +1,43 @@
+"""
+Metrics Routes - Prometheus 指標輸出
+"""
+import os
+import time
+from flask import Blueprint, Response, request, g
+from services.metrics_service import get_metrics_registry, CONTENT_TYPE, HTTP_REQUESTS, HTTP_LATENCY
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.before_app_request
+def _start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+@metrics_bp.after_app_request
+def _record_request(response):
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        # 以路由規則作為標籤，避免 /history/<id> 之類的路徑造成標籤爆量
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+        HTTP_LATENCY.observe(time.perf_counter() - start, route=route, method=request.method)
+    return response
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 文字格式指標（生產模式下合併推論行程的指標）"""
+    from services.inference_ipc import is_remote, inference_metrics
+    registry = get_metrics_registry()
+    if not is_remote():
+        return Response(registry.expose(), mimetype=None, content_type=CONTENT_TYPE)
+    try:
+        remote = inference_metrics()
+    except Exception as e:
+        # 推論行程無回應時仍輸出本 worker 的指標
+        print(f"[Metrics] 無法取得推論行程指標: {e}")
+        remote = None
+    text = registry.expose(remote, local_labels=(('process', f'web-{os.getpid()}'),),
+                           remote_labels=(('process', 'inference'),))
+    return Response(text, mimetype=None, content_type=CONTENT_TYPE)
@@ -1,15 +1,46 @@
 """
 Queue Routes - 生成佇列管理路由
 """
-from flask import Blueprint, request, jsonify
-from services.queue_service import get_queue_service
+import json
+from flask import Blueprint, Response, request, jsonify
+import config
+from services.queue_service import get_queue_service, QueueLimitError
+from services.model_registry import get_model_registry
+from services.api_key_service import get_api_key_service
+from services.bulk_service import get_bulk_service
 
 queue_bp = Blueprint('queue', __name__)
 
 
+def _rate_limit_wait(task):
+    """待處理任務因雲端速率限制的預估等待秒數（本地模型或不需等待時為 0）"""
+    if task.get('status') != 'pending':
+        return 0
+    registry = get_model_registry()
+    model = (task.get('params') or {}).get('model') or registry.active_model_id
+    return registry.cloud_waits().get(model, 0)
+
+
+def _tenant():
+    """依 API 金鑰決定租戶；沒有金鑰時為網頁介面
+
+    Returns:
+        tuple: (tenant, weight, max_pending)，金鑰無效時 tenant 為 None
+    """
+    api_key = request.headers.get('X-API-Key') or request.args.get('api_key')
+    if not api_key:
+        return 'web', 1.0, config.QUEUE_MAX_PENDING_WEB
+    service = get_api_key_service()
+    is_valid, key_info = service.validate_key(api_key)
+    if not is_valid:
+        return None, None, None
+    return (service._hash_key(api_key)[:8], key_info.get('queue_weight', 1.0),
+            key_info.get('max_pending', config.QUEUE_MAX_PENDING_PER_KEY))
+
+
 @queue_bp.route('/api/queue/submit', methods=['POST'])
 def submit_task():
-    """提交生成任務到佇列"""
+    """提交生成任務到佇列（帶 X-API-Key 時依金鑰公平排程並套用待處理上限）"""
     data = request.get_json()
     task_type = data.get('type', 'generate')
     params = data.get('params', {})
@@ -18,9 +49,17 @@ def submit_task():
     if not params.get('prompt'):
         return jsonify({'error': '請提供 prompt 參數'}), 400
 
+    tenant, weight, max_pending = _tenant()
+    if tenant is None:
+        return jsonify({'error': '無效的 API 金鑰', 'code': 'INVALID_API_KEY'}), 401
+
     service = get_queue_service()
-    task = service.submit(task_type, params, priority)
-    return jsonify({'success': True, 'task': task})
+    try:
+        task = service.submit(task_type, params, priority, tenant=tenant, weight=weight,
+                              max_pending=max_pending)
+    except QueueLimitError as e:
+        return jsonify({'error': str(e), 'code': 'QUEUE_LIMIT', 'limit': e.limit}), 429
+    return jsonify({'success': True, 'task': task, 'rate_limit_wait': _rate_limit_wait(task)})
 
 
 @queue_bp.route('/api/queue/task/<task_id>', methods=['GET'])
@@ -40,6 +79,7 @@ def get_task(task_id):
         }
         if 'image' in result['result']:
             result['result_summary']['has_image'] = True
+    result['rate_limit_wait'] = _rate_limit_wait(result)
 
     return jsonify({'success': True, 'task': result})
 
@@ -70,7 +110,9 @@ def cancel_task(task_id):
 def queue_status():
     """佇列狀態總覽"""
     service = get_queue_service()
-    return jsonify({'success': True, 'status': service.get_queue_status()})
+    status = service.get_queue_status()
+    status['rate_limited'] = get_model_registry().cloud_waits()
+    return jsonify({'success': True, 'status': status})
 
 
 @queue_bp.route('/api/queue/tasks', methods=['GET'])
@@ -87,3 +129,103 @@ def clear_completed():
     service = get_queue_service()
     result = service.clear_completed()
     return jsonify({'success': True, **result})
+
+
+# ===== 大量生成工作 (JSONL) =====
+
+def _ndjson(events):
+    """逐行輸出 NDJSON（每個事件完成即送出）"""
+    for event in events:
+        yield json.dumps(event, ensure_ascii=False) + '\n'
+
+
+def _stream_response(events):
+    response = Response(_ndjson(events), mimetype='application/x-ndjson')
+    # 避免反向代理緩衝整個回應
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _own_bulk_job(job_id):
+    """取得屬於目前租戶的工作；回傳 (job, 錯誤回應)"""
+    tenant, _, _ = _tenant()
+    if tenant is None:
+        return None, (jsonify({'error': '無效的 API 金鑰', 'code': 'INVALID_API_KEY'}), 401)
+    job = get_bulk_service().get_job(job_id)
+    if not job or job['tenant'] != tenant:
+        return None, (jsonify({'error': '工作不存在'}), 404)
+    return job, None
+
+
+@queue_bp.route('/api/queue/bulk', methods=['POST'])
+def submit_bulk_job():
+    """提交大量生成工作
+
+    Body 為 JSONL，每行一筆：{"id": "...", "prompt": "...", "negative_prompt", "width", "height", "seed", "model"}
+    Query: model / width / height / negative_prompt 為各行預設值，priority 為佇列優先順序；
+    stream=0 時立即回傳工作資訊，否則以 NDJSON 串流回傳每筆結果直到工作結束
+    （斷線不影響工作，可用 GET /api/queue/bulk/<id>/stream?after=<seq> 接續）
+    """
+    tenant, weight, _ = _tenant()
+    if tenant is None:
+        return jsonify({'error': '無效的 API 金鑰', 'code': 'INVALID_API_KEY'}), 401
+
+    defaults = {k: request.args[k] for k in ('model', 'width', 'height', 'negative_prompt')
+                if request.args.get(k)}
+    try:
+        job = get_bulk_service().create_job(
+            request.stream, tenant=tenant, weight=weight,
+            priority=request.args.get('priority', 0, type=int), defaults=defaults)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    if request.args.get('stream', '1') == '0':
+        return jsonify({'success': True, 'job': job}), 202
+
+    def events():
+        yield {'type': 'job', **job}
+        yield from get_bulk_service().stream(job['id'])
+    return _stream_response(events())
+
+
+@queue_bp.route('/api/queue/bulk', methods=['GET'])
+def list_bulk_jobs():
+    """列出目前租戶最近的大量生成工作"""
+    tenant, _, _ = _tenant()
+    if tenant is None:
+        return jsonify({'error': '無效的 API 金鑰', 'code': 'INVALID_API_KEY'}), 401
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({'success': True, 'jobs': get_bulk_service().list_jobs(tenant, limit)})
+
+
+@queue_bp.route('/api/queue/bulk/<job_id>', methods=['GET'])
+def get_bulk_job(job_id):
+    """查詢大量生成工作進度"""
+    job, error = _own_bulk_job(job_id)
+    if error:
+        return error
+    return jsonify({'success': True, 'job': job})
+
+
+@queue_bp.route('/api/queue/bulk/<job_id>/stream', methods=['GET'])
+def stream_bulk_job(job_id):
+    """以 NDJSON 串流工作結果（after = 上次收到的 seq）"""
+    job, error = _own_bulk_job(job_id)
+    if error:
+        return error
+    return _stream_response(get_bulk_service().stream(job_id, request.args.get('after', 0, type=int)))
+
+
+@queue_bp.route('/api/queue/bulk/<job_id>/cancel', methods=['POST'])
+def cancel_bulk_job(job_id):
+    """取消大量生成工作"""
+    job, error = _own_bulk_job(job_id)
+    if error:
+        return error
+    result = get_bulk_service().cancel_job(job_id)
+    if result['success']:
+        return jsonify(result)
+    return jsonify(result), 400
@@ -0,0 +1,106 @@
+"""
+Search Routes - 提示詞全文搜尋路由
+"""
+import time
+from flask import Blueprint, request, jsonify
+from services.search_service import get_search_service, SEARCH_SOURCES
+from services.embedding_service import get_embedding_service, SIMILAR_THRESHOLD, DUPLICATE_THRESHOLD
+from services.prompt_library_service import get_prompt_library_service
+from services.project_service import get_project_service
+
+search_bp = Blueprint('search', __name__)
+
+
+@search_bp.route('/api/search', methods=['GET'])
+def search_prompts():
+    """全文搜尋歷史、收藏、提示詞庫與專案中的提示詞
+
+    Query:
+        q: 搜尋字串（空白分隔為 AND，-詞 排除，詞* 前綴）
+        source: 逗號分隔的來源（history, favorite, library, project），預設全部
+        limit: 回傳筆數（預設 20，上限 200）
+    """
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': '請提供搜尋字串 q'}), 400
+
+        sources = [s.strip() for s in request.args.get('source', '').split(',') if s.strip()]
+        limit = request.args.get('limit', 20, type=int)
+
+        # 確保 JSON 儲存的來源已同步進索引
+        get_prompt_library_service()
+        get_project_service()
+
+        started = time.perf_counter()
+        results = get_search_service().search(query, sources=sources or None, limit=limit)
+        return jsonify({
+            'success': True,
+            'query': query,
+            'results': results,
+            'count': len(results),
+            'sources': sources or list(SEARCH_SOURCES),
+            'took_ms': round((time.perf_counter() - started) * 1000, 2)
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@search_bp.route('/api/search/similar', methods=['GET'])
+def similar_prompts():
+    """相似提示詞（向量索引，涵蓋歷史與提示詞庫）
+
+    Query:
+        prompt: 提示詞
+        k: 回傳筆數（預設 10，上限 50）
+        source: 逗號分隔的來源（history, library），預設全部
+        min_score: 最低餘弦相似度（預設 0.35）
+        exclude: 排除的項目 id（例如目前這筆歷史）
+    """
+    try:
+        prompt = request.args.get('prompt', '').strip()
+        if not prompt:
+            return jsonify({'error': '請提供提示詞 prompt'}), 400
+
+        sources = [s.strip() for s in request.args.get('source', '').split(',') if s.strip()]
+        k = max(1, min(request.args.get('k', 10, type=int), 50))
+        min_score = request.args.get('min_score', SIMILAR_THRESHOLD, type=float)
+        exclude = request.args.get('exclude')
+
+        get_prompt_library_service()
+        started = time.perf_counter()
+        results = get_embedding_service().similar(
+            prompt, k=k, sources=sources or None, min_score=min_score,
+            exclude_ids=[exclude] if exclude else None
+        )
+        return jsonify({
+            'success': True,
+            'results': results,
+            'count': len(results),
+            'took_ms': round((time.perf_counter() - started) * 1000, 2)
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@search_bp.route('/api/search/duplicates', methods=['GET'])
+def duplicate_prompts():
+    """「你之前生成過」：歷史中幾乎相同的提示詞"""
+    try:
+        prompt = request.args.get('prompt', '').strip()
+        if not prompt:
+            return jsonify({'error': '請提供提示詞 prompt'}), 400
+
+        threshold = request.args.get('threshold', DUPLICATE_THRESHOLD, type=float)
+        matches = get_embedding_service().find_duplicates(prompt, threshold=threshold)
+        return jsonify({
+            'success': True,
+            'generated_before': bool(matches),
+            'matches': matches
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
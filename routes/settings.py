@@ -44,6 +44,18 @@ def clear_api_key(provider_id: str):
     return jsonify(result)
 
 
+@settings_bp.route('/settings/providers/<provider_id>/rate-limits', methods=['POST'])
+def set_rate_limits(provider_id: str):
+    """設定 Provider / 模型的每分鐘請求數與圖片數上限"""
+    data = request.get_json() or {}
+    settings = get_provider_settings()
+    result = settings.set_rate_limits(provider_id, data)
+    if not result['success']:
+        return jsonify(result), 400
+    get_model_registry().reload_api_keys()
+    return jsonify(result)
+
+
 @settings_bp.route('/settings/providers/<provider_id>/model', methods=['POST'])
 def set_provider_model(provider_id: str):
     """切換 Provider 使用的模型"""
@@ -76,18 +76,8 @@ def get_all_tags():
     """獲取所有使用過的標籤"""
     try:
         history_service = get_history_service()
-        history = history_service.load_history()
-        all_tags = set()
-        tag_counts = {}
-
-        for item in history:
-            if 'tags' in item:
-                for tag in item['tags']:
-                    all_tags.add(tag)
-                    tag_counts[tag] = tag_counts.get(tag, 0) + 1
-
         # 按使用頻率排序
-        sorted_tags = sorted(tag_counts.items(), key=lambda x: x[1], reverse=True)
+        sorted_tags = history_service.get_tag_counts()
 
         return jsonify({
             'success': True,
@@ -105,17 +95,9 @@ def update_tags(item_id):
         tags = data.get('tags', [])
 
         history_service = get_history_service()
-        history = history_service.load_history()
-        updated = False
-
-        for item in history:
-            if item.get('id') == item_id:
-                item['tags'] = tags
-                updated = True
-                break
+        updated = history_service.update_tags(item_id, tags)
 
         if updated:
-            history_service.save_history(history)
             return jsonify({
                 'success': True,
                 'message': '標籤已更新'
@@ -131,29 +113,49 @@ def update_tags(item_id):
 
 @templates_bp.route('/history/filter', methods=['POST'])
 def filter_history():
-    """根據標籤過濾歷史記錄"""
+    """根據標籤過濾歷史記錄（游標分頁）
+
+    Body:
+        {
+            "tags": ["a", "b"],   // 舊版參數，搭配 mode 使用
+            "mode": "any",        // any: 符合任一 (OR)；all: 全部符合 (AND)
+            "all": ["a"],         // 必須同時具備 (AND)
+            "any": ["b", "c"],    // 符合任一 (OR)
+            "none": ["d"],        // 排除 (NOT)
+            "limit": 50,
+            "cursor": null
+        }
+    """
     try:
         data = request.get_json()
         filter_tags = data.get('tags', [])
+        all_tags = list(data.get('all', []))
+        any_tags = list(data.get('any', []))
+        none_tags = list(data.get('none', []))
+        if data.get('mode') == 'all':
+            all_tags += filter_tags
+        else:
+            any_tags += filter_tags
 
         history_service = get_history_service()
-        
-        if not filter_tags:
-            # 沒有過濾條件，返回全部
-            history = history_service.load_history()
-        else:
-            history = history_service.load_history()
-            # 過濾包含任一標籤的記錄
-            filtered = [
-                item for item in history
-                if 'tags' in item and any(tag in item['tags'] for tag in filter_tags)
-            ]
-            history = filtered
+        page = history_service.query_history(
+            limit=data.get('limit', 50),
+            cursor=data.get('cursor'),
+            tags=any_tags,
+            all_tags=all_tags,
+            exclude_tags=none_tags
+        )
+        history = page['items']
 
         return jsonify({
             'success': True,
             'history': history,
-            'count': len(history)
+            'count': len(history),
+            'total': history_service.count_tag_matches(all_tags, any_tags, none_tags),
+            'next_cursor': page['next_cursor'],
+            'has_more': page['has_more']
         })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
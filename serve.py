@@ -0,0 +1,200 @@
+"""
+Z-Image Studio - 生產模式啟動器
+
+app.py 使用 Werkzeug 開發伺服器，模型、佇列都是行程內單例，無法多行程擴充。
+生產模式將兩者分開：
+
+  推論行程 ×1   持有 ModelRegistry 與 QueueService（唯一載入模型的行程）
+  web worker ×N 處理 HTTP，透過本機 IPC 呼叫推論行程（services/inference_ipc.py），
+                 不匯入 torch、不載入模型
+
+web 伺服器：gunicorn（Linux / macOS，N 個行程）→ waitress（Windows，單行程多執行緒）
+→ 都沒安裝時退回 Werkzeug threaded。
+
+QUEUE_BACKEND = "sqlite" 時佇列改存於共用 broker，web worker 直接提交任務；
+其他 GPU 主機以 --queue-worker 啟動純工作節點即可加入處理（services/queue_broker.py）。
+
+用法:
+    python serve.py
+    python serve.py --workers 8 --threads 4 --port 8000 --no-preload
+    python serve.py --queue-worker --preload z-image-turbo
+"""
+import os
+import sys
+import time
+import secrets
+import argparse
+import threading
+import multiprocessing
+from multiprocessing.connection import Client
+
+import config
+
+
+def run_inference_worker(address, authkey, preload_model):
+    """推論行程：啟動 IPC 伺服器，並在背景預載預設模型"""
+    from services.inference_ipc import InferenceServer
+    server = InferenceServer(address, authkey.encode('utf-8'))
+
+    if preload_model:
+        def preload():
+            print(f"[Inference] 預載入模型 {preload_model}...")
+            try:
+                result = server._dispatch('registry', 'switch_model', (preload_model,), {})
+                print(f"[Inference] {result.get('message') or result.get('error')}")
+            except Exception as e:
+                print(f"[Inference] 預載入失敗: {e}")
+        threading.Thread(target=preload, daemon=True).start()
+
+    server.serve_forever()
+
+
+def start_inference_worker(address, authkey, preload_model):
+    # spawn：避免在已有執行緒的行程中 fork，Windows / Linux 行為一致
+    ctx = multiprocessing.get_context('spawn')
+    process = ctx.Process(target=run_inference_worker, args=(address, authkey, preload_model),
+                          name='zimage-inference', daemon=True)
+    process.start()
+    return process
+
+
+def wait_for_inference(address, authkey, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            Client(address, authkey=authkey.encode('utf-8')).close()
+            return True
+        except (ConnectionError, OSError):
+            time.sleep(0.2)
+    return False
+
+
+def supervise(process_holder, address, authkey, preload_model, interval=2.0):
+    """推論行程意外結束時重新啟動"""
+    while True:
+        time.sleep(interval)
+        process = process_holder[0]
+        if not process.is_alive():
+            print(f"[Serve] 推論行程已結束 (exit code {process.exitcode})，重新啟動...")
+            process_holder[0] = start_inference_worker(address, authkey, preload_model)
+
+
+def run_queue_worker(preload_model):
+    """純工作節點：不啟動 web 伺服器，只從共用 broker 領取佇列任務"""
+    if config.QUEUE_BACKEND != 'sqlite':
+        print('[Serve] --queue-worker 需要 config.QUEUE_BACKEND = "sqlite"')
+        sys.exit(1)
+    from services.model_registry import get_model_registry
+    from services.queue_service import get_queue_service
+
+    # 專用節點沒有網頁介面，可依任務切換模型
+    config.QUEUE_SWITCH_MODELS = True
+    if preload_model:
+        result = get_model_registry().switch_model(preload_model)
+        print(f"[Serve] {result.get('message') or result.get('error')}")
+    queue = get_queue_service()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        queue.stop()
+
+
+def run_gunicorn(host, port, workers, threads):
+    from gunicorn.app.base import BaseApplication
+
+    class ZImageApplication(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # 在各 worker 內匯入，SQLite 連線等資源不會跨 fork 共用
+            from app import app
+            return app
+
+    ZImageApplication({
+        'bind': f"{host}:{port}",
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread',
+        'timeout': 600,  # 生成可能超過數十秒
+        'graceful_timeout': 30,
+    }).run()
+
+
+def run_waitress(host, port, threads):
+    from waitress import serve
+    from app import app
+    serve(app, host=host, port=port, threads=threads)
+
+
+def run_werkzeug(host, port):
+    from app import app
+    print("[Serve] 未安裝 gunicorn / waitress，使用 Werkzeug threaded 伺服器（單行程）")
+    app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Z-Image Studio 生產模式')
+    parser.add_argument('--host', default=config.HOST)
+    parser.add_argument('--port', type=int, default=config.PORT)
+    parser.add_argument('--workers', type=int, default=config.WEB_WORKERS)
+    parser.add_argument('--threads', type=int, default=config.WEB_THREADS)
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'waitress', 'werkzeug'], default='auto')
+    parser.add_argument('--preload', default='z-image-turbo', help='推論行程啟動後預載的模型')
+    parser.add_argument('--no-preload', action='store_true')
+    parser.add_argument('--queue-worker', action='store_true', help='只作為佇列工作節點（需 sqlite 佇列後端）')
+    args = parser.parse_args()
+
+    config.print_config_info()
+    if args.queue_worker:
+        run_queue_worker(None if args.no_preload else args.preload)
+        return
+
+    address = (config.INFERENCE_HOST, config.INFERENCE_PORT)
+    authkey = secrets.token_hex(16)
+    preload_model = None if args.no_preload else args.preload
+
+    holder = [start_inference_worker(address, authkey, preload_model)]
+    if not wait_for_inference(address, authkey):
+        print("[Serve] 推論行程啟動逾時")
+        holder[0].terminate()
+        sys.exit(1)
+    print(f"[Serve] 推論行程就緒: {address[0]}:{address[1]} (pid {holder[0].pid})")
+    threading.Thread(target=supervise, args=(holder, address, authkey, preload_model), daemon=True).start()
+
+    # 之後匯入的 app 與 web worker 都會以遠端代理使用推論行程
+    from services.inference_ipc import INFERENCE_ADDRESS_ENV, INFERENCE_AUTHKEY_ENV
+    os.environ[INFERENCE_ADDRESS_ENV] = f"{address[0]}:{address[1]}"
+    os.environ[INFERENCE_AUTHKEY_ENV] = authkey
+
+    server = args.server
+    if server == 'auto':
+        if os.name == 'posix' and _importable('gunicorn'):
+            server = 'gunicorn'
+        elif _importable('waitress'):
+            server = 'waitress'
+        else:
+            server = 'werkzeug'
+
+    print(f"[Serve] web 伺服器: {server} http://{args.host}:{args.port}")
+    if server == 'gunicorn':
+        run_gunicorn(args.host, args.port, args.workers, args.threads)
+    elif server == 'waitress':
+        run_waitress(args.host, args.port, args.workers * args.threads)
+    else:
+        run_werkzeug(args.host, args.port)
+
+
+def _importable(name):
+    import importlib.util
+    return importlib.util.find_spec(name) is not None
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,23 @@
 # Services Package
 # Model and history management services
+#
+# 延遲匯入：model_service 會載入 torch / diffusers，
+# 生產模式的 web worker 不需要（見 serve.py），只在實際使用時才匯入
 
-from services.model_service import ModelService, get_model_service
-from services.history_service import HistoryService, get_history_service
-from services.llm_service import LLMService, get_llm_service
+_EXPORTS = {
+    'ModelService': 'services.model_service',
+    'get_model_service': 'services.model_service',
+    'HistoryService': 'services.history_service',
+    'get_history_service': 'services.history_service',
+    'LLMService': 'services.llm_service',
+    'get_llm_service': 'services.llm_service',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        import importlib
+        return getattr(importlib.import_module(_EXPORTS[name]), name)
+    raise AttributeError(f"module 'services' has no attribute {name!r}")
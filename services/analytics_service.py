@@ -1,105 +1,223 @@
 """
 Analytics Service - 使用量統計與分析服務
 追蹤生成次數、模型使用量、熱門提示詞等關鍵指標
+
+模型 / 解析度 / 模式分佈與生成速度以記憶體中的彙總值維護：
+- 每筆事件寫入後增量更新（計數器、對數桶直方圖），儀表板查詢不再掃描事件
+- 總耗時與各階段耗時（佇列等待、文字編碼、去噪、VAE 解碼、編碼、存檔）
+  依「模型 × 解析度」分組記錄於直方圖，可查 p50 / p95 / p99
+- 彙總值定期寫入 analytics_checkpoints，啟動時只重播檢查點之後的事件
+- 以事件 id 追趕，其他行程寫入的事件也會併入
 """
-import os
 import json
-from datetime import datetime, timedelta
+import time
+import atexit
+import threading
 from collections import Counter
-import config
+from datetime import datetime, timedelta
+from services.metadata_store import get_metadata_store
+from services.histogram import LogHistogram
+from services.metrics_service import record_generation_metrics
+from providers.base import GENERATION_STAGES
 
 
-ANALYTICS_FILE = os.path.join(config.OUTPUT_PATH, "analytics.json")
+# 彙總資料格式版本，格式變更時捨棄舊檢查點並從事件重建
+AGGREGATE_VERSION = 2
+AGGREGATE_CHECKPOINT = 'generation'
+# 累積多少筆新事件或經過多久寫一次檢查點
+CHECKPOINT_EVERY_EVENTS = 200
+CHECKPOINT_INTERVAL = 60  # 秒
+REPLAY_BATCH_SIZE = 5000
 
 
 class AnalyticsService:
     """使用量統計分析服務"""
 
     def __init__(self):
-        self.data = self._load()
+        self.store = get_metadata_store()
+        self._lock = threading.RLock()
+        self._reset_aggregates()
+        self._load_checkpoint()
+        self._catch_up()
+        atexit.register(self.checkpoint)
+
+    # ── 預先彙總 ───────────────────────────────────────────────
+    def _reset_aggregates(self):
+        self._last_event_id = 0
+        self._models = Counter()
+        self._resolutions = Counter()
+        self._modes = Counter()
+        self._durations = LogHistogram()
+        # (model, resolution) -> {'total' | 階段名稱: LogHistogram}
+        self._stage_groups = {}
+        self._pending_events = 0
+        self._last_checkpoint = time.monotonic()
+
+    def _load_checkpoint(self):
+        row = self.store.execute(
+            "SELECT last_event_id, data FROM analytics_checkpoints WHERE name = ?",
+            (AGGREGATE_CHECKPOINT,)
+        ).fetchone()
+        if not row:
+            return
+        try:
+            data = json.loads(row['data'])
+            if data.get('version') != AGGREGATE_VERSION:
+                return
+            self._models = Counter(data['models'])
+            self._resolutions = Counter(data['resolutions'])
+            self._modes = Counter(data['modes'])
+            self._durations = LogHistogram.from_dict(data['durations'])
+            self._stage_groups = {
+                (group['model'], group['resolution']): {
+                    name: LogHistogram.from_dict(hist) for name, hist in group['histograms'].items()
+                }
+                for group in data['stage_groups']
+            }
+            self._last_event_id = row['last_event_id']
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"[Analytics] 檢查點格式錯誤，將從事件重建: {e}")
+            self._reset_aggregates()
+
+    def _apply_event(self, row):
+        self._models[row['model'] or 'unknown'] += 1
+        self._resolutions[row['resolution'] or 'unknown'] += 1
+        self._modes[row['mode'] or 'single'] += 1
+        if row['duration'] is not None:
+            self._durations.record(row['duration'])
 
-    def _load(self):
-        """載入統計資料"""
-        if os.path.exists(ANALYTICS_FILE):
+        stages = {}
+        if row['timings']:
             try:
-                with open(ANALYTICS_FILE, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception:
+                stages = json.loads(row['timings'])
+            except ValueError:
                 pass
-        return {
-            'events': [],
-            'daily_stats': {},
-            'total_generations': 0,
-            'total_api_calls': 0,
-            'created_at': datetime.now().isoformat()
-        }
+        if row['duration'] is None and not stages:
+            return
+        group = self._stage_groups.setdefault(
+            (row['model'] or 'unknown', row['resolution'] or 'unknown'), {})
+        if row['duration'] is not None:
+            group.setdefault('total', LogHistogram()).record(row['duration'])
+        for stage, seconds in stages.items():
+            group.setdefault(stage, LogHistogram()).record(seconds)
 
-    def _save(self):
-        """儲存統計資料"""
-        try:
-            os.makedirs(os.path.dirname(ANALYTICS_FILE), exist_ok=True)
-            with open(ANALYTICS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"儲存統計資料失敗: {e}")
-
-    def track_generation(self, model_id, prompt, width, height, mode='single', duration=None):
-        """追蹤一次圖片生成事件"""
-        today = datetime.now().strftime('%Y-%m-%d')
-        event = {
-            'type': 'generation',
-            'model': model_id,
-            'prompt_length': len(prompt),
-            'prompt_preview': prompt[:80],
-            'resolution': f'{width}x{height}',
-            'mode': mode,
-            'duration': duration,
-            'timestamp': datetime.now().isoformat()
-        }
+    def _catch_up(self):
+        """套用 _last_event_id 之後的事件（沒有新事件時只是一次主鍵查詢）"""
+        with self._lock:
+            while True:
+                rows = self.store.execute(
+                    "SELECT id, type, model, resolution, mode, duration, timings FROM analytics_events "
+                    "WHERE id > ? ORDER BY id LIMIT ?",
+                    (self._last_event_id, REPLAY_BATCH_SIZE)
+                ).fetchall()
+                for row in rows:
+                    if row['type'] == 'generation':
+                        self._apply_event(row)
+                if rows:
+                    self._last_event_id = rows[-1]['id']
+                    self._pending_events += len(rows)
+                if len(rows) < REPLAY_BATCH_SIZE:
+                    break
 
-        self.data['events'].append(event)
-        self.data['total_generations'] = self.data.get('total_generations', 0) + 1
+            if self._pending_events >= CHECKPOINT_EVERY_EVENTS or (
+                    self._pending_events and
+                    time.monotonic() - self._last_checkpoint >= CHECKPOINT_INTERVAL):
+                self.checkpoint()
 
-        # 更新每日統計
-        if today not in self.data['daily_stats']:
-            self.data['daily_stats'][today] = {
-                'generations': 0, 'api_calls': 0, 'models': {}, 'modes': {}
-            }
-        day = self.data['daily_stats'][today]
-        day['generations'] = day.get('generations', 0) + 1
-        day['models'][model_id] = day.get('models', {}).get(model_id, 0) + 1
-        day['modes'][mode] = day.get('modes', {}).get(mode, 0) + 1
+    def checkpoint(self):
+        """將彙總值寫入資料庫（只會前進，不覆蓋其他行程較新的檢查點）"""
+        with self._lock:
+            if not self._pending_events:
+                return
+            data = json.dumps({
+                'version': AGGREGATE_VERSION,
+                'models': self._models,
+                'resolutions': self._resolutions,
+                'modes': self._modes,
+                'durations': self._durations.to_dict(),
+                'stage_groups': [
+                    {'model': model, 'resolution': resolution,
+                     'histograms': {name: hist.to_dict() for name, hist in histograms.items()}}
+                    for (model, resolution), histograms in self._stage_groups.items()
+                ],
+            }, ensure_ascii=False)
+            try:
+                with self.store.transaction() as conn:
+                    conn.execute(
+                        "INSERT INTO analytics_checkpoints (name, last_event_id, data, updated_at) "
+                        "VALUES (?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET "
+                        "last_event_id = excluded.last_event_id, data = excluded.data, "
+                        "updated_at = excluded.updated_at "
+                        "WHERE excluded.last_event_id > analytics_checkpoints.last_event_id",
+                        (AGGREGATE_CHECKPOINT, self._last_event_id, data, datetime.now().isoformat())
+                    )
+            except Exception as e:
+                print(f"[Analytics] 寫入檢查點失敗: {e}")
+                return
+            self._pending_events = 0
+            self._last_checkpoint = time.monotonic()
 
-        # 限制事件數量（保留最近 1000 筆）
-        if len(self.data['events']) > 1000:
-            self.data['events'] = self.data['events'][-1000:]
+    @staticmethod
+    def _top(counter, limit=10):
+        items = counter.most_common(limit)
+        return {key: n for key, n in items}
 
-        self._save()
+    def _bump_daily(self, conn, column):
+        today = datetime.now().strftime('%Y-%m-%d')
+        conn.execute(
+            f"INSERT INTO analytics_daily (day, {column}) VALUES (?, 1) "
+            f"ON CONFLICT(day) DO UPDATE SET {column} = {column} + 1",
+            (today,)
+        )
+
+    def track_generation(self, model_id, prompt, width, height, mode='single', duration=None,
+                         timings=None):
+        """追蹤一次圖片生成事件
+
+        Args:
+            duration: 生成總耗時（秒）
+            timings: 各階段耗時 {階段名稱: 秒}，見 providers.base.GENERATION_STAGES
+        """
+        stage_json = None
+        if timings:
+            stage_json = json.dumps({k: round(v, 4) for k, v in timings.items() if v is not None})
+        with self.store.transaction() as conn:
+            conn.execute(
+                "INSERT INTO analytics_events (type, model, prompt_length, prompt_preview, "
+                "resolution, mode, duration, timestamp, timings) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ('generation', model_id, len(prompt), prompt[:80], f'{width}x{height}',
+                 mode, duration, datetime.now().isoformat(), stage_json)
+            )
+            self.store.increment_counter(conn, 'total_generations')
+            self._bump_daily(conn, 'generations')
+        self._catch_up()
+        record_generation_metrics(model_id, mode, duration, timings)
 
     def track_api_call(self, endpoint, api_key_prefix=None):
         """追蹤一次 API 呼叫"""
-        today = datetime.now().strftime('%Y-%m-%d')
-        self.data['total_api_calls'] = self.data.get('total_api_calls', 0) + 1
+        with self.store.transaction() as conn:
+            self.store.increment_counter(conn, 'total_api_calls')
+            self._bump_daily(conn, 'api_calls')
 
-        if today not in self.data['daily_stats']:
-            self.data['daily_stats'][today] = {
-                'generations': 0, 'api_calls': 0, 'models': {}, 'modes': {}
-            }
-        self.data['daily_stats'][today]['api_calls'] = \
-            self.data['daily_stats'][today].get('api_calls', 0) + 1
-
-        self._save()
+    def _daily_stats(self, since):
+        """取得 since (YYYY-MM-DD) 之後的每日統計"""
+        rows = self.store.execute(
+            "SELECT day, generations, api_calls FROM analytics_daily WHERE day >= ?",
+            (since,)
+        ).fetchall()
+        return {row['day']: dict(row) for row in rows}
 
     def get_overview(self):
         """取得總覽統計"""
-        today = datetime.now().strftime('%Y-%m-%d')
-        today_stats = self.data['daily_stats'].get(today, {})
+        now = datetime.now()
+        today = now.strftime('%Y-%m-%d')
+        daily = self._daily_stats((now - timedelta(days=29)).strftime('%Y-%m-%d'))
+        today_stats = daily.get(today, {})
 
         # 計算最近 7 天和 30 天
         week_gen = 0
         month_gen = 0
-        now = datetime.now()
-        for date_str, stats in self.data['daily_stats'].items():
+        for date_str, stats in daily.items():
             try:
                 date = datetime.strptime(date_str, '%Y-%m-%d')
                 delta = (now - date).days
@@ -111,23 +229,24 @@ class AnalyticsService:
                 continue
 
         return {
-            'total_generations': self.data.get('total_generations', 0),
-            'total_api_calls': self.data.get('total_api_calls', 0),
+            'total_generations': self.store.get_counter('total_generations'),
+            'total_api_calls': self.store.get_counter('total_api_calls'),
             'today_generations': today_stats.get('generations', 0),
             'today_api_calls': today_stats.get('api_calls', 0),
             'week_generations': week_gen,
             'month_generations': month_gen,
-            'since': self.data.get('created_at', 'N/A')
+            'since': self.store.get_meta('analytics_created_at', 'N/A')
         }
 
     def get_daily_chart(self, days=30):
         """取得每日生成數量（用於圖表）"""
         now = datetime.now()
         chart_data = []
+        daily = self._daily_stats((now - timedelta(days=days - 1)).strftime('%Y-%m-%d'))
 
         for i in range(days - 1, -1, -1):
             date = (now - timedelta(days=i)).strftime('%Y-%m-%d')
-            stats = self.data['daily_stats'].get(date, {})
+            stats = daily.get(date, {})
             chart_data.append({
                 'date': date,
                 'generations': stats.get('generations', 0),
@@ -137,50 +256,91 @@ class AnalyticsService:
         return chart_data
 
     def get_model_usage(self):
-        """取得模型使用量統計"""
-        model_counts = Counter()
-        for event in self.data['events']:
-            if event.get('type') == 'generation':
-                model_counts[event.get('model', 'unknown')] += 1
-        return dict(model_counts.most_common(10))
+        """取得模型使用量統計（全部歷史）"""
+        self._catch_up()
+        with self._lock:
+            return self._top(self._models)
 
     def get_popular_resolutions(self):
         """取得熱門解析度"""
-        res_counts = Counter()
-        for event in self.data['events']:
-            if event.get('type') == 'generation':
-                res_counts[event.get('resolution', 'unknown')] += 1
-        return dict(res_counts.most_common(10))
+        self._catch_up()
+        with self._lock:
+            return self._top(self._resolutions)
 
     def get_mode_distribution(self):
         """取得生成模式分佈"""
-        mode_counts = Counter()
-        for event in self.data['events']:
-            if event.get('type') == 'generation':
-                mode_counts[event.get('mode', 'single')] += 1
-        return dict(mode_counts)
-
-    def get_generation_speed(self):
-        """取得平均生成速度"""
-        durations = [
-            e['duration'] for e in self.data['events']
-            if e.get('type') == 'generation' and e.get('duration') is not None
-        ]
-        if not durations:
-            return {'avg': None, 'min': None, 'max': None, 'count': 0}
+        self._catch_up()
+        with self._lock:
+            return dict(self._modes.most_common())
 
-        return {
-            'avg': round(sum(durations) / len(durations), 2),
-            'min': round(min(durations), 2),
-            'max': round(max(durations), 2),
-            'count': len(durations)
-        }
+    def get_generation_speed(self, model=None, resolution=None):
+        """取得生成速度：總耗時與各階段的 min / max / 平均 / 百分位數
+
+        Args:
+            model / resolution: 只看指定模型或解析度（例如 '768x768'）
+
+        Returns:
+            總耗時摘要（count / avg / min / max / p50 / p90 / p95 / p99），另含
+            stages: 各階段摘要，groups: 每個「模型 × 解析度」的總耗時與階段摘要
+        """
+        self._catch_up()
+        with self._lock:
+            selected = [
+                (key, histograms) for key, histograms in self._stage_groups.items()
+                if (model is None or key[0] == model) and (resolution is None or key[1] == resolution)
+            ]
+            if model is None and resolution is None:
+                result = self._durations.summary()
+            else:
+                total = LogHistogram()
+                for _, histograms in selected:
+                    if 'total' in histograms:
+                        total.merge(histograms['total'])
+                result = total.summary()
+
+            merged = {}
+            groups = []
+            for (group_model, group_resolution), histograms in selected:
+                stages = {}
+                for name, hist in histograms.items():
+                    if name == 'total':
+                        continue
+                    merged.setdefault(name, LogHistogram()).merge(hist)
+                    stages[name] = hist.summary(digits=3)
+                total = histograms.get('total')
+                groups.append({
+                    'model': group_model,
+                    'resolution': group_resolution,
+                    'count': total.count if total else 0,
+                    'total': total.summary() if total else None,
+                    'stages': self._ordered_stages(stages),
+                })
+
+        groups.sort(key=lambda g: g['count'], reverse=True)
+        result['stages'] = self._ordered_stages(
+            {name: hist.summary(digits=3) for name, hist in merged.items()})
+        result['groups'] = groups
+        return result
+
+    @staticmethod
+    def _ordered_stages(stages):
+        """依生成流程排序階段，未知的階段排在最後"""
+        order = {name: i for i, name in enumerate(GENERATION_STAGES)}
+        return dict(sorted(stages.items(), key=lambda item: order.get(item[0], len(order))))
 
     def get_recent_activity(self, limit=20):
         """取得最近活動"""
-        events = self.data['events'][-limit:]
-        events.reverse()
-        return events
+        rows = self.store.execute(
+            "SELECT type, model, prompt_length, prompt_preview, resolution, mode, duration, timestamp, "
+            "timings FROM analytics_events ORDER BY id DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        activity = []
+        for row in rows:
+            item = dict(row)
+            item['timings'] = json.loads(item['timings']) if item['timings'] else None
+            activity.append(item)
+        return activity
 
 
 # 全域單例
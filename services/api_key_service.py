@@ -1,28 +1,74 @@
 """
 API Key Service - API 金鑰管理服務
 提供 API 金鑰的生成、驗證和管理功能，讓外部應用可以整合圖片生成功能
+
+驗證只查記憶體中的字典（以金鑰雜湊為鍵），不寫檔：
+- last_used / usage_count 先累積在記憶體，每 USAGE_FLUSH_INTERVAL 秒與程式結束時批次寫回
+- 寫檔時持有跨行程檔案鎖，讀取最新檔案、合併其他行程的變更後以暫存檔 + os.replace 原子替換
+- 其他行程（serve.py 的 web worker）新增、撤銷的金鑰在檔案變更後最多 KEY_RELOAD_INTERVAL 秒生效
+
+每個金鑰另有 webhook_secret，用來簽署 /api/v1/jobs 的 webhook 通知（建立或輪替時顯示一次）。
 """
 import os
 import json
+import time
+import atexit
 import secrets
 import hashlib
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from functools import wraps
-from flask import request, jsonify
+from flask import request, jsonify, make_response
 import config
+from services.rate_limit_service import get_rate_limit_service, rate_limit_headers
 
 
 API_KEYS_FILE = os.path.join(config.OUTPUT_PATH, "api_keys.json")
 
+# 用量寫回間隔（秒）
+USAGE_FLUSH_INTERVAL = 30
+# 檢查金鑰檔是否被其他行程更新的最短間隔（秒）
+KEY_RELOAD_INTERVAL = 1.0
+
+
+@contextmanager
+def _file_lock(path):
+    """跨行程的獨占檔案鎖（Windows: msvcrt；其他: fcntl）"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
 
 class APIKeyService:
     """API 金鑰管理服務"""
 
     def __init__(self):
+        self._lock = threading.RLock()
+        self._pending = {}  # key_hash -> [未寫回的使用次數, 最後使用時間]
+        self._file_mtime = None
+        self._last_reload_check = 0.0
+        self._flusher = None
+        self.stats = {'flushes': 0, 'reloads': 0}
         self.keys = self._load_keys()
+        atexit.register(self.flush)
 
-    def _load_keys(self):
-        """載入 API 金鑰"""
+    def _read_file(self):
         if os.path.exists(API_KEYS_FILE):
             try:
                 with open(API_KEYS_FILE, 'r', encoding='utf-8') as f:
@@ -31,25 +77,107 @@ class APIKeyService:
                 return {}
         return {}
 
-    def _save_keys(self):
-        """儲存 API 金鑰"""
+    def _file_stat(self):
+        try:
+            return os.stat(API_KEYS_FILE).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load_keys(self):
+        """載入 API 金鑰"""
+        self._file_mtime = self._file_stat()
+        return self._read_file()
+
+    def _reload_if_changed(self):
+        """金鑰檔被其他行程更新時重新載入（保留本行程尚未寫回的用量）"""
+        now = time.monotonic()
+        if now - self._last_reload_check < KEY_RELOAD_INTERVAL:
+            return
+        self._last_reload_check = now
+        if self._file_stat() == self._file_mtime:
+            return
+        with self._lock:
+            keys = self._load_keys()
+            for key_hash, (count, last_used) in self._pending.items():
+                info = keys.get(key_hash)
+                if info:
+                    info['usage_count'] = info.get('usage_count', 0) + count
+                    info['last_used'] = max(info.get('last_used') or '', last_used)
+            self.keys = keys
+            self.stats['reloads'] += 1
+
+    def _update_file(self, mutate=None):
+        """在檔案鎖內讀取最新檔案、合併未寫回的用量並套用 mutate(keys)，原子寫回
+
+        Returns:
+            mutate 的回傳值
+        """
+        with self._lock, _file_lock(API_KEYS_FILE + '.lock'):
+            keys = self._read_file()
+            pending, self._pending = self._pending, {}
+            for key_hash, (count, last_used) in pending.items():
+                info = keys.get(key_hash)
+                if info:
+                    info['usage_count'] = info.get('usage_count', 0) + count
+                    info['last_used'] = max(info.get('last_used') or '', last_used)
+            result = mutate(keys) if mutate else None
+            tmp_path = f"{API_KEYS_FILE}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(keys, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, API_KEYS_FILE)
+            except Exception as e:
+                # 寫入失敗：用量留待下次寫回
+                for key_hash, (count, last_used) in pending.items():
+                    slot = self._pending.setdefault(key_hash, [0, last_used])
+                    slot[0] += count
+                    slot[1] = max(slot[1], last_used)
+                print(f"儲存 API 金鑰失敗: {e}")
+                raise
+            self.keys = keys
+            self._file_mtime = self._file_stat()
+            return result
+
+    def flush(self):
+        """將累積的用量寫回檔案（定期與程式結束時呼叫）"""
+        if not self._pending:
+            return
         try:
-            os.makedirs(os.path.dirname(API_KEYS_FILE), exist_ok=True)
-            with open(API_KEYS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.keys, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"儲存 API 金鑰失敗: {e}")
+            self._update_file()
+            self.stats['flushes'] += 1
+        except Exception:
+            pass
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_loop, name='api-key-flush',
+                                                     daemon=True)
+                    self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(USAGE_FLUSH_INTERVAL)
+            self.flush()
 
     def _hash_key(self, key):
         """雜湊 API 金鑰"""
         return hashlib.sha256(key.encode()).hexdigest()
 
-    def create_key(self, name, permissions=None):
+    @staticmethod
+    def _new_webhook_secret():
+        return f"whsec_{secrets.token_urlsafe(32)}"
+
+    def create_key(self, name, permissions=None, rate_limit=None, read_rate_limit=None, max_pending=None):
         """建立新的 API 金鑰
 
         Args:
             name: 金鑰名稱/描述
             permissions: 允許的操作列表
+            rate_limit: 每分鐘生成請求上限（0 = 不限制）
+            read_rate_limit: 每分鐘讀取請求上限（0 = 不限制）
+            max_pending: 佇列待處理任務數上限（None = 使用 QUEUE_MAX_PENDING_PER_KEY）
 
         Returns:
             dict: 包含金鑰資訊（金鑰明文只在建立時顯示一次）
@@ -68,21 +196,27 @@ class APIKeyService:
             'permissions': permissions or default_permissions,
             'usage_count': 0,
             'is_active': True,
-            'rate_limit': 60,  # 每分鐘請求次數上限
+            'rate_limit': config.API_RATE_LIMIT_DEFAULT if rate_limit is None else rate_limit,  # 每分鐘生成請求上限
+            'read_rate_limit': (config.API_READ_RATE_LIMIT_DEFAULT
+                                if read_rate_limit is None else read_rate_limit),  # 每分鐘讀取請求上限
+            'webhook_secret': self._new_webhook_secret(),  # 簽署 webhook 通知
         }
+        if max_pending is not None:
+            key_info['max_pending'] = max_pending  # 覆寫 QUEUE_MAX_PENDING_PER_KEY
 
-        self.keys[key_hash] = key_info
-        self._save_keys()
+        def add(keys):
+            keys[key_hash] = key_info
+        self._update_file(add)
 
         return {
             'success': True,
             'api_key': raw_key,  # 只在建立時回傳明文
             'key_info': {**key_info, 'id': key_hash[:8]},
-            'message': '請妥善保存此 API 金鑰，它不會再次顯示'
+            'message': '請妥善保存此 API 金鑰與 webhook_secret，它們不會再次顯示'
         }
 
     def validate_key(self, raw_key):
-        """驗證 API 金鑰
+        """驗證 API 金鑰（只查記憶體，用量稍後批次寫回）
 
         Returns:
             tuple: (is_valid, key_info)
@@ -90,6 +224,7 @@ class APIKeyService:
         if not raw_key:
             return False, None
 
+        self._reload_if_changed()
         key_hash = self._hash_key(raw_key)
         key_info = self.keys.get(key_hash)
 
@@ -100,16 +235,22 @@ class APIKeyService:
             return False, None
 
         # 更新使用統計
-        key_info['last_used'] = datetime.now().isoformat()
-        key_info['usage_count'] = key_info.get('usage_count', 0) + 1
-        self._save_keys()
+        now = datetime.now().isoformat()
+        with self._lock:
+            key_info['last_used'] = now
+            key_info['usage_count'] = key_info.get('usage_count', 0) + 1
+            slot = self._pending.setdefault(key_hash, [0, now])
+            slot[0] += 1
+            slot[1] = now
+        self._ensure_flusher()
 
         return True, key_info
 
     def list_keys(self):
         """列出所有 API 金鑰（不包含雜湊值）"""
+        self._reload_if_changed()
         result = []
-        for key_hash, info in self.keys.items():
+        for key_hash, info in list(self.keys.items()):
             result.append({
                 'id': key_hash[:8],
                 'name': info['name'],
@@ -119,28 +260,53 @@ class APIKeyService:
                 'permissions': info['permissions'],
                 'usage_count': info['usage_count'],
                 'is_active': info['is_active'],
-                'rate_limit': info.get('rate_limit', 60)
+                'rate_limit': info.get('rate_limit', config.API_RATE_LIMIT_DEFAULT),
+                'read_rate_limit': info.get('read_rate_limit', config.API_READ_RATE_LIMIT_DEFAULT),
+                'has_webhook_secret': bool(info.get('webhook_secret'))
             })
         return result
 
     def revoke_key(self, key_id_prefix):
         """撤銷 API 金鑰"""
-        for key_hash, info in self.keys.items():
-            if key_hash[:8] == key_id_prefix:
-                info['is_active'] = False
-                self._save_keys()
-                return {'success': True, 'message': f'已撤銷金鑰: {info["name"]}'}
-        return {'success': False, 'error': '金鑰不存在'}
+        def revoke(keys):
+            for key_hash, info in keys.items():
+                if key_hash[:8] == key_id_prefix:
+                    info['is_active'] = False
+                    return {'success': True, 'message': f'已撤銷金鑰: {info["name"]}'}
+            return {'success': False, 'error': '金鑰不存在'}
+        return self._update_file(revoke)
 
     def delete_key(self, key_id_prefix):
         """刪除 API 金鑰"""
-        for key_hash in list(self.keys.keys()):
+        def delete(keys):
+            for key_hash in list(keys.keys()):
+                if key_hash[:8] == key_id_prefix:
+                    name = keys.pop(key_hash)['name']
+                    get_rate_limit_service().reset(key_hash)
+                    return {'success': True, 'message': f'已刪除金鑰: {name}'}
+            return {'success': False, 'error': '金鑰不存在'}
+        return self._update_file(delete)
+
+    def get_webhook_secret(self, key_id_prefix):
+        """取得金鑰的 webhook 簽章 secret（舊金鑰沒有時回傳 None）"""
+        self._reload_if_changed()
+        for key_hash, info in list(self.keys.items()):
             if key_hash[:8] == key_id_prefix:
-                name = self.keys[key_hash]['name']
-                del self.keys[key_hash]
-                self._save_keys()
-                return {'success': True, 'message': f'已刪除金鑰: {name}'}
-        return {'success': False, 'error': '金鑰不存在'}
+                return info.get('webhook_secret')
+        return None
+
+    def rotate_webhook_secret(self, key_id_prefix):
+        """產生新的 webhook secret（舊 secret 立即失效）"""
+        secret = self._new_webhook_secret()
+
+        def rotate(keys):
+            for key_hash, info in keys.items():
+                if key_hash[:8] == key_id_prefix:
+                    info['webhook_secret'] = secret
+                    return {'success': True, 'webhook_secret': secret,
+                            'message': '請妥善保存此 webhook_secret，它不會再次顯示'}
+            return {'success': False, 'error': '金鑰不存在'}
+        return self._update_file(rotate)
 
     def check_permission(self, raw_key, required_permission):
         """檢查金鑰是否有特定權限"""
@@ -162,11 +328,14 @@ def get_api_key_service():
     return _api_key_service
 
 
-def require_api_key(permission=None):
+def require_api_key(permission=None, budget='read'):
     """API 金鑰驗證裝飾器
 
+    依金鑰套用速率限制：budget='generate' 計入生成額度（rate_limit），
+    其餘計入讀取額度（read_rate_limit）；回應附 RateLimit-* 標頭，超過時回傳 429 與 Retry-After。
+
     用法:
-        @require_api_key('generate')
+        @require_api_key('generate', budget='generate')
         def my_api_route():
             ...
     """
@@ -197,6 +366,25 @@ def require_api_key(permission=None):
                     'code': 'INSUFFICIENT_PERMISSIONS'
                 }), 403
 
-            return f(*args, **kwargs)
+            limiter = get_rate_limit_service()
+            limit = limiter.limit_for(key_info, budget)
+            if not config.API_RATE_LIMIT_ENABLED or not limit:
+                return f(*args, **kwargs)
+
+            result = limiter.check(service._hash_key(api_key), budget, limit)
+            headers = rate_limit_headers(result)
+            if not result['allowed']:
+                from services.metrics_service import API_RATE_LIMITED
+                API_RATE_LIMITED.inc(budget=budget)
+                response = jsonify({
+                    'error': f'請求過於頻繁，請於 {result["retry_after"]} 秒後再試',
+                    'code': 'RATE_LIMITED',
+                    'retry_after': result['retry_after']
+                })
+                response.status_code = 429
+            else:
+                response = make_response(f(*args, **kwargs))
+            response.headers.update(headers)
+            return response
         return decorated_function
     return decorator
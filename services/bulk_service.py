@@ -0,0 +1,306 @@
+"""
+Bulk Service - 大量生成工作（JSONL 提示詞清單）
+
+一份工作可包含數千行提示詞，每行一個 JSON 物件（與專案根目錄 requests.jsonl 相同的逐行格式）：
+
+    {"id": "cat-01", "prompt": "a cat sitting on a window", "seed": 42}
+
+- 工作與每一行都存在 metadata.db（bulk_jobs / bulk_items），不會一次塞進佇列：
+  每個工作最多 BULK_WINDOW 筆在生成佇列中，完成一筆補一筆，其他租戶仍可公平排程
+- 每筆完成時依完成順序編號（seq），串流端以 seq 為游標讀取，可斷線後從 after=<seq> 接續
+- 佇列啟動時 resume() 重新排入遺失的項目（記憶體佇列重啟後清空），已完成的項目不會重做
+"""
+import json
+import time
+import uuid
+import threading
+from datetime import datetime
+import config
+from services.metadata_store import get_metadata_store
+from services.fair_scheduler import WEB_TENANT
+
+# 每行可指定的生成參數
+SPEC_FIELDS = ('prompt', 'negative_prompt', 'width', 'height', 'seed', 'model')
+
+# 串流端輪詢資料庫的間隔（秒）
+STREAM_POLL_INTERVAL = 0.5
+
+
+def parse_spec(line, defaults=None):
+    """解析一行 JSONL，回傳 (item_id, spec)；格式錯誤時拋出 ValueError"""
+    try:
+        data = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f'不是有效的 JSON（{e}）')
+    if not isinstance(data, dict):
+        raise ValueError('每行必須是 JSON 物件')
+
+    spec = dict(defaults or {})
+    spec.update({k: data[k] for k in SPEC_FIELDS if data.get(k) is not None})
+    if not isinstance(spec.get('prompt'), str) or not spec['prompt'].strip():
+        raise ValueError('缺少 prompt')
+    spec['prompt'] = spec['prompt'].strip()
+    for key in ('width', 'height'):
+        if key in spec:
+            try:
+                spec[key] = int(spec[key])
+            except (TypeError, ValueError):
+                raise ValueError(f'{key} 必須是整數')
+    item_id = data.get('id', data.get('request_id'))
+    return (str(item_id) if item_id is not None else None), spec
+
+
+class BulkJobService:
+    """大量生成工作服務"""
+
+    def __init__(self):
+        self.store = get_metadata_store()
+
+    # ── 建立 / 查詢 ────────────────────────────────────────────
+    def create_job(self, lines, tenant=None, weight=1.0, priority=0, defaults=None):
+        """建立工作並排入第一批項目
+
+        Args:
+            lines: JSONL 逐行內容（str 或 bytes 的可疊代物件，例如請求串流）
+            tenant: 租戶（API 金鑰 id；None = 網頁介面）
+            weight: 公平排程權重
+            priority: 佇列優先順序
+            defaults: 每行未指定時套用的參數（model、width 等）
+
+        Raises:
+            ValueError: 內容格式錯誤或超過 BULK_MAX_ITEMS
+        """
+        job_id = uuid.uuid4().hex[:12]
+        rows, errors = [], []
+        # 先在記憶體中解析完畢，不在上傳期間持有資料庫寫入鎖
+        for lineno, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                item_id, spec = parse_spec(line, defaults)
+            except ValueError as e:
+                errors.append(f'第 {lineno} 行: {e}')
+                if len(errors) >= 10:
+                    break
+                continue
+            if len(rows) >= config.BULK_MAX_ITEMS:
+                raise ValueError(f'單一工作最多 {config.BULK_MAX_ITEMS} 筆提示詞')
+            rows.append((job_id, len(rows), item_id, json.dumps(spec, ensure_ascii=False)))
+        if errors:
+            raise ValueError('；'.join(errors))
+        if not rows:
+            raise ValueError('沒有任何提示詞')
+
+        with self.store.transaction() as conn:
+            conn.execute(
+                "INSERT INTO bulk_jobs (id, tenant, status, total, priority, weight, created_at) "
+                "VALUES (?, ?, 'running', ?, ?, ?, ?)",
+                (job_id, tenant or WEB_TENANT, len(rows), priority, weight or 1.0,
+                 datetime.now().isoformat()))
+            conn.executemany(
+                "INSERT INTO bulk_items (job_id, idx, item_id, spec) VALUES (?, ?, ?, ?)", rows)
+        print(f"[Bulk] 工作已建立: {job_id} ({len(rows)} 筆, {tenant or WEB_TENANT})")
+        self.fill(job_id)
+        return self.get_job(job_id)
+
+    @staticmethod
+    def _row_to_job(row):
+        job = dict(row)
+        # 已取消的工作不會再處理任何項目
+        job['pending'] = 0 if job['status'] == 'cancelled' else \
+            job['total'] - job['completed'] - job['failed'] - job['cancelled']
+        return job
+
+    def get_job(self, job_id):
+        row = self.store.execute("SELECT * FROM bulk_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list_jobs(self, tenant=None, limit=20):
+        """最近的工作（新的在前）"""
+        if tenant is None:
+            rows = self.store.execute(
+                "SELECT * FROM bulk_jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        else:
+            rows = self.store.execute(
+                "SELECT * FROM bulk_jobs WHERE tenant = ? ORDER BY created_at DESC LIMIT ?",
+                (tenant, limit)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def items_since(self, job_id, after=0, limit=500):
+        """完成順序 seq > after 的項目"""
+        rows = self.store.execute(
+            "SELECT idx, item_id, status, seq, result, error FROM bulk_items "
+            "WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?", (job_id, after, limit)).fetchall()
+        return [{
+            'index': row['idx'],
+            'id': row['item_id'],
+            'status': row['status'],
+            'seq': row['seq'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+        } for row in rows]
+
+    def stream(self, job_id, after=0):
+        """依完成順序逐筆產生進度事件，工作結束後以 type=job 結尾
+
+        事件: {"type": "item", ...} / {"type": "progress", ...}（有新項目或閒置心跳）/ {"type": "job", ...}
+        """
+        last_beat = time.monotonic()
+        while True:
+            items = self.items_since(job_id, after)
+            for item in items:
+                after = item['seq']
+                yield {'type': 'item', 'job_id': job_id, **item}
+            job = self.get_job(job_id)
+            if job is None:
+                return
+            if not items and job['status'] != 'running':
+                yield {'type': 'job', **job}
+                return
+            now = time.monotonic()
+            if items or now - last_beat >= config.BULK_STREAM_HEARTBEAT:
+                last_beat = now
+                yield {'type': 'progress', 'job_id': job_id, 'total': job['total'],
+                       'completed': job['completed'], 'failed': job['failed'], 'cancelled': job['cancelled'],
+                       'pending': job['pending']}
+            if not items:
+                time.sleep(STREAM_POLL_INTERVAL)
+
+    # ── 排入佇列 ───────────────────────────────────────────────
+    def fill(self, job_id):
+        """補滿工作在佇列中的項目（最多 BULK_WINDOW 筆）
+
+        Returns:
+            int: 本次排入的筆數
+        """
+        from services.queue_service import get_queue_service
+        with self.store.transaction() as conn:
+            job = conn.execute("SELECT * FROM bulk_jobs WHERE id = ?", (job_id,)).fetchone()
+            if not job or job['status'] != 'running':
+                return 0
+            inflight = conn.execute(
+                "SELECT COUNT(*) FROM bulk_items WHERE job_id = ? AND status = 'queued'", (job_id,)).fetchone()[0]
+            rows = conn.execute(
+                "SELECT idx, spec FROM bulk_items WHERE job_id = ? AND status = 'pending' ORDER BY idx LIMIT ?",
+                (job_id, max(0, config.BULK_WINDOW - inflight))).fetchall()
+            conn.executemany(
+                "UPDATE bulk_items SET status = 'queued', task_id = NULL WHERE job_id = ? AND idx = ?",
+                [(job_id, row['idx']) for row in rows])
+
+        queue = get_queue_service()
+        submitted = 0
+        for row in rows:
+            params = json.loads(row['spec'])
+            params['bulk'] = {'job_id': job_id, 'index': row['idx']}
+            try:
+                # 工作自身以 BULK_WINDOW 限制佇列中的筆數，不套用租戶待處理上限
+                task = queue.submit('generate', params, job['priority'], tenant=job['tenant'],
+                                    weight=job['weight'])
+            except Exception as e:
+                print(f"[Bulk] 工作 {job_id} 第 {row['idx']} 筆排入失敗: {e}")
+                with self.store.transaction() as conn:
+                    conn.execute(
+                        "UPDATE bulk_items SET status = 'pending' WHERE job_id = ? AND idx >= ? AND status = 'queued' "
+                        "AND task_id IS NULL", (job_id, row['idx']))
+                break
+            with self.store.transaction() as conn:
+                conn.execute("UPDATE bulk_items SET task_id = ? WHERE job_id = ? AND idx = ?",
+                             (task['id'], job_id, row['idx']))
+            submitted += 1
+        return submitted
+
+    def on_task_finished(self, task):
+        """佇列任務結束（由處理任務的行程呼叫）：記錄結果並補入下一筆"""
+        bulk = task['params']['bulk']
+        job_id, index = bulk['job_id'], bulk['index']
+        result = task.get('result')
+        completed = task.get('status') == 'completed' and isinstance(result, dict)
+        summary = None
+        if completed:
+            summary = {k: v for k, v in result.items() if k not in ('image', 'prompt', 'timings')}
+            if summary.get('filename'):
+                summary['image_url'] = f"/images/{summary['filename']}"
+            # 圖片已存檔，釋放記憶體佇列中的 base64，數千筆工作不會讓佇列持續變大
+            result.pop('image', None)
+
+        with self.store.transaction() as conn:
+            updated = conn.execute(
+                "UPDATE bulk_items SET status = ?, task_id = ?, result = ?, error = ?, "
+                "seq = (SELECT completed + failed + 1 FROM bulk_jobs WHERE id = ?) "
+                "WHERE job_id = ? AND idx = ? AND status = 'queued'",
+                ('completed' if completed else 'failed', task['id'],
+                 json.dumps(summary, ensure_ascii=False) if summary else None,
+                 None if completed else (task.get('error') or task.get('status')),
+                 job_id, job_id, index)).rowcount
+            if updated:
+                conn.execute(
+                    "UPDATE bulk_jobs SET completed = completed + ?, failed = failed + ? WHERE id = ?",
+                    (int(completed), int(not completed), job_id))
+                conn.execute(
+                    "UPDATE bulk_jobs SET status = 'completed', finished_at = ? "
+                    "WHERE id = ? AND status = 'running' AND completed + failed >= total",
+                    (datetime.now().isoformat(), job_id))
+        self.fill(job_id)
+
+    def cancel_job(self, job_id):
+        """取消工作：未開始的項目不再排入，佇列中的任務一併取消"""
+        from services.queue_service import get_queue_service
+        with self.store.transaction() as conn:
+            updated = conn.execute(
+                "UPDATE bulk_jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'running'",
+                (datetime.now().isoformat(), job_id)).rowcount
+            if not updated:
+                return {'success': False, 'error': '工作不存在或已結束'}
+            task_ids = [row[0] for row in conn.execute(
+                "SELECT task_id FROM bulk_items WHERE job_id = ? AND status = 'queued' AND task_id IS NOT NULL",
+                (job_id,))]
+            cancelled = conn.execute(
+                "UPDATE bulk_items SET status = 'cancelled' WHERE job_id = ? AND status IN ('pending', 'queued')",
+                (job_id,)).rowcount
+            conn.execute("UPDATE bulk_jobs SET cancelled = ? WHERE id = ?", (cancelled, job_id))
+        queue = get_queue_service()
+        for task_id in task_ids:
+            queue.cancel_task(task_id)
+        return {'success': True, 'message': f'已取消工作: {job_id}'}
+
+    # ── 重啟後接續 ─────────────────────────────────────────────
+    def resume(self):
+        """重新排入執行中工作遺失的項目（在持有佇列的行程啟動時呼叫）"""
+        from services.queue_service import get_queue_service
+        queue = get_queue_service()
+        job_ids = [row[0] for row in self.store.execute(
+            "SELECT id FROM bulk_jobs WHERE status = 'running'")]
+        for job_id in job_ids:
+            lost = []
+            for row in self.store.execute(
+                    "SELECT idx, task_id FROM bulk_items WHERE job_id = ? AND status = 'queued'", (job_id,)).fetchall():
+                task = queue.get_task(row['task_id']) if row['task_id'] else None
+                if task and task['status'] in ('pending', 'processing'):
+                    continue
+                if task and (task.get('params') or {}).get('bulk'):
+                    # 任務已結束但結果尚未記錄（例如在記錄前中斷）
+                    self.on_task_finished(task)
+                    continue
+                lost.append((job_id, row['idx']))
+            if lost:
+                with self.store.transaction() as conn:
+                    conn.executemany(
+                        "UPDATE bulk_items SET status = 'pending', task_id = NULL "
+                        "WHERE job_id = ? AND idx = ? AND status = 'queued'", lost)
+            submitted = self.fill(job_id)
+            print(f"[Bulk] 接續工作 {job_id}：重新排入 {len(lost)} 筆，本次排入 {submitted} 筆")
+
+
+# 全域單例
+_bulk_service = None
+_bulk_service_lock = threading.Lock()
+
+
+def get_bulk_service():
+    """取得大量生成工作服務單例"""
+    global _bulk_service
+    if _bulk_service is None:
+        with _bulk_service_lock:
+            if _bulk_service is None:
+                _bulk_service = BulkJobService()
+    return _bulk_service
@@ -0,0 +1,323 @@
+"""
+Embedding Service - 提示詞向量索引（相似提示詞 / 重複生成偵測）
+
+- 向量化：雜湊 n-gram（詞、詞組、字元三元組、中日韓單字與雙字），不需模型與網路
+- 儲存：OUTPUT_PATH/prompt_vectors.f32，float32 矩陣以 numpy.memmap 映射，容量不足時倍增
+- 列號對應存於 metadata.db 的 embedding_rows；search_docs 觸發器將異動寫入
+  embedding_changes，查詢前增量套用，不需掃描全部提示詞
+- 查詢：一次矩陣乘法算出所有餘弦相似度，argpartition 取 top-k
+"""
+import os
+import re
+import zlib
+import threading
+import unicodedata
+import numpy as np
+import config
+from services.metadata_store import get_metadata_store, CJK_RANGES
+from services.search_service import get_search_service
+
+
+EMBEDDING_FILE = os.path.join(config.OUTPUT_PATH, "prompt_vectors.f32")
+EMBEDDING_DIM = 256
+EMBEDDING_SOURCES = ('history', 'library')
+INITIAL_CAPACITY = 1024
+SYNC_BATCH_SIZE = 2000
+
+# 相似度門檻：達到 DUPLICATE_THRESHOLD 視為「生成過幾乎相同的提示詞」
+SIMILAR_THRESHOLD = 0.35
+DUPLICATE_THRESHOLD = 0.9
+
+_TOKEN_RE = re.compile(f'[{CJK_RANGES}]|[^\\W_]+')
+_CJK_RE = re.compile(f'[{CJK_RANGES}]')
+
+# 各類特徵的權重
+_WEIGHT_WORD = 1.0
+_WEIGHT_BIGRAM = 0.7
+_WEIGHT_TRIGRAM = 0.4
+
+
+def _features(text):
+    """切出雜湊特徵與權重"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    tokens = _TOKEN_RE.findall(text)
+    features = []
+    for i, token in enumerate(tokens):
+        features.append(('w:' + token, _WEIGHT_WORD))
+        if i:
+            features.append(('b:' + tokens[i - 1] + ' ' + token, _WEIGHT_BIGRAM))
+        # 字元三元組容忍拼字差異與詞形變化（cat / cats）
+        if len(token) > 3 and not _CJK_RE.match(token):
+            padded = f'<{token}>'
+            features.extend(('c:' + padded[j:j + 3], _WEIGHT_TRIGRAM)
+                            for j in range(len(padded) - 2))
+    return features
+
+
+def embed_text(text, dim=EMBEDDING_DIM):
+    """將提示詞轉為 L2 正規化的雜湊向量（signed feature hashing）"""
+    features = _features(text)
+    vector = np.zeros(dim, dtype=np.float32)
+    if not features:
+        return vector
+    hashes = np.fromiter((zlib.crc32(f.encode('utf-8')) for f, _ in features),
+                         dtype=np.uint32, count=len(features))
+    weights = np.fromiter((w for _, w in features), dtype=np.float32, count=len(features))
+    signs = np.where(hashes & 0x80000000, 1.0, -1.0).astype(np.float32)
+    np.add.at(vector, (hashes % dim).astype(np.intp), signs * weights)
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+class EmbeddingService:
+    """提示詞向量索引服務"""
+
+    def __init__(self, path=None, dim=EMBEDDING_DIM):
+        self.store = get_metadata_store()
+        self.path = path or EMBEDDING_FILE
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._matrix = None
+        self._version = None
+        self._keys = []           # row -> (source, ref_id) 或 None
+        self._rows = {}           # (source, ref_id) -> row
+        self._alive = np.zeros(0, dtype=bool)
+        self._source_codes = np.zeros(0, dtype=np.int8)
+        self._free_rows = []
+        self._next_row = 0
+
+    # ── 矩陣檔案 ───────────────────────────────────────────────
+    def _ensure_capacity(self, rows_needed):
+        """確保矩陣可容納 rows_needed 列，必要時倍增檔案大小並重新映射"""
+        row_bytes = self.dim * 4
+        file_rows = os.path.getsize(self.path) // row_bytes if os.path.exists(self.path) else 0
+        capacity = max(file_rows, INITIAL_CAPACITY)
+        while capacity < rows_needed:
+            capacity *= 2
+
+        if capacity > file_rows:
+            with open(self.path, 'ab') as f:
+                f.truncate(capacity * row_bytes)
+        if self._matrix is None or self._matrix.shape[0] != capacity:
+            if self._matrix is not None:
+                self._matrix.flush()
+            self._matrix = np.memmap(self.path, dtype=np.float32, mode='r+',
+                                     shape=(capacity, self.dim))
+        grow = capacity - len(self._keys)
+        if grow > 0:
+            self._keys.extend([None] * grow)
+            self._alive = np.concatenate([self._alive, np.zeros(grow, dtype=bool)])
+            self._source_codes = np.concatenate([self._source_codes, np.zeros(grow, dtype=np.int8)])
+
+    def _reload(self, conn):
+        """從資料庫重建列號對應（其他行程更新過索引時）"""
+        rows = conn.execute("SELECT row, source, ref_id FROM embedding_rows").fetchall()
+        stored_dim = conn.execute("SELECT value FROM meta WHERE key = 'embedding_dim'").fetchone()
+        needed_bytes = (max((r['row'] for r in rows), default=-1) + 1) * self.dim * 4
+        file_bytes = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if (stored_dim is not None and int(stored_dim['value']) != self.dim) or file_bytes < needed_bytes:
+            # 維度改變或向量檔遺失：清空對應並將所有提示詞排入重建
+            print("[Embedding] 重建提示詞向量索引")
+            conn.execute("DELETE FROM embedding_rows")
+            conn.execute(
+                "INSERT INTO embedding_changes (source, ref_id) SELECT source, ref_id FROM search_docs "
+                f"WHERE source IN ({','.join('?' * len(EMBEDDING_SOURCES))}) ORDER BY docid",
+                EMBEDDING_SOURCES
+            )
+            self._matrix = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            rows = []
+        if stored_dim is None or int(stored_dim['value']) != self.dim:
+            self.store.set_meta(conn, 'embedding_dim', str(self.dim))
+
+        self._keys = []
+        self._rows = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._source_codes = np.zeros(0, dtype=np.int8)
+        self._next_row = max((r['row'] for r in rows), default=-1) + 1
+        self._ensure_capacity(self._next_row)
+        for r in rows:
+            key = (r['source'], r['ref_id'])
+            self._keys[r['row']] = key
+            self._rows[key] = r['row']
+            self._alive[r['row']] = True
+            self._source_codes[r['row']] = EMBEDDING_SOURCES.index(r['source'])
+        used = set(self._rows.values())
+        self._free_rows = [row for row in range(self._next_row - 1, -1, -1) if row not in used]
+
+    def _sync_version(self, conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'embedding_version'").fetchone()
+        version = row['value'] if row else '0'
+        if version != self._version:
+            self._reload(conn)
+            self._version = version
+        return version
+
+    # ── 增量同步 ───────────────────────────────────────────────
+    def _allocate_row(self):
+        if self._free_rows:
+            return self._free_rows.pop()
+        row = self._next_row
+        self._next_row += 1
+        self._ensure_capacity(self._next_row)
+        return row
+
+    def _apply(self, conn, source, ref_id):
+        key = (source, ref_id)
+        doc = conn.execute("SELECT text FROM search_docs WHERE source = ? AND ref_id = ?",
+                           key).fetchone()
+        row = self._rows.get(key)
+        if doc is None:
+            if row is not None:
+                conn.execute("DELETE FROM embedding_rows WHERE row = ?", (row,))
+                self._matrix[row] = 0
+                self._alive[row] = False
+                self._keys[row] = None
+                del self._rows[key]
+                self._free_rows.append(row)
+            return
+        if row is None:
+            row = self._allocate_row()
+            conn.execute("INSERT INTO embedding_rows (row, source, ref_id) VALUES (?, ?, ?)",
+                         (row, source, ref_id))
+            self._keys[row] = key
+            self._rows[key] = row
+            self._alive[row] = True
+            self._source_codes[row] = EMBEDDING_SOURCES.index(source)
+        self._matrix[row] = embed_text(doc['text'], self.dim)
+
+    def refresh(self):
+        """套用尚未處理的異動紀錄；沒有異動時只有兩次索引查詢"""
+        with self._lock:
+            pending = self.store.execute("SELECT 1 FROM embedding_changes LIMIT 1").fetchone()
+            if not pending and self._version is not None and \
+                    self.store.get_meta('embedding_version', '0') == self._version:
+                return 0
+
+            applied = 0
+            while True:
+                try:
+                    with self.store.transaction() as conn:
+                        version = self._sync_version(conn)
+                        changes = conn.execute(
+                            "SELECT id, source, ref_id FROM embedding_changes ORDER BY id LIMIT ?",
+                            (SYNC_BATCH_SIZE,)
+                        ).fetchall()
+                        if not changes:
+                            return applied
+                        for key in dict.fromkeys((c['source'], c['ref_id']) for c in changes):
+                            self._apply(conn, *key)
+                        conn.execute("DELETE FROM embedding_changes WHERE id <= ?", (changes[-1]['id'],))
+                        self._version = str(int(version) + 1)
+                        self.store.set_meta(conn, 'embedding_version', self._version)
+                        # 先寫回向量再提交，其他行程看到新版本時檔案已更新
+                        self._matrix.flush()
+                except BaseException:
+                    # 交易已回滾，記憶體中的對應可能不一致，下次重新載入
+                    self._version = None
+                    raise
+                applied += len(changes)
+
+    # ── 查詢 ───────────────────────────────────────────────────
+    def similar(self, prompt, k=10, sources=None, min_score=SIMILAR_THRESHOLD,
+                exclude_ids=None, distinct=True):
+        """找出與 prompt 最相似的提示詞
+
+        Args:
+            k: 回傳筆數
+            sources: 限制來源（history / library）
+            min_score: 最低餘弦相似度
+            exclude_ids: 排除的 ref_id（例如目前這筆歷史本身）
+            distinct: 相同文字只保留分數最高的一筆，並回傳出現次數
+        """
+        if sources:
+            unknown = set(sources) - set(EMBEDDING_SOURCES)
+            if unknown:
+                raise ValueError(f"未知的來源: {', '.join(sorted(unknown))}")
+        query = embed_text(prompt, self.dim)
+        if not query.any():
+            return []
+
+        self.refresh()
+        with self._lock:
+            n = self._next_row
+            if n == 0:
+                return []
+            scores = self._matrix[:n] @ query
+            mask = self._alive[:n].copy()
+            if sources:
+                codes = [EMBEDDING_SOURCES.index(s) for s in sources]
+                mask &= np.isin(self._source_codes[:n], codes)
+            mask &= scores >= min_score
+            candidates = np.flatnonzero(mask)
+            if not len(candidates):
+                return []
+            # 重複的提示詞很常見，多取一些候選再去重
+            fetch = min(len(candidates), k * 4 + len(exclude_ids or ()))
+            top = candidates[np.argpartition(-scores[candidates], fetch - 1)[:fetch]]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            hits = [(self._keys[row], float(scores[row])) for row in top]
+
+        texts = self._load_texts([key for key, _ in hits])
+        exclude_ids = set(exclude_ids or ())
+        results, seen = [], {}
+        for (source, ref_id), score in hits:
+            text = texts.get((source, ref_id))
+            if text is None or ref_id in exclude_ids:
+                continue
+            if distinct:
+                normalized = ' '.join(text.lower().split())
+                if normalized in seen:
+                    seen[normalized]['occurrences'] += 1
+                    continue
+            result = {'source': source, 'id': ref_id, 'text': text,
+                      'score': round(score, 4), 'occurrences': 1}
+            if distinct:
+                seen[normalized] = result
+            results.append(result)
+        results = results[:k]
+        get_search_service().attach_details(results)
+        return results
+
+    def find_duplicates(self, prompt, k=5, threshold=DUPLICATE_THRESHOLD):
+        """「你之前生成過」：歷史中幾乎相同的提示詞"""
+        return self.similar(prompt, k=k, sources=['history'], min_score=threshold)
+
+    def _load_texts(self, keys):
+        texts = {}
+        for source in {s for s, _ in keys}:
+            ids = [ref_id for s, ref_id in keys if s == source]
+            rows = self.store.execute(
+                f"SELECT ref_id, text FROM search_docs WHERE source = ? "
+                f"AND ref_id IN ({','.join('?' * len(ids))})", [source] + ids
+            ).fetchall()
+            texts.update({(source, row['ref_id']): row['text'] for row in rows})
+        return texts
+
+    def stats(self):
+        self.refresh()
+        with self._lock:
+            return {
+                'vectors': len(self._rows),
+                'capacity': 0 if self._matrix is None else int(self._matrix.shape[0]),
+                'dim': self.dim,
+                'file_bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            }
+
+
+# 全域單例
+_embedding_service = None
+_embedding_service_lock = threading.Lock()
+
+
+def get_embedding_service():
+    """取得向量索引服務單例"""
+    global _embedding_service
+    if _embedding_service is None:
+        with _embedding_service_lock:
+            if _embedding_service is None:
+                _embedding_service = EmbeddingService()
+    return _embedding_service
@@ -0,0 +1,615 @@
+"""
+Export Service - PDF / PPT 匯出流程
+
+- 圖片解碼、依目標 DPI 縮圖與編碼在執行緒池中並行（Pillow 解碼 / 縮放 / 編碼時釋放 GIL），
+  主執行緒只負責排版；同時處理中的圖片數有上限，記憶體不隨圖片數成長
+- PDF：JPEG 以原始位元組嵌入（DCTDecode），reportlab 不再解碼或重新壓縮；
+  PDF_EXPORT_JPEG_QUALITY = None 時改為無損嵌入（仍會縮圖）
+- PDF 串流以二進位寫入，不再經 ASCII85 編碼（省去主執行緒的純 Python 編碼，檔案小約 20%）
+- PPT：尺寸只讀檔頭，圖片縮到投影片顯示大小 × PPT_EXPORT_DPI 後才嵌入，不再放入原始 PNG
+- 中文字體每個行程只搜尋、註冊一次
+- 同步匯出寫入 SpooledTemporaryFile（小檔留在記憶體、大檔自動落地且關閉即刪除），再分塊串流給用戶端
+- 圖片數超過 EXPORT_BACKGROUND_THRESHOLD 時改為背景工作（ExportJobService）：
+  進度記錄在 metadata.db，檔案寫到 OUTPUT_PATH/exports，任一 web worker 都能查詢與下載，逾時自動刪除
+"""
+import os
+import time
+import uuid
+import tempfile
+import threading
+from io import BytesIO
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from reportlab import rl_config
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import inch
+from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from pptx import Presentation
+from pptx.util import Inches, Pt
+from pptx.enum.text import PP_ALIGN
+from pptx.dml.color import RGBColor
+import config
+from services.history_service import get_history_service
+from services.metadata_store import get_metadata_store
+
+# 依序嘗試的中文字體（Windows / Linux / macOS）
+FONT_PATHS = [
+    "C:/Windows/Fonts/msyh.ttc",  # 微軟雅黑
+    "C:/Windows/Fonts/msjh.ttc",  # 微軟正黑體
+    "C:/Windows/Fonts/simsun.ttc",  # 宋體
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    "/usr/share/fonts/truetype/arphic/uming.ttc",
+    "/System/Library/Fonts/Supplemental/Arial Unicode.ttf",
+]
+FONT_NAME = 'ChineseFont'
+
+# 影像與頁面串流直接以二進位寫入（預設 ASCII85 只為了產生純文字 PDF）
+rl_config.useA85 = 0
+
+# 縮圖濾鏡：縮小 1.5～3 倍時 Hamming 與 Lanczos 在列印 / 投影解析度下肉眼難辨，耗時約三分之一
+RESAMPLE = Image.HAMMING
+
+# 輸出超過此大小才寫入磁碟暫存檔
+SPOOL_MAX_MEMORY = 32 * 1024 * 1024
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# 投影片上圖片的最大顯示範圍（16:9 寬屏）
+PPT_SLIDE_WIDTH = Inches(10)
+PPT_SLIDE_HEIGHT = Inches(5.625)
+PPT_MAX_WIDTH = Inches(9)
+PPT_MAX_HEIGHT = Inches(4.5)
+EMU_PER_INCH = Inches(1)
+
+PPT_THEMES = {
+    'dark': (RGBColor(30, 30, 30), RGBColor(255, 255, 255)),
+    'light': (RGBColor(255, 255, 255), RGBColor(0, 0, 0)),
+    'default': (RGBColor(245, 245, 245), RGBColor(50, 50, 50)),
+}
+
+MIMETYPES = {
+    'pdf': 'application/pdf',
+    'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+}
+
+_font_lock = threading.Lock()
+_font_checked = False
+_font_registered = False
+
+
+def register_pdf_font():
+    """註冊中文字體（每個行程只做一次）；回傳是否可用"""
+    global _font_checked, _font_registered
+    if _font_checked:
+        return _font_registered
+    with _font_lock:
+        if not _font_checked:
+            for font_path in FONT_PATHS:
+                if not os.path.exists(font_path):
+                    continue
+                try:
+                    pdfmetrics.registerFont(TTFont(FONT_NAME, font_path))
+                    _font_registered = True
+                    print(f"✓ PDF 字體已註冊: {font_path}")
+                    break
+                except Exception as e:
+                    print(f"⚠ 中文字體註冊失敗 ({font_path}): {e}")
+            _font_checked = True
+    return _font_registered
+
+
+def export_workers():
+    return config.EXPORT_WORKERS or min(8, os.cpu_count() or 1)
+
+
+class _EncodedJPEG(ImageReader):
+    """已縮圖並編碼為 JPEG 的圖片；reportlab 直接嵌入 JPEG 位元組"""
+
+    def getRGBData(self):
+        # drawImage 只以此值計算去重用的摘要，不需要解碼成像素
+        self._dataA = None
+        return self.fp.getvalue()
+
+
+def _flatten(img):
+    """轉為 RGB，透明背景以白色填滿"""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        rgba = img.convert('RGBA')
+        background = Image.new('RGB', rgba.size, 'white')
+        background.paste(rgba, mask=rgba.split()[3])
+        return background
+    return img.convert('RGB') if img.mode not in ('RGB', 'L') else img
+
+
+def prepare_pdf_image(path, max_width, max_height, dpi=None, quality=None):
+    """讀取並縮圖到版面大小 × DPI（在工作執行緒執行）
+
+    Args:
+        path: 圖片路徑
+        max_width, max_height: 版面可用的最大寬高（point）
+        dpi: 嵌入解析度（預設 PDF_EXPORT_DPI）
+        quality: JPEG 品質（預設 PDF_EXPORT_JPEG_QUALITY；None = 無損）
+
+    Returns:
+        tuple: (ImageReader, 原始寬, 原始高)
+    """
+    dpi = dpi or config.PDF_EXPORT_DPI
+    quality = config.PDF_EXPORT_JPEG_QUALITY if quality is None else quality
+    with Image.open(path) as source:
+        width, height = source.size
+        points_per_pixel = min(max_width / width, max_height / height)
+        target = (max(1, round(width * points_per_pixel / 72 * dpi)),
+                  max(1, round(height * points_per_pixel / 72 * dpi)))
+        if source.format == 'JPEG':
+            source.draft('RGB', target)
+        if target[0] < source.size[0]:
+            img = source.resize(target, RESAMPLE, reducing_gap=3.0)
+        else:
+            source.load()
+            img = source.copy()
+
+    img = _flatten(img)
+    if quality:
+        buffered = BytesIO()
+        img.save(buffered, format='JPEG', quality=quality)
+        return _EncodedJPEG(buffered), width, height
+    reader = ImageReader(img)
+    reader.getRGBData()  # 像素轉換也在工作執行緒完成
+    return reader, width, height
+
+
+def _has_alpha(img):
+    return img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+
+
+def prepare_ppt_image(path, dpi=None, quality=None):
+    """只讀檔頭計算投影片上的顯示大小，必要時縮圖並重新編碼（在工作執行緒執行）
+
+    顯示大小沿用原規則：每 100 像素 1 英吋，縮到 9 × 4.5 英吋內且不放大。
+
+    Args:
+        path: 圖片路徑
+        dpi: 嵌入解析度（預設 PPT_EXPORT_DPI）
+        quality: JPEG 品質（預設 PPT_EXPORT_JPEG_QUALITY；None = PNG）
+
+    Returns:
+        tuple: (圖片路徑或 BytesIO, 顯示寬, 顯示高)，寬高單位為 EMU
+    """
+    dpi = dpi or config.PPT_EXPORT_DPI
+    quality = config.PPT_EXPORT_JPEG_QUALITY if quality is None else quality
+    with Image.open(path) as source:
+        width, height = source.size
+        scale = min(PPT_MAX_WIDTH / Inches(width / 100), PPT_MAX_HEIGHT / Inches(height / 100), 1.0)
+        pic_width = Inches(width / 100) * scale
+        pic_height = Inches(height / 100) * scale
+        target = (max(1, round(pic_width / EMU_PER_INCH * dpi)),
+                  max(1, round(pic_height / EMU_PER_INCH * dpi)))
+        if target[0] >= width:
+            # 已不超過目標解析度，直接嵌入原檔
+            return path, pic_width, pic_height
+
+        alpha = _has_alpha(source)
+        if source.format == 'JPEG':
+            source.draft('RGB', target)
+        img = source if source.mode in ('RGB', 'RGBA', 'L') else source.convert('RGBA' if alpha else 'RGB')
+        img = img.resize(target, RESAMPLE, reducing_gap=3.0)
+
+    buffered = BytesIO()
+    if quality and not alpha:
+        img.save(buffered, format='JPEG', quality=quality)
+    else:
+        img.save(buffered, format='PNG')
+    buffered.seek(0)
+    return buffered, pic_width, pic_height
+
+
+def _prepared(prepare, paths, workers, *args):
+    """依原順序產生每張圖片 prepare(path, *args) 的 Future；最多 workers × 2 張同時處理"""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export') as pool:
+        pending = deque()
+        iterator = iter(paths)
+
+        def submit_next():
+            path = next(iterator, None)
+            if path is not None:
+                pending.append(pool.submit(prepare, path, *args))
+
+        for _ in range(workers * 2):
+            submit_next()
+        while pending:
+            future = pending.popleft()
+            submit_next()
+            yield future
+
+
+def _existing_pages(filenames):
+    """(序號, 檔名, 路徑)；不存在的圖片略過"""
+    pages = []
+    for idx, filename in enumerate(filenames, 1):
+        image_path = os.path.join(config.OUTPUT_PATH, filename)
+        if not os.path.exists(image_path):
+            print(f"⚠ 圖片不存在: {filename}")
+            continue
+        pages.append((idx, filename, image_path))
+    return pages
+
+
+def build_pdf(filenames, output, title='圖片集', include_prompts=True, layout='single', workers=None,
+              progress=None):
+    """將圖片排版成 PDF 寫入 output（檔案物件）
+
+    progress(done, skipped) 在每張圖片處理後呼叫（背景工作回報進度用）：done 為已處理張數，
+    skipped 為不存在而略過的檔案數
+
+    Returns:
+        int: 成功加入的圖片數
+    """
+    c = canvas.Canvas(output, pagesize=A4)
+    page_width, page_height = A4
+
+    font_registered = register_pdf_font()
+    regular = FONT_NAME if font_registered else 'Helvetica'
+    bold = FONT_NAME if font_registered else 'Helvetica-Bold'
+
+    # 載入歷史記錄（用於取得 prompts）
+    filename_to_prompt = get_history_service().get_prompts_by_filenames(filenames)
+
+    # 繪製封面頁
+    c.setFont(bold, 28)
+    c.drawCentredString(page_width / 2, page_height - 2 * inch, title)
+
+    c.setFont(regular, 12)
+    c.drawCentredString(page_width / 2, page_height - 2.5 * inch,
+                        f"生成日期: {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+    c.drawCentredString(page_width / 2, page_height - 2.8 * inch,
+                        f"共 {len(filenames)} 張圖片")
+
+    # 繪製分隔線
+    c.line(100, page_height - 3 * inch, page_width - 100, page_height - 3 * inch)
+
+    c.setFont(regular, 10)
+    c.drawCentredString(page_width / 2, 1.5 * inch, "Generated with Z-Image-Turbo Web UI")
+
+    c.showPage()  # 結束封面頁
+
+    # 添加圖片頁
+    margin = 0.5 * inch
+    usable_width = page_width - 2 * margin
+    usable_height = page_height - 2 * margin
+    if layout == 'single':
+        max_img_height = usable_height - 1.5 * inch
+    else:
+        max_img_height = (usable_height - 2 * inch) / 2
+    max_img_width = usable_width
+
+    pages = _existing_pages(filenames)
+    skipped = len(filenames) - len(pages)
+    if progress:
+        progress(0, skipped)
+    added = 0
+    prepared = _prepared(prepare_pdf_image, [page[2] for page in pages], workers or export_workers(),
+                         max_img_width, max_img_height)
+    for done, ((idx, filename, _), future) in enumerate(zip(pages, prepared), 1):
+        try:
+            reader, img_width, img_height = future.result()
+
+            # 計算縮放比例（保持比例）
+            scale = min(max_img_width / img_width, max_img_height / img_height)
+            scaled_width = img_width * scale
+            scaled_height = img_height * scale
+
+            # 繪製標題
+            c.setFont(bold, 14)
+            c.drawString(margin, page_height - margin - 0.3 * inch, f"圖片 {idx}/{len(filenames)}")
+
+            # 繪製提示詞（如果啟用）
+            lines = []
+            if include_prompts and filename in filename_to_prompt:
+                c.setFont(regular, 10)
+                current_line = ""
+                for word in filename_to_prompt[filename].split():
+                    test_line = current_line + " " + word if current_line else word
+                    if c.stringWidth(test_line, regular, 10) < usable_width:
+                        current_line = test_line
+                    else:
+                        if current_line:
+                            lines.append(current_line)
+                        current_line = word
+                if current_line:
+                    lines.append(current_line)
+                lines = lines[:3]
+
+                y_pos = page_height - margin - 0.6 * inch
+                for line in lines:
+                    c.drawString(margin, y_pos, line)
+                    y_pos -= 0.2 * inch
+
+            # 計算圖片位置（置中）
+            img_x = margin + (usable_width - scaled_width) / 2
+            img_y = page_height - margin - 1.2 * inch - scaled_height - (0.2 * inch * len(lines))
+
+            # 繪製圖片
+            c.drawImage(reader, img_x, img_y, width=scaled_width, height=scaled_height,
+                        preserveAspectRatio=True)
+
+            # 繪製檔案名稱（底部）與頁碼
+            c.setFont(regular, 8)
+            c.drawCentredString(page_width / 2, margin / 2, filename)
+            c.drawRightString(page_width - margin, margin / 2, f"第 {idx} 頁")
+
+            c.showPage()
+            added += 1
+
+        except Exception as e:
+            print(f"✗ 處理圖片 {filename} 時出錯: {e}")
+        finally:
+            if progress:
+                progress(done, skipped)
+
+    c.save()
+    return added
+
+
+def build_ppt(filenames, output, title='圖片集', include_prompts=True, theme='default', workers=None,
+              progress=None):
+    """將圖片排版成 PowerPoint 寫入 output（檔案物件或路徑）
+
+    progress(done, skipped) 在每張圖片處理後呼叫（背景工作回報進度用）：done 為已處理張數，
+    skipped 為不存在而略過的檔案數
+
+    Returns:
+        int: 成功加入的圖片數
+    """
+    # 建立簡報
+    prs = Presentation()
+    prs.slide_width = PPT_SLIDE_WIDTH  # 16:9 寬屏
+    prs.slide_height = PPT_SLIDE_HEIGHT
+
+    # 載入歷史記錄
+    filename_to_prompt = get_history_service().get_prompts_by_filenames(filenames)
+
+    # 添加封面頁
+    slide = prs.slides.add_slide(prs.slide_layouts[0])
+    slide.shapes.title.text = title
+    slide.placeholders[1].text = (f"生成日期: {datetime.now().strftime('%Y-%m-%d %H:%M')}\n"
+                                  f"共 {len(filenames)} 張圖片")
+
+    # 設定主題顏色
+    bg_color, text_color = PPT_THEMES.get(theme, PPT_THEMES['default'])
+    blank_slide_layout = prs.slide_layouts[6]
+
+    # 添加圖片投影片
+    pages = _existing_pages(filenames)
+    skipped = len(filenames) - len(pages)
+    if progress:
+        progress(0, skipped)
+    added = 0
+    prepared = _prepared(prepare_ppt_image, [page[2] for page in pages], workers or export_workers())
+    for done, ((idx, filename, _), future) in enumerate(zip(pages, prepared), 1):
+        try:
+            image, pic_width, pic_height = future.result()
+
+            slide = prs.slides.add_slide(blank_slide_layout)
+
+            # 設定背景顏色
+            fill = slide.background.fill
+            fill.solid()
+            fill.fore_color.rgb = bg_color
+
+            left = (prs.slide_width - pic_width) / 2
+            top = Inches(0.5)
+            slide.shapes.add_picture(image, left, top, width=pic_width, height=pic_height)
+
+            # 添加標題文字框
+            if include_prompts and filename in filename_to_prompt:
+                textbox = slide.shapes.add_textbox(Inches(0.5), top + pic_height + Inches(0.1),
+                                                   Inches(9), Inches(0.8))
+                text_frame = textbox.text_frame
+                text_frame.word_wrap = True
+
+                p = text_frame.paragraphs[0]
+                p.text = filename_to_prompt[filename][:200]
+                p.font.size = Pt(12)
+                p.font.color.rgb = text_color
+                p.alignment = PP_ALIGN.CENTER
+
+            # 添加頁碼
+            page_box = slide.shapes.add_textbox(Inches(9), Inches(5.2), Inches(0.8), Inches(0.3))
+            page_p = page_box.text_frame.paragraphs[0]
+            page_p.text = f"{idx}/{len(filenames)}"
+            page_p.font.size = Pt(10)
+            page_p.font.color.rgb = text_color
+            page_p.alignment = PP_ALIGN.RIGHT
+
+            added += 1
+
+        except Exception as e:
+            print(f"✗ 處理圖片 {filename} 時出錯: {e}")
+        finally:
+            if progress:
+                progress(done, skipped)
+
+    prs.save(output)
+    return added
+
+
+BUILDERS = {'pdf': build_pdf, 'pptx': build_ppt}
+
+
+def spooled_output():
+    """匯出用的暫存輸出：小檔在記憶體，大檔落地，關閉即刪除"""
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+
+
+def stream_file(fileobj, chunk_size=STREAM_CHUNK_SIZE):
+    """從頭分塊讀出 fileobj，結束（或用戶端中斷）後關閉"""
+    try:
+        fileobj.seek(0)
+        while True:
+            data = fileobj.read(chunk_size)
+            if not data:
+                break
+            yield data
+    finally:
+        fileobj.close()
+
+
+# ── 背景匯出工作 ───────────────────────────────────────────────
+
+# 進度寫入資料庫的最短間隔（秒）
+PROGRESS_INTERVAL = 0.5
+
+# queued / running 狀態超過此秒數沒有更新，視為處理的行程已結束
+# （同一行程的執行中工作會一併更新排隊工作的時間）
+STALE_SECONDS = 120
+
+
+class ExportJobService:
+    """背景匯出工作服務（每個 web worker 一個執行緒依序處理）"""
+
+    def __init__(self):
+        self.store = get_metadata_store()
+        self.export_dir = os.path.join(config.OUTPUT_PATH, 'exports')
+        # 單一執行緒：每個工作內部已用 export_workers() 個執行緒並行縮圖
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='export-job')
+        self._queued = set()  # 本行程排隊中的工作，執行中的工作更新時一併更新時間
+        self._lock = threading.Lock()
+
+    def create_job(self, kind, filenames, options=None):
+        """建立工作並排入背景執行
+
+        Args:
+            kind: 'pdf' 或 'pptx'
+            filenames: 圖片檔名
+            options: 傳給 build_pdf / build_ppt 的排版參數
+
+        Returns:
+            dict: 工作資訊
+        """
+        if kind not in BUILDERS:
+            raise ValueError(f'不支援的匯出格式: {kind}')
+        self.cleanup()
+
+        job_id = uuid.uuid4().hex[:12]
+        now = datetime.now()
+        download_name = f"export_{now.strftime('%Y%m%d_%H%M%S')}.{kind}"
+        with self.store.transaction() as conn:
+            conn.execute(
+                "INSERT INTO export_jobs (id, kind, status, total, download_name, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, kind, len(filenames), download_name, now.isoformat(), now.isoformat()))
+        with self._lock:
+            self._queued.add(job_id)
+        self._executor.submit(self._run, job_id, kind, list(filenames), dict(options or {}))
+        print(f"[Export] 工作已建立: {job_id} ({kind}, {len(filenames)} 張)")
+        return self.get_job(job_id)
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = datetime.now().isoformat()
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        with self._lock:
+            queued = list(self._queued - {job_id})
+        with self.store.transaction() as conn:
+            conn.execute(f"UPDATE export_jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            if queued:
+                # 排在後面的工作仍在等待，不應被判定為中斷
+                conn.execute(
+                    f"UPDATE export_jobs SET updated_at = ? WHERE status = 'queued' "
+                    f"AND id IN ({', '.join('?' * len(queued))})", (fields['updated_at'], *queued))
+
+    def _run(self, job_id, kind, filenames, options):
+        start = time.perf_counter()
+        path = os.path.join(self.export_dir, f"{job_id}.{kind}")
+        partial = path + '.part'
+        last_update = 0.0
+
+        def progress(done, skipped):
+            nonlocal last_update
+            now = time.monotonic()
+            if done + skipped == len(filenames) or now - last_update >= PROGRESS_INTERVAL:
+                last_update = now
+                self._update(job_id, done=done, skipped=skipped)
+
+        with self._lock:
+            self._queued.discard(job_id)
+        try:
+            self._update(job_id, status='running')
+            os.makedirs(self.export_dir, exist_ok=True)
+            with open(partial, 'wb') as output:
+                added = BUILDERS[kind](filenames, output, progress=progress, **options)
+            os.replace(partial, path)
+            size = os.path.getsize(path)
+            self._update(job_id, status='done', path=path, size=size,
+                         finished_at=datetime.now().isoformat())
+            print(f"[Export] 工作 {job_id} 完成（{added} 張, {size / 2 ** 20:.1f} MB, "
+                  f"{time.perf_counter() - start:.2f}s）")
+        except Exception as e:
+            print(f"[Export] 工作 {job_id} 失敗: {e}")
+            if os.path.exists(partial):
+                os.remove(partial)
+            self._update(job_id, status='failed', error=str(e), finished_at=datetime.now().isoformat())
+
+    def get_job(self, job_id):
+        row = self.store.execute("SELECT * FROM export_jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        if job['status'] in ('queued', 'running') and \
+                time.time() - datetime.fromisoformat(job['updated_at']).timestamp() > STALE_SECONDS:
+            # 排隊 / 處理中的 web worker 已結束（重啟 / 當機），工作不會再有進度
+            with self.store.transaction() as conn:
+                conn.execute(
+                    "UPDATE export_jobs SET status = 'failed', error = ? WHERE id = ? AND updated_at = ?",
+                    ('匯出中斷（處理的行程已結束）', job_id, job['updated_at']))
+            return self.get_job(job_id)
+        job.pop('path')
+        job['progress'] = round((job['done'] + job['skipped']) / job['total'], 3) if job['total'] else 1.0
+        return job
+
+    def get_file(self, job_id):
+        """已完成工作的 (檔案路徑, 下載檔名, MIME 類型)；未完成或已刪除時回傳 None"""
+        row = self.store.execute(
+            "SELECT kind, path, download_name FROM export_jobs WHERE id = ? AND status = 'done'",
+            (job_id,)).fetchone()
+        if not row or not row['path'] or not os.path.exists(row['path']):
+            return None
+        return row['path'], row['download_name'], MIMETYPES[row['kind']]
+
+    def cleanup(self):
+        """刪除超過 EXPORT_JOB_TTL 的工作與檔案
+
+        Returns:
+            int: 刪除的工作數
+        """
+        cutoff = datetime.fromtimestamp(time.time() - config.EXPORT_JOB_TTL).isoformat()
+        with self.store.transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, path FROM export_jobs WHERE created_at < ?", (cutoff,)).fetchall()
+            conn.execute("DELETE FROM export_jobs WHERE created_at < ?", (cutoff,))
+        for row in rows:
+            if row['path'] and os.path.exists(row['path']):
+                try:
+                    os.remove(row['path'])
+                except OSError as e:
+                    print(f"[Export] 無法刪除過期檔案 {row['path']}: {e}")
+        return len(rows)
+
+
+# 全域單例
+_export_job_service = None
+_export_job_service_lock = threading.Lock()
+
+
+def get_export_job_service():
+    """取得背景匯出工作服務單例"""
+    global _export_job_service
+    if _export_job_service is None:
+        with _export_job_service_lock:
+            if _export_job_service is None:
+                _export_job_service = ExportJobService()
+    return _export_job_service
@@ -0,0 +1,77 @@
+"""
+Fair Scheduler - 佇列的租戶公平排程（Deficit Round Robin）
+
+任務先依優先順序分層，同一優先順序內再以加權 DRR 在租戶（API 金鑰 / 網頁介面）之間輪流：
+
+- 每個租戶輪到時額度（deficit）增加 QUANTUM × 權重，額度足夠就處理其最前面的任務並扣除成本
+- 任務成本依像素數換算（預設解析度 = 1），大圖佔用較多額度
+- 沒有待處理任務的租戶額度歸零，不會累積到之後一次插隊
+
+狀態可序列化（to_dict / from_dict），sqlite broker 存在資料庫中讓多個節點共用。
+"""
+import config
+
+QUANTUM = 1.0
+WEB_TENANT = 'web'
+
+
+def task_cost(params):
+    """任務成本：像素數相對於預設解析度的比例（下限 0.25）"""
+    try:
+        width = int(params.get('width') or config.IMAGE_WIDTH)
+        height = int(params.get('height') or config.IMAGE_HEIGHT)
+    except (TypeError, ValueError):
+        return 1.0
+    return max(0.25, width * height / float(config.IMAGE_WIDTH * config.IMAGE_HEIGHT))
+
+
+class DeficitRoundRobin:
+    """加權 DRR 選擇器：pick({tenant: (cost, weight)}) → tenant"""
+
+    def __init__(self, ring=None, current=None, deficit=None):
+        self.ring = list(ring or [])        # 租戶輪替順序（依首次出現）
+        self.current = current              # 目前輪到的租戶
+        self.deficit = dict(deficit or {})
+
+    def _sync(self, heads):
+        """加入新租戶、移除沒有候選任務的租戶（額度歸零）；回傳接續輪到的租戶"""
+        following = None
+        if self.current is not None and self.current not in heads:
+            if self.current in self.ring:
+                index = self.ring.index(self.current)
+                rotated = self.ring[index + 1:] + self.ring[:index]
+                following = next((t for t in rotated if t in heads), None)
+            self.current = None
+        self.ring = [t for t in self.ring if t in heads]
+        self.ring.extend(t for t in heads if t not in self.ring)
+        self.deficit = {t: d for t, d in self.deficit.items() if t in heads}
+        return following
+
+    def _enter(self, tenant, heads):
+        """輪到 tenant：額度增加 QUANTUM × 權重"""
+        self.current = tenant
+        weight = max(heads[tenant][1] or 1.0, 0.01)
+        self.deficit[tenant] = self.deficit.get(tenant, 0.0) + QUANTUM * weight
+
+    def pick(self, heads):
+        """heads: {tenant: (該租戶最前面任務的成本, 權重)}；回傳本次處理的租戶"""
+        if not heads:
+            return None
+        following = self._sync(heads)
+        if self.current is None:
+            self._enter(following or self.ring[0], heads)
+        while True:
+            tenant = self.current
+            cost = heads[tenant][0]
+            if self.deficit[tenant] >= cost:
+                self.deficit[tenant] -= cost
+                return tenant
+            self._enter(self.ring[(self.ring.index(tenant) + 1) % len(self.ring)], heads)
+
+    def to_dict(self):
+        return {'ring': self.ring, 'current': self.current, 'deficit': self.deficit}
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(data.get('ring'), data.get('current'), data.get('deficit'))
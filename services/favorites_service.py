@@ -1,71 +1,80 @@
 """
 Favorites Service - 提示詞收藏管理服務
 """
-import os
-import json
+import random
 from datetime import datetime
-import config
+from services.metadata_store import get_metadata_store
 
 
 class FavoritesService:
     """提示詞收藏管理類"""
-    
+
     def __init__(self):
-        self.favorites_file = os.path.join(config.OUTPUT_PATH, "favorites.json")
-    
+        self.store = get_metadata_store()
+
+    @staticmethod
+    def _row_to_item(row):
+        return {
+            'id': row['id'],
+            'prompt': row['prompt'],
+            'name': row['name'],
+            'created_at': row['created_at'],
+            'use_count': row['use_count']
+        }
+
     def load_favorites(self):
-        """載入收藏清單"""
-        if os.path.exists(self.favorites_file):
-            try:
-                with open(self.favorites_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return []
-        return []
-    
+        """載入收藏清單（最新的在前面）"""
+        rows = self.store.execute(
+            "SELECT * FROM favorites ORDER BY seq DESC"
+        ).fetchall()
+        return [self._row_to_item(row) for row in rows]
+
     def save_favorites(self, favorites):
-        """儲存收藏清單"""
-        try:
-            with open(self.favorites_file, 'w', encoding='utf-8') as f:
-                json.dump(favorites, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"儲存收藏失敗: {e}")
-    
+        """以指定清單取代全部收藏"""
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM favorites")
+            for fav in reversed(favorites):
+                conn.execute(
+                    "INSERT OR IGNORE INTO favorites (id, prompt, name, created_at, use_count) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (fav['id'], fav['prompt'], fav.get('name'),
+                     fav.get('created_at') or datetime.now().isoformat(), fav.get('use_count', 0))
+                )
+
     def add_favorite(self, prompt, name=None):
         """新增收藏"""
-        favorites = self.load_favorites()
-        
-        # 檢查是否已存在
-        for fav in favorites:
-            if fav['prompt'] == prompt:
-                return None  # 已存在
-        
         favorite_item = {
-            'id': f"fav_{int(datetime.now().timestamp() * 1000)}",
+            'id': f"fav_{int(datetime.now().timestamp() * 1000)}_{random.randint(1000, 9999)}",
             'prompt': prompt,
             'name': name or prompt[:30] + ('...' if len(prompt) > 30 else ''),
             'created_at': datetime.now().isoformat(),
             'use_count': 0
         }
-        favorites.insert(0, favorite_item)
-        self.save_favorites(favorites)
+        with self.store.transaction() as conn:
+            # prompt 有唯一索引，已存在時不會插入
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO favorites (id, prompt, name, created_at, use_count) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (favorite_item['id'], favorite_item['prompt'], favorite_item['name'],
+                 favorite_item['created_at'], favorite_item['use_count'])
+            )
+            if cursor.rowcount == 0:
+                return None  # 已存在
         return favorite_item
-    
+
     def remove_favorite(self, favorite_id):
         """移除收藏"""
-        favorites = self.load_favorites()
-        favorites = [f for f in favorites if f['id'] != favorite_id]
-        self.save_favorites(favorites)
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM favorites WHERE id = ?", (favorite_id,))
         return True
-    
+
     def increment_use_count(self, favorite_id):
         """增加使用次數"""
-        favorites = self.load_favorites()
-        for fav in favorites:
-            if fav['id'] == favorite_id:
-                fav['use_count'] = fav.get('use_count', 0) + 1
-                break
-        self.save_favorites(favorites)
+        with self.store.transaction() as conn:
+            conn.execute(
+                "UPDATE favorites SET use_count = use_count + 1 WHERE id = ?",
+                (favorite_id,)
+            )
 
 
 # 全域收藏服務實例
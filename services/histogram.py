@@ -0,0 +1,109 @@
+"""
+Histogram - HDR 風格對數桶直方圖
+以固定相對誤差記錄延遲等正值，記憶體用量與樣本數無關，可合併、可序列化為 JSON
+
+桶寬比例為 (1 + 2 * precision)，以桶中點回報百分位數，相對誤差不超過 precision
+"""
+import math
+
+
+class LogHistogram:
+    """對數桶直方圖（串流 count / sum / min / max / 百分位數）"""
+
+    def __init__(self, precision=0.01, min_value=0.001):
+        self.precision = precision
+        self.min_value = min_value
+        self._log_ratio = math.log1p(2 * precision)
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        if value <= self.min_value:
+            return 0
+        return int(math.log(value / self.min_value) / self._log_ratio) + 1
+
+    def _bucket_value(self, index):
+        if index == 0:
+            return self.min_value
+        lower = self.min_value * math.exp((index - 1) * self._log_ratio)
+        return lower * (1 + self.precision)
+
+    def record(self, value, count=1):
+        """記錄一個樣本"""
+        if value is None or value < 0:
+            return
+        index = self._index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """合併另一個相同精度的直方圖"""
+        for index, n in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + n
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, q):
+        """第 q 百分位數（0-100），沒有樣本時回傳 None"""
+        if not self.count:
+            return None
+        target = max(1, math.ceil(q / 100 * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                if index == 0:
+                    return self.min
+                return min(max(self._bucket_value(index), self.min), self.max)
+        return self.max
+
+    def summary(self, percentiles=(50, 90, 95, 99), digits=2):
+        """常用統計摘要"""
+        def _round(value):
+            return None if value is None else round(value, digits)
+
+        result = {
+            'count': self.count,
+            'avg': _round(self.mean),
+            'min': _round(self.min),
+            'max': _round(self.max),
+        }
+        for q in percentiles:
+            result[f'p{q}'] = _round(self.percentile(q))
+        return result
+
+    def to_dict(self):
+        return {
+            'precision': self.precision,
+            'min_value': self.min_value,
+            'buckets': {str(k): v for k, v in self.buckets.items()},
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        hist = cls(data.get('precision', 0.01), data.get('min_value', 0.001))
+        hist.buckets = {int(k): v for k, v in data.get('buckets', {}).items()}
+        hist.count = data.get('count', 0)
+        hist.total = data.get('total', 0.0)
+        hist.min = data.get('min')
+        hist.max = data.get('max')
+        return hist
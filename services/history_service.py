@@ -3,55 +3,330 @@ History Service - 歷史記錄管理服務
 """
 import os
 import json
+import uuid
+import base64
 from datetime import datetime
-import random
 import config
+from services.metadata_store import get_metadata_store
+
+
+# 單次查詢筆數上限
+MAX_PAGE_SIZE = 500
+
+
+def _encode_cursor(timestamp, seq):
+    raw = json.dumps([timestamp, seq]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, seq = json.loads(base64.urlsafe_b64decode(padded))
+        return str(timestamp), int(seq)
+    except Exception:
+        raise ValueError('無效的分頁游標')
 
 
 class HistoryService:
     """歷史記錄管理類"""
-    
+
     def __init__(self):
         self.output_path = config.OUTPUT_PATH
-        self.history_file = os.path.join(self.output_path, "history.json")
         os.makedirs(self.output_path, exist_ok=True)
-    
+        self.store = get_metadata_store()
+
+    @staticmethod
+    def _row_to_item(row):
+        return {
+            'id': row['id'],
+            'prompt': row['prompt'],
+            'filename': row['filename'],
+            'timestamp': row['timestamp'],
+            'image_url': row['image_url'],
+            'tags': json.loads(row['tags']) if row['tags'] else [],
+            'model': row['model']
+        }
+
     def load_history(self):
-        """載入歷史記錄"""
-        if os.path.exists(self.history_file):
-            try:
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return []
-        return []
-    
+        """載入全部歷史記錄（最新的在前面）
+
+        歷史記錄不再有上限，一般查詢請改用 query_history() 分頁。
+        """
+        rows = self.store.execute(
+            "SELECT * FROM history ORDER BY timestamp DESC, seq DESC"
+        ).fetchall()
+        return [self._row_to_item(row) for row in rows]
+
     def save_history(self, history):
-        """儲存歷史記錄"""
-        try:
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(history, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"儲存歷史記錄失敗: {e}")
-    
-    def add_to_history(self, prompt, filename, tags=None):
+        """以指定清單取代全部歷史記錄"""
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM history")
+            for item in reversed(history):
+                self._insert(conn, item)
+
+    def _insert(self, conn, item):
+        tags = list(dict.fromkeys(item.get('tags') or []))
+        cursor = conn.execute(
+            "INSERT INTO history (id, prompt, filename, timestamp, image_url, tags, model) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (item['id'], item['prompt'], item['filename'], item['timestamp'],
+             item.get('image_url'), json.dumps(tags, ensure_ascii=False), item.get('model'))
+        )
+        conn.executemany(
+            "INSERT INTO history_tags (tag, item_seq) VALUES (?, ?)",
+            [(tag, cursor.lastrowid) for tag in tags]
+        )
+
+    def add_to_history(self, prompt, filename, tags=None, model=None):
         """新增歷史記錄"""
-        history = self.load_history()
         history_item = {
-            'id': f"{int(datetime.now().timestamp() * 1000)}_{random.randint(1000, 9999)}",
+            'id': f"{int(datetime.now().timestamp() * 1000)}_{uuid.uuid4().hex[:8]}",
             'prompt': prompt,
             'filename': filename,
             'timestamp': datetime.now().isoformat(),
             'image_url': f'/images/{filename}',
-            'tags': tags if tags else []
+            'tags': tags if tags else [],
+            'model': model
         }
-        history.insert(0, history_item)  # 最新的在前面
-        # 限制歷史記錄數量 (最多50筆)
-        if len(history) > 50:
-            history = history[:50]
-        self.save_history(history)
+        with self.store.transaction() as conn:
+            self._insert(conn, history_item)
         return history_item
 
+    def count(self):
+        """歷史記錄總筆數（由觸發器維護，O(1)）"""
+        return self.store.get_counter('history_count')
+
+    def query_history(self, limit=50, cursor=None, offset=None, tags=None, prompt=None,
+                      model=None, since=None, until=None, all_tags=None, exclude_tags=None):
+        """分頁查詢歷史記錄（依時間由新到舊）
+
+        Args:
+            limit: 每頁筆數（上限 MAX_PAGE_SIZE）
+            cursor: 上一頁回傳的 next_cursor
+            offset: 舊版位移分頁（有 cursor 時忽略）
+            tags: 標籤清單，符合任一標籤即可 (OR)
+            all_tags: 必須同時具備的標籤 (AND)
+            exclude_tags: 不可具備的標籤 (NOT)
+            prompt: 提示詞子字串
+            model: 模型 ID
+            since / until: ISO 時間範圍（含）
+
+        Returns:
+            dict: {'items': [...], 'next_cursor': str | None, 'has_more': bool}
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        where, params = [], []
+
+        if cursor:
+            cursor_ts, cursor_seq = _decode_cursor(cursor)
+            where.append("(timestamp, seq) < (?, ?)")
+            params.extend([cursor_ts, cursor_seq])
+        if tags or all_tags or exclude_tags:
+            tag_clauses, tag_params = self._tag_clauses(all_tags, tags, exclude_tags, limit)
+            if tag_clauses is None:
+                return {'items': [], 'next_cursor': None, 'has_more': False}
+            where.extend(tag_clauses)
+            params.extend(tag_params)
+        if prompt:
+            escaped = prompt.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            where.append("prompt LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        if model:
+            where.append("model = ?")
+            params.append(model)
+        if since:
+            where.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            where.append("timestamp <= ?")
+            params.append(until)
+
+        sql = "SELECT * FROM history"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY timestamp DESC, seq DESC LIMIT ?"
+        params.append(limit + 1)
+        if offset and not cursor:
+            sql += " OFFSET ?"
+            params.append(int(offset))
+
+        rows = self.store.execute(sql, params).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1]['timestamp'], rows[-1]['seq']) if has_more else None
+        return {
+            'items': [self._row_to_item(row) for row in rows],
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        }
+
+    def _tag_clauses(self, all_tags, any_tags, exclude_tags, limit):
+        """依標籤計數選擇較便宜的查詢計畫，回傳 (WHERE 子句清單, params)
+
+        - 集合計畫：倒排索引交集 / 聯集 / 差集，成本約為相關標籤的記錄數總和
+        - 掃描計畫：沿時間索引由新到舊逐筆以 EXISTS 檢查，取滿一頁即停止，
+          成本約為 limit × 總筆數 / 預估符合筆數
+        標籤越稀有越適合集合計畫，越常見越適合掃描計畫。
+        條件必定不成立時回傳 (None, None)。
+        """
+        all_tags = list(dict.fromkeys(all_tags or []))
+        any_tags = list(dict.fromkeys(any_tags or []))
+        exclude_tags = list(dict.fromkeys(exclude_tags or []))
+
+        if all_tags or any_tags:
+            counts = self.get_counts_for_tags(all_tags + any_tags + exclude_tags)
+            if all_tags:
+                estimated = min(counts.get(tag, 0) for tag in all_tags)
+            else:
+                estimated = sum(counts.get(tag, 0) for tag in any_tags)
+            if estimated == 0:
+                return None, None
+            set_cost = sum(counts.get(tag, 0) for tag in all_tags + any_tags + exclude_tags)
+            probes = len(all_tags) + (1 if any_tags else 0) + (1 if exclude_tags else 0)
+            scan_cost = (limit + 1) * self.count() / estimated * probes
+            if set_cost <= scan_cost:
+                compound, params = self._tag_compound(all_tags, any_tags, exclude_tags, counts)
+                return [f"seq IN ({compound})"], params
+
+        clauses, params = [], []
+        exists = "EXISTS (SELECT 1 FROM history_tags t WHERE t.item_seq = history.seq AND t.tag {})"
+        for tag in all_tags:
+            clauses.append(exists.format("= ?"))
+            params.append(tag)
+        if any_tags:
+            clauses.append(exists.format(f"IN ({','.join('?' * len(any_tags))})"))
+            params.extend(any_tags)
+        if exclude_tags:
+            clauses.append("NOT " + exists.format(f"IN ({','.join('?' * len(exclude_tags))})"))
+            params.extend(exclude_tags)
+        return clauses, params
+
+    def _tag_compound(self, all_tags=None, any_tags=None, exclude_tags=None, counts=None):
+        """將 AND / OR / NOT 標籤條件轉為集合運算子查詢
+
+        以 history_tags 倒排索引求解：
+            (tag1 ∩ tag2 ∩ ...) ∩ (any1 ∪ any2 ∪ ...) − (not1 ∪ not2 ∪ ...)
+        每個集合只讀取該標籤的索引範圍，不掃描整個歷史記錄。
+        至少需要一個 AND 或 OR 標籤。
+
+        Returns:
+            (compound_sql, params)；條件必定不成立時回傳 (None, None)
+        """
+        all_tags = list(dict.fromkeys(all_tags or []))
+        any_tags = list(dict.fromkeys(any_tags or []))
+        exclude_tags = list(dict.fromkeys(exclude_tags or []))
+
+        if counts is None:
+            counts = self.get_counts_for_tags(all_tags + any_tags)
+        # AND 條件中任一標籤不存在，或 OR 條件的標籤全都不存在 → 必定無結果
+        if any(counts.get(tag, 0) == 0 for tag in all_tags):
+            return None, None
+        if any_tags and not any(counts.get(tag, 0) for tag in any_tags):
+            return None, None
+
+        parts, params = [], []
+        # 由最稀有的標籤開始交集，中間結果最小
+        for tag in sorted(all_tags, key=lambda t: counts[t]):
+            parts.append("SELECT item_seq FROM history_tags WHERE tag = ?")
+            params.append(tag)
+        if any_tags:
+            placeholders = ','.join('?' * len(any_tags))
+            parts.append(f"SELECT item_seq FROM history_tags WHERE tag IN ({placeholders})")
+            params.extend(any_tags)
+
+        compound = " INTERSECT ".join(parts)
+        if exclude_tags:
+            placeholders = ','.join('?' * len(exclude_tags))
+            compound += f" EXCEPT SELECT item_seq FROM history_tags WHERE tag IN ({placeholders})"
+            params.extend(exclude_tags)
+        return compound, params
+
+    def count_tag_matches(self, all_tags=None, any_tags=None, exclude_tags=None):
+        """符合標籤條件的記錄數（只用集合運算，不掃描歷史記錄）"""
+        if not (all_tags or any_tags):
+            if not exclude_tags:
+                return self.count()
+            excluded = self.store.execute(
+                f"SELECT COUNT(DISTINCT item_seq) FROM history_tags "
+                f"WHERE tag IN ({','.join('?' * len(exclude_tags))})",
+                list(exclude_tags)
+            ).fetchone()[0]
+            return self.count() - excluded
+        compound, params = self._tag_compound(all_tags, any_tags, exclude_tags)
+        if compound is None:
+            return 0
+        return self.store.execute(f"SELECT COUNT(*) FROM ({compound})", params).fetchone()[0]
+
+    def get_counts_for_tags(self, tags):
+        """查詢指定標籤的使用次數"""
+        if not tags:
+            return {}
+        rows = self.store.execute(
+            f"SELECT tag, count FROM tag_counts WHERE tag IN ({','.join('?' * len(tags))})",
+            list(tags)
+        ).fetchall()
+        return {row['tag']: row['count'] for row in rows}
+
+    def get_tag_counts(self, limit=None):
+        """各標籤的使用次數（依次數排序，由觸發器增量維護）"""
+        sql = "SELECT tag, count FROM tag_counts ORDER BY count DESC, tag"
+        params = []
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        rows = self.store.execute(sql, params).fetchall()
+        return [(row['tag'], row['count']) for row in rows]
+
+    def clear_history(self):
+        """清除所有歷史記錄"""
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM history")
+
+    def remove_by_filenames(self, filenames):
+        """移除指定檔案的歷史記錄，回傳移除筆數"""
+        with self.store.transaction() as conn:
+            cursor = conn.executemany(
+                "DELETE FROM history WHERE filename = ?",
+                [(fn,) for fn in filenames]
+            )
+            return cursor.rowcount
+
+    def update_tags(self, item_id, tags):
+        """更新單筆記錄的標籤，找不到記錄時回傳 False"""
+        tags = list(dict.fromkeys(tags or []))
+        with self.store.transaction() as conn:
+            row = conn.execute("SELECT seq FROM history WHERE id = ?", (item_id,)).fetchone()
+            if row is None:
+                return False
+            conn.execute(
+                "UPDATE history SET tags = ? WHERE seq = ?",
+                (json.dumps(tags, ensure_ascii=False), row['seq'])
+            )
+            conn.execute("DELETE FROM history_tags WHERE item_seq = ?", (row['seq'],))
+            conn.executemany(
+                "INSERT INTO history_tags (tag, item_seq) VALUES (?, ?)",
+                [(tag, row['seq']) for tag in tags]
+            )
+            return True
+
+    def get_prompts_by_filenames(self, filenames):
+        """取得 filename -> prompt 對照（只查詢需要的檔案）"""
+        result = {}
+        filenames = list(filenames)
+        # SQLite 參數上限，分批查詢
+        for start in range(0, len(filenames), 500):
+            chunk = filenames[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.store.execute(
+                f"SELECT filename, prompt FROM history WHERE filename IN ({placeholders}) "
+                "ORDER BY seq",
+                chunk
+            ).fetchall()
+            for row in rows:
+                result[row['filename']] = row['prompt']
+        return result
+
 
 # 全域歷史記錄服務實例
 _history_service = None
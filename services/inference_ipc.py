@@ -0,0 +1,377 @@
+"""
+Inference IPC - web worker 與推論行程之間的本機 IPC
+
+生產模式（serve.py）下只有一個推論行程持有 ModelRegistry 與 QueueService，
+web worker 透過 multiprocessing.connection（本機 TCP + authkey）呼叫：
+
+- 推論行程：InferenceServer 接受連線，每條連線一個執行緒，
+  只開放白名單內的方法；佔用 GPU 的呼叫與佇列處理器共用 ModelRegistry.gpu_lock 序列化
+- web worker：get_model_registry() / get_queue_service() 回傳 RemoteModelRegistry /
+  RemoteQueueService，介面與原物件相同，路由不需修改
+- 每個執行緒保留一條連線重複使用，斷線時自動重連一次
+
+是否為遠端模式由環境變數 ZIMAGE_INFERENCE_ADDRESS（host:port）與
+ZIMAGE_INFERENCE_AUTHKEY 決定，推論行程本身不會進入遠端模式。
+"""
+import os
+import threading
+from types import SimpleNamespace
+from multiprocessing.connection import Listener, Client
+
+INFERENCE_ADDRESS_ENV = 'ZIMAGE_INFERENCE_ADDRESS'
+INFERENCE_AUTHKEY_ENV = 'ZIMAGE_INFERENCE_AUTHKEY'
+
+# 對應回用戶端的例外型別，其餘一律以 RuntimeError 拋出
+_EXCEPTIONS = {e.__name__: e for e in (ValueError, KeyError, TypeError, RuntimeError,
+                                       NotImplementedError, FileNotFoundError)}
+
+
+def _remote_exception(name, message, ipc_args=None):
+    """重建推論行程拋出的例外；帶 ipc_args 的自訂例外以原參數重建"""
+    if name == 'QueueLimitError' and ipc_args:
+        from services.queue_service import QueueLimitError
+        return QueueLimitError(*ipc_args)
+    return _EXCEPTIONS.get(name, RuntimeError)(message)
+
+_serving = False
+
+
+def remote_address():
+    """回傳 (host, port)，未設定時為 None"""
+    value = os.environ.get(INFERENCE_ADDRESS_ENV)
+    if not value:
+        return None
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def is_remote():
+    """目前行程是否應透過 IPC 使用推論行程"""
+    return not _serving and remote_address() is not None
+
+
+def _authkey():
+    return os.environ.get(INFERENCE_AUTHKEY_ENV, '').encode('utf-8')
+
+
+# ── 推論行程端 ────────────────────────────────────────────────
+class _RegistryHandler:
+    """ModelRegistry 對外開放的操作"""
+
+    # 直接使用 pipeline 的操作在此加鎖；生成與切換模型由 ModelRegistry 自行持有 gpu_lock
+    # （只鎖本地模型），雲端生成不與本地 GPU 工作互斥
+    GPU_METHODS = {'run_pipeline', 'register_custom_model', 'remove_custom_model'}
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def state(self):
+        registry = self.registry
+        return {
+            'active_model_id': registry.active_model_id,
+            'has_pipeline': registry.active_pipeline is not None,
+            'is_loading': registry.is_loading,
+            'loading_model_name': registry.loading_model_name,
+        }
+
+    def list_models(self):
+        return self.registry.list_models()
+
+    def get_model_info(self, model_id):
+        return self.registry.get_model_info(model_id)
+
+    def get_active_model(self):
+        return self.registry.get_active_model()
+
+    def switch_model(self, model_id):
+        return self.registry.switch_model(model_id)
+
+    def register_custom_model(self, model_config):
+        return self.registry.register_custom_model(model_config)
+
+    def remove_custom_model(self, model_id):
+        return self.registry.remove_custom_model(model_id)
+
+    def reload_api_keys(self):
+        return self.registry.reload_api_keys()
+
+    def edit_photo(self, **kwargs):
+        return self.registry.edit_photo(**kwargs)
+
+    def generate(self, prompt, width, height, seed=None, negative_prompt=None, with_timings=False, **kwargs):
+        from providers.base import StageTimings
+        timings = StageTimings() if with_timings else None
+        image, used_seed = self.registry.generate(prompt, width, height, seed, negative_prompt,
+                                                  timings=timings, **kwargs)
+        return image, used_seed, dict(timings or {})
+
+    def generate_b64(self, prompt, width, height, seed=None, negative_prompt=None, with_timings=False,
+                     **kwargs):
+        from providers.base import StageTimings
+        timings = StageTimings() if with_timings else None
+        result = self.registry.generate_b64(prompt, width, height, seed, negative_prompt,
+                                            timings=timings, **kwargs)
+        result.pop('pil_image', None)
+        return result, dict(timings or {})
+
+    def generate_many(self, requests, concurrency=None):
+        return self.registry.generate_many(requests, concurrency)
+
+    def cloud_waits(self):
+        return self.registry.cloud_waits()
+
+    def run_pipeline(self, kwargs, seed=None):
+        """直接呼叫目前 pipeline（img2img 路由使用），generator 以種子在推論行程重建"""
+        import torch
+        pipeline = self.registry.active_pipeline
+        if pipeline is None:
+            raise RuntimeError('尚未載入模型')
+        if seed is not None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            kwargs['generator'] = torch.Generator(device=device).manual_seed(seed)
+        return list(pipeline(**kwargs).images)
+
+
+class _QueueHandler:
+    """QueueService 對外開放的操作"""
+
+    METHODS = ('submit', 'get_task', 'cancel_task', 'get_queue_status', 'get_recent_tasks',
+               'clear_completed', 'webhook_status', 'lane_depth')
+
+    def __init__(self, queue):
+        for name in self.METHODS:
+            setattr(self, name, getattr(queue, name))
+
+
+class _MetricsHandler:
+    """推論行程的指標（佇列、模型載入、雲端呼叫、GPU 記憶體都記錄在此行程）"""
+
+    def snapshot(self):
+        from services.metrics_service import get_metrics_registry
+        return get_metrics_registry().snapshot()
+
+
+class InferenceServer:
+    """推論行程的 IPC 伺服器"""
+
+    def __init__(self, address, authkey):
+        global _serving
+        _serving = True
+        from services.model_registry import get_model_registry
+        from services.queue_service import get_queue_service
+
+        registry = get_model_registry()
+        self.handlers = {
+            'registry': _RegistryHandler(registry),
+            'queue': _QueueHandler(get_queue_service()),
+            'metrics': _MetricsHandler(),
+        }
+        # 與佇列處理器共用同一把鎖
+        self.gpu_lock = registry.gpu_lock
+        self.listener = Listener(address, authkey=authkey)
+
+    def serve_forever(self):
+        print(f"[Inference] IPC 伺服器已啟動: {self.listener.address}")
+        while True:
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                # 認證失敗等個別連線錯誤不影響伺服器
+                print(f"[Inference] 拒絕連線: {e}")
+                continue
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _dispatch(self, target, method, args, kwargs):
+        handler = self.handlers.get(target)
+        if handler is None or method.startswith('_') or not hasattr(handler, method):
+            raise ValueError(f"不支援的操作: {target}.{method}")
+        fn = getattr(handler, method)
+        if target == 'registry' and method in _RegistryHandler.GPU_METHODS:
+            with self.gpu_lock:
+                return fn(*args, **kwargs)
+        return fn(*args, **kwargs)
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    target, method, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = ('ok', self._dispatch(target, method, args, kwargs))
+                except Exception as e:
+                    reply = ('error', type(e).__name__, str(e), getattr(e, 'ipc_args', None))
+                try:
+                    conn.send(reply)
+                except OSError:
+                    return
+                except Exception as e:
+                    # 回傳值無法序列化（PicklingError、TypeError、AttributeError 等）時回報錯誤；
+                    # 序列化在寫入前完成，連線仍可繼續使用
+                    try:
+                        conn.send(('error', 'RuntimeError', f"無法回傳結果: {type(e).__name__}: {e}"))
+                    except Exception:
+                        return
+
+
+# ── web worker 端 ─────────────────────────────────────────────
+class InferenceClient:
+    """每個執行緒一條連線的 IPC 用戶端"""
+
+    def __init__(self, address=None, authkey=None):
+        self.address = address or remote_address()
+        self.authkey = authkey if authkey is not None else _authkey()
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = Client(self.address, authkey=self.authkey)
+        return conn
+
+    def _drop(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def call(self, target, method, *args, **kwargs):
+        message = (target, method, args, kwargs)
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send(message)
+                reply = conn.recv()
+                break
+            except (EOFError, ConnectionError, OSError) as e:
+                self._drop()
+                if attempt:
+                    raise RuntimeError(f"無法連線推論行程 {self.address}: {e}")
+        if reply[0] == 'ok':
+            return reply[1]
+        raise _remote_exception(*reply[1:])
+
+
+class RemotePipeline:
+    """代替 registry.active_pipeline，呼叫時轉送到推論行程"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __call__(self, **kwargs):
+        generator = kwargs.pop('generator', None)
+        seed = generator.initial_seed() if generator is not None else None
+        images = self._client.call('registry', 'run_pipeline', kwargs, seed)
+        return SimpleNamespace(images=images)
+
+
+class RemoteModelRegistry:
+    """與 ModelRegistry 相同介面的遠端代理"""
+
+    def __init__(self, client=None):
+        self._client = client or InferenceClient()
+
+    def _call(self, method, *args, **kwargs):
+        return self._client.call('registry', method, *args, **kwargs)
+
+    @property
+    def active_model_id(self):
+        return self._call('state')['active_model_id']
+
+    @property
+    def _active_model_id(self):
+        return self.active_model_id
+
+    @property
+    def active_pipeline(self):
+        return RemotePipeline(self._client) if self._call('state')['has_pipeline'] else None
+
+    @property
+    def is_loading(self):
+        return self._call('state')['is_loading']
+
+    @property
+    def loading_model_name(self):
+        return self._call('state')['loading_model_name']
+
+    @property
+    def models(self):
+        return {m['id']: m for m in self.list_models()}
+
+    def list_models(self):
+        return self._call('list_models')
+
+    def get_model_info(self, model_id):
+        return self._call('get_model_info', model_id)
+
+    def get_active_model(self):
+        return self._call('get_active_model')
+
+    def switch_model(self, model_id):
+        return self._call('switch_model', model_id)
+
+    def register_custom_model(self, model_config):
+        return self._call('register_custom_model', model_config)
+
+    def remove_custom_model(self, model_id):
+        return self._call('remove_custom_model', model_id)
+
+    def reload_api_keys(self):
+        return self._call('reload_api_keys')
+
+    def edit_photo(self, **kwargs):
+        return self._call('edit_photo', **kwargs)
+
+    def generate(self, prompt, width, height, seed=None, negative_prompt=None, **kwargs):
+        timings = kwargs.pop('timings', None)
+        image, used_seed, remote_timings = self._call(
+            'generate', prompt, width, height, seed, negative_prompt,
+            with_timings=timings is not None, **kwargs)
+        for stage, seconds in remote_timings.items():
+            timings.add(stage, seconds)
+        return image, used_seed
+
+    def generate_many(self, requests, concurrency=None):
+        return self._call('generate_many', requests, concurrency)
+
+    def cloud_waits(self):
+        return self._call('cloud_waits')
+
+    def generate_b64(self, prompt, width, height, seed=None, negative_prompt=None, **kwargs):
+        timings = kwargs.pop('timings', None)
+        result, remote_timings = self._call(
+            'generate_b64', prompt, width, height, seed, negative_prompt,
+            with_timings=timings is not None, **kwargs)
+        for stage, seconds in remote_timings.items():
+            timings.add(stage, seconds)
+        return result
+
+
+class RemoteQueueService:
+    """與 QueueService 相同介面的遠端代理（佇列與處理器在推論行程）"""
+
+    def __init__(self, client=None):
+        self._client = client or InferenceClient()
+
+    def __getattr__(self, name):
+        if name not in _QueueHandler.METHODS:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            return self._client.call('queue', name, *args, **kwargs)
+        return call
+
+
+_metrics_client = None
+
+
+def inference_metrics():
+    """推論行程的指標 snapshot()（web worker 合併到 /metrics）"""
+    global _metrics_client
+    if _metrics_client is None:
+        _metrics_client = InferenceClient()
+    return _metrics_client.call('metrics', 'snapshot')
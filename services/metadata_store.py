@@ -0,0 +1,454 @@
+"""
+Metadata Store - 嵌入式 SQLite 中繼資料儲存
+集中保存歷史記錄、收藏與統計事件，取代每次異動都整檔重寫的 JSON 檔案
+
+- 單一資料庫檔案，WAL 模式，讀寫互不阻塞
+- 每個執行緒各自持有連線，寫入以 BEGIN IMMEDIATE 交易序列化
+- Schema 以 PRAGMA user_version 逐版升級
+- 首次啟動時一次性匯入舊版 history.json / favorites.json / analytics.json
+- 提示詞全文索引（FTS5），歷史與收藏由觸發器同步
+"""
+import os
+import re
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import config
+
+
+METADATA_DB_FILE = os.path.join(config.OUTPUT_PATH, "metadata.db")
+
+# 舊版 JSON 檔案（只在首次遷移時讀取）
+LEGACY_HISTORY_FILE = os.path.join(config.OUTPUT_PATH, "history.json")
+LEGACY_FAVORITES_FILE = os.path.join(config.OUTPUT_PATH, "favorites.json")
+LEGACY_ANALYTICS_FILE = os.path.join(config.OUTPUT_PATH, "analytics.json")
+
+# 中日韓文字沒有空白分詞，索引前在每個字前後補空白，讓 unicode61 以單字為詞元
+CJK_RANGES = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af\uff66-\uff9f'
+_CJK_CHAR_RE = re.compile(f'([{CJK_RANGES}])')
+
+
+def segment_text(text):
+    """全文索引前處理：將中日韓字元切成獨立詞元"""
+    if not text:
+        return ''
+    return _CJK_CHAR_RE.sub(r' \1 ', text)
+
+
+# Schema 版本清單：第 N 筆將資料庫從 user_version N 升級到 N+1
+# 只能在尾端追加，不可修改已發佈的版本
+SCHEMA_MIGRATIONS = [
+    (
+        """CREATE TABLE history (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT NOT NULL UNIQUE,
+            prompt TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            image_url TEXT,
+            tags TEXT NOT NULL DEFAULT '[]'
+        )""",
+        "CREATE INDEX idx_history_filename ON history(filename)",
+        "CREATE INDEX idx_history_timestamp ON history(timestamp)",
+        """CREATE TABLE favorites (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT NOT NULL UNIQUE,
+            prompt TEXT NOT NULL UNIQUE,
+            name TEXT,
+            created_at TEXT NOT NULL,
+            use_count INTEGER NOT NULL DEFAULT 0
+        )""",
+        """CREATE TABLE analytics_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            model TEXT,
+            prompt_length INTEGER,
+            prompt_preview TEXT,
+            resolution TEXT,
+            mode TEXT,
+            duration REAL,
+            timestamp TEXT NOT NULL
+        )""",
+        "CREATE INDEX idx_events_type ON analytics_events(type, id)",
+        """CREATE TABLE analytics_daily (
+            day TEXT PRIMARY KEY,
+            generations INTEGER NOT NULL DEFAULT 0,
+            api_calls INTEGER NOT NULL DEFAULT 0
+        )""",
+        "CREATE TABLE counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)",
+        "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)",
+    ),
+    # v2: 無上限歷史記錄 - 模型欄位、標籤正規化表、筆數計數器
+    (
+        "ALTER TABLE history ADD COLUMN model TEXT",
+        "CREATE INDEX idx_history_model ON history(model, timestamp)",
+        """CREATE TABLE history_tags (
+            tag TEXT NOT NULL,
+            item_seq INTEGER NOT NULL REFERENCES history(seq) ON DELETE CASCADE,
+            PRIMARY KEY (tag, item_seq)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX idx_history_tags_item ON history_tags(item_seq)",
+        """INSERT OR IGNORE INTO history_tags (tag, item_seq)
+           SELECT j.value, h.seq FROM history h, json_each(h.tags) j
+           WHERE j.type = 'text'""",
+        """INSERT INTO counters (name, value) SELECT 'history_count', COUNT(*) FROM history
+           WHERE 1 ON CONFLICT(name) DO UPDATE SET value = excluded.value""",
+        """CREATE TRIGGER trg_history_count_insert AFTER INSERT ON history BEGIN
+               UPDATE counters SET value = value + 1 WHERE name = 'history_count';
+           END""",
+        """CREATE TRIGGER trg_history_count_delete AFTER DELETE ON history BEGIN
+               UPDATE counters SET value = value - 1 WHERE name = 'history_count';
+           END""",
+    ),
+    # v3: 標籤倒排索引計數 - history_tags 異動時由觸發器增量維護
+    (
+        """CREATE TABLE tag_counts (
+            tag TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID""",
+        "CREATE INDEX idx_tag_counts_count ON tag_counts(count)",
+        "INSERT INTO tag_counts (tag, count) SELECT tag, COUNT(*) FROM history_tags GROUP BY tag",
+        """CREATE TRIGGER trg_tag_counts_insert AFTER INSERT ON history_tags BEGIN
+               INSERT INTO tag_counts (tag, count) VALUES (NEW.tag, 1)
+               ON CONFLICT(tag) DO UPDATE SET count = count + 1;
+           END""",
+        """CREATE TRIGGER trg_tag_counts_delete AFTER DELETE ON history_tags BEGIN
+               UPDATE tag_counts SET count = count - 1 WHERE tag = OLD.tag;
+               DELETE FROM tag_counts WHERE tag = OLD.tag AND count <= 0;
+           END""",
+    ),
+    # v4: 提示詞全文搜尋 - search_docs 存原文與分詞結果，prompt_fts 為外部內容 FTS5 索引
+    (
+        """CREATE TABLE search_docs (
+            docid INTEGER PRIMARY KEY,
+            source TEXT NOT NULL,
+            ref_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            body TEXT NOT NULL,
+            UNIQUE (source, ref_id)
+        )""",
+        """CREATE VIRTUAL TABLE prompt_fts USING fts5(
+            body, content='search_docs', content_rowid='docid',
+            tokenize='unicode61 remove_diacritics 2'
+        )""",
+        """CREATE TRIGGER trg_search_docs_insert AFTER INSERT ON search_docs BEGIN
+               INSERT INTO prompt_fts (rowid, body) VALUES (NEW.docid, NEW.body);
+           END""",
+        """CREATE TRIGGER trg_search_docs_delete AFTER DELETE ON search_docs BEGIN
+               INSERT INTO prompt_fts (prompt_fts, rowid, body) VALUES ('delete', OLD.docid, OLD.body);
+           END""",
+        """CREATE TRIGGER trg_search_docs_update AFTER UPDATE ON search_docs BEGIN
+               INSERT INTO prompt_fts (prompt_fts, rowid, body) VALUES ('delete', OLD.docid, OLD.body);
+               INSERT INTO prompt_fts (rowid, body) VALUES (NEW.docid, NEW.body);
+           END""",
+        """INSERT INTO search_docs (source, ref_id, text, body)
+           SELECT 'history', id, prompt, zimg_segment(prompt) FROM history ORDER BY seq""",
+        """INSERT INTO search_docs (source, ref_id, text, body)
+           SELECT 'favorite', id, prompt, zimg_segment(COALESCE(name, '') || ' ' || prompt)
+           FROM favorites ORDER BY seq""",
+        """CREATE TRIGGER trg_history_search_insert AFTER INSERT ON history BEGIN
+               INSERT INTO search_docs (source, ref_id, text, body)
+               VALUES ('history', NEW.id, NEW.prompt, zimg_segment(NEW.prompt));
+           END""",
+        """CREATE TRIGGER trg_history_search_delete AFTER DELETE ON history BEGIN
+               DELETE FROM search_docs WHERE source = 'history' AND ref_id = OLD.id;
+           END""",
+        """CREATE TRIGGER trg_favorites_search_insert AFTER INSERT ON favorites BEGIN
+               INSERT INTO search_docs (source, ref_id, text, body)
+               VALUES ('favorite', NEW.id, NEW.prompt,
+                       zimg_segment(COALESCE(NEW.name, '') || ' ' || NEW.prompt));
+           END""",
+        """CREATE TRIGGER trg_favorites_search_delete AFTER DELETE ON favorites BEGIN
+               DELETE FROM search_docs WHERE source = 'favorite' AND ref_id = OLD.id;
+           END""",
+    ),
+    # v5: 提示詞向量索引 - embedding_rows 對應向量矩陣列號，embedding_changes 為待處理的異動紀錄
+    (
+        """CREATE TABLE embedding_rows (
+            row INTEGER PRIMARY KEY,
+            source TEXT NOT NULL,
+            ref_id TEXT NOT NULL,
+            UNIQUE (source, ref_id)
+        )""",
+        """CREATE TABLE embedding_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL,
+            ref_id TEXT NOT NULL
+        )""",
+        """INSERT INTO embedding_changes (source, ref_id)
+           SELECT source, ref_id FROM search_docs WHERE source IN ('history', 'library') ORDER BY docid""",
+        """CREATE TRIGGER trg_embedding_insert AFTER INSERT ON search_docs
+           WHEN NEW.source IN ('history', 'library') BEGIN
+               INSERT INTO embedding_changes (source, ref_id) VALUES (NEW.source, NEW.ref_id);
+           END""",
+        """CREATE TRIGGER trg_embedding_update AFTER UPDATE OF text ON search_docs
+           WHEN NEW.source IN ('history', 'library') BEGIN
+               INSERT INTO embedding_changes (source, ref_id) VALUES (NEW.source, NEW.ref_id);
+           END""",
+        """CREATE TRIGGER trg_embedding_delete AFTER DELETE ON search_docs
+           WHEN OLD.source IN ('history', 'library') BEGIN
+               INSERT INTO embedding_changes (source, ref_id) VALUES (OLD.source, OLD.ref_id);
+           END""",
+    ),
+    # v6: 統計預先彙總的檢查點 - 啟動時載入後只需重播 last_event_id 之後的事件
+    (
+        """CREATE TABLE analytics_checkpoints (
+            name TEXT PRIMARY KEY,
+            last_event_id INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )""",
+    ),
+    # v7: 每次生成的分階段耗時（JSON：階段 → 秒）
+    (
+        "ALTER TABLE analytics_events ADD COLUMN timings TEXT",
+    ),
+    # v8: 大量生成工作 - 每行提示詞一筆 bulk_items，seq 為完成順序（串流進度的游標）
+    (
+        """CREATE TABLE bulk_jobs (
+            id TEXT PRIMARY KEY,
+            tenant TEXT NOT NULL,
+            status TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            priority INTEGER NOT NULL DEFAULT 0,
+            weight REAL NOT NULL DEFAULT 1.0,
+            created_at TEXT NOT NULL,
+            finished_at TEXT
+        )""",
+        """CREATE TABLE bulk_items (
+            job_id TEXT NOT NULL REFERENCES bulk_jobs(id) ON DELETE CASCADE,
+            idx INTEGER NOT NULL,
+            item_id TEXT,
+            spec TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            task_id TEXT,
+            seq INTEGER,
+            result TEXT,
+            error TEXT,
+            PRIMARY KEY (job_id, idx)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX idx_bulk_items_status ON bulk_items(job_id, status, idx)",
+        "CREATE INDEX idx_bulk_items_seq ON bulk_items(job_id, seq)",
+        "CREATE INDEX idx_bulk_jobs_status ON bulk_jobs(status)",
+    ),
+    # v9: 背景匯出工作（PDF / PPT）- 進度與輸出檔路徑，任一 web worker 都能查詢與下載
+    (
+        """CREATE TABLE export_jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0,
+            download_name TEXT NOT NULL,
+            path TEXT,
+            size INTEGER,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            finished_at TEXT
+        )""",
+        "CREATE INDEX idx_export_jobs_created ON export_jobs(created_at)",
+    ),
+    # v10: 補建舊版 JSON 遷移時漏寫的標籤索引（遷移在 v2 回填之後才執行）
+    (
+        """INSERT OR IGNORE INTO history_tags (tag, item_seq)
+           SELECT j.value, h.seq FROM history h, json_each(h.tags) j
+           WHERE j.type = 'text'""",
+    ),
+    # v11: 匯出工作記錄略過（不存在）的檔案數，total 保持請求的張數
+    (
+        "ALTER TABLE export_jobs ADD COLUMN skipped INTEGER NOT NULL DEFAULT 0",
+    ),
+    # v12: 大量生成工作記錄取消的項目數（取消後不再有待處理項目）
+    (
+        "ALTER TABLE bulk_jobs ADD COLUMN cancelled INTEGER NOT NULL DEFAULT 0",
+        """UPDATE bulk_jobs SET cancelled = (
+               SELECT COUNT(*) FROM bulk_items i WHERE i.job_id = bulk_jobs.id AND i.status = 'cancelled')
+           WHERE status = 'cancelled'""",
+    ),
+]
+
+
+class MetadataStore:
+    """SQLite 中繼資料儲存（執行緒安全，可跨行程共用同一檔案）"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or METADATA_DB_FILE
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._upgrade_schema()
+        self._migrate_legacy_json()
+
+    # ── 連線與交易 ─────────────────────────────────────────────
+    def connection(self):
+        """取得目前執行緒專屬的連線"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                  check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            # 全文索引觸發器會呼叫此函式，每條連線都必須註冊
+            conn.create_function('zimg_segment', 1, segment_text, deterministic=True)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """寫入交易：BEGIN IMMEDIATE 取得寫入鎖，避免併發寫入遺失"""
+        conn = self.connection()
+        if conn.in_transaction:
+            # 巢狀呼叫沿用外層交易
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def execute(self, sql, params=()):
+        """唯讀查詢的捷徑"""
+        return self.connection().execute(sql, params)
+
+    # ── 計數器 / 中繼資料 ──────────────────────────────────────
+    def increment_counter(self, conn, name, amount=1):
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount)
+        )
+
+    def get_counter(self, name):
+        row = self.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row['value'] if row else 0
+
+    def get_meta(self, key, default=None):
+        row = self.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else default
+
+    def set_meta(self, conn, key, value):
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+
+    # ── Schema 升級 ────────────────────────────────────────────
+    def _upgrade_schema(self):
+        with self.transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for target, statements in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {target}")
+
+    # ── 舊版 JSON 遷移 ─────────────────────────────────────────
+    def _migrate_legacy_json(self):
+        """一次性匯入舊版 JSON 檔案，完成後將原檔改名為 *.migrated"""
+        if self.get_meta('legacy_json_migrated'):
+            return
+
+        migrated_files = []
+        with self.transaction() as conn:
+            # 其他行程可能已搶先完成遷移
+            row = conn.execute("SELECT value FROM meta WHERE key = 'legacy_json_migrated'").fetchone()
+            if row:
+                return
+
+            history = self._read_legacy(LEGACY_HISTORY_FILE)
+            if isinstance(history, list):
+                # 舊檔最新的在前面，反向插入讓 seq 依時間遞增
+                for item in reversed(history):
+                    # 與 HistoryService._insert 相同：標籤去重後同步寫入 history_tags
+                    tags = [tag for tag in dict.fromkeys(item.get('tags') or []) if isinstance(tag, str)]
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO history (id, prompt, filename, timestamp, image_url, tags, model) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (item.get('id'), item.get('prompt', ''), item.get('filename', ''),
+                         item.get('timestamp') or datetime.now().isoformat(),
+                         item.get('image_url'), json.dumps(tags, ensure_ascii=False), item.get('model'))
+                    )
+                    if cursor.rowcount:
+                        conn.executemany(
+                            "INSERT OR IGNORE INTO history_tags (tag, item_seq) VALUES (?, ?)",
+                            [(tag, cursor.lastrowid) for tag in tags]
+                        )
+                migrated_files.append(LEGACY_HISTORY_FILE)
+
+            favorites = self._read_legacy(LEGACY_FAVORITES_FILE)
+            if isinstance(favorites, list):
+                for fav in reversed(favorites):
+                    conn.execute(
+                        "INSERT OR IGNORE INTO favorites (id, prompt, name, created_at, use_count) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (fav.get('id'), fav.get('prompt', ''), fav.get('name'),
+                         fav.get('created_at') or datetime.now().isoformat(), fav.get('use_count', 0))
+                    )
+                migrated_files.append(LEGACY_FAVORITES_FILE)
+
+            analytics = self._read_legacy(LEGACY_ANALYTICS_FILE)
+            if isinstance(analytics, dict):
+                for event in analytics.get('events', []):
+                    conn.execute(
+                        "INSERT INTO analytics_events (type, model, prompt_length, prompt_preview, "
+                        "resolution, mode, duration, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (event.get('type', 'generation'), event.get('model'), event.get('prompt_length'),
+                         event.get('prompt_preview'), event.get('resolution'), event.get('mode'),
+                         event.get('duration'), event.get('timestamp') or datetime.now().isoformat())
+                    )
+                for day, stats in analytics.get('daily_stats', {}).items():
+                    conn.execute(
+                        "INSERT OR REPLACE INTO analytics_daily (day, generations, api_calls) VALUES (?, ?, ?)",
+                        (day, stats.get('generations', 0), stats.get('api_calls', 0))
+                    )
+                self.increment_counter(conn, 'total_generations', analytics.get('total_generations', 0))
+                self.increment_counter(conn, 'total_api_calls', analytics.get('total_api_calls', 0))
+                if analytics.get('created_at'):
+                    self.set_meta(conn, 'analytics_created_at', analytics['created_at'])
+                migrated_files.append(LEGACY_ANALYTICS_FILE)
+
+            if not self.get_meta('analytics_created_at'):
+                self.set_meta(conn, 'analytics_created_at', datetime.now().isoformat())
+            self.set_meta(conn, 'legacy_json_migrated', datetime.now().isoformat())
+
+        for path in migrated_files:
+            try:
+                os.replace(path, path + '.migrated')
+                print(f"[Metadata] 已遷移 {os.path.basename(path)} 至 SQLite")
+            except OSError as e:
+                print(f"[Metadata] 無法重新命名 {path}: {e}")
+
+    def _read_legacy(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[Metadata] 讀取舊版檔案失敗 {path}: {e}")
+            return None
+
+
+# 全域單例
+_metadata_store = None
+_metadata_store_lock = threading.Lock()
+
+
+def get_metadata_store():
+    """取得中繼資料儲存單例"""
+    global _metadata_store
+    if _metadata_store is None:
+        with _metadata_store_lock:
+            if _metadata_store is None:
+                _metadata_store = MetadataStore()
+    return _metadata_store
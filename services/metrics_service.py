@@ -0,0 +1,376 @@
+"""
+Metrics Service - 行程內 Prometheus 指標收集
+提供 Counter / Gauge / Histogram，以 Prometheus 文字格式 (0.0.4) 輸出給 /metrics
+
+- 全部保存在記憶體，記錄時只有一次鎖與字典查詢，不做任何檔案 I/O
+- 佇列深度、記憶體用量等狀態型指標於抓取時由 collector 計算
+- 生產模式（serve.py）下佇列、模型載入、雲端呼叫與 GPU 記憶體都記錄在推論行程：
+  回應 /metrics 的 web worker 經 IPC 取得推論行程的 snapshot() 合併輸出，
+  樣本以 process 標籤區分（inference / web-<pid>）
+- 限制：HTTP 指標只存在各 web worker 自己的記憶體，每次抓取只會看到回應該次抓取的 worker；
+  各 worker 的序列以 process 標籤分開（各自單調遞增），查詢時以 sum without (process) 彙總
+"""
+import os
+import sys
+import math
+import time
+import bisect
+import threading
+
+
+# 延遲類直方圖預設桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# 生成 / 模型載入等較長的操作
+GENERATION_BUCKETS = (0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=None, const=()):
+    pairs = [f'{n}="{_escape_label(v)}"' for n, v in const]
+    pairs += [f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    type_name = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要標籤 {self.labelnames}，收到 {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+
+    def snapshot(self):
+        """目前的值（可序列化，跨行程合併用）"""
+        with self._lock:
+            return dict(self._values)
+
+    def expose(self, sources=None):
+        """sources: [(常數標籤, snapshot())]，預設只輸出本行程的值"""
+        lines = self._header()
+        for const, values in (sources if sources is not None else [((), self.snapshot())]):
+            lines.extend(self._samples(values, const))
+        return lines
+
+
+class Counter(_Metric):
+    """只增不減的計數器"""
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _header(self):
+        # HELP / TYPE 必須使用樣本名稱（含 _total），否則解析器視為 untyped
+        return [f'# HELP {self.name}_total {self.documentation}', f'# TYPE {self.name}_total counter']
+
+    def _samples(self, values, const=()):
+        return [f'{self.name}_total{_format_labels(self.labelnames, key, const=const)} {_format_value(value)}'
+                for key, value in values.items()]
+
+
+class Gauge(_Metric):
+    """可增可減的量測值"""
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def replace(self, values):
+        """以 {標籤值 tuple: 值} 整批取代（collector 使用，移除已消失的標籤組合）"""
+        with self._lock:
+            self._values = {tuple(str(v) for v in key): value for key, value in values.items()}
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels))
+
+    def _samples(self, values, const=()):
+        return [f'{self.name}{_format_labels(self.labelnames, key, const=const)} {_format_value(value)}'
+                for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    """固定桶直方圖（Prometheus 累積桶格式）"""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def snapshot(self):
+        with self._lock:
+            return {key: (list(s[0]), s[1], s[2]) for key, s in self._values.items()}
+
+    def _samples(self, values, const=()):
+        lines = []
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(float(bound))), const)
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key, const=const)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+_METRIC_TYPES = {cls.type_name: cls for cls in (Counter, Gauge, Histogram)}
+
+
+class MetricsRegistry:
+    """指標註冊表：同名指標只建立一次，抓取時先執行 collector 再輸出"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"指標 {name} 已以不同型別或標籤註冊")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def register_collector(self, collector):
+        """collector() 在每次抓取時呼叫，用來更新狀態型 Gauge"""
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    def _collect(self):
+        for collector in list(self._collectors):
+            try:
+                collector()
+            except Exception as e:
+                print(f"[Metrics] collector {getattr(collector, '__name__', collector)} 失敗: {e}")
+
+    def snapshot(self):
+        """執行 collector 後回傳所有指標的定義與值（可序列化，供其他行程合併輸出）"""
+        self._collect()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: {'type': m.type_name, 'documentation': m.documentation, 'labelnames': m.labelnames,
+                         'buckets': getattr(m, 'buckets', None), 'values': m.snapshot()}
+                for m in metrics}
+
+    def expose(self, remote=None, local_labels=(), remote_labels=()):
+        """輸出 Prometheus 文字格式
+
+        remote: 其他行程的 snapshot()，同名指標合併在同一組 HELP / TYPE 下；
+        local_labels / remote_labels: 加在本行程 / 遠端樣本上的常數標籤（(名稱, 值) tuple）
+        """
+        self._collect()
+        with self._lock:
+            metrics = dict(self._metrics)
+        remote = remote or {}
+        lines = []
+        for name in list(metrics) + [n for n in remote if n not in metrics]:
+            metric = metrics.get(name)
+            sources = [(local_labels, metric.snapshot())] if metric is not None else []
+            if name in remote:
+                info = remote[name]
+                if metric is None:
+                    cls = _METRIC_TYPES[info['type']]
+                    kwargs = {'buckets': info['buckets']} if info['buckets'] else {}
+                    metric = cls(name, info['documentation'], info['labelnames'], **kwargs)
+                sources.append((remote_labels, info['values']))
+            lines.extend(metric.expose(sources))
+        return '\n'.join(lines) + '\n'
+
+
+# ── 全域註冊表與應用程式指標 ──────────────────────────────────
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'zimage_http_requests', 'HTTP requests by route, method and status', ('route', 'method', 'status'))
+HTTP_LATENCY = REGISTRY.histogram(
+    'zimage_http_request_duration_seconds', 'HTTP request latency by route', ('route', 'method'))
+GENERATION_LATENCY = REGISTRY.histogram(
+    'zimage_generation_duration_seconds', 'Image generation latency by model and mode',
+    ('model', 'mode'), buckets=GENERATION_BUCKETS)
+GENERATION_STAGE_LATENCY = REGISTRY.histogram(
+    'zimage_generation_stage_seconds', 'Per-stage generation latency by model',
+    ('model', 'stage'))
+QUEUE_WAIT = REGISTRY.histogram(
+    'zimage_queue_wait_seconds', 'Time tasks spend waiting in the queue by lane',
+    ('lane',), buckets=GENERATION_BUCKETS)
+QUEUE_DEPTH = REGISTRY.gauge(
+    'zimage_queue_depth', 'Pending queue tasks by lane', ('lane',))
+QUEUE_ACTIVE = REGISTRY.gauge(
+    'zimage_queue_active_tasks', 'Queue tasks currently being processed')
+MODEL_LOAD_LATENCY = REGISTRY.histogram(
+    'zimage_model_load_seconds', 'Local model load time', ('model',), buckets=GENERATION_BUCKETS)
+MODEL_LOADED = REGISTRY.gauge(
+    'zimage_model_loaded', 'Whether a model is the active model (1) or not', ('model',))
+CACHE_REQUESTS = REGISTRY.counter(
+    'zimage_cache_requests', 'Cache lookups by cache and result (hit / miss)', ('cache', 'result'))
+CLOUD_REQUESTS = REGISTRY.counter(
+    'zimage_cloud_requests', 'Cloud provider calls by provider, model and result',
+    ('provider', 'model', 'result'))
+CLOUD_RETRIES = REGISTRY.counter(
+    'zimage_cloud_retries', 'Cloud provider retries by provider and reason (HTTP status / network)',
+    ('provider', 'reason'))
+CLOUD_BREAKER_STATE = REGISTRY.gauge(
+    'zimage_cloud_breaker_state', 'Cloud provider circuit breaker state (0 closed, 1 half-open, 2 open)',
+    ('provider',))
+API_RATE_LIMITED = REGISTRY.counter(
+    'zimage_api_rate_limited', 'External API requests rejected by per-key rate limits', ('budget',))
+DOWNLOAD_FIRST_BYTE = REGISTRY.histogram(
+    'zimage_download_first_byte_seconds', 'Time to first byte of streamed downloads by kind', ('kind',))
+GPU_MEMORY = REGISTRY.gauge(
+    'zimage_gpu_memory_bytes', 'CUDA memory by device and kind (allocated / reserved)', ('device', 'kind'))
+PROCESS_MEMORY = REGISTRY.gauge(
+    'zimage_process_resident_memory_bytes', 'Resident memory of this process')
+PROCESS_START = REGISTRY.gauge(
+    'zimage_process_start_time_seconds', 'Start time of this process since unix epoch')
+PROCESS_START.set(time.time())
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def record_generation_metrics(model, mode, duration=None, timings=None):
+    """記錄一次生成的總耗時與各階段耗時（佇列等待另由佇列記錄）"""
+    model = model or 'unknown'
+    if duration is not None:
+        GENERATION_LATENCY.observe(duration, model=model, mode=mode)
+    for stage, seconds in (timings or {}).items():
+        if seconds is not None and stage != 'queue_wait':
+            GENERATION_STAGE_LATENCY.observe(seconds, model=model, stage=stage)
+
+
+# ── 抓取時計算的狀態 ──────────────────────────────────────────
+def _is_remote():
+    """生產模式的 web worker：佇列與模型狀態由推論行程的 snapshot() 提供"""
+    module = sys.modules.get('services.inference_ipc')
+    return module is not None and module.is_remote()
+
+
+def _collect_queue():
+    # 只讀取已存在的佇列，不因抓取而啟動佇列處理器
+    module = sys.modules.get('services.queue_service')
+    queue = getattr(module, '_queue_service', None) if module else None
+    if queue is None or _is_remote():
+        return
+    depth, active = queue.lane_depth()
+    QUEUE_DEPTH.replace({(lane,): n for lane, n in depth.items()})
+    QUEUE_ACTIVE.set(active)
+
+
+def _collect_models():
+    module = sys.modules.get('services.model_registry')
+    registry = getattr(module, '_model_registry', None) if module else None
+    if registry is None or _is_remote():
+        return
+    active = registry._active_model_id
+    MODEL_LOADED.replace({(active,): 1} if active else {})
+
+
+def _collect_memory():
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available():
+        values = {}
+        for device in range(torch.cuda.device_count()):
+            values[(str(device), 'allocated')] = torch.cuda.memory_allocated(device)
+            values[(str(device), 'reserved')] = torch.cuda.memory_reserved(device)
+        GPU_MEMORY.replace(values)
+
+    rss = _resident_memory()
+    if rss is not None:
+        PROCESS_MEMORY.set(rss)
+
+
+def _resident_memory():
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+REGISTRY.register_collector(_collect_queue)
+REGISTRY.register_collector(_collect_models)
+REGISTRY.register_collector(_collect_memory)
+
+
+def get_metrics_registry():
+    """取得全域指標註冊表"""
+    return REGISTRY
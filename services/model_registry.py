@@ -13,12 +13,18 @@ Model Registry Service v4.0 - 多 Provider 模型管理系統
 """
 import os
 import json
+import time
 import base64
+import asyncio
+import threading
 from typing import Optional
 import config
+from services.metrics_service import CLOUD_REQUESTS, MODEL_LOAD_LATENCY, record_cache
+from providers.base import StageTimings
 from providers.local.diffusers_provider import DiffusersProvider
 from providers.cloud.gemini_provider import GeminiProvider
 from providers.cloud.openai_provider import OpenAIProvider
+from providers.cloud.rate_limiter import get_rate_limiter
 
 
 # ── 本地模型清單 ─────────────────────────────────────────────────
@@ -111,6 +117,9 @@ class ModelRegistry:
         self._gemini_providers: dict = {}  # model_id -> GeminiProvider
         self._openai_providers: dict = {}  # model_id -> OpenAIProvider
         self._active_model_id: Optional[str] = None
+        # 本地模型的切換與生成共用此鎖（可重入）：任何路徑都不會在生成途中卸載 pipeline；
+        # serve.py 的 IPC 伺服器與佇列處理器也使用同一把鎖
+        self.gpu_lock = threading.RLock()
         self._custom_models_file = os.path.join(config.OUTPUT_PATH, "custom_models.json")
 
         self._init_local_providers()
@@ -144,11 +153,14 @@ class ModelRegistry:
             if openai_key:
                 for p in self._openai_providers.values():
                     p.set_api_key(openai_key)
+            limiter = get_rate_limiter()
+            for pid in ('gemini', 'openai'):
+                limiter.configure(pid, settings.get_rate_limits(pid))
         except Exception as e:
             print(f"[!] 同步 API Key 失敗: {e}")
 
     def reload_api_keys(self):
-        """API Key 更新後呼叫此方法"""
+        """API Key 或速率限制更新後呼叫此方法"""
         self._sync_api_keys()
 
     # ── 自訂本地模型 ────────────────────────────────────────────
@@ -258,14 +270,23 @@ class ModelRegistry:
 
     # ── 切換模型 ────────────────────────────────────────────────
     def switch_model(self, model_id: str) -> dict:
+        with self.gpu_lock:
+            return self._switch_model(model_id)
+
+    def _switch_model(self, model_id: str) -> dict:
         if model_id in self._local_providers:
             provider = self._local_providers[model_id]
             if provider.is_configured():
+                record_cache('model_memory', True)
                 self._active_model_id = model_id
                 return {'success': True, 'message': f'{provider._model_config["name"]} 已在使用中',
                         'model': self.get_model_info(model_id)}
+            record_cache('model_memory', False)
+            record_cache('model_disk', provider.is_cached())
             result = provider.load()
             if result['success']:
+                if result.get('load_time') is not None:
+                    MODEL_LOAD_LATENCY.observe(result['load_time'], model=model_id)
                 for oid, op in self._local_providers.items():
                     if oid != model_id and op.is_configured():
                         op.unload()
@@ -308,7 +329,41 @@ class ModelRegistry:
             return self._get_cloud_provider(self._active_model_id, cloud_cfg['provider'])
         return None
 
+    def cloud_waits(self) -> dict:
+        """各雲端模型目前受速率限制需等待的秒數（只列出需等待者，佇列排程與預估使用）"""
+        limiter = get_rate_limiter()
+        waits = {}
+        for cfg in CLOUD_MODELS:
+            provider = self._get_cloud_provider(cfg['id'], cfg['provider'])
+            if provider:
+                wait = limiter.predict_wait(cfg['provider'], provider._model_id)
+                if wait > 0:
+                    waits[cfg['id']] = round(wait, 1)
+        return waits
+
     # ── 生成（統一） ─────────────────────────────────────────────
+    def _timed_generate(self, provider, **kwargs):
+        """呼叫 provider.generate；雲端 Provider 的整段往返記為 api_call 階段並計入成功 / 失敗次數"""
+        if provider.provider_type != 'cloud':
+            with self.gpu_lock:
+                return provider.generate(**kwargs)
+        timings = kwargs.get('timings')
+        try:
+            if timings is not None:
+                with timings.stage('api_call'):
+                    result = provider.generate(**kwargs)
+            else:
+                result = provider.generate(**kwargs)
+        except Exception:
+            self._count_cloud_call(provider, False)
+            raise
+        self._count_cloud_call(provider, result.get('success', False))
+        return result
+
+    def _count_cloud_call(self, provider, success):
+        CLOUD_REQUESTS.inc(provider=provider.provider_id, model=self._active_model_id or 'unknown',
+                           result='success' if success else 'error')
+
     def generate(self, prompt: str, width: int, height: int,
                  seed=None, negative_prompt=None, **kwargs):
         """
@@ -319,8 +374,8 @@ class ModelRegistry:
         provider = self._get_active_provider()
         if provider is None:
             raise RuntimeError("尚未載入任何模型")
-        result = provider.generate(prompt=prompt, width=width, height=height,
-                                   seed=seed, negative_prompt=negative_prompt, **kwargs)
+        result = self._timed_generate(provider, prompt=prompt, width=width, height=height,
+                                      seed=seed, negative_prompt=negative_prompt, **kwargs)
         if not result.get('success'):
             raise RuntimeError(result.get('error', '生成失敗'))
         if 'pil_image' in result:
@@ -333,8 +388,8 @@ class ModelRegistry:
         provider = self._get_active_provider()
         if provider is None:
             return {'success': False, 'error': '尚未選擇模型'}
-        result = provider.generate(prompt=prompt, width=width, height=height,
-                                   seed=seed, negative_prompt=negative_prompt, **kwargs)
+        result = self._timed_generate(provider, prompt=prompt, width=width, height=height,
+                                      seed=seed, negative_prompt=negative_prompt, **kwargs)
         if result.get('success') and 'pil_image' in result:
             from io import BytesIO
             buf = BytesIO()
@@ -343,6 +398,55 @@ class ModelRegistry:
             result['mime_type'] = 'image/png'
         return result
 
+    def generate_many(self, requests: list, concurrency: Optional[int] = None) -> list:
+        """
+        一次生成多張（批量生成使用）
+        雲端模型 → 以非同步 client 在背景事件迴圈並行，上限 concurrency（預設 CLOUD_CONCURRENCY）
+        本地模型 → 依序執行
+
+        requests: [{'prompt', 'width', 'height', 'seed', 'negative_prompt'}, ...]
+        Returns: 與 requests 順序對應的結果，格式同 provider.generate()，
+                 另含 'duration'（秒）與 'timings'（各階段秒數）
+        """
+        provider = self._get_active_provider()
+        if provider is None:
+            raise RuntimeError("尚未載入任何模型")
+
+        if provider.provider_type != 'cloud':
+            results = []
+            for req in requests:
+                timings = StageTimings()
+                start = time.time()
+                try:
+                    result = self._timed_generate(provider, timings=timings, **req)
+                except Exception as e:
+                    result = {'success': False, 'error': str(e)}
+                result.update(duration=time.time() - start, timings=dict(timings))
+                results.append(result)
+            return results
+
+        from providers.cloud.client_pool import run_async
+        limit = concurrency or config.CLOUD_CONCURRENCY
+
+        async def run_all():
+            semaphore = asyncio.Semaphore(limit)
+
+            async def one(req):
+                async with semaphore:
+                    start = time.time()
+                    try:
+                        result = await provider.agenerate(**req)
+                    except Exception as e:
+                        result = {'success': False, 'error': str(e)}
+                    duration = time.time() - start
+                self._count_cloud_call(provider, result.get('success', False))
+                result.update(duration=duration, timings={'api_call': duration})
+                return result
+
+            return await asyncio.gather(*(one(req) for req in requests))
+
+        return run_async(run_all()).result()
+
     # ── Avatar Studio ────────────────────────────────────────────
     def edit_photo(self, feature: str, image_base64: str,
                    image2_base64=None, mask_base64=None,
@@ -353,10 +457,18 @@ class ModelRegistry:
             return {'success': False, 'error': '請先選擇一個模型'}
         if not hasattr(provider, 'edit_photo'):
             return {'success': False, 'error': f'{self._active_model_id} 不支援照片編輯，請切換到雲端模型'}
-        return provider.edit_photo(feature=feature, image_base64=image_base64,
-                                   image2_base64=image2_base64, mask_base64=mask_base64,
-                                   image_mime=image_mime, image2_mime=image2_mime,
-                                   params=params)
+        try:
+            result = provider.edit_photo(feature=feature, image_base64=image_base64,
+                                         image2_base64=image2_base64, mask_base64=mask_base64,
+                                         image_mime=image_mime, image2_mime=image2_mime,
+                                         params=params)
+        except Exception:
+            if provider.provider_type == 'cloud':
+                self._count_cloud_call(provider, False)
+            raise
+        if provider.provider_type == 'cloud':
+            self._count_cloud_call(provider, result.get('success', False))
+        return result
 
     # ── 自訂模型管理 ────────────────────────────────────────────
     def register_custom_model(self, model_config: dict) -> dict:
@@ -401,5 +513,7 @@ _model_registry: Optional[ModelRegistry] = None
 def get_model_registry() -> ModelRegistry:
     global _model_registry
     if _model_registry is None:
-        _model_registry = ModelRegistry()
+        from services.inference_ipc import is_remote, RemoteModelRegistry
+        # 生產模式的 web worker 不載入模型，改由推論行程代為執行
+        _model_registry = RemoteModelRegistry() if is_remote() else ModelRegistry()
     return _model_registry
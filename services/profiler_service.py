@@ -0,0 +1,236 @@
+"""
+Profiler Service - 逐請求效能剖析
+以堆疊取樣（或 cProfile）記錄單一請求，輸出可直接給 flamegraph.pl / speedscope 使用的檔案
+
+- 取樣：背景執行緒每 PROFILE_SAMPLE_INTERVAL 秒讀取被剖析執行緒的堆疊，
+  累計為 collapsed stack 格式（func;func;func 次數），即 .folded 檔
+- cProfile：另存 .prof（pstats），可用 snakeviz / flameprof 開啟
+- 觸發：X-Profile 標頭（需 PROFILE_ENABLED），或設定 PROFILE_SLOW_THRESHOLD 後
+  所有請求皆取樣、超過門檻才寫檔
+- 結果存在 OUTPUT_PATH/profiles，只保留最近 PROFILE_KEEP 份
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from datetime import datetime
+import config
+
+
+PROFILE_DIR_NAME = 'profiles'
+PROFILE_FORMATS = {'folded': '.folded', 'prof': '.prof'}
+_PROFILE_ID_RE = re.compile(r'^[0-9]{8}_[0-9]{6}_[0-9a-f]{8}$')
+
+
+def _frame_label(code):
+    label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label.replace(';', ':')
+
+
+class ProfileSession:
+    """單一請求的剖析狀態"""
+
+    def __init__(self, mode, trigger, thread_id):
+        self.id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self.mode = mode
+        self.trigger = trigger
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self.samples = 0
+        self.profiler = None
+        self.started = time.perf_counter()
+        self.duration = None
+
+
+class StackSampler:
+    """共用的取樣執行緒，同時取樣所有進行中的剖析"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, session):
+        with self._lock:
+            self._sessions[session.thread_id] = session
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, session):
+        with self._lock:
+            if self._sessions.get(session.thread_id) is session:
+                del self._sessions[session.thread_id]
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                sessions = list(self._sessions.values())
+                if not sessions:
+                    self._wake.clear()
+            if not sessions:
+                self._wake.wait()
+                continue
+
+            frames = sys._current_frames()
+            for session in sessions:
+                frame = frames.get(session.thread_id)
+                if frame is None or session.thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                session.stacks[';'.join(stack)] += 1
+                session.samples += 1
+            del frames
+            time.sleep(self.interval)
+
+
+class ProfilerService:
+    """逐請求剖析：開始 / 結束 / 保存 / 列出"""
+
+    def __init__(self):
+        self.profile_dir = os.path.join(config.OUTPUT_PATH, PROFILE_DIR_NAME)
+        self.sampler = StackSampler(config.PROFILE_SAMPLE_INTERVAL)
+        self._lock = threading.Lock()
+
+    @property
+    def slow_threshold(self):
+        return config.PROFILE_SLOW_THRESHOLD
+
+    def header_enabled(self):
+        return bool(config.PROFILE_ENABLED)
+
+    def start(self, mode='sample', trigger='header'):
+        """在目前執行緒開始剖析"""
+        session = ProfileSession(mode, trigger, threading.get_ident())
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                session.profiler = profiler
+            except ValueError:
+                # 已有其他 profiler 在執行（Python 3.12+ 同時只允許一個），退回純取樣
+                session.mode = 'sample'
+        self.sampler.add(session)
+        return session
+
+    def stop(self, session):
+        """結束剖析並記錄總耗時"""
+        if session.profiler is not None:
+            session.profiler.disable()
+        self.sampler.remove(session)
+        session.duration = time.perf_counter() - session.started
+        return session
+
+    def should_keep(self, session):
+        if session.trigger == 'header':
+            return True
+        threshold = self.slow_threshold
+        return threshold is not None and session.duration >= threshold
+
+    def save(self, session, info=None):
+        """寫出 .folded / .prof 與摘要 .json，回傳摘要"""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        base = os.path.join(self.profile_dir, session.id)
+
+        with open(base + '.folded', 'w', encoding='utf-8') as f:
+            for stack, count in session.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        formats = ['folded']
+        if session.profiler is not None:
+            pstats.Stats(session.profiler).dump_stats(base + '.prof')
+            formats.append('prof')
+
+        meta = {
+            'id': session.id,
+            'mode': session.mode,
+            'trigger': session.trigger,
+            'duration': round(session.duration, 4),
+            'samples': session.samples,
+            'interval': self.sampler.interval,
+            'formats': formats,
+            'created_at': datetime.now().isoformat(),
+            'top_frames': self._top_frames(session.stacks),
+        }
+        meta.update(info or {})
+        tmp_path = base + '.json.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, base + '.json')
+
+        self._prune()
+        print(f"[Profiler] 已保存 {session.id} ({meta['duration']}s, {session.samples} 個樣本)")
+        return meta
+
+    @staticmethod
+    def _top_frames(stacks, limit=10):
+        """以葉節點（自身時間）統計最耗時的函式"""
+        leaves = Counter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [{'frame': frame, 'samples': n, 'percent': round(n * 100 / total, 1)}
+                for frame, n in leaves.most_common(limit)]
+
+    def _meta_files(self):
+        if not os.path.isdir(self.profile_dir):
+            return []
+        entries = [e for e in os.scandir(self.profile_dir) if e.name.endswith('.json')]
+        entries.sort(key=lambda e: (e.stat().st_mtime_ns, e.name), reverse=True)
+        return [e.name for e in entries]
+
+    def _prune(self):
+        with self._lock:
+            for name in self._meta_files()[max(config.PROFILE_KEEP, 1):]:
+                profile_id = name[:-len('.json')]
+                for ext in ('.json',) + tuple(PROFILE_FORMATS.values()):
+                    try:
+                        os.remove(os.path.join(self.profile_dir, profile_id + ext))
+                    except FileNotFoundError:
+                        pass
+
+    def list_profiles(self, limit=20):
+        """最近的剖析結果（新到舊）"""
+        profiles = []
+        for name in self._meta_files()[:limit]:
+            try:
+                with open(os.path.join(self.profile_dir, name), 'r', encoding='utf-8') as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def get_profile_path(self, profile_id, fmt='folded'):
+        """取得剖析檔路徑，不存在或參數不合法時回傳 None"""
+        if fmt not in PROFILE_FORMATS:
+            raise ValueError(f"不支援的格式: {fmt}（可用: {', '.join(PROFILE_FORMATS)}）")
+        if not _PROFILE_ID_RE.match(profile_id):
+            return None
+        path = os.path.join(self.profile_dir, profile_id + PROFILE_FORMATS[fmt])
+        return path if os.path.exists(path) else None
+
+
+# 全域服務實例
+_profiler_service = None
+
+
+def get_profiler_service():
+    """取得剖析服務單例"""
+    global _profiler_service
+    if _profiler_service is None:
+        _profiler_service = ProfilerService()
+    return _profiler_service
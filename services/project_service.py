@@ -7,6 +7,7 @@ import json
 import uuid
 from datetime import datetime
 import config
+from services.search_service import get_search_service
 
 
 PROJECTS_FILE = os.path.join(config.OUTPUT_PATH, "projects.json")
@@ -17,6 +18,11 @@ class ProjectService:
 
     def __init__(self):
         self.projects = self._load()
+        self.search = get_search_service()
+        try:
+            self.search.sync_projects(self.projects)
+        except Exception as e:
+            print(f"[Project] 同步搜尋索引失敗: {e}")
 
     def _load(self):
         """載入專案列表"""
@@ -68,6 +74,7 @@ class ProjectService:
 
         self.projects.insert(0, project)
         self._save()
+        self.search.index_project(project)
         return project
 
     def list_all(self, status=None):
@@ -93,12 +100,14 @@ class ProjectService:
 
         project['updated_at'] = datetime.now().isoformat()
         self._save()
+        self.search.index_project(project)
         return project
 
     def delete(self, project_id):
         """刪除專案（不刪除圖片檔案）"""
         self.projects = [p for p in self.projects if p['id'] != project_id]
         self._save()
+        self.search.remove_project(project_id)
         return True
 
     def add_image(self, project_id, filename, prompt, seed=None, model_id=None, metadata=None):
@@ -123,6 +132,7 @@ class ProjectService:
         project['image_count'] = len(project['images'])
         project['updated_at'] = datetime.now().isoformat()
         self._save()
+        self.search.index_project(project)
         return image_entry
 
     def remove_image(self, project_id, filename):
@@ -135,6 +145,7 @@ class ProjectService:
         project['image_count'] = len(project['images'])
         project['updated_at'] = datetime.now().isoformat()
         self._save()
+        self.search.index_project(project)
         return True
 
     def rate_image(self, project_id, filename, rating):
@@ -194,6 +205,7 @@ class ProjectService:
 
         self.projects.insert(0, new_project)
         self._save()
+        self.search.index_project(new_project)
         return new_project
 
 
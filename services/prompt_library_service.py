@@ -7,6 +7,7 @@ import json
 import uuid
 from datetime import datetime
 import config
+from services.search_service import get_search_service
 
 
 PROMPT_LIBRARY_FILE = os.path.join(config.OUTPUT_PATH, "prompt_library.json")
@@ -131,6 +132,11 @@ class PromptLibraryService:
 
     def __init__(self):
         self.prompts = self._load()
+        self.search = get_search_service()
+        try:
+            self.search.sync_library(self.prompts)
+        except Exception as e:
+            print(f"[PromptLibrary] 同步搜尋索引失敗: {e}")
 
     def _load(self):
         """載入提示詞庫"""
@@ -165,11 +171,13 @@ class PromptLibraryService:
             results = [p for p in results if p.get('category') == category]
 
         if search:
+            # 全文索引比對標題、提示詞與標籤；再以子字串補上詞中間的命中（"punk" → cyberpunk）
+            matched = set(self.search.search_ids(search, 'library', limit=len(self.prompts) or 1))
             search_lower = search.lower()
-            results = [p for p in results if
+            results = [p for p in results if p['id'] in matched or
                        search_lower in p.get('title', '').lower() or
                        search_lower in p.get('prompt', '').lower() or
-                       any(search_lower in t for t in p.get('tags', []))]
+                       any(search_lower in t.lower() for t in p.get('tags', []))]
 
         if sort_by == 'rating':
             results.sort(key=lambda p: p.get('rating', 0), reverse=True)
@@ -206,6 +214,7 @@ class PromptLibraryService:
         }
         self.prompts.insert(0, entry)
         self._save()
+        self.search.index_library_prompt(entry)
         return entry
 
     def use_prompt(self, prompt_id):
@@ -240,6 +249,7 @@ class PromptLibraryService:
                     return False
                 self.prompts.remove(p)
                 self._save()
+                self.search.remove_library_prompt(prompt_id)
                 return True
         return False
 
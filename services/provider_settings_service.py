@@ -49,6 +49,10 @@ class ProviderSettingsService:
     def get_active_model(self, provider_id: str) -> Optional[str]:
         return self._settings.get(provider_id, {}).get('active_model') or None
 
+    def get_rate_limits(self, provider_id: str) -> dict:
+        """用戶端速率限制（providers/cloud/rate_limiter.py），未設定時為空"""
+        return self._settings.get(provider_id, {}).get('rate_limits') or {}
+
     def get_all(self) -> dict:
         """回傳給前端顯示（遮蔽 Key 的中間部分）"""
         result = {}
@@ -59,6 +63,7 @@ class ProviderSettingsService:
                 'has_key': bool(key),
                 'masked_key': masked,
                 'active_model': cfg.get('active_model', ''),
+                'rate_limits': cfg.get('rate_limits') or {},
             }
         return result
 
@@ -84,6 +89,45 @@ class ProviderSettingsService:
         self._save()
         return {'success': True, 'message': f'{provider_id} 模型已切換為 {model_id}'}
 
+    def set_rate_limits(self, provider_id: str, limits: dict) -> dict:
+        """設定每分鐘請求數 / 圖片數上限；值為 0 或 None 表示不限制"""
+        if provider_id not in ('gemini', 'openai'):
+            return {'success': False, 'error': f'未知 Provider: {provider_id}'}
+
+        def clean(values, where='速率限制'):
+            if values is None:
+                values = {}
+            if not isinstance(values, dict):
+                raise ValueError(f'{where}必須是物件')
+            result = {}
+            for key in ('requests_per_minute', 'images_per_minute'):
+                value = values.get(key)
+                if value in (None, '', 0):
+                    continue
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f'{key} 必須是數字')
+                if value < 0:
+                    raise ValueError(f'{key} 不可為負數')
+                result[key] = value
+            return result
+
+        try:
+            cleaned = clean(limits)
+            models = (limits or {}).get('models') or {}
+            if not isinstance(models, dict):
+                raise ValueError('models 必須是以模型 ID 為鍵的物件')
+            models = {mid: clean(v, f'models.{mid} ') for mid, v in models.items()}
+        except ValueError as e:
+            return {'success': False, 'error': str(e)}
+        models = {mid: v for mid, v in models.items() if v}
+        if models:
+            cleaned['models'] = models
+        self._settings.setdefault(provider_id, {})['rate_limits'] = cleaned
+        self._save()
+        return {'success': True, 'message': f'{provider_id} 速率限制已更新', 'rate_limits': cleaned}
+
     def clear_api_key(self, provider_id: str) -> dict:
         if provider_id in self._settings:
             self._settings[provider_id]['api_key'] = ''
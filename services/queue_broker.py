@@ -0,0 +1,521 @@
+"""
+Queue Broker - 多個推論行程 / 節點共用的佇列後端
+
+QUEUE_BACKEND = "sqlite" 時，任務存放在共用的 SQLite 檔案（WAL，BEGIN IMMEDIATE 交易），
+同一台機器的多個推論行程、或掛載同一共用目錄的多台 GPU 主機都能從中領取任務：
+
+- 租約：領取時寫入 worker_id 與 lease_expires，處理期間由心跳執行緒續約；
+  節點當機導致租約過期，任務重新排入佇列，超過 QUEUE_MAX_ATTEMPTS 次則標記失敗
+- 心跳：queue_workers 表記錄每個節點目前載入的模型與最後心跳時間
+- 模型親和：指定模型的任務優先交給已載入該模型的節點；沒有存活節點載入該模型、
+  或任務已等待超過 QUEUE_AFFINITY_WAIT 秒時，任何節點都可領取
+- 結果：圖片存入共用的 OUTPUT_PATH，任務結果寫回 broker，任一 web 行程都能查詢
+- 公平排程：同一優先順序內依租戶以 DRR 輪流，DRR 狀態存在 queue_scheduler 表由各節點共用
+
+跨主機共用時，broker 檔案所在的檔案系統必須支援 POSIX 檔案鎖。
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import config
+from services.queue_service import QueueService, QueueLimitError, TaskStatus
+from services.fair_scheduler import DeficitRoundRobin
+
+
+# 第 N 筆將 broker 從 user_version N 升級到 N+1，只能在尾端追加
+BROKER_MIGRATIONS = [
+    (
+        """CREATE TABLE queue_tasks (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT NOT NULL UNIQUE,
+            type TEXT NOT NULL,
+            params TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            model TEXT,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            enqueued_at REAL NOT NULL,
+            started_at TEXT,
+            completed_at TEXT,
+            progress INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            image TEXT,
+            error TEXT,
+            worker_id TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )""",
+        "CREATE INDEX idx_queue_tasks_pending ON queue_tasks(status, priority DESC, seq)",
+        "CREATE INDEX idx_queue_tasks_created ON queue_tasks(created_at)",
+        """CREATE TABLE queue_workers (
+            id TEXT PRIMARY KEY,
+            host TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            model TEXT,
+            current_task TEXT,
+            started_at TEXT NOT NULL,
+            heartbeat REAL NOT NULL
+        )""",
+    ),
+    (
+        "ALTER TABLE queue_tasks ADD COLUMN tenant TEXT NOT NULL DEFAULT 'web'",
+        "ALTER TABLE queue_tasks ADD COLUMN weight REAL NOT NULL DEFAULT 1",
+        "ALTER TABLE queue_tasks ADD COLUMN cost REAL NOT NULL DEFAULT 1",
+        "CREATE INDEX idx_queue_tasks_tenant ON queue_tasks(status, tenant, priority DESC, seq)",
+        """CREATE TABLE queue_scheduler (
+            name TEXT PRIMARY KEY,
+            state TEXT NOT NULL
+        )""",
+    ),
+]
+
+# 每次領取時每個租戶最多檢視的待處理任務數
+CLAIM_SCAN_LIMIT = 100
+
+# 摘要欄位（不含 params 以外的大型欄位）
+_SUMMARY_COLUMNS = ('id, type, params, priority, model, tenant, weight, cost, status, created_at, '
+                    'started_at, completed_at, progress, result, error, worker_id, attempts')
+FINISHED_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED)
+
+
+def _row_to_task(row, image=None):
+    task = {
+        'id': row['id'],
+        'type': row['type'],
+        'params': json.loads(row['params']),
+        'priority': row['priority'],
+        'model': row['model'],
+        'tenant': row['tenant'],
+        'weight': row['weight'],
+        'cost': row['cost'],
+        'status': row['status'],
+        'created_at': row['created_at'],
+        'started_at': row['started_at'],
+        'completed_at': row['completed_at'],
+        'progress': row['progress'],
+        'result': json.loads(row['result']) if row['result'] else None,
+        'error': row['error'],
+        'worker_id': row['worker_id'],
+        'attempts': row['attempts'],
+    }
+    if image and task['result'] is not None:
+        task['result']['image'] = image
+    return task
+
+
+class QueueBroker:
+    """SQLite 佇列 broker（執行緒安全，可跨行程 / 節點共用同一檔案）"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or config.QUEUE_BROKER_PATH or os.path.join(config.OUTPUT_PATH, 'queue.db')
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._upgrade_schema()
+
+    # ── 連線與交易 ─────────────────────────────────────────────
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def _upgrade_schema(self):
+        with self.transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for target, statements in enumerate(BROKER_MIGRATIONS[version:], start=version + 1):
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {target}")
+
+    # ── 提交 / 查詢 ────────────────────────────────────────────
+    def put(self, task, max_pending=None):
+        with self.transaction() as conn:
+            if max_pending is not None:
+                pending = conn.execute("SELECT COUNT(*) FROM queue_tasks WHERE status = ? AND tenant = ?",
+                                       (TaskStatus.PENDING, task['tenant'])).fetchone()[0]
+                if pending >= max_pending:
+                    raise QueueLimitError(task['tenant'], max_pending)
+            conn.execute(
+                "INSERT INTO queue_tasks (id, type, params, priority, model, tenant, weight, cost, status, "
+                "created_at, enqueued_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (task['id'], task['type'], json.dumps(task['params'], ensure_ascii=False),
+                 task['priority'], task['params'].get('model') or None, task['tenant'], task['weight'],
+                 task['cost'], task['status'], task['created_at'], time.time())
+            )
+
+    def get(self, task_id, conn=None):
+        conn = conn or self.connection()
+        row = conn.execute(f"SELECT {_SUMMARY_COLUMNS}, image FROM queue_tasks WHERE id = ?",
+                           (task_id,)).fetchone()
+        return _row_to_task(row, row['image']) if row else None
+
+    def is_cancelled(self, task_id):
+        row = self.connection().execute("SELECT status FROM queue_tasks WHERE id = ?", (task_id,)).fetchone()
+        return row is None or row['status'] == TaskStatus.CANCELLED
+
+    def cancel(self, task_id):
+        with self.transaction() as conn:
+            row = conn.execute("SELECT status FROM queue_tasks WHERE id = ?", (task_id,)).fetchone()
+            if not row:
+                return {'success': False, 'error': '任務不存在'}
+            if row['status'] not in (TaskStatus.PENDING, TaskStatus.PROCESSING):
+                return {'success': False, 'error': '任務已完成或已取消'}
+            conn.execute("UPDATE queue_tasks SET status = ?, completed_at = ? WHERE id = ?",
+                         (TaskStatus.CANCELLED, datetime.now().isoformat(), task_id))
+        if row['status'] == TaskStatus.PENDING:
+            return {'success': True, 'message': '任務已取消'}
+        return {'success': True, 'message': '任務將在目前步驟完成後取消'}
+
+    def status_counts(self):
+        rows = self.connection().execute("SELECT status, COUNT(*) AS n FROM queue_tasks GROUP BY status")
+        return {row['status']: row['n'] for row in rows}
+
+    def lane_depth(self):
+        conn = self.connection()
+        depth = {row['type']: row['n'] for row in conn.execute(
+            "SELECT type, COUNT(*) AS n FROM queue_tasks WHERE status = ? GROUP BY type",
+            (TaskStatus.PENDING,))}
+        active = conn.execute("SELECT COUNT(*) FROM queue_tasks WHERE status = ?",
+                              (TaskStatus.PROCESSING,)).fetchone()[0]
+        return depth, active
+
+    def tenant_stats(self):
+        """各租戶的待處理 / 處理中任務數、最久等待秒數與最近一小時開始任務的平均等待"""
+        conn = self.connection()
+        now = time.time()
+        stats = {}
+
+        def entry(tenant):
+            return stats.setdefault(tenant, {'pending': 0, 'processing': 0, 'oldest_wait': 0.0,
+                                             'started': 0, 'avg_wait': None, 'max_wait': None})
+        for row in conn.execute(
+                "SELECT tenant, status, COUNT(*) AS n, MIN(enqueued_at) AS oldest FROM queue_tasks "
+                "WHERE status IN (?, ?) GROUP BY tenant, status",
+                (TaskStatus.PENDING, TaskStatus.PROCESSING)):
+            item = entry(row['tenant'])
+            if row['status'] == TaskStatus.PENDING:
+                item['pending'] = row['n']
+                item['oldest_wait'] = round(now - row['oldest'], 1)
+            else:
+                item['processing'] = row['n']
+        since = datetime.fromtimestamp(now - 3600).isoformat()
+        for row in conn.execute(
+                "SELECT tenant, COUNT(*) AS n, "
+                "AVG((julianday(started_at) - julianday(created_at)) * 86400) AS avg_wait, "
+                "MAX((julianday(started_at) - julianday(created_at)) * 86400) AS max_wait "
+                "FROM queue_tasks WHERE started_at >= ? GROUP BY tenant", (since,)):
+            item = entry(row['tenant'])
+            item['started'] = row['n']
+            item['avg_wait'] = round(row['avg_wait'], 2)
+            item['max_wait'] = round(row['max_wait'], 2)
+        return stats
+
+    def recent(self, limit=20):
+        rows = self.connection().execute(
+            f"SELECT {_SUMMARY_COLUMNS} FROM queue_tasks ORDER BY created_at DESC, seq DESC LIMIT ?",
+            (limit,))
+        result = []
+        for row in rows:
+            task = _row_to_task(row)
+            summary = {k: v for k, v in task.items() if k != 'result'}
+            if task['result']:
+                summary['has_result'] = True
+                summary['result_filename'] = task['result'].get('filename')
+            result.append(summary)
+        return result
+
+    def clear_finished(self):
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                f"DELETE FROM queue_tasks WHERE status IN ({','.join('?' * len(FINISHED_STATUSES))})",
+                FINISHED_STATUSES)
+        return cursor.rowcount
+
+    # ── 領取 / 租約 ────────────────────────────────────────────
+    def _expire_leases(self, conn, now):
+        """租約過期的任務重新排入佇列，超過重試次數則標記失敗"""
+        conn.execute(
+            "UPDATE queue_tasks SET status = ?, error = ?, completed_at = ?, worker_id = NULL, "
+            "lease_expires = NULL WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+            (TaskStatus.FAILED, '處理節點逾時（租約過期）', datetime.now().isoformat(),
+             TaskStatus.PROCESSING, now, config.QUEUE_MAX_ATTEMPTS))
+        expired = conn.execute(
+            "UPDATE queue_tasks SET status = ?, started_at = NULL, worker_id = NULL, lease_expires = NULL "
+            "WHERE status = ? AND lease_expires < ?",
+            (TaskStatus.PENDING, TaskStatus.PROCESSING, now)).rowcount
+        if expired:
+            print(f"[Queue] {expired} 個任務租約過期，重新排入佇列")
+
+    def _live_models(self, conn, worker_id, now):
+        """其他存活節點已載入的模型"""
+        rows = conn.execute(
+            "SELECT DISTINCT model FROM queue_workers WHERE id != ? AND heartbeat >= ? AND model IS NOT NULL",
+            (worker_id, now - self.worker_ttl()))
+        return {row['model'] for row in rows}
+
+    @staticmethod
+    def worker_ttl():
+        return config.QUEUE_HEARTBEAT_INTERVAL * 3
+
+    def claim(self, worker_id, model=None, deferred=()):
+        """領取一個任務並取得租約，沒有可領取的任務時回傳 None
+
+        同優先順序下優先領取不需切換模型的任務；指定了其他存活節點已載入的模型、
+        且等待未超過 QUEUE_AFFINITY_WAIT 的任務留給該節點；未開啟 QUEUE_SWITCH_MODELS 的節點
+        只領取符合目前模型的任務。
+        deferred: 本節點目前受速率限制的模型，這些任務暫不領取
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            self._expire_leases(conn, now)
+            # 每個租戶各取最前面的任務，避免單一租戶的大量任務佔滿掃描範圍
+            rows = conn.execute(
+                "SELECT seq, id, model, priority, enqueued_at, tenant, weight, cost FROM ("
+                "SELECT *, ROW_NUMBER() OVER (PARTITION BY tenant ORDER BY priority DESC, seq) AS rank "
+                "FROM queue_tasks WHERE status = ?) WHERE rank <= ?",
+                (TaskStatus.PENDING, CLAIM_SCAN_LIMIT)).fetchall()
+            if not rows:
+                return None
+            others = self._live_models(conn, worker_id, now)
+
+            # 最高優先順序層內，各租戶優先取不需切換模型的任務
+            heads = {}
+            for row in rows:
+                wanted = row['model']
+                if (wanted or model) in deferred:
+                    continue
+                matches = wanted is None or wanted == model
+                if not matches and not config.QUEUE_SWITCH_MODELS:
+                    continue
+                if not matches and wanted in others and now - row['enqueued_at'] < config.QUEUE_AFFINITY_WAIT:
+                    continue
+                key = (-row['priority'], 0 if matches else 1, row['seq'])
+                current = heads.get(row['tenant'])
+                if current is None or key < current[0]:
+                    heads[row['tenant']] = (key, row)
+            if not heads:
+                return None
+            top = min(key[0] for key, _ in heads.values())
+            heads = {tenant: row for tenant, (key, row) in heads.items() if key[0] == top}
+
+            state = conn.execute("SELECT state FROM queue_scheduler WHERE name = 'drr'").fetchone()
+            drr = DeficitRoundRobin.from_dict(json.loads(state['state']) if state else None)
+            tenant = drr.pick({t: (row['cost'], row['weight']) for t, row in heads.items()})
+            conn.execute("INSERT OR REPLACE INTO queue_scheduler (name, state) VALUES ('drr', ?)",
+                         (json.dumps(drr.to_dict()),))
+
+            task_id = heads[tenant]['id']
+            conn.execute(
+                "UPDATE queue_tasks SET status = ?, worker_id = ?, lease_expires = ?, "
+                "attempts = attempts + 1, started_at = ? WHERE id = ?",
+                (TaskStatus.PROCESSING, worker_id, now + config.QUEUE_LEASE_SECONDS,
+                 datetime.now().isoformat(), task_id))
+            conn.execute("UPDATE queue_workers SET current_task = ? WHERE id = ?", (task_id, worker_id))
+            return self.get(task_id, conn)
+
+    def heartbeat(self, worker_id, model=None, task_id=None):
+        """更新節點心跳並為目前任務續約；回傳租約是否仍有效（沒有任務時為 True）"""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO queue_workers (id, host, pid, model, current_task, started_at, heartbeat) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+                "model = excluded.model, current_task = excluded.current_task, heartbeat = excluded.heartbeat",
+                (worker_id, socket.gethostname(), os.getpid(), model, task_id,
+                 datetime.now().isoformat(), now))
+            # 清除早已失聯的節點記錄
+            conn.execute("DELETE FROM queue_workers WHERE heartbeat < ?", (now - self.worker_ttl() * 20,))
+            if task_id is None:
+                return True
+            renewed = conn.execute(
+                "UPDATE queue_tasks SET lease_expires = ? WHERE id = ? AND worker_id = ? AND status = ?",
+                (now + config.QUEUE_LEASE_SECONDS, task_id, worker_id, TaskStatus.PROCESSING)).rowcount
+        return bool(renewed)
+
+    def finish(self, task, worker_id):
+        """寫回完成 / 失敗結果；租約已失效或任務已取消時不覆寫，回傳 False"""
+        result = task.get('result')
+        image = None
+        if isinstance(result, dict):
+            result = dict(result)
+            image = result.pop('image', None)
+        with self.transaction() as conn:
+            updated = conn.execute(
+                "UPDATE queue_tasks SET status = ?, completed_at = ?, progress = ?, result = ?, image = ?, "
+                "error = ?, lease_expires = NULL WHERE id = ? AND worker_id = ? AND status = ?",
+                (task['status'], task['completed_at'], task.get('progress', 0),
+                 json.dumps(result, ensure_ascii=False) if result is not None else None, image,
+                 task.get('error'), task['id'], worker_id, TaskStatus.PROCESSING)).rowcount
+            conn.execute("UPDATE queue_workers SET current_task = NULL WHERE id = ?", (worker_id,))
+        return bool(updated)
+
+    def unregister(self, worker_id):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM queue_workers WHERE id = ?", (worker_id,))
+
+    def workers(self):
+        """存活節點清單"""
+        now = time.time()
+        rows = self.connection().execute(
+            "SELECT id, host, pid, model, current_task, started_at, heartbeat FROM queue_workers "
+            "WHERE heartbeat >= ? ORDER BY started_at", (now - self.worker_ttl(),))
+        return [{
+            'id': row['id'],
+            'host': row['host'],
+            'pid': row['pid'],
+            'model': row['model'],
+            'current_task': row['current_task'],
+            'started_at': row['started_at'],
+            'heartbeat_age': round(now - row['heartbeat'], 1),
+        } for row in rows]
+
+
+class BrokerQueueService(QueueService):
+    """以 QueueBroker 儲存任務的佇列服務
+
+    web worker 只使用提交 / 查詢方法；呼叫 start() 的行程成為工作節點，
+    以租約領取任務並沿用 QueueService 的生成流程。
+    """
+
+    def __init__(self, broker=None, worker_id=None):
+        super().__init__(max_concurrent=1)
+        self.broker = broker or get_queue_broker()
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.current_task_id = None
+        self._heartbeat_thread = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self.broker.heartbeat(self.worker_id, self._loaded_model())
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat_thread.start()
+        self.worker_thread = threading.Thread(target=self._process_loop, daemon=True)
+        self.worker_thread.start()
+        print(f"[Queue] broker 工作節點已啟動: {self.worker_id} ({self.broker.db_path})")
+        self._resume_bulk_jobs()
+
+    def stop(self):
+        self._running = False
+        try:
+            self.broker.unregister(self.worker_id)
+        except sqlite3.Error:
+            pass
+
+    # ── 提交 / 查詢 ────────────────────────────────────────────
+    def _enqueue(self, task, max_pending=None):
+        self.broker.put(task, max_pending)
+
+    def get_task(self, task_id):
+        return self.broker.get(task_id)
+
+    def _cancel_task(self, task_id):
+        return self.broker.cancel(task_id)
+
+    def get_queue_status(self):
+        counts = self.broker.status_counts()
+        return {
+            'queue_length': counts.get(TaskStatus.PENDING, 0),
+            'processing': counts.get(TaskStatus.PROCESSING, 0),
+            'completed': counts.get(TaskStatus.COMPLETED, 0),
+            'failed': counts.get(TaskStatus.FAILED, 0),
+            'total': sum(counts.values()),
+            'tenants': self.broker.tenant_stats(),
+            'backend': 'sqlite',
+            'workers': self.broker.workers(),
+        }
+
+    def lane_depth(self):
+        return self.broker.lane_depth()
+
+    def get_recent_tasks(self, limit=20):
+        return self.broker.recent(limit)
+
+    def clear_completed(self):
+        return {'cleared': self.broker.clear_finished()}
+
+    # ── 工作節點 ───────────────────────────────────────────────
+    def _loaded_model(self):
+        from services.model_registry import get_model_registry
+        return get_model_registry().active_model_id
+
+    def _heartbeat_loop(self):
+        while self._running:
+            time.sleep(config.QUEUE_HEARTBEAT_INTERVAL)
+            task_id = self.current_task_id
+            try:
+                if not self.broker.heartbeat(self.worker_id, self._loaded_model(), task_id):
+                    print(f"[Queue] 任務 {task_id} 租約已失效，結果將不會寫回")
+            except sqlite3.Error as e:
+                print(f"[Queue] 心跳失敗: {e}")
+
+    def _process_loop(self):
+        while self._running:
+            try:
+                deferred, active_model = self._rate_limited_models()
+                task = self.broker.claim(self.worker_id, active_model, deferred)
+            except sqlite3.Error as e:
+                print(f"[Queue] 領取任務失敗: {e}")
+                task = None
+            if task is None:
+                time.sleep(0.5)
+                continue
+
+            self.current_task_id = task['id']
+            self.active_count = 1
+            try:
+                self._run_task(task)
+            finally:
+                self.current_task_id = None
+                self.active_count = 0
+
+    def _is_cancelled(self, task):
+        return task['status'] == TaskStatus.CANCELLED or self.broker.is_cancelled(task['id'])
+
+    def _finish_task(self, task):
+        if not self.broker.finish(task, self.worker_id):
+            print(f"[Queue] 任務 {task['id']} 已取消或由其他節點接手，捨棄結果")
+            return False
+        return True
+
+
+# 全域單例
+_queue_broker = None
+_queue_broker_lock = threading.Lock()
+
+
+def get_queue_broker():
+    """取得佇列 broker 單例"""
+    global _queue_broker
+    if _queue_broker is None:
+        with _queue_broker_lock:
+            if _queue_broker is None:
+                _queue_broker = QueueBroker()
+    return _queue_broker
@@ -1,6 +1,19 @@
 """
 Queue Service - 生成佇列管理服務
 管理非同步圖片生成任務，支援優先順序、狀態追蹤和取消
+
+任務預設存在行程記憶體內；QUEUE_BACKEND = "sqlite" 時改用共用 broker
+（services/queue_broker.py），可由多個推論行程 / 節點共同處理。
+
+指定雲端模型的任務在該模型達到速率上限（provider_settings.json 的 rate_limits）時
+留在佇列中，先處理其他可執行的任務，額度恢復後再送出。
+
+同一優先順序內依租戶（API 金鑰；網頁介面為 "web"）以加權 DRR 輪流處理
+（services/fair_scheduler.py），單一金鑰大量提交不會讓其他人一直等待；
+每個金鑰另有待處理任務數上限。
+
+參數帶 webhook（/api/v1/jobs）的任務結束後交由 services/webhook_service.py 在背景投遞通知；
+大量生成工作（services/bulk_service.py）的任務結束後記錄結果並補入下一筆。
 """
 import os
 import json
@@ -10,6 +23,7 @@ import time
 from datetime import datetime
 from collections import deque
 import config
+from services.fair_scheduler import DeficitRoundRobin, WEB_TENANT, task_cost
 
 
 class TaskStatus:
@@ -20,6 +34,16 @@ class TaskStatus:
     CANCELLED = 'cancelled'
 
 
+class QueueLimitError(Exception):
+    """租戶的待處理任務數已達上限"""
+
+    def __init__(self, tenant, limit):
+        self.tenant = tenant
+        self.limit = limit
+        self.ipc_args = (tenant, limit)
+        super().__init__(f"待處理任務已達上限 ({limit})，請等待現有任務完成後再提交")
+
+
 class QueueService:
     """生成佇列服務"""
 
@@ -31,6 +55,8 @@ class QueueService:
         self.lock = threading.Lock()
         self.worker_thread = None
         self._running = False
+        self._drr = DeficitRoundRobin()
+        self._tenant_waits = {}  # tenant -> {'started': 已開始任務數, 'wait_total': 秒, 'max_wait': 秒}
 
     def start(self):
         """啟動佇列處理器"""
@@ -40,28 +66,54 @@ class QueueService:
         self.worker_thread = threading.Thread(target=self._process_loop, daemon=True)
         self.worker_thread.start()
         print("[Queue] 佇列處理器已啟動")
+        self._resume_bulk_jobs()
+
+    def _resume_bulk_jobs(self):
+        """背景接續重啟前未完成的大量生成工作"""
+        def resume():
+            try:
+                from services.bulk_service import get_bulk_service
+                get_bulk_service().resume()
+            except Exception as e:
+                print(f"[Queue] 接續大量生成工作失敗: {e}")
+        threading.Thread(target=resume, name='bulk-resume', daemon=True).start()
 
     def stop(self):
         """停止佇列處理器"""
         self._running = False
 
-    def submit(self, task_type, params, priority=0):
+    def submit(self, task_type, params, priority=0, tenant=None, weight=1.0, max_pending=None):
         """提交新任務到佇列
 
         Args:
             task_type: 任務類型 (generate, batch, img2img, variation)
             params: 任務參數
             priority: 優先順序 (數字越大越優先)
+            tenant: 租戶（API 金鑰 id；None = 網頁介面）
+            weight: 公平排程權重（越大分到越多處理量）
+            max_pending: 此租戶待處理任務數上限（None = 不限制）
 
         Returns:
             dict: 任務資訊
+
+        Raises:
+            QueueLimitError: 租戶待處理任務已達上限
         """
+        task = self._new_task(task_type, params, priority, tenant, weight)
+        self._enqueue(task, max_pending)
+        print(f"[Queue] 任務已加入佇列: {task['id']} ({task_type}, {task['tenant']})")
+        return task
+
+    def _new_task(self, task_type, params, priority, tenant=None, weight=1.0):
         task_id = str(uuid.uuid4())[:12]
-        task = {
+        return {
             'id': task_id,
             'type': task_type,
             'params': params,
             'priority': priority,
+            'tenant': tenant or WEB_TENANT,
+            'weight': weight or 1.0,
+            'cost': task_cost(params),
             'status': TaskStatus.PENDING,
             'created_at': datetime.now().isoformat(),
             'started_at': None,
@@ -71,7 +123,13 @@ class QueueService:
             'error': None
         }
 
+    def _enqueue(self, task, max_pending=None):
+        task_id = task['id']
         with self.lock:
+            if max_pending is not None:
+                pending = sum(1 for tid in self.queue if self.tasks[tid].get('tenant') == task['tenant'])
+                if pending >= max_pending:
+                    raise QueueLimitError(task['tenant'], max_pending)
             self.tasks[task_id] = task
             self.queue.append(task_id)
             # 依優先順序排序
@@ -80,15 +138,18 @@ class QueueService:
                                   reverse=True)
             self.queue = deque(sorted_queue)
 
-        print(f"[Queue] 任務已加入佇列: {task_id} ({task_type})")
-        return task
-
     def get_task(self, task_id):
         """取得任務狀態"""
         return self.tasks.get(task_id)
 
     def cancel_task(self, task_id):
         """取消任務"""
+        result = self._cancel_task(task_id)
+        if result['success']:
+            self._on_cancelled(self.get_task(task_id))
+        return result
+
+    def _cancel_task(self, task_id):
         with self.lock:
             task = self.tasks.get(task_id)
             if not task:
@@ -118,9 +179,58 @@ class QueueService:
             'processing': processing,
             'completed': completed,
             'failed': failed,
-            'total': len(self.tasks)
+            'total': len(self.tasks),
+            'tenants': self.tenant_stats()
         }
 
+    def tenant_stats(self):
+        """各租戶的待處理 / 處理中任務數、最久等待秒數與已開始任務的平均等待"""
+        now = datetime.now()
+        stats = {}
+
+        def entry(tenant):
+            return stats.setdefault(tenant, {'pending': 0, 'processing': 0, 'oldest_wait': 0.0,
+                                             'started': 0, 'avg_wait': None, 'max_wait': None})
+        with self.lock:
+            for task_id in self.queue:
+                task = self.tasks.get(task_id)
+                if not task:
+                    continue
+                item = entry(task.get('tenant', WEB_TENANT))
+                item['pending'] += 1
+                try:
+                    waited = (now - datetime.fromisoformat(task['created_at'])).total_seconds()
+                    item['oldest_wait'] = round(max(item['oldest_wait'], waited), 1)
+                except (KeyError, ValueError):
+                    pass
+            for task in self.tasks.values():
+                if task['status'] == TaskStatus.PROCESSING:
+                    entry(task.get('tenant', WEB_TENANT))['processing'] += 1
+            for tenant, waits in self._tenant_waits.items():
+                item = entry(tenant)
+                item['started'] = waits['started']
+                item['avg_wait'] = round(waits['wait_total'] / waits['started'], 2)
+                item['max_wait'] = round(waits['max_wait'], 2)
+        return stats
+
+    def _record_tenant_wait(self, task, waited):
+        with self.lock:
+            waits = self._tenant_waits.setdefault(task.get('tenant', WEB_TENANT),
+                                                  {'started': 0, 'wait_total': 0.0, 'max_wait': 0.0})
+            waits['started'] += 1
+            waits['wait_total'] += waited
+            waits['max_wait'] = max(waits['max_wait'], waited)
+
+    def lane_depth(self):
+        """各任務類型的待處理數與執行中任務數（指標收集用）"""
+        depth = {}
+        with self.lock:
+            for task_id in self.queue:
+                task = self.tasks.get(task_id)
+                lane = task['type'] if task else 'unknown'
+                depth[lane] = depth.get(lane, 0) + 1
+            return depth, self.active_count
+
     def get_recent_tasks(self, limit=20):
         """取得最近的任務列表"""
         tasks_list = sorted(
@@ -150,15 +260,58 @@ class QueueService:
                 del self.tasks[tid]
         return {'cleared': len(to_remove)}
 
+    def _rate_limited_models(self):
+        """目前受雲端速率限制需延後的模型 {model_id: 預估等待秒數} 與目前使用中的模型"""
+        try:
+            from services.model_registry import get_model_registry
+            registry = get_model_registry()
+            return registry.cloud_waits(), registry.active_model_id
+        except Exception:
+            return {}, None
+
+    def _next_runnable(self, deferred, active_model):
+        """取出下一個任務（呼叫端持有 self.lock）
+
+        略過受速率限制的任務，以及未開啟 QUEUE_SWITCH_MODELS 時指定其他模型的任務（保持排隊，
+        待該模型成為使用中模型），取最高優先順序，再以 DRR 在該層各租戶最前面的任務間選擇。
+        """
+        heads = {}
+        top = None
+        for task_id in self.queue:
+            task = self.tasks.get(task_id)
+            if task is None:
+                continue
+            wanted = task['params'].get('model')
+            if wanted and wanted != active_model and not config.QUEUE_SWITCH_MODELS:
+                continue
+            model = wanted or active_model
+            if model in deferred:
+                continue
+            priority = task.get('priority', 0)
+            if top is None:
+                top = priority
+            elif priority < top:
+                break
+            heads.setdefault(task.get('tenant', WEB_TENANT), task)
+        tenant = self._drr.pick({t: (task.get('cost', 1.0), task.get('weight', 1.0))
+                                 for t, task in heads.items()})
+        if tenant is None:
+            return None
+        task_id = heads[tenant]['id']
+        self.queue.remove(task_id)
+        return task_id
+
     def _process_loop(self):
         """佇列處理主迴圈"""
         while self._running:
             task_id = None
+            deferred, active_model = self._rate_limited_models() if self.queue else ({}, None)
 
             with self.lock:
                 if self.active_count < self.max_concurrent and self.queue:
-                    task_id = self.queue.popleft()
-                    self.active_count += 1
+                    task_id = self._next_runnable(deferred, active_model)
+                    if task_id:
+                        self.active_count += 1
 
             if task_id:
                 self._execute_task(task_id)
@@ -172,16 +325,80 @@ class QueueService:
         task = self.tasks.get(task_id)
         if not task or task['status'] == TaskStatus.CANCELLED:
             return
+        self._run_task(task)
+
+    def _is_cancelled(self, task):
+        return task['status'] == TaskStatus.CANCELLED
+
+    def _finish_task(self, task):
+        """任務結束（完成或失敗）後的保存點，記憶體佇列不需處理
+
+        Returns:
+            bool: 結果是否有效（False = 已取消或由其他節點接手）
+        """
+        return True
+
+    def _on_finished(self, task):
+        """任務結束的後續處理：大量生成工作記錄結果、webhook 排入背景投遞（失敗不影響任務）"""
+        params = task.get('params') or {}
+        if params.get('bulk'):
+            try:
+                from services.bulk_service import get_bulk_service
+                get_bulk_service().on_task_finished(task)
+            except Exception as e:
+                print(f"[Queue] 任務 {task['id']} 大量生成結果記錄失敗: {e}")
+        webhook = params.get('webhook')
+        if not webhook:
+            return
+        try:
+            from services.api_key_service import get_api_key_service
+            from services.webhook_service import get_webhook_service, job_payload
+            secret = get_api_key_service().get_webhook_secret(task.get('tenant'))
+            if not secret:
+                print(f"[Queue] 任務 {task['id']} 的金鑰沒有 webhook secret，略過通知")
+                return
+            get_webhook_service().deliver(task['id'], webhook['url'], job_payload(task), secret)
+        except Exception as e:
+            print(f"[Queue] 任務 {task['id']} webhook 排入失敗: {e}")
+
+    def _on_cancelled(self, task):
+        """大量生成工作的任務被取消時記為失敗，工作繼續處理下一筆"""
+        if not task or not (task.get('params') or {}).get('bulk'):
+            return
+        try:
+            from services.bulk_service import get_bulk_service
+            get_bulk_service().on_task_finished(task)
+        except Exception as e:
+            print(f"[Queue] 任務 {task['id']} 大量生成結果記錄失敗: {e}")
+
+    def webhook_status(self, task_id):
+        """任務的 webhook 投遞狀態（只記錄在處理該任務的行程內）"""
+        from services.webhook_service import get_webhook_service
+        return get_webhook_service().delivery_status(task_id)
 
+    def _run_task(self, task):
+        task_id = task['id']
         task['status'] = TaskStatus.PROCESSING
-        task['started_at'] = datetime.now().isoformat()
+        started_at = datetime.now()
+        task['started_at'] = started_at.isoformat()
+
+        from providers.base import StageTimings
+        timings = StageTimings()
+        try:
+            timings.add('queue_wait', max(0.0, (
+                started_at - datetime.fromisoformat(task['created_at'])).total_seconds()))
+        except (KeyError, ValueError):
+            pass
+        from services.metrics_service import QUEUE_WAIT
+        QUEUE_WAIT.observe(timings.get('queue_wait', 0.0), lane=task['type'])
+        self._record_tenant_wait(task, timings.get('queue_wait', 0.0))
 
         try:
             start_time = time.time()
-            result = self._run_generation(task)
+            result = self._run_generation(task, timings)
             duration = time.time() - start_time
 
-            if task['status'] == TaskStatus.CANCELLED:
+            if self._is_cancelled(task):
                 return
 
             task['status'] = TaskStatus.COMPLETED
@@ -189,31 +406,37 @@ class QueueService:
             task['progress'] = 100
             task['result'] = result
             task['result']['duration'] = round(duration, 2)
+            task['result']['timings'] = timings.rounded()
 
             # 追蹤統計
             try:
                 from services.analytics_service import get_analytics_service
                 analytics = get_analytics_service()
                 analytics.track_generation(
-                    model_id=task['params'].get('model', 'unknown'),
+                    model_id=result.get('model') or task['params'].get('model', 'unknown'),
                     prompt=task['params'].get('prompt', ''),
                     width=task['params'].get('width', config.IMAGE_WIDTH),
                     height=task['params'].get('height', config.IMAGE_HEIGHT),
                     mode=task['type'],
-                    duration=round(duration, 2)
+                    duration=round(duration, 2),
+                    timings=timings
                 )
             except Exception:
                 pass
 
+            if self._finish_task(task):
+                self._on_finished(task)
             print(f"[Queue] 任務完成: {task_id} ({duration:.1f}s)")
 
         except Exception as e:
             task['status'] = TaskStatus.FAILED
             task['completed_at'] = datetime.now().isoformat()
             task['error'] = str(e)
+            if self._finish_task(task):
+                self._on_finished(task)
             print(f"[Queue] 任務失敗: {task_id} - {e}")
 
-    def _run_generation(self, task):
+    def _run_generation(self, task, timings=None):
         """執行圖片生成"""
         import base64
         from io import BytesIO
@@ -223,20 +446,42 @@ class QueueService:
         params = task['params']
         registry = get_model_registry()
 
-        if registry.active_pipeline is None:
-            raise RuntimeError("尚未載入模型")
-
         prompt = params.get('prompt', '')
         width = params.get('width', config.IMAGE_WIDTH)
         height = params.get('height', config.IMAGE_HEIGHT)
         seed = params.get('seed')
         negative_prompt = params.get('negative_prompt')
 
-        image, used_seed = registry.generate(
-            prompt, width, height, seed,
-            negative_prompt=negative_prompt
-        )
-
+        if timings is None:
+            from providers.base import StageTimings
+            timings = StageTimings()
+
+        # 切換與生成在同一把 GPU 鎖內，期間其他請求不會卸載或換掉模型
+        with registry.gpu_lock:
+            model_id = params.get('model')
+            if model_id and model_id != registry.active_model_id:
+                # 切換會改變網頁介面的使用中模型，只在專用工作節點（--queue-worker）允許
+                if not config.QUEUE_SWITCH_MODELS:
+                    raise RuntimeError(f"任務指定模型 {model_id}，但目前使用中的模型為 "
+                                       f"{registry.active_model_id}；此節點不為佇列任務切換模型")
+                switched = registry.switch_model(model_id)
+                if not switched.get('success'):
+                    raise RuntimeError(switched.get('error') or f"無法載入模型: {model_id}")
+
+            if registry.active_model_id is None:
+                raise RuntimeError("尚未載入模型")
+
+            image, used_seed = registry.generate(
+                prompt, width, height, seed,
+                negative_prompt=negative_prompt,
+                timings=timings
+            )
+        if isinstance(image, str):
+            # 雲端模型回傳 base64
+            from PIL import Image
+            image = Image.open(BytesIO(base64.b64decode(image)))
+
+        persist_start = time.perf_counter()
         # 儲存
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"queue_{timestamp}_{task['id']}.png"
@@ -245,7 +490,8 @@ class QueueService:
 
         # 歷史記錄
         history_service = get_history_service()
-        history_service.add_to_history(f"[queue] {prompt}", filename)
+        history_service.add_to_history(f"[queue] {prompt}", filename,
+                                       model=registry.active_model_id)
 
         # 加入專案（如果指定）
         project_id = params.get('project_id')
@@ -260,11 +506,13 @@ class QueueService:
                 )
             except Exception:
                 pass
+        timings.add('persist', time.perf_counter() - persist_start)
 
         # base64
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        with timings.stage('image_encode'):
+            buffered = BytesIO()
+            image.save(buffered, format="PNG")
+            img_str = base64.b64encode(buffered.getvalue()).decode()
 
         return {
             'filename': filename,
@@ -272,7 +520,8 @@ class QueueService:
             'prompt': prompt,
             'seed': used_seed,
             'width': width,
-            'height': height
+            'height': height,
+            'model': registry.active_model_id
         }
 
 
@@ -284,6 +533,17 @@ def get_queue_service():
     """取得佇列服務單例"""
     global _queue_service
     if _queue_service is None:
-        _queue_service = QueueService(max_concurrent=1)
-        _queue_service.start()
+        from services.inference_ipc import is_remote, RemoteQueueService
+        if config.QUEUE_BACKEND == 'sqlite':
+            from services.queue_broker import BrokerQueueService
+            _queue_service = BrokerQueueService()
+            # web worker 只提交與查詢，由推論行程 / 節點領取任務
+            if not is_remote():
+                _queue_service.start()
+        elif is_remote():
+            # 生產模式：佇列與處理器在推論行程
+            _queue_service = RemoteQueueService()
+        else:
+            _queue_service = QueueService(max_concurrent=1)
+            _queue_service.start()
     return _queue_service
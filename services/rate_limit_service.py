@@ -0,0 +1,129 @@
+"""
+Rate Limit Service - 對外 API 的每金鑰速率限制
+以 GCRA（Generic Cell Rate Algorithm）依 API 金鑰雜湊分別計算讀取與生成兩種額度：
+
+- read:     history、models 等查詢（金鑰的 read_rate_limit，每分鐘）
+- generate: 佔用 GPU / 雲端額度的生成請求（金鑰的 rate_limit，每分鐘）
+
+每個 (金鑰, 額度) 只保存一個理論到達時間（TAT），判斷為 O(1)；
+可連續突發的請求數為 API_RATE_LIMIT_BURST_SECONDS 秒的額度。
+狀態在各 web 行程記憶體內，serve.py 多 worker 時每個 worker 各自計算。
+"""
+import math
+import time
+import threading
+import config
+
+BUDGETS = ('read', 'generate')
+
+# 已完全恢復額度的項目超過此數量時清理
+_PRUNE_THRESHOLD = 10000
+
+
+class RateLimitService:
+    """GCRA 速率限制（單例）"""
+
+    def __init__(self):
+        self._tat = {}  # (key_hash, budget) -> 理論到達時間（monotonic 秒）
+        self._lock = threading.Lock()
+        self.stats = {'checks': 0, 'limited': 0, 'check_seconds': 0.0}
+
+    @staticmethod
+    def limit_for(key_info, budget):
+        """金鑰的每分鐘上限；0 或 None 表示不限制"""
+        if budget == 'generate':
+            return key_info.get('rate_limit', config.API_RATE_LIMIT_DEFAULT)
+        return key_info.get('read_rate_limit', config.API_READ_RATE_LIMIT_DEFAULT)
+
+    @staticmethod
+    def burst_for(limit):
+        return max(1, int(limit * config.API_RATE_LIMIT_BURST_SECONDS / 60))
+
+    def check(self, key_hash, budget, limit):
+        """扣除一次額度
+
+        Returns:
+            dict: allowed, limit, remaining, reset（額度完全恢復秒數）, retry_after（被拒時）
+        """
+        start = time.perf_counter()
+        interval = 60.0 / limit
+        burst = self.burst_for(limit)
+        window = interval * burst
+        key = (key_hash, budget)
+        now = time.monotonic()
+        with self._lock:
+            tat = max(self._tat.get(key, now), now)
+            new_tat = tat + interval
+            allow_at = new_tat - window
+            allowed = now >= allow_at
+            if allowed:
+                self._tat[key] = new_tat
+                if len(self._tat) > _PRUNE_THRESHOLD:
+                    self._prune(now)
+            else:
+                new_tat = tat
+            self.stats['checks'] += 1
+            if not allowed:
+                self.stats['limited'] += 1
+            self.stats['check_seconds'] += time.perf_counter() - start
+
+        result = {
+            'allowed': allowed,
+            'limit': limit,
+            'burst': burst,
+            'remaining': max(0, int((window - (new_tat - now)) / interval)),
+            'reset': max(0, math.ceil(new_tat - now)),
+        }
+        if not allowed:
+            result['retry_after'] = max(1, math.ceil(allow_at - now))
+        return result
+
+    def _prune(self, now):
+        """移除已完全恢復額度的項目（呼叫端持有 self._lock）"""
+        for key in [k for k, tat in self._tat.items() if tat <= now]:
+            del self._tat[key]
+
+    def reset(self, key_hash=None):
+        """清除某金鑰（或全部）的計數，金鑰刪除或上限變更時呼叫"""
+        with self._lock:
+            for key in [k for k in self._tat if key_hash is None or k[0] == key_hash]:
+                del self._tat[key]
+
+    def get_stats(self):
+        with self._lock:
+            checks = self.stats['checks']
+            return {
+                'checks': checks,
+                'limited': self.stats['limited'],
+                'tracked_keys': len(self._tat),
+                'avg_check_us': round(self.stats['check_seconds'] / checks * 1e6, 2) if checks else None,
+            }
+
+
+def rate_limit_headers(result):
+    """RateLimit-* 標頭（IETF draft: RateLimit-Limit / Remaining / Reset / Policy）"""
+    headers = {
+        'RateLimit-Limit': str(result['burst']),
+        'RateLimit-Remaining': str(result['remaining']),
+        'RateLimit-Reset': str(result['reset']),
+        'RateLimit-Policy': f"{result['burst']};w={config.API_RATE_LIMIT_BURST_SECONDS}, "
+                            f"{result['limit']:g};w=60",
+    }
+    if not result['allowed']:
+        headers['Retry-After'] = str(result['retry_after'])
+    return headers
+
+
+# 全域單例
+_rate_limit_service = None
+_rate_limit_lock = threading.Lock()
+
+
+def get_rate_limit_service():
+    """取得速率限制服務單例"""
+    global _rate_limit_service
+    if _rate_limit_service is None:
+        with _rate_limit_lock:
+            if _rate_limit_service is None:
+                _rate_limit_service = RateLimitService()
+    return _rate_limit_service
@@ -0,0 +1,262 @@
+"""
+Search Service - 提示詞全文搜尋
+以 SQLite FTS5 索引歷史記錄、收藏、提示詞庫與專案圖片的提示詞
+
+- 歷史與收藏由資料庫觸發器同步；提示詞庫與專案仍存於 JSON，異動時呼叫 index_* 同步
+- 中日韓文字以單字為詞元，查詢時連續字元視為片語（「夕陽」→ "夕 陽"）
+- 英文詞自動前綴比對（輸入 "cyber" 可找到 cyberpunk），"-詞" 排除
+- 依 bm25 相關度排序；命中過多時只對最新的 RANK_WINDOW 筆計分，較舊的命中依時間接在其後，
+  常見詞在十萬筆以上仍維持毫秒級
+"""
+import re
+import json
+import sqlite3
+from services.metadata_store import get_metadata_store, segment_text
+
+
+SEARCH_SOURCES = ('history', 'favorite', 'library', 'project')
+MAX_SEARCH_LIMIT = 200
+# bm25 需逐筆計分，常見詞在大量資料下只對最新的 N 筆候選排序
+RANK_WINDOW = 1000
+
+_WORD_RE = re.compile(r'\w')
+
+
+def build_match_query(query, prefix_last=True):
+    """將使用者輸入轉為 FTS5 MATCH 語法，無有效詞時回傳 None
+
+    - 空白分隔的詞之間為 AND
+    - 以 * 結尾為前綴查詢；prefix_last 時最後一個詞自動前綴（邊打邊搜）
+    - 以 - 開頭的詞為排除條件
+    """
+    positives, negatives = [], []
+    terms = (query or '').split()
+    for index, raw in enumerate(terms):
+        negate = raw.startswith('-') and len(raw) > 1
+        term = raw[1:] if negate else raw
+        prefix = term.endswith('*')
+        term = term.rstrip('*')
+        if not _WORD_RE.search(term):
+            continue
+
+        phrase = '"' + ' '.join(segment_text(term).split()).replace('"', '""') + '"'
+        # 中日韓單字詞元已完整，前綴比對沒有意義
+        if not negate and (prefix or (prefix_last and index == len(terms) - 1)) \
+                and not segment_text(term).endswith(' '):
+            phrase += '*'
+        (negatives if negate else positives).append(phrase)
+
+    if not positives:
+        return None
+    match = ' '.join(positives)
+    for phrase in negatives:
+        match += f' NOT {phrase}'
+    return match
+
+
+class SearchService:
+    """提示詞全文搜尋服務"""
+
+    def __init__(self):
+        self.store = get_metadata_store()
+
+    # ── 索引維護 ───────────────────────────────────────────────
+    def _upsert(self, conn, source, ref_id, text, extra=''):
+        body = segment_text(f"{extra} {text}" if extra else text)
+        conn.execute(
+            "INSERT INTO search_docs (source, ref_id, text, body) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(source, ref_id) DO UPDATE SET text = excluded.text, body = excluded.body "
+            "WHERE text != excluded.text OR body != excluded.body",
+            (source, ref_id, text, body)
+        )
+
+    @staticmethod
+    def _library_extra(entry):
+        return ' '.join([entry.get('title', '')] + list(entry.get('tags') or []))
+
+    def index_library_prompt(self, entry):
+        with self.store.transaction() as conn:
+            self._upsert(conn, 'library', entry['id'], entry.get('prompt', ''),
+                         self._library_extra(entry))
+
+    def remove_library_prompt(self, prompt_id):
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM search_docs WHERE source = 'library' AND ref_id = ?",
+                         (prompt_id,))
+
+    def sync_library(self, prompts):
+        """以提示詞庫內容重建 library 來源的索引（只寫入有變動的項目）"""
+        with self.store.transaction() as conn:
+            wanted = {p['id'] for p in prompts}
+            existing = {row['ref_id'] for row in conn.execute(
+                "SELECT ref_id FROM search_docs WHERE source = 'library'")}
+            for ref_id in existing - wanted:
+                conn.execute("DELETE FROM search_docs WHERE source = 'library' AND ref_id = ?",
+                             (ref_id,))
+            for entry in prompts:
+                self._upsert(conn, 'library', entry['id'], entry.get('prompt', ''),
+                             self._library_extra(entry))
+
+    @staticmethod
+    def _project_range(project_id):
+        # 專案本身的 ref_id 為 "<id>"，圖片為 "<id>/<filename>"；'0' 是 '/' 的下一個字元
+        return project_id, project_id + '/', project_id + '0'
+
+    def _index_project(self, conn, project):
+        pid, low, high = self._project_range(project['id'])
+        wanted = {pid}
+        self._upsert(conn, 'project', pid, project.get('description', ''), project.get('name', ''))
+        for img in project.get('images', []):
+            if not img.get('prompt'):
+                continue
+            ref_id = low + img['filename']
+            wanted.add(ref_id)
+            self._upsert(conn, 'project', ref_id, img['prompt'])
+        for row in conn.execute(
+                "SELECT ref_id FROM search_docs WHERE source = 'project' "
+                "AND (ref_id = ? OR (ref_id >= ? AND ref_id < ?))", (pid, low, high)).fetchall():
+            if row['ref_id'] not in wanted:
+                conn.execute("DELETE FROM search_docs WHERE source = 'project' AND ref_id = ?",
+                             (row['ref_id'],))
+
+    def index_project(self, project):
+        with self.store.transaction() as conn:
+            self._index_project(conn, project)
+
+    def remove_project(self, project_id):
+        pid, low, high = self._project_range(project_id)
+        with self.store.transaction() as conn:
+            conn.execute(
+                "DELETE FROM search_docs WHERE source = 'project' "
+                "AND (ref_id = ? OR (ref_id >= ? AND ref_id < ?))", (pid, low, high))
+
+    def sync_projects(self, projects):
+        """以專案清單重建 project 來源的索引"""
+        with self.store.transaction() as conn:
+            wanted = {p['id'] for p in projects}
+            stale = {row['ref_id'].split('/', 1)[0] for row in conn.execute(
+                "SELECT ref_id FROM search_docs WHERE source = 'project'")} - wanted
+            for project_id in stale:
+                self.remove_project(project_id)
+            for project in projects:
+                self._index_project(conn, project)
+
+    # ── 查詢 ───────────────────────────────────────────────────
+    def _source_clause(self, sources):
+        if not sources:
+            return '', []
+        unknown = set(sources) - set(SEARCH_SOURCES)
+        if unknown:
+            raise ValueError(f"未知的搜尋來源: {', '.join(sorted(unknown))}")
+        return f" AND d.source IN ({','.join('?' * len(sources))})", list(sources)
+
+    def _rank_floor(self, match, sources=None):
+        """命中超過 RANK_WINDOW 筆時，回傳第 N 新命中的 docid 作為計分下限
+
+        rowid 條件會推入 FTS5 doclist 掃描，bm25 只計算下限之後的文件
+        """
+        clause, params = self._source_clause(sources)
+        # 不限來源時不需要 JOIN，直接走 doclist
+        join = " JOIN search_docs d ON d.docid = prompt_fts.rowid" if clause else ''
+        row = self.store.execute(
+            f"SELECT prompt_fts.rowid FROM prompt_fts{join} "
+            f"WHERE prompt_fts MATCH ?{clause} ORDER BY prompt_fts.rowid DESC LIMIT 1 OFFSET ?",
+            [match] + params + [RANK_WINDOW - 1]
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _ranked_rows(self, columns, match, sources, limit):
+        """最新 RANK_WINDOW 筆命中依 bm25 排序，不足 limit 時再依時間（新到舊）接上較舊的命中"""
+        clause, params = self._source_clause(sources)
+        base = (f"SELECT {columns} FROM prompt_fts JOIN search_docs d ON d.docid = prompt_fts.rowid "
+                f"WHERE prompt_fts MATCH ?{clause}")
+        floor = self._rank_floor(match, sources)
+        rows = self.store.execute(
+            base + " AND prompt_fts.rowid >= ? ORDER BY rank LIMIT ?",
+            [match] + params + [floor, limit]
+        ).fetchall()
+        if floor and len(rows) < limit:
+            # 計分視窗之外的命中不計分排序，但不會被捨棄
+            rows += self.store.execute(
+                base + " AND prompt_fts.rowid < ? ORDER BY prompt_fts.rowid DESC LIMIT ?",
+                [match] + params + [floor, limit - len(rows)]
+            ).fetchall()
+        return rows
+
+    def search_ids(self, query, source, limit=MAX_SEARCH_LIMIT):
+        """回傳指定來源中符合查詢的 ref_id（依相關度排序）"""
+        match = build_match_query(query)
+        if not match:
+            return []
+        rows = self._ranked_rows("d.ref_id", match, [source], limit)
+        return [row['ref_id'] for row in rows]
+
+    def search(self, query, sources=None, limit=20):
+        """全文搜尋提示詞
+
+        Returns:
+            list[dict]: source, id, text, score，歷史附 filename / image_url，
+            專案附 project_id / filename
+        """
+        match = build_match_query(query)
+        if not match:
+            return []
+        limit = max(1, min(int(limit), MAX_SEARCH_LIMIT))
+
+        try:
+            rows = self._ranked_rows("d.source, d.ref_id, d.text, bm25(prompt_fts) AS score",
+                                     match, sources, limit)
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"無效的搜尋語法: {e}")
+
+        results = [{
+            'source': row['source'],
+            'id': row['ref_id'],
+            'text': row['text'],
+            'score': round(-row['score'], 6)
+        } for row in rows]
+        self.attach_details(results)
+        return results
+
+    def attach_details(self, results):
+        """為搜尋結果補上歷史圖片與專案資訊"""
+        history_ids = [r['id'] for r in results if r['source'] == 'history']
+        if history_ids:
+            rows = self.store.execute(
+                f"SELECT id, filename, image_url, timestamp, tags FROM history "
+                f"WHERE id IN ({','.join('?' * len(history_ids))})", history_ids
+            ).fetchall()
+            details = {row['id']: row for row in rows}
+            for result in results:
+                row = details.get(result['id']) if result['source'] == 'history' else None
+                if row:
+                    result.update({
+                        'filename': row['filename'],
+                        'image_url': row['image_url'],
+                        'timestamp': row['timestamp'],
+                        'tags': json.loads(row['tags'] or '[]')
+                    })
+        for result in results:
+            if result['source'] == 'project':
+                project_id, _, filename = result['id'].partition('/')
+                result['project_id'] = project_id
+                if filename:
+                    result['filename'] = filename
+                    result['image_url'] = f'/images/{filename}'
+
+    def count_documents(self):
+        rows = self.store.execute(
+            "SELECT source, COUNT(*) AS n FROM search_docs GROUP BY source").fetchall()
+        return {row['source']: row['n'] for row in rows}
+
+
+# 全域單例
+_search_service = None
+
+
+def get_search_service():
+    """取得搜尋服務單例"""
+    global _search_service
+    if _search_service is None:
+        _search_service = SearchService()
+    return _search_service
@@ -0,0 +1,229 @@
+"""
+Webhook Service - 非同步任務完成通知
+
+/api/v1/jobs 提交的任務帶 webhook_url 時，任務完成或失敗後 POST JSON 到該網址：
+
+- 投遞在獨立的執行緒池進行，佇列 / GPU 工作執行緒只負責排入，不等待網路
+- 失敗（連線錯誤、逾時、408 / 429 / 5xx）以指數退避重試，最多 WEBHOOK_MAX_ATTEMPTS 次；
+  等待期間以計時器重新排入，不佔用投遞執行緒
+- 簽章：X-ZImage-Signature: t=<unix 秒>,v1=<HMAC-SHA256(secret, "<t>.<body>")>，
+  secret 為 API 金鑰的 webhook_secret（建立金鑰時回傳）
+- 預設拒絕送往本機 / 私有網段（WEBHOOK_ALLOW_PRIVATE = True 可開放，例如本機測試）；
+  主機只解析一次，連線直接使用檢查過的位址（避免 DNS rebinding），不跟隨重新導向（3xx 視為失敗）
+
+投遞狀態保存在處理任務的行程記憶體內（最近 MAX_DELIVERY_RECORDS 筆）。
+"""
+import hmac
+import json
+import time
+import uuid
+import ssl
+import socket
+import hashlib
+import ipaddress
+import threading
+import http.client
+from collections import OrderedDict
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import config
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+MAX_DELIVERY_RECORDS = 1000
+
+
+def sign_payload(secret, body, timestamp=None):
+    """簽章標頭值；接收端以相同方式計算後用常數時間比較"""
+    timestamp = int(timestamp if timestamp is not None else time.time())
+    digest = hmac.new(secret.encode('utf-8'), f"{timestamp}.".encode('utf-8') + body,
+                      hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify_signature(secret, body, header, tolerance=300):
+    """驗證簽章（供接收端 / 測試使用），timestamp 超過 tolerance 秒視為重放"""
+    try:
+        fields = dict(part.split('=', 1) for part in header.split(','))
+        timestamp = int(fields['t'])
+    except (ValueError, KeyError, AttributeError):
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    return hmac.compare_digest(sign_payload(secret, body, timestamp), header)
+
+
+def validate_url(url):
+    """檢查 webhook 網址格式，不合法時拋出 ValueError"""
+    parsed = urlparse(url or '')
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError('webhook_url 必須是 http:// 或 https:// 網址')
+    return url
+
+
+def job_payload(task):
+    """任務結束的通知內容（不含 base64 圖片，改附圖片網址）"""
+    result = task.get('result')
+    summary = None
+    if isinstance(result, dict):
+        summary = {k: v for k, v in result.items() if k != 'image'}
+        if summary.get('filename'):
+            summary['image_url'] = f"/images/{summary['filename']}"
+    return {
+        'event': 'job.completed' if task.get('status') == 'completed' else 'job.failed',
+        'job_id': task['id'],
+        'status': task.get('status'),
+        'created_at': task.get('created_at'),
+        'started_at': task.get('started_at'),
+        'completed_at': task.get('completed_at'),
+        'result': summary,
+        'error': task.get('error'),
+    }
+
+
+def _check_destination(url):
+    """解析主機位址（只解析一次），拒絕送往本機 / 私有網段；回傳實際連線使用的位址"""
+    parsed = urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    infos = socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)
+    if not config.WEBHOOK_ALLOW_PRIVATE:
+        for info in infos:
+            address = ipaddress.ip_address(info[4][0])
+            if address.is_private or address.is_loopback or address.is_link_local or address.is_reserved:
+                raise PermissionError(f'webhook 目的位址 {address} 為內部網路，已拒絕')
+    return infos[0][4][0]
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    """連到已檢查位址的 HTTP 連線；Host 標頭仍使用原主機名稱"""
+
+    def __init__(self, host, port, address, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.pinned_address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.pinned_address, self.port), self.timeout, self.source_address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class _PinnedHTTPSConnection(_PinnedHTTPConnection, http.client.HTTPSConnection):
+    """連到已檢查位址的 HTTPS 連線；TLS SNI 與憑證驗證使用原主機名稱"""
+
+    def __init__(self, host, port, address, **kwargs):
+        self.ssl_context = ssl.create_default_context()
+        super().__init__(host, port, address, context=self.ssl_context, **kwargs)
+
+    def connect(self):
+        _PinnedHTTPConnection.connect(self)
+        self.sock = self.ssl_context.wrap_socket(self.sock, server_hostname=self.host)
+
+
+def _pinned_connection(url, address):
+    """連到已檢查位址（避免 DNS rebinding）的 HTTP(S) 連線"""
+    parsed = urlparse(url)
+    cls = _PinnedHTTPSConnection if parsed.scheme == 'https' else _PinnedHTTPConnection
+    return cls(parsed.hostname, parsed.port, address, timeout=config.WEBHOOK_TIMEOUT)
+
+
+class WebhookService:
+    """Webhook 投遞服務（單例）"""
+
+    def __init__(self):
+        self._pool = ThreadPoolExecutor(max_workers=config.WEBHOOK_WORKERS, thread_name_prefix='webhook')
+        self._lock = threading.Lock()
+        self._deliveries = OrderedDict()  # job_id -> 投遞狀態
+        self.stats = {'queued': 0, 'delivered': 0, 'failed': 0, 'retries': 0}
+
+    def deliver(self, job_id, url, payload, secret):
+        """排入投遞（立即返回）"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        record = {
+            'id': uuid.uuid4().hex[:16],
+            'url': url,
+            'event': payload.get('event'),
+            'status': 'pending',
+            'attempts': 0,
+            'last_status': None,
+            'last_error': None,
+            'delivered_at': None,
+        }
+        with self._lock:
+            self._deliveries[job_id] = record
+            while len(self._deliveries) > MAX_DELIVERY_RECORDS:
+                self._deliveries.popitem(last=False)
+            self.stats['queued'] += 1
+        self._pool.submit(self._attempt, record, body, secret)
+        return record['id']
+
+    def _attempt(self, record, body, secret):
+        record['attempts'] += 1
+        retryable = True
+        try:
+            url = record['url']
+            conn = _pinned_connection(url, _check_destination(url))
+            parsed = urlparse(url)
+            path = (parsed.path or '/') + (f'?{parsed.query}' if parsed.query else '')
+            try:
+                conn.request('POST', path, body=body, headers={
+                    'Content-Type': 'application/json',
+                    'User-Agent': 'zImage-Webhook/1.0',
+                    'X-ZImage-Event': record['event'] or '',
+                    'X-ZImage-Delivery': record['id'],
+                    'X-ZImage-Signature': sign_payload(secret, body),
+                })
+                status = conn.getresponse().status
+            finally:
+                conn.close()
+            record['last_status'] = status
+            if 200 <= status < 300:
+                record['status'] = 'delivered'
+                record['last_error'] = None
+                record['delivered_at'] = time.time()
+                with self._lock:
+                    self.stats['delivered'] += 1
+                return
+            # 不跟隨重新導向：導向目標未經位址檢查
+            record['last_error'] = f'HTTP {status}' + (' 重新導向（不跟隨）' if 300 <= status < 400 else '')
+            retryable = status in RETRYABLE_STATUS
+        except PermissionError as e:
+            record['last_error'] = str(e)
+            retryable = False
+        except Exception as e:
+            record['last_error'] = str(e) or type(e).__name__
+
+        if retryable and record['attempts'] < config.WEBHOOK_MAX_ATTEMPTS:
+            delay = config.WEBHOOK_RETRY_BASE_DELAY * 2 ** (record['attempts'] - 1)
+            record['status'] = 'retrying'
+            with self._lock:
+                self.stats['retries'] += 1
+            timer = threading.Timer(delay, self._pool.submit, args=(self._attempt, record, body, secret))
+            timer.daemon = True
+            timer.start()
+            return
+        record['status'] = 'failed'
+        with self._lock:
+            self.stats['failed'] += 1
+        print(f"[Webhook] 投遞失敗 {record['url']}（{record['attempts']} 次）: {record['last_error']}")
+
+    def delivery_status(self, job_id):
+        with self._lock:
+            record = self._deliveries.get(job_id)
+            return dict(record) if record else None
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+# 全域單例
+_webhook_service = None
+_webhook_lock = threading.Lock()
+
+
+def get_webhook_service():
+    """取得 Webhook 服務單例"""
+    global _webhook_service
+    if _webhook_service is None:
+        with _webhook_lock:
+            if _webhook_service is None:
+                _webhook_service = WebhookService()
+    return _webhook_service
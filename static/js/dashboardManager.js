@@ -9,6 +9,7 @@
         loadDailyChart();
         loadModelUsage();
         loadModeDistribution();
+        loadGenerationSpeed();
         loadQueueStatus();
         loadApiKeys();
         loadRecentActivity();
@@ -126,6 +127,79 @@
         }
     }
 
+    // ===== 生成速度（p50 / p95 / p99 與各階段耗時） =====
+    function ensureSpeedContainer() {
+        let container = document.getElementById('generationSpeed');
+        if (container) return container;
+        const grid = document.querySelector('.charts-grid');
+        if (!grid) return null;
+        const card = document.createElement('div');
+        card.className = 'chart-card wide';
+        card.innerHTML = `
+            <h3>生成速度 (p50 / p95 / p99)</h3>
+            <div id="generationSpeed" class="usage-list">
+                <p class="empty-data">載入中...</p>
+            </div>
+        `;
+        grid.appendChild(card);
+        return card.querySelector('#generationSpeed');
+    }
+
+    async function loadGenerationSpeed() {
+        try {
+            const res = await fetch('/api/analytics/speed');
+            const { data } = await res.json();
+            const container = ensureSpeedContainer();
+            if (!container) return;
+
+            if (!data.count) {
+                container.innerHTML = '<p class="empty-data">尚無速度資料</p>';
+                return;
+            }
+
+            const stageLabels = {
+                queue_wait: '佇列等待', model_load: '模型載入', text_encode: '文字編碼',
+                denoise: '去噪', vae_decode: 'VAE 解碼', api_call: '雲端 API',
+                image_encode: '圖片編碼', persist: '存檔'
+            };
+            const fmt = (v) => (v === null || v === undefined) ? '-' : `${Number(v).toFixed(2)}s`;
+            const rows = [['總耗時', data]].concat(
+                Object.entries(data.stages || {}).map(([stage, s]) => [stageLabels[stage] || stage, s])
+            );
+            const maxVal = Math.max(0.001, ...rows.map(([, s]) => s.p99 || 0));
+
+            container.innerHTML = '';
+            rows.forEach(([label, s]) => {
+                const item = document.createElement('div');
+                item.className = 'usage-item';
+                item.innerHTML = `
+                    <span class="usage-label">${label}</span>
+                    <div class="usage-bar-wrapper">
+                        <div class="usage-bar" style="width: ${((s.p50 || 0) / maxVal) * 100}%"></div>
+                    </div>
+                    <span class="usage-count">${fmt(s.p50)} / ${fmt(s.p95)} / ${fmt(s.p99)}</span>
+                `;
+                container.appendChild(item);
+            });
+
+            (data.groups || []).slice(0, 5).forEach(group => {
+                if (!group.total) return;
+                const item = document.createElement('div');
+                item.className = 'usage-item';
+                item.innerHTML = `
+                    <span class="usage-label">${group.model} · ${group.resolution}</span>
+                    <div class="usage-bar-wrapper">
+                        <div class="usage-bar" style="width: ${((group.total.p50 || 0) / maxVal) * 100}%"></div>
+                    </div>
+                    <span class="usage-count">${fmt(group.total.p50)} / ${fmt(group.total.p95)} / ${fmt(group.total.p99)} (${group.count})</span>
+                `;
+                container.appendChild(item);
+            });
+        } catch (e) {
+            console.error('載入生成速度失敗:', e);
+        }
+    }
+
     // ===== 佇列狀態 =====
     async function loadQueueStatus() {
         try {
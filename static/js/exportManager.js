@@ -269,7 +269,17 @@ async function executeExport() {
             body: JSON.stringify(requestData)
         });
 
-        if (response.ok) {
+        if (response.status === 202) {
+            // 圖片較多時改為背景工作：輪詢進度，完成後由瀏覽器直接下載
+            const { job } = await response.json();
+            const finished = await waitForExportJob(job, confirmBtn);
+            window.location.href = finished.download_url;
+
+            console.log(`✓ ${exportFormat.toUpperCase()} 導出成功: ${finished.download_name}`);
+            alert(`導出成功！檔案開始下載: ${finished.download_name}`);
+            hideExportDialog();
+
+        } else if (response.ok) {
             // 下載檔案
             const blob = await response.blob();
             const url = window.URL.createObjectURL(blob);
@@ -321,6 +331,27 @@ async function executeExport() {
     }
 }
 
+// 輪詢背景匯出工作直到完成，期間在按鈕上顯示進度
+async function waitForExportJob(job, button) {
+    while (job.status === 'queued' || job.status === 'running') {
+        button.innerHTML = `
+            <div class="spinner-small"></div>
+            處理中... ${job.done}/${job.total}${job.skipped ? `（略過 ${job.skipped} 張）` : ''}
+        `;
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const response = await fetch(job.status_url);
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || '查詢匯出進度失敗');
+        }
+        job = data.job;
+    }
+    if (job.status !== 'done') {
+        throw new Error(job.error || '導出失敗');
+    }
+    return job;
+}
+
 // 刪除選定的圖片
 async function deleteSelectedImages() {
     if (selectedFiles.size === 0) {
@@ -418,25 +418,47 @@ async function handleBatchGenerate() {
             },
             body: JSON.stringify({
                 prompts: lines,
-                negative_prompt: negativePromptInput ? negativePromptInput.value.trim() : ''
+                negative_prompt: negativePromptInput ? negativePromptInput.value.trim() : '',
+                stream: 'ndjson'
             }),
         });
 
-        const data = await response.json();
-
-        if (response.ok && data.success) {
-            batchResults = data.results;
+        if (!response.ok) {
+            const data = await response.json();
+            throw new Error(data.error || '批量生成失敗');
+        }
 
-            // 顯示批量結果
-            loadingSection.style.display = 'none';
-            batchProgress.style.display = 'none';
-            displayBatchResults(data);
+        // 逐行讀取串流結果，每完成一張就顯示
+        loadingSection.style.display = 'none';
+        batchResultSection.style.display = 'block';
+        batchResultGrid.innerHTML = '';
+        batchSuccessCount.textContent = '0';
+        batchFailCount.textContent = '0';
+
+        let summary = null;
+        await readNdjson(response, event => {
+            if (event.type === 'result') {
+                batchResults.push(event);
+                batchResultGrid.appendChild(createBatchResultItem(event));
+                const succeeded = batchResults.filter(r => r.success).length;
+                batchSuccessCount.textContent = succeeded;
+                batchFailCount.textContent = batchResults.length - succeeded;
+                currentProgress.textContent = event.completed;
+                batchProgressBar.style.width = `${event.completed / lines.length * 100}%`;
+            } else if (event.type === 'done') {
+                summary = event;
+            } else if (event.type === 'error') {
+                throw new Error(event.error || '批量生成失敗');
+            }
+        });
 
-            // 重新載入歷史記錄
-            loadHistory();
-        } else {
-            throw new Error(data.error || '批量生成失敗');
+        batchProgress.style.display = 'none';
+        if (!summary) {
+            throw new Error('批量生成中斷');
         }
+
+        // 重新載入歷史記錄
+        loadHistory();
     } catch (error) {
         console.error('批量生成錯誤:', error);
         showError(error.message || '批量生成失敗，請稍後再試');
@@ -447,20 +469,26 @@ async function handleBatchGenerate() {
     }
 }
 
-// 顯示批量結果
-function displayBatchResults(data) {
-    batchResultSection.style.display = 'block';
-    batchSuccessCount.textContent = data.succeeded;
-    batchFailCount.textContent = data.failed;
-
-    // 清空之前的結果
-    batchResultGrid.innerHTML = '';
-
-    // 添加每個結果項目
-    data.results.forEach(result => {
-        const item = createBatchResultItem(result);
-        batchResultGrid.appendChild(item);
-    });
+// 讀取 NDJSON 串流回應，每行解析後交給 onEvent
+async function readNdjson(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+        let newline;
+        while ((newline = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newline).trim();
+            buffer = buffer.slice(newline + 1);
+            if (line) {
+                onEvent(JSON.parse(line));
+            }
+        }
+        if (done) {
+            break;
+        }
+    }
 }
 
 // 創建批量結果項目